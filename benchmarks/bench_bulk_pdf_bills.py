@@ -0,0 +1,189 @@
+"""Month-end PDF bill generation: the per-bill endpoint called once per allottee against the bulk run.
+
+The bulk run is measured rendering in a single process and across one process per core, then re-run
+for the same month (every stored PDF is current, so nothing is rendered), and finally with every
+invocation handing over after one page, so the month is finished by continuations resuming from the
+JobStateTable checkpoint.
+Every run is checked to leave a current PDF for every bill and, with --zip, DDO archives holding all
+of them.
+
+Usage: python benchmarks/bench_bulk_pdf_bills.py [--bills 1000] [--latency-ms 5] [--zip]
+                                                  [--processes N]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import uuid
+import zipfile
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PDF_BILLS_BUCKET_NAME', 'bench-pdf-bills')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+
+import billing_index  # noqa: E402
+import bulk_pdf_bills_lambda  # noqa: E402
+import generate_pdf_bill_lambda  # noqa: E402
+import job_state  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import CallStats, FakeDynamoDB, FakeLambda, FakeS3, FakeTable  # noqa: E402
+
+BILLING_MONTH = '2025-06'
+FUNCTION_ARN = 'arn:aws:lambda:ap-south-1:000000000000:function:bench-bulk-pdf-bills'
+DDO_CODES = ('DDO-LS-01', 'DDO-LS-02', 'DDO-LS-03', 'DDO-LS-04', None)
+
+
+class FakeContext:
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = FUNCTION_ARN
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def setup(count, latency):
+    stats = CallStats()
+    allottees = FakeTable(generate_pdf_bill_lambda.allottees_table.name, ['quarter_id'], latency=latency, stats=stats)
+    bills = FakeTable(generate_pdf_bill_lambda.water_bills_table.name, ['allottee_id', 'billing_month'],
+                      indexes={billing_index.MONTH_INDEX_NAME: ['month_shard', 'employee_id']},
+                      latency=latency, stats=stats)
+    for i in range(1, count + 1):
+        allottee = {'quarter_id': f"LSL-C-{i:06d}", 'allottee_id': f"LSQA{i:06d}", 'employee_id': f"PFMS{i:06d}",
+                    'name': f"Allottee {i}"}
+        if DDO_CODES[i % len(DDO_CODES)]:
+            allottee['ddo_code'] = DDO_CODES[i % len(DDO_CODES)]
+        allottees.load([allottee])
+        # The previous month's bills are in the table too and must be left alone
+        for month, billed_date in (('2025-05', '2025-06-01T00:00:00Z'), (BILLING_MONTH, '2025-07-01T00:00:00Z')):
+            employee_id = f"PFMS{i:06d}"
+            bills.load([{'allottee_id': f"LSQA{i:06d}", 'billing_month': month, 'quarter_id': f"LSL-C-{i:06d}",
+                         'employee_id': employee_id, 'month_shard': billing_index.month_shard(month, employee_id),
+                         'amount_inr': Decimal(500 + i % 7 * 10), 'status': 'PENDING', 'billed_date': billed_date}])
+
+    s3 = FakeS3(latency=latency, stats=stats)
+    job_state.job_state_table = FakeTable(job_state.job_state_table.name, ['job_id'], latency=latency, stats=stats)
+    generate_pdf_bill_lambda.allottees_table = allottees
+    generate_pdf_bill_lambda.water_bills_table = bills
+    generate_pdf_bill_lambda.s3 = s3
+    bulk_pdf_bills_lambda.allottees_table = allottees
+    bulk_pdf_bills_lambda.water_bills_table = bills
+    bulk_pdf_bills_lambda.dynamodb = dynamo.ThrottledDynamoDB(FakeDynamoDB([allottees, bills], latency=latency, stats=stats))
+    bulk_pdf_bills_lambda.s3 = s3
+    bulk_pdf_bills_lambda.lambda_client = FakeLambda(stats=stats)
+    return stats, s3
+
+
+def per_bill_requests(count):
+    for i in range(1, count + 1):
+        event = {'pathParameters': {'allottee_id': f"LSQA{i:06d}", 'billing_month': BILLING_MONTH},
+                 'queryStringParameters': {'delivery': 'url'}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = generate_pdf_bill_lambda.lambda_handler(event, None)
+        assert response['statusCode'] == 200, response
+
+
+def bulk_run(event, invocation_seconds):
+    # Runs the event and every continuation it queues, in order; returns (invocations, final body)
+    lambda_client = bulk_pdf_bills_lambda.lambda_client
+    events, invocations, body = [event], 0, None
+    while events:
+        invocations += 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = bulk_pdf_bills_lambda.lambda_handler(events.pop(0), FakeContext(invocation_seconds))
+        assert response['statusCode'] in (200, 202), response
+        body = json.loads(response['body'])
+        events.extend(json.loads(payload) for _, _, payload in lambda_client.invocations)
+        lambda_client.invocations.clear()
+    return invocations, body
+
+
+def check_outputs(s3, count, make_archives):
+    bucket = generate_pdf_bill_lambda.pdf_bills_bucket_name
+    for i in range(1, count + 1):
+        key = generate_pdf_bill_lambda.pdf_object_key(f"LSQA{i:06d}", BILLING_MONTH)
+        assert s3.objects[(bucket, key)].startswith(b'%PDF'), key
+        assert s3.object_metadata[(bucket, key)].get(generate_pdf_bill_lambda.CONTENT_HASH_METADATA_KEY)
+    assert not any(key.startswith('bills/LSQA000001/2025-05') for _, key in s3.objects)
+    if make_archives:
+        archived = 0
+        for (_, key), body in s3.objects.items():
+            if key.startswith(f"bills/{BILLING_MONTH}/archives/"):
+                archived += len(zipfile.ZipFile(io.BytesIO(body)).namelist())
+        assert archived == count, archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bills', type=int, default=1000)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call AWS latency')
+    parser.add_argument('--zip', action='store_true', help='Also build the per-DDO archives')
+    parser.add_argument('--processes', type=int, default=bulk_pdf_bills_lambda.render_process_count(),
+                        help='Render processes for the parallel run (default: one per core)')
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000.0
+    cores = bulk_pdf_bills_lambda.render_process_count()
+    processes = args.processes
+    # Several pages even for small runs, so checkpoints and continuations are exercised
+    bulk_pdf_bills_lambda.BULK_PDF_PAGE_BILLS = max(50, args.bills // 10)
+    event = {'billing_month': BILLING_MONTH, 'zip': args.zip}
+
+    print(f"{args.bills} bills, {args.latency_ms:g} ms per call, {cores} cores")
+    print(f"{'run':<28} {'seconds':>8} {'bills/s':>8} {'rendered':>9} {'invocations':>11} {'calls':>7}")
+
+    def report(label, seconds, rendered, invocations, stats):
+        print(f"{label:<28} {seconds:>8.2f} {args.bills / seconds:>8.1f} {rendered:>9} {invocations:>11}"
+              f" {stats.total():>7}")
+
+    stats, s3 = setup(args.bills, latency)
+    start = time.perf_counter()
+    per_bill_requests(args.bills)
+    report('per-bill endpoint', time.perf_counter() - start, args.bills, args.bills, stats)
+    check_outputs(s3, args.bills, False)
+
+    for label, count in (('bulk, 1 process', 1), (f"bulk, {processes} processes", processes)):
+        stats, s3 = setup(args.bills, latency)
+        bulk_pdf_bills_lambda.BULK_PDF_RENDER_PROCESSES = count
+        start = time.perf_counter()
+        invocations, body = bulk_run(event, 900)
+        report(label, time.perf_counter() - start, body['rendered'], invocations, stats)
+        assert body['status'] == 'COMPLETED' and body['rendered'] == args.bills and body['failed'] == 0, body
+        # The month is read from the month-index, not by scanning the table, and the finished run is kept
+        assert not stats.calls['Scan'], stats.calls
+        assert 'expires_at' not in job_state.get_job(f"bulk-pdf#{BILLING_MONTH}"), 'completed run expires'
+        check_outputs(s3, args.bills, args.zip)
+
+    # The same month again as a new run: every stored PDF is current
+    stats.reset()
+    start = time.perf_counter()
+    invocations, body = bulk_run(dict(event, run_id='rerun'), 900)
+    report('bulk re-run, unchanged', time.perf_counter() - start, body['rendered'], invocations, stats)
+    assert body['rendered'] == 0 and body['unchanged'] == args.bills, body
+
+    # Invoking a completed run again does nothing
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = bulk_pdf_bills_lambda.lambda_handler(event, FakeContext(900))
+    assert response['statusCode'] == 200 and json.loads(response['body'])['status'] == 'COMPLETED', response
+
+    stats, s3 = setup(args.bills, latency)
+    reserve_ms = bulk_pdf_bills_lambda.BULK_PDF_TIME_RESERVE_MS
+    bulk_pdf_bills_lambda.BULK_PDF_TIME_RESERVE_MS = 900 * 1000
+    start = time.perf_counter()
+    invocations, body = bulk_run(event, 900)
+    bulk_pdf_bills_lambda.BULK_PDF_TIME_RESERVE_MS = reserve_ms
+    report('bulk, page per invocation', time.perf_counter() - start, body['rendered'], invocations, stats)
+    assert body['status'] == 'COMPLETED' and body['rendered'] == args.bills, body
+    check_outputs(s3, args.bills, args.zip)
+    print(f"reported by the last run: {body['bills_per_second']} bills/s over {body['elapsed_seconds']} s")
+
+
+if __name__ == '__main__':
+    main()
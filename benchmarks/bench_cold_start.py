@@ -0,0 +1,136 @@
+"""Cold start of every handler: importing its module, then creating the AWS clients it holds.
+
+Each measurement is a fresh Python process, as a new Lambda container is. "import" is what the Lambda
+init phase runs; "+ clients" adds creating every client, resource and table the handler's modules hold
+at module level, without calling AWS. A handler that creates its clients at import time has nothing
+left to create, while with the shared lazy clients an invocation only pays for the ones it touches.
+"created" counts the botocore clients created for that handler, each resource counting as one.
+
+The working tree is compared with --baseline, by default the commit before src/common was added,
+extracted with git archive. Reported times are medians of --runs processes.
+
+Usage: python benchmarks/bench_cold_start.py [--runs 5] [--baseline REF]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ENV = {
+    'AWS_DEFAULT_REGION': 'ap-south-1',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'ALLOTTEES_TABLE_NAME': 'bench-allottees',
+    'OCCUPANCY_HISTORY_TABLE_NAME': 'bench-occupancy-history',
+    'WATER_BILLS_TABLE_NAME': 'bench-water-bills',
+    'METER_READINGS_TABLE_NAME': 'bench-meter-readings',
+    'PAYMENT_STATUSES_TABLE_NAME': 'bench-payment-statuses',
+    'DUES_LEDGER_TABLE_NAME': 'bench-dues-ledger',
+    'JOB_STATE_TABLE_NAME': 'bench-job-state',
+    'PDF_BILLS_BUCKET_NAME': 'bench-pdf-bills',
+    'DEDUCTION_FILES_BUCKET_NAME': 'bench-deduction-files',
+    'PDF_RENDER_QUEUE_URL': 'https://sqs.ap-south-1.amazonaws.com/000000000000/bench-pdf-render',
+    'DDO_EMAIL_RECIPIENT': 'ddo@example.com',
+    'SES_EMAIL_SENDER': 'no-reply@example.com'
+}
+
+# Runs in the child process: times the import and the client creation, prints them as JSON
+CHILD = r'''
+import json, os, sys, time
+src, module_name, count = sys.argv[1], sys.argv[2], sys.argv[3] == '1'
+sys.path.insert(0, src)
+created = []
+if count:
+    import botocore.session
+    create_client = botocore.session.Session.create_client
+    def counting_create_client(self, service_name, *args, **kwargs):
+        created.append(service_name)
+        return create_client(self, service_name, *args, **kwargs)
+    botocore.session.Session.create_client = counting_create_client
+start = time.perf_counter()
+try:
+    __import__(module_name)
+except Exception as e:
+    print(json.dumps({'error': f"{type(e).__name__}: {e}"}))
+    sys.exit()
+imported = time.perf_counter()
+for module in list(sys.modules.values()):
+    if os.path.dirname(os.path.abspath(getattr(module, '__file__', None) or '/')).startswith(src):
+        for value in list(vars(module).values()):
+            if hasattr(type(value), '_resolve'):
+                value._resolve()
+ready = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'ready_ms': (ready - start) * 1000,
+                  'created': len(created)}))
+'''
+
+
+def handlers(src):
+    return sorted(name[:-3] for name in os.listdir(src) if name.endswith('_lambda.py'))
+
+
+def measure(src, module_name, count=False):
+    env = dict(os.environ, **ENV)
+    output = subprocess.run([sys.executable, '-c', CHILD, os.path.abspath(src), module_name, '1' if count else '0'],
+                            capture_output=True, text=True, env=env, cwd=src, check=True).stdout
+    return json.loads(output)
+
+
+def profile(src, module_name, runs):
+    samples = [measure(src, module_name) for _ in range(runs)]
+    if 'error' in samples[0]:
+        return samples[0]
+    return {'import_ms': statistics.median(s['import_ms'] for s in samples),
+            'ready_ms': statistics.median(s['ready_ms'] for s in samples),
+            'created': measure(src, module_name, count=True)['created']}
+
+
+def default_baseline():
+    added = subprocess.run(['git', 'log', '--diff-filter=A', '--format=%H', '--', 'src/common/aws.py'],
+                           capture_output=True, text=True, cwd=REPO, check=True).stdout.split()
+    return f"{added[-1]}^" if added else 'HEAD'
+
+
+def extract(ref, directory):
+    archive = subprocess.run(['git', 'archive', ref, 'src'], capture_output=True, cwd=REPO, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+    return os.path.join(directory, 'src')
+
+
+def cell(result, field):
+    return 'fails' if 'error' in result else f"{result[field]:.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--baseline', default=None, help='Git ref to compare with (default: before src/common)')
+    args = parser.parse_args()
+    baseline = args.baseline or default_baseline()
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline_src = extract(baseline, directory)
+        current_src = os.path.join(REPO, 'src')
+        print(f"median of {args.runs} fresh processes; ms; baseline {baseline} -> working tree")
+        print(f"{'handler':<28} {'import':>15} {'+ clients':>15} {'created':>9}")
+        errors = []
+        for module_name in handlers(current_src):
+            before = (profile(baseline_src, module_name, args.runs) if module_name in handlers(baseline_src)
+                      else {'error': 'not in baseline'})
+            after = profile(current_src, module_name, args.runs)
+            errors.extend(f"{label} {module_name}: {result['error']}"
+                          for label, result in (('baseline', before), ('current', after)) if 'error' in result)
+            print(f"{module_name:<28} {cell(before, 'import_ms'):>6} -> {cell(after, 'import_ms'):>5}"
+                  f" {cell(before, 'ready_ms'):>6} -> {cell(after, 'ready_ms'):>5}"
+                  f" {cell(before, 'created'):>3} -> {cell(after, 'created'):>2}")
+        for error in errors:
+            print(error)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Micro-benchmark of the dues engine on synthetic 10-year bill and payment histories.
+
+Compares dues_status_lambda.compute_dues (one pass over bills and payments) with the
+previous nested-loop calculation, and checks that both agree on the pending months.
+
+Usage: python benchmarks/bench_dues_engine.py [--years 10] [--allottees 200] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+
+import dues_status_lambda  # noqa: E402
+
+
+def synthetic_history(rng, years, start_year=2015):
+    bills, payments = [], []
+    for month_index in range(years * 12):
+        billing_month = f"{start_year + month_index // 12}-{month_index % 12 + 1:02d}"
+        amount = Decimal(500 + rng.randint(0, 40) * 5)
+        bills.append({'billing_month': billing_month, 'amount_inr': amount})
+
+        outcome = rng.random()
+        if outcome < 0.85:
+            payments.append({'billing_month': billing_month, 'amount_deducted_inr': amount, 'status': 'SUCCESS'})
+        elif outcome < 0.92:
+            payments.append({'billing_month': billing_month, 'amount_deducted_inr': amount / 2, 'status': 'PARTIAL'})
+        elif outcome < 0.97:
+            payments.append({'billing_month': billing_month, 'amount_deducted_inr': amount, 'status': 'FAILED'})
+        # Otherwise no confirmation was ever received for the month
+    return bills, payments
+
+
+def legacy_pending_months(bills, payments):
+    # The calculation dues_status_lambda used before the single-pass engine
+    total_billed = sum(b.get('amount_inr', 0) for b in bills)
+    total_paid = sum(p.get('amount_deducted_inr', 0) for p in payments if p.get('status') == 'SUCCESS')
+    pending_months = []
+    if round(total_billed - total_paid, 2) > 0:
+        for bill in bills:
+            paid_for_month = sum(p.get('amount_deducted_inr', 0) for p in payments
+                                 if p.get('billing_month') == bill['billing_month'] and p.get('status') == 'SUCCESS')
+            if paid_for_month < bill['amount_inr']:
+                pending_months.append(bill['billing_month'])
+    return sorted(pending_months)
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--allottees', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    histories = [synthetic_history(rng, args.years) for _ in range(args.allottees)]
+    as_of_month = f"{2015 + args.years}-01"
+
+    for bills, payments in histories:
+        engine = dues_status_lambda.compute_dues(bills, payments, as_of_month)
+        assert engine['pending_months'] == legacy_pending_months(bills, payments)
+
+    legacy = best_of(args.repeat, lambda: [legacy_pending_months(b, p) for b, p in histories])
+    engine = best_of(args.repeat, lambda: [dues_status_lambda.compute_dues(b, p, as_of_month) for b, p in histories])
+
+    bills_per_history = len(histories[0][0])
+    print(f"{args.allottees} histories x {bills_per_history} bills")
+    print(f"{'legacy nested loop':<22} {legacy * 1e6 / args.allottees:>10.1f} us/allottee")
+    print(f"{'single-pass engine':<22} {engine * 1e6 / args.allottees:>10.1f} us/allottee")
+    print(f"{'speed-up':<22} {legacy / engine:>10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Interactive lookups while a bulk scan runs against a provisioned AllotteesTable.
+
+The bulk job is occupancy_backfill_lambda's parallel scan of AllotteesTable (the monthly deduction
+run no longer scans it, reading the occupancy history's month index instead); the interactive load is
+--clients threads looking allottees up by quarter_id, as the PDF endpoint does, with a short pause
+between requests. The fake table is provisioned at --capacity read units per second (5 in
+template.yaml; scaled up here so that a run takes seconds) and throttles as DynamoDB does once it is
+used up. Every call goes through common.dynamo, and the scan is run:
+
+  - without a capacity share: the scan only backs off once it is throttled;
+  - with --share of the capacity reserved for bulk calls, the rest left to interactive ones.
+
+Reported per run: how long the scan took, the lookups' latency percentiles, how many calls DynamoDB
+throttled, and how many lookups still failed after their retries (answered 503).
+
+Usage: python benchmarks/bench_dynamodb_throttling.py [--allottees 8000] [--capacity 2000] [--share 0.5]
+                                                       [--clients 4] [--latency-ms 2]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+
+import occupancy  # noqa: E402
+import occupancy_backfill_lambda  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import FakeTable  # noqa: E402
+
+LOOKUP_PAUSE_SECONDS = 0.01
+
+
+def make_table(count, capacity, latency):
+    table = FakeTable(os.environ['ALLOTTEES_TABLE_NAME'], ['quarter_id'], latency=latency, read_capacity=capacity)
+    table.load({'quarter_id': f"LSL-C-{i:06d}", 'allottee_id': f"LSQA{i:06d}", 'employee_id': f"PFMS{i:06d}",
+                'name': f"Allottee {i}", 'allotment_start_date': '2023-01-01', 'status': 'OCCUPIED'}
+               for i in range(1, count + 1))
+    return table
+
+
+def scan_all(table):
+    # The spans go to an unprovisioned table: only AllotteesTable's capacity is contended
+    occupancy_backfill_lambda.allottees_table = dynamo.ThrottledTable(table, priority='bulk')
+    occupancy.occupancy_table = FakeTable(os.environ['OCCUPANCY_HISTORY_TABLE_NAME'], ['quarter_id', 'span_key'],
+                                          keep_items=False)
+    segments = occupancy_backfill_lambda.BACKFILL_SEGMENTS
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = executor.map(occupancy_backfill_lambda.backfill_segment, range(segments), [segments] * segments)
+        return sum(allottees for allottees, _ in results)
+
+
+def lookups(table, count, stop, latencies, failures):
+    interactive = dynamo.ThrottledTable(table, priority='interactive')
+    i = 0
+    while not stop.is_set():
+        i += 1
+        start = time.perf_counter()
+        try:
+            interactive.get_item(Key={'quarter_id': f"LSL-C-{i * 7919 % count + 1:06d}"})
+            latencies.append(time.perf_counter() - start)
+        except dynamo.Throttled:
+            failures.append(time.perf_counter() - start)
+        time.sleep(LOOKUP_PAUSE_SECONDS)
+
+
+def run(args, share, with_scan):
+    dynamo.DYNAMODB_BULK_CAPACITY_SHARE = share
+    dynamo.reset_buckets()
+    dynamo.meter.reset()
+    table = make_table(args.allottees, args.capacity, args.latency_ms / 1000.0)
+    # Let the table's capacity settle after loading
+    time.sleep(1.0)
+    stop, latencies, failures = threading.Event(), [], []
+    clients = [threading.Thread(target=lookups, args=(table, args.allottees, stop, latencies, failures))
+               for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    start = time.perf_counter()
+    if with_scan:
+        scanned = scan_all(table)
+        assert scanned == args.allottees, scanned
+    else:
+        time.sleep(3.0)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for client in clients:
+        client.join()
+    return elapsed, sorted(latencies), failures, table.throttled
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--allottees', type=int, default=8000)
+    parser.add_argument('--capacity', type=float, default=2000, help='Provisioned read units per second')
+    parser.add_argument('--share', type=float, default=0.5, help='Share of the capacity bulk calls may use')
+    parser.add_argument('--clients', type=int, default=4, help='Threads making interactive lookups')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='Simulated per-call AWS latency')
+    args = parser.parse_args()
+
+    print(f"{args.allottees} allottees, {args.capacity:g} RCU/s, {args.clients} lookup clients, "
+          f"{args.latency_ms:g} ms per call")
+    print(f"{'run':<26} {'scan s':>7} {'lookups':>8} {'p50 ms':>7} {'p99 ms':>7} {'max ms':>7}"
+          f" {'503s':>5} {'throttled scan/get':>19}")
+    for label, share, with_scan in (('lookups alone', 0, False),
+                                    ('scan, no capacity share', 0, True),
+                                    (f"scan, {args.share:g} share", args.share, True)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, latencies, failures, throttled = run(args, share, with_scan)
+        print(f"{label:<26} {f'{elapsed:.2f}' if with_scan else '-':>7} {len(latencies) + len(failures):>8}"
+              f" {percentile(latencies, 0.5):>7.1f} {percentile(latencies, 0.99):>7.1f}"
+              f" {(latencies[-1] * 1000 if latencies else float('nan')):>7.1f} {len(failures):>5}"
+              f" {throttled['Scan']:>10}/{throttled['GetItem']:<8}")
+
+    print('\ncapacity consumed in the last run, as reported by common.dynamo:')
+    for line in dynamo.capacity_report():
+        print(f"  {line['operation']:<8} calls {line['calls']:>6}  units {line['units']:>8.1f}"
+              f"  throttles {line['throttles']:>4}  retries {line['retries']:>4}"
+              f"  waited {line['wait_seconds']:>6.2f} s")
+
+
+if __name__ == '__main__':
+    main()
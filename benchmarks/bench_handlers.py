@@ -0,0 +1,528 @@
+"""Load test of the Lambda handlers: API Gateway proxy events replayed against in-process fakes.
+
+Every handler's tables and clients are replaced with the fakes in fakes.py (DynamoDB, S3, SES), loaded
+with a synthetic dataset from dataset.py (--allottees, --months), and each scenario's events are
+replayed by --concurrency threads. DynamoDB calls still go through common.dynamo, so its retries and
+capacity accounting are part of what is measured. Scenarios:
+
+  send_deductions          the monthly run over the whole table, --job-runs times, one at a time, each a
+                           fresh run of the month (its own run_id) finding the dataset's bills written
+  dues_status              GET  /v1/allottees/{employee_id}/water-dues-status (2% unknown employees)
+  dues_status_batch        POST /v1/allottees/water-dues-status/batch, --batch-size employees
+  arrears                  GET  /v1/arrears, a page of --page-size unsettled bills of a month or older
+                           than 30 or 90 days, from the start or from a cursor into it
+  generate_pdf_bill        GET  /v1/bills/{allottee_id}/{billing_month}/pdf?delivery=url
+  allottee_list            GET  /v1/allottees, a page of --page-size from a random cursor
+  payment_confirmation     POST /v1/payments/confirmations, --batch-size PFMS results
+  allottee_status_updates  POST /v1/allottees/status-updates, --batch-size CPWD updates
+
+Reported per scenario: latency p50/p95/p99/max, throughput, status codes, DynamoDB calls by operation
+(and per request), S3 and SES calls, consumed capacity units, the peak resident set size while it ran,
+and where the time went: the milliseconds per request of each span common.metrics records (summed over
+threads), slowest first. All threads share one process, as requests share a warm container:
+module-level caches (the dues cache, the PDF template) are warm after --warmup requests, and CPU-bound
+work such as PDF rendering does not scale with threads. The scenarios run in order against the same tables, so the updates and
+confirmations are visible to the scenarios after them; by default the status updates, which end most
+allotments at a large --requests, run last.
+
+--output writes the results as JSON; --compare prints the change from an earlier JSON file.
+
+Usage: python benchmarks/bench_handlers.py [--allottees 10000] [--months 3] [--requests 500]
+                                           [--concurrency 8] [--latency-ms 5] [--scenarios a,b]
+                                           [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('METER_READINGS_TABLE_NAME', 'bench-meter-readings')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+os.environ.setdefault('PDF_BILLS_BUCKET_NAME', 'bench-pdf-bills')
+os.environ.setdefault('DEDUCTION_FILES_BUCKET_NAME', 'bench-deduction-files')
+os.environ.setdefault('DDO_EMAIL_RECIPIENT', 'ddo@example.com')
+os.environ.setdefault('SES_EMAIL_SENDER', 'billing@example.com')
+os.environ['PDF_JOB_BACKEND'] = 'memory'
+
+import allottee_sync_lambda  # noqa: E402
+import billing_index  # noqa: E402
+import deduction_files  # noqa: E402
+import dues_ledger  # noqa: E402
+import dues_status_lambda  # noqa: E402
+import generate_pdf_bill_lambda  # noqa: E402
+import job_state  # noqa: E402
+import occupancy  # noqa: E402
+import payment_confirmation_lambda  # noqa: E402
+import pdf_jobs  # noqa: E402
+import send_deductions_lambda  # noqa: E402
+from common import dynamo, metrics  # noqa: E402
+from dataset import Dataset, allottee_id, employee_id, quarter_id  # noqa: E402
+from fakes import CallStats, FakeDynamoDB, FakeLambda, FakeS3, FakeSES, FakeTable  # noqa: E402
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+API_GATEWAY_TIMEOUT_SECONDS = 29
+SCHEDULED_TIMEOUT_SECONDS = 900
+RSS_SAMPLE_SECONDS = 0.005
+UNKNOWN_EMPLOYEE_SHARE = 0.02
+TOP_SPANS = 5
+
+
+class FakeContext:
+    def __init__(self, function_name, timeout_seconds):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_stream_name = f"bench/{function_name}"
+        self.invoked_function_arn = f"arn:aws:lambda:ap-south-1:123456789012:function:{function_name}"
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def proxy_event(method, resource_path, path_parameters=None, query=None, body=None):
+    # The API Gateway REST proxy event the handlers receive
+    path = resource_path.format(**(path_parameters or {}))
+    return {
+        'resource': resource_path,
+        'path': path,
+        'httpMethod': method,
+        'headers': {'Accept': 'application/json', 'Accept-Encoding': 'gzip, deflate, br',
+                    'Content-Type': 'application/json'},
+        'queryStringParameters': query,
+        'pathParameters': path_parameters,
+        'requestContext': {'resourcePath': resource_path, 'httpMethod': method, 'path': f"/v1{path}",
+                           'stage': 'v1', 'requestId': str(uuid.uuid4())},
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def scheduled_event():
+    return {'version': '0', 'id': str(uuid.uuid4()), 'detail-type': 'Scheduled Event', 'source': 'aws.events',
+            'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), 'detail': {}}
+
+
+# Event builders per scenario: (rng, dataset, args, n) -> event, n counting the scenario's requests
+
+def some_employee(rng, dataset):
+    # A few lookups are for employees without an allotment, which answer 404
+    return employee_id(rng.randint(1, dataset.allottees + max(1, int(dataset.allottees * UNKNOWN_EMPLOYEE_SHARE))))
+
+
+def dues_status_event(rng, dataset, args, n):
+    return proxy_event('GET', '/v1/allottees/{employee_id}/water-dues-status',
+                       {'employee_id': some_employee(rng, dataset)})
+
+
+def dues_status_batch_event(rng, dataset, args, n):
+    employee_ids = [some_employee(rng, dataset) for _ in range(args.batch_size)]
+    return proxy_event('POST', '/v1/allottees/water-dues-status/batch', body=json.dumps({'employee_ids': employee_ids}))
+
+
+def arrears_event(rng, dataset, args, n):
+    query = {'limit': str(args.page_size)}
+    if n % 2:
+        query['billing_month'] = rng.choice(dataset.months)
+    else:
+        query['older_than_days'] = str(rng.choice((30, 90)))
+    if n % 3 == 0:
+        # Continue after some allottee's bill, somewhere in the middle of its shard
+        i = rng.randint(1, dataset.allottees)
+        shard = billing_index.index_shard(employee_id(i))
+        key = {'arrears_shard': shard, 'billing_month': rng.choice(dataset.months), 'allottee_id': allottee_id(i)}
+        query['cursor'] = dues_status_lambda.encode_arrears_cursor(int(shard), key)
+    return proxy_event('GET', '/v1/arrears', query=query)
+
+
+def allottee_list_event(rng, dataset, args, n):
+    query = {'limit': str(args.page_size)}
+    if n % 10:
+        # Most requests continue a listing somewhere in the table; every tenth starts from the top
+        cursor = {'quarter_id': quarter_id(rng.randint(1, dataset.allottees))}
+        query['cursor'] = allottee_sync_lambda.encode_cursor(cursor)
+    return proxy_event('GET', '/v1/allottees', query=query)
+
+
+def allottee_status_updates_event(rng, dataset, args, n):
+    effective_date = dataset.today.strftime('%Y-%m-%d')
+    updates = []
+    for k in range(args.batch_size):
+        i = rng.randint(1, dataset.allottees)
+        update = {'quarter_id': quarter_id(i), 'allottee_id': allottee_id(i), 'employee_id': employee_id(i),
+                  'effective_date': effective_date}
+        # New allottees get IDs past the dataset's, unique per update
+        newcomer = dataset.allottees + n * args.batch_size + k + 1
+        status = rng.choice(('VACATED', 'TRANSFERRED', 'OCCUPIED'))
+        if status == 'TRANSFERRED':
+            update.update(new_allottee_id=allottee_id(newcomer), new_employee_id=employee_id(newcomer))
+        elif status == 'OCCUPIED':
+            update.update(allottee_id=allottee_id(newcomer), employee_id=employee_id(newcomer))
+        updates.append(dict(update, status=status))
+    return proxy_event('POST', '/v1/allottees/status-updates', body=json.dumps({'updates': updates}))
+
+
+def payment_confirmation_event(rng, dataset, args, n):
+    # PFMS results for the current month, which the dataset has billed but not yet paid
+    results = []
+    for _ in range(args.batch_size):
+        i = rng.randint(1, dataset.allottees)
+        if rng.random() < 0.05:
+            results.append({'employee_id': employee_id(i), 'amount_deducted_inr': 0, 'status': 'FAILED',
+                            'failure_reason': 'Insufficient pay'})
+        else:
+            results.append({'employee_id': employee_id(i), 'amount_deducted_inr': 500.0 + i % 10 * 10,
+                            'status': 'SUCCESS', 'failure_reason': None})
+    return proxy_event('POST', '/v1/payments/confirmations', body=json.dumps(
+        {'billing_month': dataset.months[0], 'job_id': f"PFMS-JOB-BENCH-{n:06d}", 'results': results}))
+
+
+def generate_pdf_bill_event(rng, dataset, args, n):
+    return proxy_event('GET', '/v1/bills/{allottee_id}/{billing_month}/pdf',
+                       {'allottee_id': allottee_id(rng.randint(1, dataset.allottees)),
+                        'billing_month': rng.choice(dataset.months)}, query={'delivery': 'url'})
+
+
+def send_deductions_event(rng, dataset, args, n):
+    # The schedule's own event would find the month done after the first run
+    return dict(scheduled_event(), run_id=f"bench{n}")
+
+
+# name -> (handler module, event builder, timeout, whether --requests and --concurrency apply)
+SCENARIOS = {
+    'send_deductions': (send_deductions_lambda, send_deductions_event, SCHEDULED_TIMEOUT_SECONDS, False),
+    'dues_status': (dues_status_lambda, dues_status_event, API_GATEWAY_TIMEOUT_SECONDS, True),
+    'dues_status_batch': (dues_status_lambda, dues_status_batch_event, API_GATEWAY_TIMEOUT_SECONDS, True),
+    'arrears': (dues_status_lambda, arrears_event, API_GATEWAY_TIMEOUT_SECONDS, True),
+    'generate_pdf_bill': (generate_pdf_bill_lambda, generate_pdf_bill_event, API_GATEWAY_TIMEOUT_SECONDS, True),
+    'allottee_list': (allottee_sync_lambda, allottee_list_event, API_GATEWAY_TIMEOUT_SECONDS, True),
+    'payment_confirmation': (payment_confirmation_lambda, payment_confirmation_event, API_GATEWAY_TIMEOUT_SECONDS,
+                             True),
+    'allottee_status_updates': (allottee_sync_lambda, allottee_status_updates_event, API_GATEWAY_TIMEOUT_SECONDS,
+                                True),
+}
+
+
+class Fakes:
+    # The fake tables and clients, installed into every handler module in place of the lazy AWS ones
+
+    def __init__(self, dataset, latency):
+        self.dynamodb_stats = CallStats()
+        self.service_stats = CallStats()
+        self.tables = {
+            'allottees': FakeTable(os.environ['ALLOTTEES_TABLE_NAME'], ['quarter_id'], stats=self.dynamodb_stats,
+                                   indexes={'employee_id-index': ['employee_id']}),
+            'occupancy_history': FakeTable(os.environ['OCCUPANCY_HISTORY_TABLE_NAME'], ['quarter_id', 'span_key'],
+                                           stats=self.dynamodb_stats,
+                                           indexes={occupancy.OCCUPANCY_INDEX_NAME: ['index_shard', 'end_month'],
+                                                    occupancy.EMPLOYEE_INDEX_NAME: ['employee_id', 'span_key']}),
+            'meter_readings': FakeTable(os.environ['METER_READINGS_TABLE_NAME'], ['quarter_id', 'billing_month'],
+                                        stats=self.dynamodb_stats),
+            'water_bills': FakeTable(os.environ['WATER_BILLS_TABLE_NAME'], ['allottee_id', 'billing_month'],
+                                     stats=self.dynamodb_stats,
+                                     indexes={billing_index.MONTH_INDEX_NAME: ['month_shard', 'employee_id'],
+                                              billing_index.ARREARS_INDEX_NAME: ['arrears_shard', 'billing_month']}),
+            'payment_statuses': FakeTable(os.environ['PAYMENT_STATUSES_TABLE_NAME'], ['employee_id', 'billing_month'],
+                                          stats=self.dynamodb_stats,
+                                          indexes={billing_index.MONTH_INDEX_NAME: ['month_shard', 'status']}),
+            'dues_ledger': FakeTable(os.environ['DUES_LEDGER_TABLE_NAME'], ['employee_id'], stats=self.dynamodb_stats),
+        }
+        start = time.perf_counter()
+        self.counts = dataset.load(*self.tables.values())
+        self.load_seconds = time.perf_counter() - start
+        # Loading is free; the latency applies from here on
+        for table in self.tables.values():
+            table.latency = latency
+        self.dynamodb = FakeDynamoDB(self.tables.values(), latency=latency, stats=self.dynamodb_stats)
+        self.s3 = FakeS3(latency=latency, stats=self.service_stats)
+        self.ses = FakeSES(latency=latency, stats=self.service_stats)
+        self.lambda_client = FakeLambda(stats=self.service_stats)
+        self.job_state = FakeTable(os.environ['JOB_STATE_TABLE_NAME'], ['job_id'], latency=latency,
+                                   stats=self.dynamodb_stats)
+
+    def table(self, name, priority=None):
+        return dynamo.ThrottledTable(self.tables[name], priority=priority)
+
+    def install(self):
+        dynamodb = dynamo.ThrottledDynamoDB(self.dynamodb)
+        dues_ledger.dynamodb = dynamodb
+        dues_ledger.dues_ledger_table = self.table('dues_ledger')
+        dues_ledger.water_bills_table = self.table('water_bills')
+        dues_ledger.payment_statuses_table = self.table('payment_statuses')
+        job_state.job_state_table = dynamo.ThrottledTable(self.job_state)
+
+        # Written by allottee_sync, read by the monthly run; one module-level table serves both here
+        occupancy.occupancy_table = self.table('occupancy_history')
+        billing_index.water_bills_table = self.table('water_bills')
+
+        dues_status_lambda.allottees_table = self.table('allottees')
+        dues_status_lambda.water_bills_table = self.table('water_bills')
+        dues_status_lambda.payment_statuses_table = self.table('payment_statuses')
+
+        allottee_sync_lambda.dynamodb = dynamodb
+        allottee_sync_lambda.allottees_table = self.table('allottees')
+
+        payment_confirmation_lambda.dynamodb = dynamodb
+        payment_confirmation_lambda.payment_statuses_table = self.table('payment_statuses')
+
+        generate_pdf_bill_lambda.allottees_table = self.table('allottees')
+        generate_pdf_bill_lambda.water_bills_table = self.table('water_bills')
+        generate_pdf_bill_lambda.s3 = self.s3
+        pdf_jobs._backend = (pdf_jobs.InMemoryJobStore(), pdf_jobs.InMemoryJobQueue())
+
+        # The monthly run is a bulk job (DYNAMODB_PRIORITY: bulk in template.yaml)
+        send_deductions_lambda.water_bills_table = self.table('water_bills', priority='bulk')
+        send_deductions_lambda.meter_readings_table = self.table('meter_readings', priority='bulk')
+        send_deductions_lambda.dynamodb = dynamo.ThrottledDynamoDB(self.dynamodb, priority='bulk')
+        send_deductions_lambda.s3 = self.s3
+        deduction_files.s3 = self.s3
+        send_deductions_lambda.ses_client = self.ses
+        send_deductions_lambda.lambda_client = self.lambda_client
+
+    def reset_stats(self):
+        self.dynamodb_stats.reset()
+        self.service_stats.reset()
+        dynamo.meter.reset()
+
+
+def current_rss_bytes():
+    # Resident set size now, from /proc (Linux); None elsewhere
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def process_peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler:
+    # Peak resident set size while the block runs, sampled every RSS_SAMPLE_SECONDS; where /proc is not
+    # available this falls back to the process-wide peak from getrusage
+
+    def __enter__(self):
+        self.peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_SECONDS):
+            self.peak = max(self.peak, current_rss_bytes() or 0)
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.peak = max(self.peak or 0, current_rss_bytes() or 0) or process_peak_rss_bytes()
+
+
+def mib(value):
+    return round(value / (1024 * 1024), 1)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def invoke(module, event, timeout_seconds):
+    context = FakeContext(module.__name__, timeout_seconds)
+    start = time.perf_counter()
+    try:
+        status = module.lambda_handler(event, context).get('statusCode', 200)
+    except Exception as e:
+        status = f"raised {type(e).__name__}"
+    return time.perf_counter() - start, status
+
+
+def span_breakdown(spans, capacity, requests):
+    # Milliseconds per request spent in each span, DynamoDB's per table, index and operation, slowest first.
+    # Taken from common.metrics' and common.dynamo's counters around the whole replay: the handlers' own
+    # metric logs are per invocation, which concurrent requests in one process would count several times.
+    totals = Counter({name: entry['seconds'] for name, entry in spans.items()})
+    totals.update({metrics.capacity_metric_name(key): entry['seconds'] for key, entry in capacity.items()})
+    return {name: round(seconds * 1000 / requests, 3) for name, seconds in totals.most_common()}
+
+
+def run_scenario(name, fakes, dataset, args, rng):
+    module, build_event, timeout_seconds, api = SCENARIOS[name]
+    requests = args.requests if api else args.job_runs
+    concurrency = args.concurrency if api else 1
+    warmup = [build_event(rng, dataset, args, n) for n in range(args.warmup if api else 0)]
+    events = [build_event(rng, dataset, args, n) for n in range(len(warmup), len(warmup) + requests)]
+
+    # The handlers log every request; stdout is redirected around the whole replay, not per thread
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        with contextlib.redirect_stdout(io.StringIO()):
+            list(executor.map(lambda event: invoke(module, event, timeout_seconds), warmup))
+        fakes.reset_stats()
+        spans_before, capacity_before = metrics.recorder.snapshot(), dynamo.meter.snapshot()
+        with contextlib.redirect_stdout(io.StringIO()), RssSampler() as rss:
+            start = time.perf_counter()
+            outcomes = list(executor.map(lambda event: invoke(module, event, timeout_seconds), events))
+            elapsed = time.perf_counter() - start
+        spans = metrics.changes(spans_before, metrics.recorder.snapshot())
+        capacity = metrics.changes(capacity_before, dynamo.meter.snapshot())
+
+    latencies = sorted(seconds for seconds, _ in outcomes)
+    dynamodb_calls = dict(sorted(fakes.dynamodb_stats.calls.items()))
+    units = {'read': 0.0, 'write': 0.0}
+    for (_, _, operation), entry in capacity.items():
+        units['read' if operation in dynamo.READ_OPERATIONS else 'write'] += entry['units']
+    return {
+        'scenario': name,
+        'handler': module.__name__,
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(requests / elapsed, 2) if elapsed else None,
+        'latency_ms': {label: round(percentile(latencies, fraction) * 1000, 2)
+                       for label, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        'latency_max_ms': round(latencies[-1] * 1000, 2),
+        'latency_mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'status_codes': {str(status): count for status, count in sorted(Counter(s for _, s in outcomes).items(),
+                                                                         key=str)},
+        'dynamodb_calls': dynamodb_calls,
+        'dynamodb_calls_per_request': round(sum(dynamodb_calls.values()) / requests, 2),
+        'other_calls': dict(sorted(fakes.service_stats.calls.items())),
+        'capacity_units': {kind: round(value, 1) for kind, value in units.items()},
+        'peak_rss_mib': mib(rss.peak),
+        'span_ms_per_request': span_breakdown(spans, capacity, requests),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=REPO,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'scenario':<24} {'reqs':>6} {'conc':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f" {'ddb/req':>8} {'RSS MiB':>8}  status codes")
+    for result in results:
+        latency = result['latency_ms']
+        print(f"{result['scenario']:<24} {result['requests']:>6} {result['concurrency']:>4}"
+              f" {result['throughput_rps']:>8.1f} {latency['p50']:>8.1f} {latency['p95']:>8.1f} {latency['p99']:>8.1f}"
+              f" {result['dynamodb_calls_per_request']:>8.1f} {result['peak_rss_mib']:>8.1f}"
+              f"  {json.dumps(result['status_codes'])}")
+
+    print(f"\nms per request by span, top {TOP_SPANS}:")
+    for result in results:
+        spans = list(result['span_ms_per_request'].items())[:TOP_SPANS]
+        print(f"{result['scenario']:<24} " + ', '.join(f"{name} {ms:.2f}" for name, ms in spans))
+
+
+def print_comparison(baseline, results):
+    previous = {result['scenario']: result for result in baseline['scenarios']}
+    print(f"\nchange from {baseline.get('git_commit') or 'baseline'} ({baseline.get('started_at')}):")
+    print(f"{'scenario':<24} {'req/s':>22} {'p50 ms':>22} {'p99 ms':>22} {'RSS MiB':>20}")
+
+    def change(before, after):
+        delta = f"{(after - before) / before * 100:+.0f}%" if before else ''
+        return f"{before:.1f} -> {after:.1f} {delta:>5}"
+
+    for result in results:
+        before = previous.get(result['scenario'])
+        if not before:
+            print(f"{result['scenario']:<24} not in baseline")
+            continue
+        print(f"{result['scenario']:<24} {change(before['throughput_rps'], result['throughput_rps']):>22}"
+              f" {change(before['latency_ms']['p50'], result['latency_ms']['p50']):>22}"
+              f" {change(before['latency_ms']['p99'], result['latency_ms']['p99']):>22}"
+              f" {change(before['peak_rss_mib'], result['peak_rss_mib']):>20}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--allottees', type=int, default=10000, help='Allottees in the dataset (1k to 1M)')
+    parser.add_argument('--months', type=int, default=3, help='Billing months of bills and payments per allottee')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated, run in this order')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per API scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='Threads replaying an API scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests before each API scenario')
+    parser.add_argument('--job-runs', type=int, default=1, help='Runs of the scheduled send_deductions job')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Employees, updates or results per batch request')
+    parser.add_argument('--page-size', type=int, default=100, help='Allottees per GET /v1/allottees page')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call AWS latency')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the dataset and the request mix')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    dataset = Dataset(args.allottees, months=args.months, seed=args.seed)
+    print(f"loading {args.allottees} allottees x {args.months} months ...", flush=True)
+    fakes = Fakes(dataset, args.latency_ms / 1000.0)
+    fakes.install()
+    print(f"loaded {sum(fakes.counts.values())} items in {fakes.load_seconds:.1f} s"
+          f" ({mib(current_rss_bytes() or process_peak_rss_bytes()):.0f} MiB resident);"
+          f" {args.latency_ms:g} ms per call", flush=True)
+
+    rng = random.Random(args.seed)
+    results = []
+    for name in scenarios:
+        results.append(run_scenario(name, fakes, dataset, args, rng))
+        print(f"  {name}: {results[-1]['seconds']:.1f} s", flush=True)
+
+    print()
+    print_results(results)
+    if baseline:
+        print_comparison(baseline, results)
+
+    if args.output:
+        report = {
+            'benchmark': 'bench_handlers',
+            'started_at': started_at,
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': vars(args),
+            'dataset': {'allottees': args.allottees, 'billing_months': dataset.months, 'items': fakes.counts,
+                        'load_seconds': round(fakes.load_seconds, 2)},
+            'process_peak_rss_mib': mib(process_peak_rss_bytes()),
+            'scenarios': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Cost of the per-invocation metrics (common.metrics) on the API handlers.
+
+The dues-status endpoints are replayed one request at a time against the fakes in fakes.py, with no
+simulated AWS latency so that the handlers' own CPU time is all there is to compare, in three modes:
+
+  off       METRICS_ENABLED=false: no spans, no metric log
+  on        the production default: spans and one EMF log line per invocation
+  detailed  every invocation detailed (METRICS_DETAIL_SAMPLE_RATE=1): per-item spans and latency samples
+
+The modes take turns for --rounds rounds and the fastest round of each is kept. Reported per endpoint
+and mode: the mean time per request, the overhead over "off", and the bytes of metric log per request.
+The dues cache is off, so every request reads DynamoDB.
+
+Usage: python benchmarks/bench_metrics.py [--allottees 2000] [--requests 300] [--batch-size 100]
+                                          [--rounds 5]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ['DUES_CACHE_MAX_ENTRIES'] = '0'
+
+# bench_handlers sets up the environment the handler modules read on import
+from bench_handlers import FakeContext, Fakes, dues_status_batch_event, dues_status_event  # noqa: E402
+from common import metrics  # noqa: E402
+from dataset import Dataset  # noqa: E402
+import dues_status_lambda  # noqa: E402
+
+MODES = {'off': (False, 0.0), 'on': (True, 0.0), 'detailed': (True, 1.0)}
+
+
+def replay(events, mode):
+    metrics.METRICS_ENABLED, metrics.METRICS_DETAIL_SAMPLE_RATE = MODES[mode]
+    context = FakeContext('dues_status_lambda', 30)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        start = time.perf_counter()
+        for event in events:
+            dues_status_lambda.lambda_handler(event, context)
+        elapsed = time.perf_counter() - start
+    metric_bytes = sum(len(line) + 1 for line in log.getvalue().splitlines() if line.startswith('{"_aws"'))
+    return elapsed / len(events), metric_bytes / len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--allottees', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=300, help='Requests per endpoint, mode and round')
+    parser.add_argument('--batch-size', type=int, default=100, help='Employees per batch request')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    dataset = Dataset(args.allottees, 3, args.seed)
+    fakes = Fakes(dataset, 0.0)
+    fakes.install()
+    endpoints = {
+        'dues_status': [dues_status_event(rng, dataset, args, n) for n in range(args.requests)],
+        'dues_status_batch': [dues_status_batch_event(rng, dataset, args, n)
+                              for n in range(max(1, args.requests // 10))]
+    }
+
+    print(f"{args.allottees} allottees, {args.rounds} rounds, no simulated latency")
+    print(f"{'endpoint':<20} {'mode':<9} {'us/request':>11} {'overhead':>15} {'log B/request':>14}")
+    for name, events in endpoints.items():
+        replay(events, 'on')  # Warm-up
+        best = {}
+        for _ in range(args.rounds):
+            for mode in MODES:
+                seconds, metric_bytes = replay(events, mode)
+                if mode not in best or seconds < best[mode][0]:
+                    best[mode] = (seconds, metric_bytes)
+        baseline = best['off'][0]
+        for mode, (seconds, metric_bytes) in best.items():
+            overhead = (seconds - baseline) * 1e6
+            print(f"{name:<20} {mode:<9} {seconds * 1e6:>11.1f}"
+                  f" {f'{overhead:+.1f} us ({overhead / (baseline * 1e4):+.1f}%)' if mode != 'off' else '-':>15}"
+                  f" {metric_bytes:>14.0f}")
+
+
+if __name__ == '__main__':
+    main()
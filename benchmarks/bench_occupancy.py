@@ -0,0 +1,175 @@
+"""Finding a month's occupants: the occupancy history's month index against the scans it replaces.
+
+A synthetic population from dataset.py (quarters with vacated and transferred allotments) is loaded
+into local stand-in tables, with --past-spans earlier, long-ended allotments per quarter in its
+history as years of use would leave, and the occupants of the last full month are found three ways:
+
+  allottees scan   parallel scan of AllotteesTable in pages of --page-size, filtered on status
+                   and allotment dates as the deduction run did before OccupancyHistoryTable; it
+                   sees only each quarter's current allotment, so a transfer month misses the
+                   outgoing allottee
+  history scan     the same scan of the whole OccupancyHistoryTable, filtered to spans overlapping
+                   the month
+  month index      occupancy.month_spans(): a range query per shard of end_month-index
+
+The month index must return exactly the history scan's spans. Reported per run: wall time, calls and
+read units (as common.dynamo meters them). Only the scans' read units grow with the history; the wall
+times include the stand-ins' own CPU time, which the calls and read units leave out. OccupancyIndex
+is then built from the month's spans and timed on --lookups occupant() calls for random quarters and
+days, and on splitting every quarter's month between its occupants (whose days may not add up to
+more than the month).
+
+Usage: python benchmarks/bench_occupancy.py [--allottees 20000] [--months 6] [--past-spans 4]
+                                            [--latency-ms 5] [--segments 4] [--page-size 500]
+                                            [--lookups 200000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+
+import occupancy  # noqa: E402
+from common import dynamo  # noqa: E402
+from dataset import Dataset, quarter_id  # noqa: E402
+from fakes import CallStats, FakeTable  # noqa: E402
+
+
+def past_spans(count, per_quarter, before_year):
+    # per_quarter allotments of each quarter, three years each, ending before before_year
+    for i in range(1, count + 1):
+        for k in range(per_quarter):
+            end_year = before_year - 3 * k
+            yield occupancy.span_item(quarter_id(i), f"LSQP{i:07d}{k}", f"PFMP{i:07d}{k}",
+                                      f"{end_year - 3}-04-{i % 27 + 1:02d}", f"{end_year}-04-{i % 27 + 1:02d}",
+                                      'VACATED')
+
+
+def legacy_is_occupied(allottee, billing_month):
+    # The filter send_deductions_lambda applied to each scanned allottee before the occupancy history
+    start, end = allottee.get('allotment_start_date'), allottee.get('allotment_end_date')
+    if allottee.get('status') == 'OCCUPIED':
+        return not start or start[:7] <= billing_month
+    if allottee.get('status') in ('VACATED', 'TRANSFERRED') and start and end:
+        return start[:7] <= billing_month <= end[:7]
+    return False
+
+
+def parallel_scan(table, segments, page_size, keep):
+    # Every item of the table for which keep(item) holds, read by `segments` parallel scans
+    def scan_segment(segment):
+        scan_kwargs = {'Segment': segment, 'TotalSegments': segments, 'Limit': page_size}
+        kept = []
+        while True:
+            response = table.scan(**scan_kwargs)
+            kept.extend(item for item in response.get('Items', []) if keep(item))
+            if not response.get('LastEvaluatedKey'):
+                return kept
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return [item for kept in executor.map(scan_segment, range(segments)) for item in kept]
+
+
+def timed(function, *args):
+    # (seconds, result, calls, read units) of one run
+    dynamo.meter.reset()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args)
+    elapsed = time.perf_counter() - start
+    report = dynamo.capacity_report()
+    return elapsed, result, sum(line['calls'] for line in report), sum(line['units'] for line in report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--allottees', type=int, default=20000)
+    parser.add_argument('--months', type=int, default=6, help='Billing months of history in the dataset')
+    parser.add_argument('--past-spans', type=int, default=4,
+                        help='Ended allotments per quarter before the dataset')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call DynamoDB latency')
+    parser.add_argument('--segments', type=int, default=4, help='Parallel segments of the scans')
+    parser.add_argument('--page-size', type=int, default=500, help='Items per scan page')
+    parser.add_argument('--lookups', type=int, default=200000, help='OccupancyIndex.occupant() calls to time')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    dataset = Dataset(args.allottees, months=args.months, seed=args.seed)
+    stats = CallStats()
+    allottees = FakeTable('bench-allottees', ['quarter_id'], stats=stats)
+    history = FakeTable(os.environ['OCCUPANCY_HISTORY_TABLE_NAME'], ['quarter_id', 'span_key'], stats=stats,
+                        indexes={occupancy.OCCUPANCY_INDEX_NAME: ['index_shard', 'end_month']})
+    others = [FakeTable(name, ['quarter_id'], keep_items=False)
+              for name in ('readings', 'bills', 'payments', 'ledger')]
+    counts = dataset.load(allottees, history, *others)
+    history.load(past_spans(args.allottees, args.past_spans, int(dataset.months[-1][:4]) - 6))
+    for table in (allottees, history):
+        table.latency = args.latency_ms / 1000.0
+    occupancy.occupancy_table = dynamo.ThrottledTable(history, priority='bulk')
+    billing_month = dataset.months[1]
+    after_month = occupancy.month_after(billing_month)
+
+    def overlaps(span):
+        return span['end_month'] >= billing_month and span['start_date'] < after_month and 'employee_id' in span
+
+    runs = {
+        'allottees scan': (parallel_scan, dynamo.ThrottledTable(allottees, priority='bulk'), args.segments,
+                           args.page_size,
+                           lambda item: item.get('employee_id') and legacy_is_occupied(item, billing_month)),
+        'history scan': (parallel_scan, occupancy.occupancy_table, args.segments, args.page_size, overlaps),
+        'month index': (occupancy.month_spans, billing_month)
+    }
+    # The fakes index their items on first use: an untimed first pass leaves that out
+    for run in runs.values():
+        timed(*run)
+    results = {name: timed(*run) for name, run in runs.items()}
+
+    def keys(spans):
+        return sorted((span['quarter_id'], span['span_key']) for span in spans)
+
+    spans = results['month index'][1]
+    assert keys(spans) == keys(results['history scan'][1]), 'the month index and the history scan disagree'
+
+    print(f"{counts['allottees']} allottees, {len(history)} spans; occupants of {billing_month}, "
+          f"{args.latency_ms:g} ms per call")
+    print(f"{'run':<16} {'seconds':>8} {'calls':>6} {'read units':>11} {'occupants':>10}")
+    for name, (elapsed, found, calls, units) in results.items():
+        print(f"{name:<16} {elapsed:>8.2f} {calls:>6} {units:>11.1f} {len(found):>10}")
+
+    start = time.perf_counter()
+    index = occupancy.OccupancyIndex(billing_month, spans)
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(args.seed)
+    probes = [(quarter_id(rng.randint(1, args.allottees)),
+               f"{billing_month}-{rng.randint(1, index.month_days):02d}") for _ in range(args.lookups)]
+    start = time.perf_counter()
+    held = sum(index.occupant(quarter, day) is not None for quarter, day in probes)
+    lookup_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    days = {}
+    for span, _, _, share_days in index.month_shares():
+        days[span['quarter_id']] = days.get(span['quarter_id'], 0) + share_days
+    shares_seconds = time.perf_counter() - start
+    assert max(days.values(), default=0) <= index.month_days
+    split = sum(len(index.shares(quarter)) > 1 for quarter in index.quarters())
+
+    print(f"\nOccupancyIndex of {len(index)} quarters built in {build_seconds * 1000:.1f} ms")
+    print(f"occupant()  {args.lookups / lookup_seconds:>10.0f} lookups/s ({held} of {args.lookups} days held)")
+    print(f"shares      {len(index) / shares_seconds:>10.0f} quarters/s ({split} quarters split between occupants)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""End-to-end time of a PFMS payment-confirmation callback against local DynamoDB stand-ins.
+
+Each payload is posted twice: the first run stores every result, the replay (what PFMS sends
+when it did not see the first response) should find every row already stored for the job.
+A run passes when both finish inside the API Gateway integration timeout.
+
+Every employee has a bill for the month. The stored results are then handed to bill_settlement_lambda
+as PaymentStatusesTable's stream would, in batches of 1000 records, and each SUCCESS must have settled
+its bill; the time and calls of that are reported on their own line.
+
+Usage: python benchmarks/bench_payment_confirmations.py [--sizes 1000,10000,50000] [--latency-ms 5]
+                                                         [--unprocessed-every 50]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+
+import bill_settlement_lambda  # noqa: E402
+import billing_index  # noqa: E402
+import dues_ledger  # noqa: E402
+import payment_confirmation_lambda  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import CallStats, FakeDynamoDB, FakeTable  # noqa: E402
+
+API_GATEWAY_TIMEOUT_SECONDS = 29
+STREAM_BATCH_SIZE = 1000 # BatchSize of BillSettlementFunction's stream event
+
+
+class FakeContext:
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def synthetic_payload(count, billing_month='2025-06'):
+    results = []
+    for i in range(1, count + 1):
+        # Roughly what a month looks like: most deductions succeed, a few fail, a handful are malformed
+        if i % 500 == 0:
+            results.append({'employee_id': f"PFMS{i:06d}", 'status': 'SUCCESS'})
+        elif i % 20 == 0:
+            results.append({'employee_id': f"PFMS{i:06d}", 'amount_deducted_inr': 0, 'status': 'FAILED',
+                            'failure_reason': 'Insufficient pay'})
+        else:
+            results.append({'employee_id': f"PFMS{i:06d}", 'amount_deducted_inr': 500.0 + i % 5 * 10,
+                            'status': 'SUCCESS', 'failure_reason': None})
+    return json.dumps({'billing_month': billing_month, 'job_id': f"PFMS-JOB-{count}", 'results': results})
+
+
+def month_bills(count, billing_month='2025-06'):
+    # A bill per employee of the payload, as the deduction run writes it
+    bills = []
+    for i in range(1, count + 1):
+        bill = {'allottee_id': f"LSQA{i:06d}", 'billing_month': billing_month, 'quarter_id': f"LSL-C-{i:06d}",
+                'employee_id': f"PFMS{i:06d}", 'amount_inr': 500 + i % 5 * 10, 'status': 'PENDING_DDO_UPLOAD'}
+        bill.update(billing_index.bill_index_fields(bill))
+        bills.append(bill)
+    return bills
+
+
+def stream_records(rows):
+    # DynamoDB stream records (NEW_IMAGE) of newly written PaymentStatusesTable rows
+    return [{'eventName': 'INSERT', 'dynamodb': {
+        'SequenceNumber': str(n),
+        'NewImage': {name: {'S': row[name]} for name in ('employee_id', 'billing_month', 'status')}
+    }} for n, row in enumerate(rows, 1)]
+
+
+def settle(records):
+    # Returns (seconds, failed records)
+    failed = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for first in range(0, len(records), STREAM_BATCH_SIZE):
+            response = bill_settlement_lambda.lambda_handler(
+                {'Records': records[first:first + STREAM_BATCH_SIZE]}, FakeContext(300))
+            failed += len(response['batchItemFailures'])
+    return time.perf_counter() - start, failed
+
+
+def post(payload):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = payment_confirmation_lambda.lambda_handler(
+            {'body': payload}, FakeContext(API_GATEWAY_TIMEOUT_SECONDS))
+    return time.perf_counter() - start, response['statusCode'], json.loads(response['body'])
+
+
+def run(count, latency, unprocessed_every):
+    stats = CallStats()
+    payments = FakeTable(payment_confirmation_lambda.payment_statuses_table.name,
+                         ['employee_id', 'billing_month'], latency=latency, stats=stats)
+    ledger = FakeTable(dues_ledger.dues_ledger_table.name, ['employee_id'], latency=latency, stats=stats)
+    bills = FakeTable(billing_index.water_bills_table.name, ['allottee_id', 'billing_month'], latency=latency,
+                      stats=stats, indexes={billing_index.MONTH_INDEX_NAME: ['month_shard', 'employee_id']})
+    bills.load(month_bills(count))
+    payment_confirmation_lambda.dynamodb = dynamo.ThrottledDynamoDB(
+        FakeDynamoDB([payments, ledger], latency=latency, stats=stats, unprocessed_every=unprocessed_every))
+    payment_confirmation_lambda.payment_statuses_table = payments
+    dues_ledger.dues_ledger_table = ledger
+    billing_index.water_bills_table = bills
+
+    payload = synthetic_payload(count)
+    rows = []
+    for label in ('first', 'replay'):
+        stats.reset()
+        elapsed, status_code, body = post(payload)
+        assert status_code == 200, body
+        rows.append((label, elapsed, body, stats.total()))
+
+    first, replay = rows[0][2], rows[1][2]
+    assert first['accepted'] + first['rejected'] == count and first['duplicate'] == 0, first
+    assert replay['accepted'] == 0 and replay['duplicate'] == first['accepted'], replay
+    assert len(payments) == first['accepted']
+
+    stats.reset()
+    stored = payments.items()
+    elapsed, failed = settle(stream_records(stored))
+    settled = Counter(bill['settlement_status'] for bill in bills.items())
+    successes = sum(row['status'] == 'SUCCESS' for row in stored)
+    assert failed == 0 and settled['PAID'] == successes and settled['UNPAID'] == count - successes, settled
+    return rows, (elapsed, len(stored), settled['PAID'], stats.total())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call DynamoDB latency')
+    parser.add_argument('--unprocessed-every', type=int, default=50,
+                        help='Return every n-th batch key or write as unprocessed once (0 disables)')
+    args = parser.parse_args()
+
+    print(f"{'results':>8} {'run':>7} {'seconds':>8} {'rows/s':>9} {'accepted':>9} {'duplicate':>9}"
+          f" {'rejected':>9} {'calls':>7}")
+    for count in (int(s) for s in args.sizes.split(',')):
+        rows, settlement = run(count, args.latency_ms / 1000.0, args.unprocessed_every)
+        for label, elapsed, body, calls in rows:
+            print(f"{count:>8} {label:>7} {elapsed:>8.2f} {count / elapsed:>9.0f} {body['accepted']:>9}"
+                  f" {body['duplicate']:>9} {body['rejected']:>9} {calls:>7}")
+            if elapsed > API_GATEWAY_TIMEOUT_SECONDS:
+                print(f"  exceeded the {API_GATEWAY_TIMEOUT_SECONDS}s API Gateway timeout")
+        elapsed, records, paid, calls = settlement
+        print(f"{'':>8} {'settle':>7} {elapsed:>8.2f} {records / elapsed:>9.0f}   {records} stream records,"
+              f" {paid} bills settled, {calls} calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Cost of a first PDF bill request (render + upload) against repeat requests served from the S3 cache.
+
+Usage: python benchmarks/bench_pdf_bill.py [--bills 50] [--repeat 5] [--latency-ms 5]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PDF_BILLS_BUCKET_NAME', 'bench-pdf-bills')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+
+import generate_pdf_bill_lambda  # noqa: E402
+from fakes import CallStats, FakeS3, FakeTable  # noqa: E402
+
+
+def setup(count, latency):
+    stats = CallStats()
+    allottees = FakeTable('allottees', ['quarter_id'], latency=latency, stats=stats)
+    bills = FakeTable('water_bills', ['allottee_id', 'billing_month'], latency=latency, stats=stats)
+    for i in range(1, count + 1):
+        allottees.load([{'quarter_id': f"LSL-C-{i:06d}", 'allottee_id': f"LSQA{i:06d}",
+                         'employee_id': f"PFMS{i:06d}", 'name': f"Allottee {i}"}])
+        bills.load([{'allottee_id': f"LSQA{i:06d}", 'billing_month': '2025-06', 'quarter_id': f"LSL-C-{i:06d}",
+                     'amount_inr': Decimal('520.00'), 'status': 'PENDING', 'billed_date': '2025-07-01T00:00:00Z'}])
+    generate_pdf_bill_lambda.allottees_table = allottees
+    generate_pdf_bill_lambda.water_bills_table = bills
+    s3 = FakeS3(latency=latency, stats=stats)
+    generate_pdf_bill_lambda.s3 = s3
+    return stats, bills, s3
+
+
+def request_all(count, delivery):
+    start = time.perf_counter()
+    for i in range(1, count + 1):
+        event = {'pathParameters': {'allottee_id': f"LSQA{i:06d}", 'billing_month': '2025-06'},
+                 'queryStringParameters': {'delivery': delivery}}
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = generate_pdf_bill_lambda.lambda_handler(event, None)
+        assert response['statusCode'] in (200, 302), response
+        if delivery == 'inline':
+            assert base64.b64decode(response['body']).startswith(b'%PDF')
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bills', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call AWS latency')
+    args = parser.parse_args()
+
+    print(f"{'request':<28} {'ms/request':>10} {'S3 calls':>9} {'puts':>5}")
+    for delivery in ('inline', 'url'):
+        stats, bills, s3 = setup(args.bills, args.latency_ms / 1000.0)
+        rows = [('first ' + delivery, request_all(args.bills, delivery))]
+        first_calls = dict(stats.calls)
+        stats.reset()
+        rows.append(('repeat ' + delivery, min(request_all(args.bills, delivery) for _ in range(args.repeat))))
+        repeat_calls = {k: v / args.repeat for k, v in stats.calls.items()}
+
+        # A changed bill must be re-rendered
+        bills._items[('LSQA000001', '2025-06')]['status'] = 'PAID'
+        stats.reset()
+        request_all(1, delivery)
+        assert stats.calls['PutObject'] == 1
+
+        for (label, seconds), calls in zip(rows, (first_calls, repeat_calls)):
+            s3_calls = sum(v for k, v in calls.items() if k in ('HeadObject', 'GetObject', 'PutObject'))
+            print(f"{label:<28} {seconds * 1000:>10.2f} {s3_calls / args.bills:>9.1f}"
+                  f" {calls.get('PutObject', 0) / args.bills:>5.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Concurrent requests for the same PDFs: synchronous GETs against single-flight asynchronous jobs.
+
+--clients threads ask for each of --bills bills at the same moment, as several browser tabs or portal
+retries would. Synchronous GETs all miss the S3 cache together and each renders and uploads the PDF;
+POSTs to the job endpoint coalesce onto one job per bill, which a worker drains from the queue before
+every client's job GET returns a download link. The job flow runs fully offline, once with the
+in-memory job store and once with the DynamoDB store on a local stand-in table, both with the
+in-memory queue. It also checks that a changed bill gets a new job and that a POST for a PDF that is
+already stored completes without queuing anything.
+
+Usage: python benchmarks/bench_pdf_jobs.py [--bills 20] [--clients 8] [--latency-ms 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PDF_BILLS_BUCKET_NAME', 'bench-pdf-bills')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+os.environ['PDF_JOB_BACKEND'] = 'memory'
+
+import generate_pdf_bill_lambda  # noqa: E402
+import pdf_jobs  # noqa: E402
+import pdf_render_worker_lambda  # noqa: E402
+from fakes import CallStats, FakeS3, FakeTable  # noqa: E402
+
+BILLING_MONTH = '2025-06'
+
+
+class FakeContext:
+    def __init__(self, timeout_seconds=300):
+        self.deadline = time.monotonic() + timeout_seconds
+        self.aws_request_id = str(uuid.uuid4())
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def setup(count, latency, store):
+    stats = CallStats()
+    allottees = FakeTable('allottees', ['quarter_id'], latency=latency, stats=stats)
+    bills = FakeTable('water_bills', ['allottee_id', 'billing_month'], latency=latency, stats=stats)
+    for i in range(1, count + 1):
+        allottees.load([{'quarter_id': f"LSL-C-{i:06d}", 'allottee_id': f"LSQA{i:06d}",
+                         'employee_id': f"PFMS{i:06d}", 'name': f"Allottee {i}"}])
+        bills.load([{'allottee_id': f"LSQA{i:06d}", 'billing_month': BILLING_MONTH, 'quarter_id': f"LSL-C-{i:06d}",
+                     'amount_inr': Decimal('520.00'), 'status': 'PENDING', 'billed_date': '2025-07-01T00:00:00Z'}])
+    generate_pdf_bill_lambda.allottees_table = allottees
+    generate_pdf_bill_lambda.water_bills_table = bills
+    generate_pdf_bill_lambda.s3 = FakeS3(latency=latency, stats=stats)
+    if store == 'dynamodb':
+        table = FakeTable(os.environ['JOB_STATE_TABLE_NAME'], ['job_id'], latency=latency, stats=stats)
+        pdf_jobs._backend = (pdf_jobs.DynamoJobStore(table), pdf_jobs.InMemoryJobQueue())
+    else:
+        pdf_jobs._backend = (pdf_jobs.InMemoryJobStore(), pdf_jobs.InMemoryJobQueue())
+    return stats, bills
+
+
+def call(event):
+    response = generate_pdf_bill_lambda.lambda_handler(event, None)
+    return response['statusCode'], json.loads(response['body'] or '{}')
+
+
+def bill_event(i, method='GET', resource='pdf'):
+    return {'httpMethod': method, 'resource': f"/v1/bills/{{allottee_id}}/{{billing_month}}/{resource}",
+            'pathParameters': {'allottee_id': f"LSQA{i:06d}", 'billing_month': BILLING_MONTH},
+            'queryStringParameters': {'delivery': 'url'} if method == 'GET' else None}
+
+
+def all_clients(executor, bills, clients, event_for):
+    requests = [event_for(i) for i in range(1, bills + 1) for _ in range(clients)]
+    return list(executor.map(call, requests))
+
+
+def run_sync(args, latency):
+    stats, _ = setup(args.bills, latency, 'memory')
+    with ThreadPoolExecutor(max_workers=args.bills * args.clients) as executor:
+        start = time.perf_counter()
+        responses = all_clients(executor, args.bills, args.clients, bill_event)
+        elapsed = time.perf_counter() - start
+    assert all(status == 200 for status, _ in responses), responses[0]
+    return elapsed, stats.calls['PutObject'], 0
+
+
+def run_async(args, latency, store_name):
+    stats, bills = setup(args.bills, latency, store_name)
+    store, queue = pdf_jobs.job_backend()
+    with ThreadPoolExecutor(max_workers=args.bills * args.clients) as executor:
+        start = time.perf_counter()
+        posted = all_clients(executor, args.bills, args.clients, lambda i: bill_event(i, 'POST', 'pdf-jobs'))
+        assert all(status == 202 for status, _ in posted), posted[0]
+        job_ids = {body['job_id'] for _, body in posted}
+        queued = len(queue.messages)
+        pdf_render_worker_lambda.drain(FakeContext())
+        polled = list(executor.map(call, [{'httpMethod': 'GET', 'pathParameters': {'job_id': body['job_id']}}
+                                          for _, body in posted]))
+        elapsed = time.perf_counter() - start
+    assert len(job_ids) == args.bills and queued == args.bills, (len(job_ids), queued)
+    assert all(status == 200 and body['status'] == 'COMPLETED' and body['url'] for status, body in polled), polled[0]
+    puts = stats.calls['PutObject']
+
+    # Asking again for a stored PDF completes straight away; a changed bill is a new job
+    status, body = call(bill_event(1, 'POST', 'pdf-jobs'))
+    assert status == 200 and body['status'] == 'COMPLETED' and body['job_id'] in job_ids and not queue.messages, body
+    bills._items[('LSQA000001', BILLING_MONTH)]['status'] = 'PAID'
+    status, body = call(bill_event(1, 'POST', 'pdf-jobs'))
+    assert status == 202 and body['status'] == 'QUEUED' and body['job_id'] not in job_ids, body
+    assert len(queue.messages) == 1, queue.messages
+    return elapsed, puts, queued
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bills', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent requests per bill')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call AWS latency')
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000.0
+
+    print(f"{args.bills} bills x {args.clients} concurrent clients, {args.latency_ms:g} ms per call")
+    print(f"{'mode':<34} {'seconds':>8} {'renders':>8} {'queued':>7}")
+    for label, run in (('synchronous GET', lambda: run_sync(args, latency)),
+                       ('async jobs, in-memory store', lambda: run_async(args, latency, 'memory')),
+                       ('async jobs, DynamoDB store (local)', lambda: run_async(args, latency, 'dynamodb'))):
+        # The handlers log every request; stdout is redirected once for the run, not per thread
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, renders, queued = run()
+        print(f"{label:<34} {elapsed:>8.2f} {renders:>8} {queued:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Per-bill render time and peak memory: laying every bill out with fpdf2 against filling the bill template.
+
+Renders --bills synthetic bills both ways, checks that the template produces byte-for-byte the PDF fpdf2
+produces and that rendering the same bill twice gives the same bytes, then times multi-page statements.
+Peak memory is the largest Python heap allocated while rendering, measured with tracemalloc in a
+separate pass so that it does not slow the timed one.
+
+Usage: python benchmarks/bench_pdf_render.py [--bills 1000] [--statement-months 12,36]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+import warnings
+import zlib
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PDF_BILLS_BUCKET_NAME', 'bench-pdf-bills')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+
+import generate_pdf_bill_lambda  # noqa: E402
+
+# The bill layout uses fpdf2's positional ln argument, which it reports as deprecated on every cell
+warnings.filterwarnings('ignore', category=DeprecationWarning)
+
+STATUSES = ('PENDING', 'PAID', 'PARTIAL')
+
+
+def synthetic_fields(count):
+    for i in range(1, count + 1):
+        bill = {'quarter_id': f"LSL-C-{i:06d}", 'billing_month': '2025-06', 'amount_inr': Decimal(500 + i % 9 * 15),
+                'status': STATUSES[i % len(STATUSES)], 'billed_date': f"2025-07-{i % 28 + 1:02d}T00:00:00Z"}
+        # Some names need escaping in the PDF string syntax
+        name = f"Allottee {i}" if i % 10 else f"Allottee (Acting) {i}"
+        allottee = {'name': name, 'employee_id': f"PFMS{i:06d}"}
+        yield generate_pdf_bill_lambda.bill_fields(bill, allottee, '2025-06')
+
+
+def render_all(render, bills):
+    start = time.perf_counter()
+    for fields in bills:
+        render(fields)
+    return (time.perf_counter() - start) / len(bills)
+
+
+def peak_memory(render, bills):
+    tracemalloc.start()
+    for fields in bills:
+        render(fields)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--bills', type=int, default=1000)
+    parser.add_argument('--statement-months', default='12,36')
+    args = parser.parse_args()
+    bills = list(synthetic_fields(args.bills))
+
+    start = time.perf_counter()
+    template = generate_pdf_bill_lambda.bill_template()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    for fields in bills:
+        direct = generate_pdf_bill_lambda.render_bill_pdf_direct(fields)
+        assert template.fill(fields) == direct, fields
+        assert generate_pdf_bill_lambda.render_bill_pdf(fields) == generate_pdf_bill_lambda.render_bill_pdf(fields)
+
+    print(f"{args.bills} bills; template built once in {build_ms:.1f} ms")
+    print(f"{'renderer':<18} {'ms/bill':>8} {'bills/s':>8} {'peak KiB':>9}")
+    for label, render in (('fpdf2 layout', generate_pdf_bill_lambda.render_bill_pdf_direct),
+                          ('bill template', generate_pdf_bill_lambda.render_bill_pdf)):
+        seconds = render_all(render, bills)
+        peak = peak_memory(render, bills)
+        print(f"{label:<18} {seconds * 1000:>8.3f} {1 / seconds:>8.0f} {peak / 1024:>9.0f}")
+
+    print(f"\n{'statement':<18} {'ms':>8} {'pages':>8} {'bytes':>9}")
+    for months in (int(m) for m in args.statement_months.split(',')):
+        rows = [{'allottee_id': 'LSQA000001', 'quarter_id': 'LSL-C-000001', 'billing_month':
+                 generate_pdf_bill_lambda.month_offset('2025-06', offset - months + 1),
+                 'amount_inr': Decimal('520.00'), 'status': 'PAID', 'billed_date': '2025-07-01T00:00:00Z'}
+                for offset in range(months)]
+        fields = generate_pdf_bill_lambda.statement_fields(rows, {'name': 'Allottee 1', 'employee_id': 'PFMS000001'},
+                                                           rows[0]['billing_month'], rows[-1]['billing_month'])
+        start = time.perf_counter()
+        pdf_output = generate_pdf_bill_lambda.render_statement_pdf(fields)
+        elapsed = time.perf_counter() - start
+        assert pdf_output == generate_pdf_bill_lambda.render_statement_pdf(fields)
+        pages = int(re.search(rb'/Count (\d+)', pdf_output).group(1))
+        # Every month is listed
+        content = b''.join(zlib.decompress(stream) for stream in
+                           re.findall(rb'stream\n(.*?)\nendstream', pdf_output, re.S))
+        assert all(row['billing_month'].encode() in content for row in rows)
+        print(f"{months:>3} months{'':<9} {elapsed * 1000:>8.2f} {pages:>8} {len(pdf_output):>9}")
+
+
+if __name__ == '__main__':
+    main()
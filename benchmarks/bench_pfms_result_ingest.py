@@ -0,0 +1,138 @@
+"""Streaming ingest of a generated multi-million-row PFMS result file from a local S3 stand-in.
+
+The file is put into a fake bucket and an S3 event is delivered to pfms_result_ingest_lambda. Each
+invocation gets --invocation-seconds to run, so large files are finished by continuation invocations
+that resume from the JobStateTable checkpoint; the benchmark runs them in order, as Lambda would.
+It checks that every valid row was written exactly once across all invocations.
+
+Usage: python benchmarks/bench_pfms_result_ingest.py [--rows 2000000] [--format csv|jsonl]
+                                                      [--latency-ms 1] [--invocation-seconds 60]
+                                                      [--trace-memory]
+
+With --trace-memory the peak Python heap allocated during ingestion (the generated file itself
+is excluded) is measured with tracemalloc, which slows the run down several times.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+
+import dues_ledger  # noqa: E402
+import job_state as job_state_module  # noqa: E402
+import payment_confirmation_lambda  # noqa: E402
+import pfms_result_ingest_lambda  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import CallStats, FakeDynamoDB, FakeLambda, FakeS3, FakeTable  # noqa: E402
+
+BUCKET = 'bench-pfms-results'
+FUNCTION_ARN = 'arn:aws:lambda:ap-south-1:000000000000:function:bench-pfms-result-ingest'
+
+
+class FakeContext:
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = FUNCTION_ARN
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def result_file(rows, file_format):
+    # Every 1000th row is malformed; it should be counted as rejected and not stop the file
+    lines = ['employee_id,amount_deducted_inr,status,failure_reason'] if file_format == 'csv' else []
+    for i in range(1, rows + 1):
+        employee_id = f"E{i:09d}"
+        if i % 1000 == 0:
+            lines.append(f"{employee_id},,SUCCESS," if file_format == 'csv' else '{"employee_id": "' + employee_id)
+        elif i % 20 == 0:
+            lines.append(f"{employee_id},0,FAILED,Insufficient pay" if file_format == 'csv' else json.dumps(
+                {'employee_id': employee_id, 'amount_deducted_inr': 0, 'status': 'FAILED',
+                 'failure_reason': 'Insufficient pay'}))
+        else:
+            amount = f"{500 + i % 5 * 10}.00"
+            lines.append(f"{employee_id},{amount},SUCCESS," if file_format == 'csv' else
+                         f'{{"employee_id": "{employee_id}", "amount_deducted_inr": {amount}, "status": "SUCCESS"}}')
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def run(rows, file_format, latency, invocation_seconds, trace_memory):
+    stats = CallStats()
+    payments = FakeTable(payment_confirmation_lambda.payment_statuses_table.name, ['employee_id', 'billing_month'],
+                         latency=latency, stats=stats, keep_items=False)
+    ledger = FakeTable(dues_ledger.dues_ledger_table.name, ['employee_id'], latency=latency, stats=stats,
+                       keep_items=False)
+    job_state = FakeTable(job_state_module.job_state_table.name, ['job_id'], latency=latency, stats=stats)
+    payment_confirmation_lambda.dynamodb = dynamo.ThrottledDynamoDB(
+        FakeDynamoDB([payments, ledger], latency=latency, stats=stats))
+    payment_confirmation_lambda.payment_statuses_table = payments
+    dues_ledger.dues_ledger_table = ledger
+    job_state_module.job_state_table = job_state
+
+    s3 = FakeS3(latency=latency, stats=stats)
+    lambda_client = FakeLambda(stats=stats)
+    pfms_result_ingest_lambda.s3 = s3
+    pfms_result_ingest_lambda.lambda_client = lambda_client
+
+    key = f"pfms-results/2025-06/PFMS-JOB-{rows}.{file_format}"
+    etag = s3.put_object(Bucket=BUCKET, Key=key, Body=result_file(rows, file_format))['ETag']
+    events = [{'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key, 'eTag': etag.strip('"')}}}]}]
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    invocations = 0
+    while events:
+        invocations += 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            pfms_result_ingest_lambda.lambda_handler(events.pop(0), FakeContext(invocation_seconds))
+        # Continuations queued by the handler run next, the way Lambda's async queue would deliver them
+        events.extend(json.loads(payload) for _, _, payload in lambda_client.invocations)
+        lambda_client.invocations.clear()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    state = job_state.items()[0]
+    assert state['status'] == 'COMPLETED', state
+    assert state['rejected'] == rows // 1000 and state['accepted'] == rows - rows // 1000, state
+    assert payments.write_count == state['accepted'], 'rows were written more than once'
+    return elapsed, invocations, stats, peak, s3.object_sizes[(BUCKET, key)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='Simulated per-call AWS latency')
+    parser.add_argument('--invocation-seconds', type=float, default=60.0,
+                        help='Time each invocation gets before it must hand over to a continuation')
+    parser.add_argument('--trace-memory', action='store_true', help='Measure peak heap usage with tracemalloc')
+    args = parser.parse_args()
+
+    pfms_result_ingest_lambda.INGEST_TIME_RESERVE_MS = min(pfms_result_ingest_lambda.INGEST_TIME_RESERVE_MS,
+                                                           int(args.invocation_seconds * 1000 / 4))
+    elapsed, invocations, stats, peak, file_size = run(args.rows, args.format, args.latency_ms / 1000.0,
+                                                       args.invocation_seconds, args.trace_memory)
+    print(f"{'rows':>9} {'file MiB':>9} {'seconds':>8} {'rows/s':>8} {'invocations':>11} {'calls':>7} {'peak MiB':>9}")
+    peak_mib = f"{peak / 2 ** 20:.1f}" if peak is not None else '-'
+    print(f"{args.rows:>9} {file_size / 2 ** 20:>9.1f} {elapsed:>8.1f} {args.rows / elapsed:>8.0f} {invocations:>11}"
+          f" {stats.total():>7} {peak_mib:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""The month-end reconciliation (reconciliation_lambda) over a million employees, against local stand-ins.
+
+WaterBillsTable and PaymentStatusesTable are stood in for by tables that generate each page of a
+month-index query (one --shards index shard) when it is asked for, so a month of --employees employees
+is read without holding it in memory (as a FakeTable would): a bill per employee (a second one for
+every 200th, who moved quarters) and a PFMS result for most of them. By employee number, results are
+exact SUCCESS, PARTIAL, FAILED, missing, or SUCCESS deducting more than was billed, and one employee in
+a thousand has a result but no bill. The stand-in tables hold only the month being reconciled; each
+query waits --latency-ms.
+
+Reported: wall time (which includes generating the pages), rows per second, the peak resident set
+size of the process and how much of it the run added, bytes spilled to disk and the report's size.
+The classification counts are checked against the ones the employee numbers imply, and the report
+must list every employee not PAID.
+
+Usage: python benchmarks/bench_reconciliation.py [--employees 1000000] [--shards 16] [--partitions 64]
+                                                 [--latency-ms 5] [--page-items 2000]
+"""
+import argparse
+import contextlib
+import io
+import os
+import resource
+import sys
+import tempfile
+import time
+from array import array
+from collections import Counter
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+os.environ.setdefault('METER_READINGS_TABLE_NAME', 'bench-meter-readings')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+os.environ.setdefault('DEDUCTION_FILES_BUCKET_NAME', 'bench-deduction-files')
+
+import billing_index  # noqa: E402
+import deduction_files  # noqa: E402
+import reconciliation_lambda  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import CallStats, FakeS3  # noqa: E402
+
+BILLING_MONTH = '2025-06'
+ITEM_BYTES = 150 # Roughly, for the read units a page consumes
+
+
+def bill_amount(i):
+    return Decimal(100 + i * 37 % 900) + Decimal(i % 100).scaleb(-2)
+
+
+def outcome(i):
+    # What employee i's PFMS result says, by the last two digits
+    last = i % 100
+    if last < 86:
+        return 'SUCCESS'
+    if last < 91:
+        return 'PARTIAL'
+    if last < 96:
+        return 'FAILED'
+    return 'MISSING' if last < 99 else 'OVER_DEDUCTED'
+
+
+EXPECTED = {'SUCCESS': 'PAID', 'PARTIAL': 'SHORT_PAID', 'FAILED': 'FAILED', 'MISSING': 'MISSING',
+            'OVER_DEDUCTED': 'OVER_DEDUCTED'}
+
+
+def billed(i):
+    # Every 200th employee moved quarters during the month and has a bill for each
+    return bill_amount(i) * 2 if i % 200 == 0 else bill_amount(i)
+
+
+def bill_items(i, employees):
+    if i > employees:
+        return []
+    bill = {'allottee_id': f"LSQA{i:07d}", 'billing_month': BILLING_MONTH, 'quarter_id': f"LSL-C-{i:07d}",
+            'employee_id': f"PFMS{i:07d}", 'amount_inr': bill_amount(i), 'status': 'PENDING_DDO_UPLOAD'}
+    if i % 200:
+        return [bill]
+    return [bill, dict(bill, allottee_id=f"LSQB{i:07d}", quarter_id=f"LSL-D-{i:07d}")]
+
+
+def payment_items(i, employees):
+    employee_id = f"PFMS{i:07d}"
+    if i > employees:
+        # A result for an employee with no bill
+        return [{'employee_id': employee_id, 'billing_month': BILLING_MONTH, 'job_id': 'PFMS-JOB-1',
+                 'amount_deducted_inr': Decimal('250.00'), 'status': 'SUCCESS'}]
+    result = outcome(i)
+    if result == 'MISSING':
+        return []
+    amount = {'SUCCESS': billed(i), 'PARTIAL': (billed(i) * Decimal('0.6')).quantize(Decimal('0.01')),
+              'FAILED': Decimal('0.00'), 'OVER_DEDUCTED': billed(i) + 10}[result]
+    return [{'employee_id': employee_id, 'billing_month': BILLING_MONTH, 'job_id': 'PFMS-JOB-1',
+             'amount_deducted_inr': amount, 'status': 'SUCCESS' if result == 'OVER_DEDUCTED' else result,
+             'failure_reason': 'Insufficient pay' if result != 'SUCCESS' else None}]
+
+
+def shard_members(last):
+    # Employee numbers 1..last by the index shard their employee_id falls into
+    members = [array('l') for _ in range(billing_index.BILLING_INDEX_SHARDS)]
+    for i in range(1, last + 1):
+        members[int(billing_index.index_shard(f"PFMS{i:07d}"))].append(i)
+    return members
+
+
+class GeneratedTable:
+    # Answers month-index queries with pages made on demand from the employees of the shard the key
+    # condition names. The projection is not evaluated: every item is returned whole.
+
+    def __init__(self, name, items_of, members, employees, latency, page_items, stats):
+        self.name = name
+        self.items_of = items_of
+        self.members = members
+        self.employees = employees
+        self.latency = latency
+        self.page_items = page_items
+        self.stats = stats
+
+    def query(self, KeyConditionExpression, IndexName=None, ExclusiveStartKey=None, **kwargs):
+        self.stats.record('Query')
+        if self.latency:
+            time.sleep(self.latency)
+        assert IndexName == billing_index.MONTH_INDEX_NAME, IndexName
+        billing_month, shard = KeyConditionExpression.get_expression()['values'][1].split('#')
+        numbers = self.members[int(shard)] if billing_month == BILLING_MONTH else array('l')
+        first = ExclusiveStartKey['position'] if ExclusiveStartKey else 0
+        stop = min(len(numbers), first + self.page_items)
+        items = [item for i in numbers[first:stop] for item in self.items_of(i, self.employees)]
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': len(items)}
+        if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+            response['ConsumedCapacity'] = {'TableName': self.name,
+                                            'CapacityUnits': max(1, len(items) * ITEM_BYTES // 4096) * 0.5}
+        if stop < len(numbers):
+            response['LastEvaluatedKey'] = {'position': stop}
+        return response
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--employees', type=int, default=1000000)
+    parser.add_argument('--shards', type=int, default=16, help='Index shards, each queried in parallel per table')
+    parser.add_argument('--partitions', type=int, default=64, help='Spill partitions of the hash join')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call DynamoDB latency')
+    parser.add_argument('--page-items', type=int, default=2000, help='Items per query page')
+    args = parser.parse_args()
+
+    stats = CallStats()
+    latency = args.latency_ms / 1000.0
+    billing_index.BILLING_INDEX_SHARDS = args.shards
+    members = shard_members(args.employees + args.employees // 1000)
+    reconciliation_lambda.water_bills_table = dynamo.ThrottledTable(
+        GeneratedTable('bench-water-bills', bill_items, members, args.employees, latency, args.page_items, stats),
+        priority='bulk')
+    reconciliation_lambda.payment_statuses_table = dynamo.ThrottledTable(
+        GeneratedTable('bench-payment-statuses', payment_items, members, args.employees, latency, args.page_items,
+                       stats),
+        priority='bulk')
+    s3 = FakeS3(stats=stats)
+    reconciliation_lambda.s3 = s3
+    deduction_files.s3 = s3
+    reconciliation_lambda.RECONCILE_PARTITIONS = args.partitions
+
+    baseline = peak_rss_bytes()
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as spill_directory, contextlib.redirect_stdout(io.StringIO()):
+        summary = reconciliation_lambda.reconcile(BILLING_MONTH, spill_directory)
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_bytes()
+
+    expected = Counter(EXPECTED[outcome(i)] for i in range(1, args.employees + 1))
+    expected['OVER_DEDUCTED'] += args.employees // 1000
+    assert summary['classifications'] == {name: expected[name] for name in summary['classifications']}, \
+        (summary['classifications'], expected)
+    report = s3.objects[(reconciliation_lambda.reports_bucket_name, summary['report'])]
+    assert report.count(b'\n') == summary['mismatches'] + 1
+
+    rows = summary['bills'] + summary['payments']
+    print(f"{args.employees} employees: {summary['bills']} bills, {summary['payments']} payment results; "
+           f"{args.shards} index shards per table, {args.partitions} partitions, {args.latency_ms:g} ms per call")
+    print(f"{'seconds':>8} {'rows/s':>9} {'calls':>6} {'peak MiB':>9} {'added MiB':>10} {'spilled MiB':>12}"
+          f" {'report MiB':>11}")
+    print(f"{elapsed:>8.1f} {rows / elapsed:>9.0f} {stats.total():>6} {peak / 2 ** 20:>9.1f}"
+          f" {(peak - baseline) / 2 ** 20:>10.1f} {summary['spilled_bytes'] / 2 ** 20:>12.1f}"
+          f" {len(report) / 2 ** 20:>11.1f}")
+    print(', '.join(f"{name} {count}" for name, count in summary['classifications'].items()))
+    print(f"billed INR {summary['billed_inr']}, deducted INR {summary['deducted_inr']}, "
+          f"shortfall INR {summary['shortfall_inr']}, excess INR {summary['excess_inr']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Serialising and compressing API responses (common.responses) on 10k-item payloads.
+
+Payloads are lists of --items DynamoDB items from dataset.py, as the handlers get them from boto3
+(Decimal numbers, string sets): AllotteesTable items (GET /v1/allottees), water bills, and dues
+ledgers (which carry pending_months as a set). Each is serialised three ways, best of --rounds:
+
+  prewalk      the workaround: a copy of every item with Decimals and sets converted, then json.dumps
+  default=str  json.dumps(default=str), as GET /v1/allottees did: one pass, but amounts become strings
+               and sets their Python repr
+  dumps        common.dumps: one pass of the C encoder, Decimals and sets converted by its default hook
+
+prewalk and dumps must produce the same JSON. Then each body goes through json_response() as for a
+client sending Accept-Encoding gzip (and br, when the brotli package is installed), and for one that
+sends none: time (compression and base64 included), the bytes API Gateway sends, and the ratio.
+
+Usage: python benchmarks/bench_responses.py [--items 10000] [--rounds 5]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+
+from common import responses  # noqa: E402
+from dataset import Dataset  # noqa: E402
+
+
+def payloads(items):
+    # {name: [item, ...]} of `items` items each, from as many quarters as that takes
+    found = {'allottees': [], 'bills': [], 'dues ledgers': []}
+    for allottee, _, _, bills, _, ledgers in Dataset(items, months=6).records():
+        found['allottees'].append(allottee)
+        found['bills'].extend(bills)
+        found['dues ledgers'].extend(ledgers)
+        if min(len(listed) for listed in found.values()) >= items:
+            break
+    return {name: listed[:items] for name, listed in found.items()}
+
+
+def plain(value):
+    # The pre-walk: a copy with every Decimal and set converted before json.dumps sees it
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(plain(item) for item in value)
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+SERIALISERS = {
+    'prewalk': lambda body: json.dumps(plain(body)),
+    'default=str': lambda body: json.dumps(body, default=str),
+    'dumps': responses.dumps
+}
+
+
+def best_of(rounds, function, *args):
+    # (fastest seconds, result)
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def sent_bytes(response):
+    return len(base64.b64decode(response['body'])) if response['isBase64Encoded'] else len(response['body'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    clients = {'identity': {}, 'gzip': {'Accept-Encoding': 'gzip, deflate'}}
+    if responses.brotli_module():
+        clients['br'] = {'Accept-Encoding': 'gzip, deflate, br'}
+    else:
+        print('brotli is not installed: br is not measured')
+
+    for name, items in payloads(args.items).items():
+        body = {'items': items, 'count': len(items)}
+        print(f"\n{name}: {len(items)} items")
+        print(f"{'serialiser':<12} {'ms':>8} {'items/s':>10} {'MiB/s':>7} {'KiB':>8}")
+        results = {}
+        for serialiser, function in SERIALISERS.items():
+            elapsed, results[serialiser] = best_of(args.rounds, function, body)
+            size = len(results[serialiser])
+            print(f"{serialiser:<12} {elapsed * 1000:>8.1f} {len(items) / elapsed:>10.0f}"
+                  f" {size / 2 ** 20 / elapsed:>7.1f} {size / 1024:>8.1f}")
+        assert json.loads(results['dumps']) == json.loads(results['prewalk']), f"{name}: dumps and prewalk differ"
+
+        text = results['dumps']
+        print(f"{'encoding':<12} {'ms':>8} {'sent KiB':>10} {'ratio':>7}")
+        for client, headers in clients.items():
+            event = {'headers': headers}
+            elapsed, response = best_of(args.rounds, responses.json_response, 200, text, event)
+            assert response['headers'].get('Content-Encoding', 'identity') == client, response['headers']
+            if client == 'gzip':
+                assert gzip.decompress(base64.b64decode(response['body'])).decode('utf-8') == text
+            print(f"{client:<12} {elapsed * 1000:>8.1f} {sent_bytes(response) / 1024:>10.1f}"
+                  f" {len(text) / sent_bytes(response):>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
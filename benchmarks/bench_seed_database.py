@@ -0,0 +1,146 @@
+"""Synthetic seeding with seed_database_lambda: records per second, continuations and idempotence.
+
+Invokes the handler directly with {"mode": "synthetic", "allottees": N, "months": M} against local
+stand-in tables. Each BatchWriteItem call takes --latency-ms, and its items are serialized the way
+boto3 serializes them before sending, so the CPU cost of the real write path is included. An invocation
+gets --invocation-seconds before it must hand over; continuations run next, the way Lambda's async
+queue would deliver them.
+
+With --verify the seed is run a second time in one invocation with a different chunk size, and every
+table must come out identical: re-running a seed is a no-op whichever worker writes which quarters.
+
+Usage: python benchmarks/bench_seed_database.py [--allottees 20000] [--months 3] [--latency-ms 10]
+                                                [--invocation-seconds 300] [--verify]
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+from boto3.dynamodb.types import TypeSerializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('METER_READINGS_TABLE_NAME', 'bench-meter-readings')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('DYNAMODB_PRIORITY', 'bulk')
+
+import dues_ledger  # noqa: E402
+import occupancy  # noqa: E402
+import seed_database_lambda  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import CallStats, FakeDynamoDB, FakeLambda, FakeTable  # noqa: E402
+
+FUNCTION_ARN = 'arn:aws:lambda:ap-south-1:000000000000:function:bench-seed-database'
+
+
+class FakeContext:
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+        self.invoked_function_arn = FUNCTION_ARN
+        self.log_stream_name = 'bench'
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+class SerializingDynamoDB(FakeDynamoDB):
+    # Serializes every item written, as boto3 does before sending a BatchWriteItem request
+    serializer = TypeSerializer()
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for requests in RequestItems.values():
+            for request in requests:
+                if 'PutRequest' in request:
+                    {name: self.serializer.serialize(value) for name, value in request['PutRequest']['Item'].items()}
+        return super().batch_write_item(RequestItems, **kwargs)
+
+
+def install(latency):
+    stats = CallStats()
+    tables = [FakeTable(os.environ['ALLOTTEES_TABLE_NAME'], ['quarter_id'], latency=latency, stats=stats),
+              FakeTable(os.environ['OCCUPANCY_HISTORY_TABLE_NAME'], ['quarter_id', 'span_key'], latency=latency,
+                        stats=stats),
+              FakeTable(os.environ['METER_READINGS_TABLE_NAME'], ['quarter_id', 'billing_month'], latency=latency,
+                        stats=stats),
+              FakeTable(os.environ['WATER_BILLS_TABLE_NAME'], ['allottee_id', 'billing_month'], latency=latency,
+                        stats=stats),
+              FakeTable(os.environ['PAYMENT_STATUSES_TABLE_NAME'], ['employee_id', 'billing_month'], latency=latency,
+                        stats=stats),
+              FakeTable(os.environ['DUES_LEDGER_TABLE_NAME'], ['employee_id'], latency=latency, stats=stats)]
+    SerializingDynamoDB(tables, latency=latency, stats=stats)
+    (seed_database_lambda.allottees_table, occupancy.occupancy_table, seed_database_lambda.meter_readings_table,
+     seed_database_lambda.water_bills_table, seed_database_lambda.payment_statuses_table,
+     dues_ledger.dues_ledger_table) = \
+        [dynamo.ThrottledTable(table) for table in tables]
+    seed_database_lambda.lambda_client = FakeLambda(stats=stats)
+    return tables, stats
+
+
+def seed(event, invocation_seconds):
+    # Runs the handler and its continuations; returns (seconds, invocations, last response)
+    events = [event]
+    invocations = 0
+    start = time.perf_counter()
+    while events:
+        invocations += 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = seed_database_lambda.lambda_handler(events.pop(0), FakeContext(invocation_seconds))
+        events.extend(json.loads(payload) for _, _, payload in seed_database_lambda.lambda_client.invocations)
+        seed_database_lambda.lambda_client.invocations.clear()
+    return time.perf_counter() - start, invocations, response
+
+
+def digest(table):
+    # Order-independent fingerprint of a table's items (sets are sorted, so equal items hash equally)
+    encoded = sorted(json.dumps(item, sort_keys=True, default=lambda v: sorted(v) if isinstance(v, set) else str(v))
+                     for item in table.items())
+    return hashlib.sha256('\n'.join(encoded).encode('utf-8')).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--allottees', type=int, default=20000)
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=10.0, help='Simulated per-call DynamoDB latency')
+    parser.add_argument('--invocation-seconds', type=float, default=300.0,
+                        help='Time each invocation gets before it must hand over to a continuation')
+    parser.add_argument('--verify', action='store_true', help='Seed again and check that nothing changes')
+    args = parser.parse_args()
+
+    seed_database_lambda.SEED_TIME_RESERVE_MS = min(seed_database_lambda.SEED_TIME_RESERVE_MS,
+                                                    int(args.invocation_seconds * 1000 / 4))
+    tables, stats = install(args.latency_ms / 1000.0)
+    event = {'mode': 'synthetic', 'allottees': args.allottees, 'months': args.months, 'seed': 1,
+             'end_month': '2025-06'}
+    elapsed, invocations, response = seed(event, args.invocation_seconds)
+    assert response['statusCode'] == 200, response
+    records = sum(len(table) for table in tables)
+
+    print(f"{args.allottees} allottees x {args.months} months, {args.latency_ms:g} ms per call, "
+          f"{seed_database_lambda.SEED_WORKERS} workers")
+    print(f"{'records':>9} {'seconds':>8} {'records/s':>10} {'invocations':>11} {'batch writes':>13}")
+    print(f"{records:>9} {elapsed:>8.1f} {records / elapsed:>10.0f} {invocations:>11}"
+          f" {stats.calls['BatchWriteItem']:>13}")
+    print('items per table:', {table.name: len(table) for table in tables})
+
+    if args.verify:
+        before = [digest(table) for table in tables]
+        seed_database_lambda.SEED_CHUNK_QUARTERS = seed_database_lambda.SEED_CHUNK_QUARTERS * 3 + 7
+        _, invocations, response = seed(event, 10 ** 6)
+        assert response['statusCode'] == 200 and invocations == 1, response
+        assert [digest(table) for table in tables] == before, 'a second seed changed the tables'
+        assert sum(len(table) for table in tables) == records
+        print('seeded again with a different chunk size: every table unchanged')
+
+
+if __name__ == '__main__':
+    main()
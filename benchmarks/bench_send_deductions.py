@@ -0,0 +1,189 @@
+"""Throughput and peak memory of the monthly deduction run against local DynamoDB/S3 stand-ins.
+
+Every quarter is occupied the whole month, found through the occupancy history's month index, and
+has a meter reading for it, except every 50th (charged the assessed consumption), so each page of
+occupants is charged by the tariff engine after its BatchGetItem calls. --workers is the run's
+BILLING_WORKERS, each reading its share of the index shards.
+
+The run is checkpointed in a stand-in JobStateTable and hands over to a continuation invocation when
+less than a quarter of --invocation-seconds (at most DEDUCTION_TIME_RESERVE_MS) is left; the benchmark
+runs the continuations in order, so a short --invocation-seconds exercises resuming from checkpoints.
+Each run is then repeated twice: with the same event, which must find the month done and send no
+second email, and as a fresh run of the month (a run_id), which must find every bill already written
+and assemble the same deduction file.
+
+Usage: python benchmarks/bench_send_deductions.py [--sizes 1000,10000,100000] [--latency-ms 5] [--gzip]
+                                                  [--invocation-seconds 900] [--trace-memory]
+
+With --trace-memory the peak Python heap allocated during the run is measured with
+tracemalloc (which slows the run down several times, so timings are not comparable).
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'bench-water-bills')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'bench-payment-statuses')
+os.environ.setdefault('METER_READINGS_TABLE_NAME', 'bench-meter-readings')
+os.environ.setdefault('DEDUCTION_FILES_BUCKET_NAME', 'bench-deductions')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'bench-dues-ledger')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'bench-job-state')
+os.environ.setdefault('DDO_EMAIL_RECIPIENT', 'ddo@example.com')
+os.environ.setdefault('SES_EMAIL_SENDER', 'billing@example.com')
+
+import deduction_files  # noqa: E402
+import dues_ledger  # noqa: E402
+import job_state  # noqa: E402
+import occupancy  # noqa: E402
+import send_deductions_lambda  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import CallStats, FakeDynamoDB, FakeLambda, FakeS3, FakeSES, FakeTable  # noqa: E402
+
+FUNCTION_ARN = 'arn:aws:lambda:ap-south-1:123456789012:function:bench-send-deductions'
+
+
+class FakeContext:
+    def __init__(self, timeout_seconds):
+        self.deadline = time.monotonic() + timeout_seconds
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = FUNCTION_ARN
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def synthetic_spans(count):
+    for i in range(1, count + 1):
+        yield occupancy.span_item(f"LSL-C-{i:06d}", f"LSQA{i:06d}", f"PFMS{i:06d}", '2023-01-01')
+
+
+def synthetic_readings(count, billing_month):
+    for i in range(1, count + 1):
+        if i % 50:
+            yield {
+                'quarter_id': f"LSL-C-{i:06d}",
+                'billing_month': billing_month,
+                'opening_reading_kl': Decimal(i * 137 % 90000),
+                'closing_reading_kl': Decimal(i * 137 % 90000) + Decimal(5000 + i * 7919 % 40000).scaleb(-3),
+                'reading_status': 'OK'
+            }
+
+
+def deduction_run(event, invocation_seconds):
+    # Runs the event and every continuation it queues, in order; returns (status code, invocations, final body)
+    lambda_client = send_deductions_lambda.lambda_client
+    events, invocations = [event], 0
+    while events:
+        invocations += 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = send_deductions_lambda.lambda_handler(events.pop(0), FakeContext(invocation_seconds))
+        assert response['statusCode'] in (200, 202), response
+        events.extend(json.loads(payload) for _, _, payload in lambda_client.invocations)
+        lambda_client.invocations.clear()
+    return response['statusCode'], invocations, json.loads(response['body'])
+
+
+def file_rows(s3, body):
+    # The deduction file a run assembled, decompressed, as lines
+    data = s3.objects[(send_deductions_lambda.deduction_files_bucket_name, body['deduction_file'])]
+    if body['deduction_file'].endswith('.gz'):
+        data = gzip.decompress(data)
+    return data.splitlines()
+
+
+def run(count, workers, latency, gzip_output, invocation_seconds, trace_memory=False):
+    stats = CallStats()
+    spans = FakeTable('occupancy_history', ['quarter_id', 'span_key'], latency=latency, stats=stats,
+                      indexes={occupancy.OCCUPANCY_INDEX_NAME: ['index_shard', 'end_month']})
+    spans.load(synthetic_spans(count))
+    bills = FakeTable('water_bills', ['allottee_id', 'billing_month'], latency=latency, stats=stats)
+    # The month the handler bills
+    billing_month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    readings = FakeTable('meter_readings', ['quarter_id', 'billing_month'], latency=latency, stats=stats)
+    readings.load(synthetic_readings(count, billing_month))
+
+    occupancy.occupancy_table = spans
+    send_deductions_lambda.water_bills_table = bills
+    send_deductions_lambda.meter_readings_table = readings
+    send_deductions_lambda.dynamodb = dynamo.ThrottledDynamoDB(FakeDynamoDB([readings], latency=latency, stats=stats))
+    dues_ledger.dues_ledger_table = FakeTable('dues_ledger', ['employee_id'], latency=latency, stats=stats)
+    job_state.job_state_table = FakeTable('job_state', ['job_id'], latency=latency, stats=stats)
+    ses = FakeSES(stats=stats)
+    send_deductions_lambda.ses_client = ses
+    # Page objects are read back to assemble the file, so bodies are kept
+    s3 = FakeS3(stats=stats)
+    send_deductions_lambda.s3 = s3
+    deduction_files.s3 = s3
+    send_deductions_lambda.lambda_client = FakeLambda(stats=stats)
+    send_deductions_lambda.BILLING_WORKERS = workers
+    send_deductions_lambda.DEDUCTION_FILE_GZIP = gzip_output
+    send_deductions_lambda.DEDUCTION_TIME_RESERVE_MS = min(
+        int(os.environ.get('DEDUCTION_TIME_RESERVE_MS', '60000')), int(invocation_seconds * 250))
+
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    status_code, invocations, body = deduction_run({}, invocation_seconds)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    assert status_code == 200 and body['status'] == 'COMPLETED', body
+    assert body['bills'] == body['new_bills'] == count and not body['conflicting_bills'], body
+    assert bills.write_count == count and len(ses.sent) == 1
+    rows = file_rows(s3, body)
+    assert len(rows) == count + 1
+    file_size = s3.object_sizes[(send_deductions_lambda.deduction_files_bucket_name, body['deduction_file'])]
+    run_stats = stats.total()
+
+    # The month is done, for good: its record outlives the job TTL, and the scheduled event again finds
+    # nothing to do
+    assert 'expires_at' not in job_state.job_state_table.get_item(Key={'job_id': body['job_id']})['Item']
+    _, again, repeat = deduction_run({}, invocation_seconds)
+    assert again == 1 and repeat['status'] == 'COMPLETED' and len(ses.sent) == 1, repeat
+    # A fresh run of the month writes no bill twice and assembles the same file
+    _, _, rerun = deduction_run({'run_id': 'rerun'}, invocation_seconds)
+    assert rerun['existing_bills'] == count and not rerun['new_bills'], rerun
+    assert bills.write_count == count and file_rows(s3, rerun) == rows
+    return elapsed, run_stats, invocations, peak, file_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--workers', default='1,4,8')
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call DynamoDB latency')
+    parser.add_argument('--gzip', action='store_true', help='Upload the deduction file gzip-compressed')
+    parser.add_argument('--invocation-seconds', type=float, default=900.0,
+                        help='Time each invocation is given before handing over to a continuation')
+    parser.add_argument('--trace-memory', action='store_true', help='Measure peak heap usage with tracemalloc')
+    args = parser.parse_args()
+
+    print(f"{'allottees':>10} {'workers':>8} {'seconds':>9} {'bills/s':>10} {'calls':>7} {'invokes':>8}"
+          f" {'peak MiB':>9} {'file MiB':>9}")
+    for count in (int(s) for s in args.sizes.split(',')):
+        for workers in (int(s) for s in args.workers.split(',')):
+            elapsed, calls, invocations, peak, file_size = run(count, workers, args.latency_ms / 1000.0, args.gzip,
+                                                               args.invocation_seconds,
+                                                               trace_memory=args.trace_memory)
+            peak_mib = f"{peak / 2 ** 20:.1f}" if peak is not None else '-'
+            print(f"{count:>10} {workers:>8} {elapsed:>9.2f} {count / elapsed:>10.0f} {calls:>7} {invocations:>8}"
+                  f" {peak_mib:>9} {file_size / 2 ** 20:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
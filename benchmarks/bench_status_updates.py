@@ -0,0 +1,127 @@
+"""Round trips and wall time of a CPWD status-update push against a local DynamoDB stand-in.
+
+Compares allottee_sync_lambda's batched processing with the previous GetItem/PutItem-per-update loop
+and checks that both leave AllotteesTable in the same state. The batched run also writes the
+occupancy history spans the updates open and close.
+
+Usage: python benchmarks/bench_status_updates.py [--updates 5000] [--latency-ms 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'bench-allottees')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'bench-occupancy-history')
+
+import allottee_sync_lambda  # noqa: E402
+import occupancy  # noqa: E402
+from common import dynamo  # noqa: E402
+from fakes import CallStats, FakeDynamoDB, FakeTable  # noqa: E402
+
+
+def existing_allottees(count):
+    for i in range(1, count + 1):
+        yield {
+            'quarter_id': f"LSL-C-{i:06d}",
+            'allottee_id': f"LSQA{i:06d}",
+            'employee_id': f"PFMS{i:06d}",
+            'name': f"Allottee {i}",
+            'allotment_start_date': '2023-01-01',
+            'status': 'OCCUPIED'
+        }
+
+
+def synthetic_updates(count):
+    # A third of the quarters are vacated, a third change hands, a third get a new occupant
+    updates = []
+    for i in range(1, count + 1):
+        update = {'quarter_id': f"LSL-C-{i:06d}", 'allottee_id': f"LSQA{i:06d}", 'employee_id': f"PFMS{i:06d}",
+                  'effective_date': '2025-06-20'}
+        if i % 3 == 0:
+            update['status'] = 'VACATED'
+        elif i % 3 == 1:
+            update.update(status='TRANSFERRED', new_allottee_id=f"LSQB{i:06d}", new_employee_id=f"PFMT{i:06d}")
+        else:
+            update.update(status='OCCUPIED', allottee_id=f"LSQC{i:06d}", employee_id=f"PFMU{i:06d}")
+        updates.append(update)
+    return updates
+
+
+def legacy_status_updates(table, updates):
+    # The loop allottee_sync_lambda ran before updates were validated up front and batched
+    for update in updates:
+        item = {
+            'quarter_id': update['quarter_id'],
+            'allottee_id': update['allottee_id'],
+            'employee_id': update.get('employee_id'),
+            'status': update['status'],
+            'effective_date': update['effective_date'],
+            'last_updated': 'legacy'
+        }
+        if update['status'] in ['VACATED', 'TRANSFERRED']:
+            existing_item = table.get_item(Key={'quarter_id': update['quarter_id']}).get('Item')
+            if existing_item:
+                item['allotment_start_date'] = existing_item.get('allotment_start_date')
+            item['allotment_end_date'] = update['effective_date']
+        elif update['status'] == 'OCCUPIED':
+            item['allotment_start_date'] = update['effective_date']
+            item['allotment_end_date'] = None
+        table.put_item(Item=item)
+
+
+def fresh_table(count, latency, stats):
+    table = FakeTable(allottee_sync_lambda.allottees_table.name, ['quarter_id'], latency=latency, stats=stats)
+    table.load(existing_allottees(count))
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=5.0, help='Simulated per-call DynamoDB latency')
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000.0
+    updates = synthetic_updates(args.updates)
+
+    stats = CallStats()
+    legacy_table = fresh_table(args.updates, latency, stats)
+    start = time.perf_counter()
+    legacy_status_updates(legacy_table, updates)
+    legacy_seconds, legacy_calls = time.perf_counter() - start, stats.total()
+
+    stats = CallStats()
+    table = fresh_table(args.updates, latency, stats)
+    allottee_sync_lambda.allottees_table = table
+    spans = FakeTable(os.environ['OCCUPANCY_HISTORY_TABLE_NAME'], ['quarter_id', 'span_key'], latency=latency,
+                      stats=stats)
+    occupancy.occupancy_table = spans
+    allottee_sync_lambda.dynamodb = dynamo.ThrottledDynamoDB(FakeDynamoDB([table, spans], latency=latency, stats=stats))
+    event = {'httpMethod': 'POST', 'path': '/v1/allottees/status-updates', 'body': json.dumps({'updates': updates})}
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = allottee_sync_lambda.lambda_handler(event, None)
+    batched_seconds, batched_calls = time.perf_counter() - start, stats.total()
+    assert response['statusCode'] == 200, response
+
+    # Vacated quarters must end up identical; transfers now also record the incoming allottee
+    for update in updates:
+        if update['status'] == 'VACATED':
+            new = dict(table._items[(update['quarter_id'],)], last_updated='legacy')
+            new.pop('name', None)
+            assert new == legacy_table._items[(update['quarter_id'],)], update
+
+    print(f"{args.updates} updates, {args.latency_ms:g} ms per call")
+    print(f"{'legacy loop':<16} {legacy_seconds:>8.2f} s {legacy_calls:>7} calls")
+    print(f"{'batched':<16} {batched_seconds:>8.2f} s {batched_calls:>7} calls")
+    print(f"{'calls by type':<16} {dict(stats.calls)}")
+    print(f"{'spans written':<16} {len(spans)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""The vectorised tariff engine (tariff.month_charges) against the per-row Decimal reference (tariff.charge).
+
+A month of synthetic quarters is charged both ways: readings as DynamoDB returns them (Decimal kL, with
+meter rollovers, missing and FAULTY readings) and allotments that start or end within the month for
+pro-rata charges. Timed per run, best of --rounds:
+
+  reference   tariff.charge() per quarter
+  arrays      month_charges() over all quarters in one pass, results left as int64 arrays
+  engine      the same, plus the Decimal amounts and consumption the bills are written with
+  paged       engine in passes of --page-size quarters, as the deduction run charges each scan page
+
+Making a Decimal of each result is a large share of the engine's time, and the least it can cost
+while bills carry Decimal amounts. Every amount, consumption and day count of the engine is checked
+against the reference.
+
+Usage: python benchmarks/bench_tariff_engine.py [--quarters 100000] [--page-size 500] [--rounds 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import tariff  # noqa: E402
+
+BILLING_MONTH = '2025-06'
+
+
+def synthetic_columns(quarters, seed):
+    # (opening kL, closing kL, metered, start dates, end dates), one row per quarter
+    rng = random.Random(seed)
+    rollover_litres = int(tariff.METER_ROLLOVER_KL * 1000)
+    columns = ([], [], [], [], [])
+    for _ in range(quarters):
+        opening = rng.randrange(rollover_litres)
+        closing = (opening + int(16000 * min(rng.lognormvariate(0, 0.45), 8.0))) % rollover_litres
+        metered = rng.random() >= 0.03
+        draw = rng.random()
+        start = f"{BILLING_MONTH}-{rng.randint(1, 28):02d}" if draw < 0.05 else '2022-04-01'
+        end = f"{BILLING_MONTH}-{rng.randint(1, 28):02d}" if 0.05 <= draw < 0.09 else None
+        for column, value in zip(columns, (Decimal(opening).scaleb(-3) if metered else 0,
+                                           Decimal(closing).scaleb(-3) if metered else 0, metered, start, end)):
+            column.append(value)
+    return columns
+
+
+def reference(columns):
+    return [tariff.charge(BILLING_MONTH, *row) for row in zip(*columns)]
+
+
+def arrays(columns):
+    return tariff.month_charges(BILLING_MONTH, *columns)
+
+
+def engine(columns, page_size=None):
+    count = len(columns[0])
+    page_size = page_size or count
+    charges = []
+    for start in range(0, count, page_size):
+        paise, litres, days = tariff.month_charges(BILLING_MONTH, *(column[start:start + page_size]
+                                                                     for column in columns))
+        charges.extend(zip(tariff.paise_to_inr(paise), tariff.litres_to_kl(litres), days.tolist()))
+    return charges
+
+
+def best_of(rounds, function, *args):
+    best, result = None, None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quarters', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=500, help='Quarters per pass in the paged run')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    columns = synthetic_columns(args.quarters, args.seed)
+    reference_seconds, expected = best_of(args.rounds, reference, columns)
+    results = {'reference': reference_seconds, 'arrays': best_of(args.rounds, arrays, columns)[0]}
+    for name, page_size in (('engine', None), ('paged', args.page_size)):
+        seconds, charges = best_of(args.rounds, engine, columns, page_size)
+        mismatches = sum(charge != wanted for charge, wanted in zip(charges, expected))
+        assert len(charges) == len(expected) and not mismatches, f"{name}: {mismatches} charges differ"
+        results[name] = seconds
+
+    total = sum(amount for amount, _, _ in expected)
+    print(f"{args.quarters} quarters for {BILLING_MONTH}, total INR {total}, best of {args.rounds}; "
+          f"all charges identical")
+    print(f"{'run':<10} {'ms':>9} {'us/quarter':>11} {'speed-up':>9}")
+    for name, seconds in results.items():
+        print(f"{name:<10} {seconds * 1000:>9.1f} {seconds * 1e6 / args.quarters:>11.2f}"
+              f" {reference_seconds / seconds:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Synthetic AllotteesTable, OccupancyHistoryTable, MeterReadingsTable, WaterBillsTable, PaymentStatusesTable
+and DuesLedgerTable contents.
+
+The records are the population seed_database_lambda writes in its synthetic mode (src/seed_population.py):
+quarters with vacated and transferred allotments and their occupancy spans, meter readings with skewed
+consumption and the bills the tariff makes of them, and SUCCESS, PARTIAL, FAILED and missing payment
+results. Here the billing window ends with the current month, whose bills have no PFMS results yet. The
+data is the same for the same arguments.
+
+Loaded into the fakes, a record takes about 0.75 KiB: 100k allottees over 3 months are about 700k
+records and 500 MiB, so 1M allottees need --months 1 (about 2.5 GiB) or a large machine.
+"""
+from datetime import datetime
+
+import seed_population
+from seed_population import allottee_id, employee_id, quarter_id  # noqa: F401
+
+
+class Dataset:
+    def __init__(self, allottees, months=3, seed=1):
+        self.allottees = allottees
+        self.today = datetime.now()
+        # Newest first
+        self.months = seed_population.billing_window(self.today.strftime('%Y-%m'), months)[::-1]
+        self.seed = seed
+
+    def records(self):
+        # Yields (allottee, spans, readings, bills, payments, ledgers) per quarter, in quarter order
+        return seed_population.population(1, self.allottees, self.months[::-1], self.seed)
+
+    def load(self, allottees_table, occupancy_history_table, meter_readings_table, water_bills_table,
+             payment_statuses_table, dues_ledger_table):
+        # Loads every record into the fake tables; returns the number of items per table
+        counts = {'allottees': 0, 'occupancy_history': 0, 'meter_readings': 0, 'water_bills': 0,
+                  'payment_statuses': 0, 'dues_ledger': 0}
+        for allottee, spans, readings, bills, payments, ledgers in self.records():
+            allottees_table.load([allottee])
+            occupancy_history_table.load(spans)
+            meter_readings_table.load(readings)
+            water_bills_table.load(bills)
+            payment_statuses_table.load(payments)
+            dues_ledger_table.load(ledgers)
+            counts['allottees'] += 1
+            counts['occupancy_history'] += len(spans)
+            counts['meter_readings'] += len(readings)
+            counts['water_bills'] += len(bills)
+            counts['payment_statuses'] += len(payments)
+            counts['dues_ledger'] += len(ledgers)
+        return counts
@@ -0,0 +1,278 @@
+"""Evaluator for the string form of DynamoDB condition and update expressions.
+
+Supports the subset the handlers use: comparisons, BETWEEN, IN, AND/OR/NOT, parentheses,
+attribute_exists/attribute_not_exists/contains/begins_with/size, and SET (with +, -,
+if_not_exists, list_append), ADD, DELETE and REMOVE update clauses on top-level and
+dotted map paths.
+"""
+import re
+from decimal import Decimal
+
+_TOKEN = re.compile(r'\s*(<>|<=|>=|[=<>(),+\-.\[\]]|[#:]?[A-Za-z_][A-Za-z0-9_\-]*|\d+)')
+_KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'ADD', 'DELETE', 'REMOVE'}
+_MISSING = object()
+
+
+def _tokenize(expression):
+    tokens, position = [], 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if not match:
+            raise ValueError(f"Cannot parse expression at: {expression[position:]}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expression, names, values):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else None
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and (token or '').upper() != expected:
+            raise ValueError(f"Expected {expected}, got {token}")
+        self.position += 1
+        return token
+
+    # --- paths and operands ---
+
+    def path(self):
+        parts = [self._name(self.take())]
+        while self.peek() == '.':
+            self.take()
+            parts.append(self._name(self.take()))
+        return parts
+
+    def _name(self, token):
+        return self.names[token] if token.startswith('#') else token
+
+    def operand(self):
+        token = self.peek()
+        if token.startswith(':'):
+            self.take()
+            return ('value', self.values[token])
+        if token in ('if_not_exists', 'list_append', 'size') and self.peek(1) == '(':
+            self.take()
+            self.take('(')
+            args = [self.value_expression()]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.value_expression())
+            self.take(')')
+            return ('call', token, args)
+        return ('path', self.path())
+
+    def value_expression(self):
+        left = self.operand()
+        while self.peek() in ('+', '-'):
+            operator = self.take()
+            left = ('arith', operator, left, self.operand())
+        return left
+
+    # --- conditions ---
+
+    def condition(self):
+        left = self.conjunction()
+        while (self.peek() or '').upper() == 'OR':
+            self.take()
+            right = self.conjunction()
+            left = ('or', left, right)
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while (self.peek() or '').upper() == 'AND':
+            self.take()
+            right = self.negation()
+            left = ('and', left, right)
+        return left
+
+    def negation(self):
+        if (self.peek() or '').upper() == 'NOT':
+            self.take()
+            return ('not', self.negation())
+        if self.peek() == '(':
+            self.take()
+            inner = self.condition()
+            self.take(')')
+            return inner
+        token = self.peek()
+        if token in ('attribute_exists', 'attribute_not_exists', 'contains', 'begins_with') and self.peek(1) == '(':
+            self.take()
+            self.take('(')
+            args = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                args.append(self.operand())
+            self.take(')')
+            return ('func', token, args)
+        left = self.operand()
+        operator = self.take()
+        if operator.upper() == 'BETWEEN':
+            low = self.operand()
+            self.take('AND')
+            return ('between', left, low, self.operand())
+        if operator.upper() == 'IN':
+            self.take('(')
+            options = [self.operand()]
+            while self.peek() == ',':
+                self.take()
+                options.append(self.operand())
+            self.take(')')
+            return ('in', left, options)
+        return ('compare', operator, left, self.operand())
+
+    # --- update clauses ---
+
+    def update(self):
+        clauses = []
+        while self.peek() is not None:
+            action = self.take().upper()
+            while True:
+                if action == 'SET':
+                    target = self.path()
+                    self.take('=')
+                    clauses.append(('SET', target, self.value_expression()))
+                elif action in ('ADD', 'DELETE'):
+                    target = self.path()
+                    clauses.append((action, target, self.operand()))
+                elif action == 'REMOVE':
+                    clauses.append(('REMOVE', self.path(), None))
+                else:
+                    raise ValueError(f"Unknown update action {action}")
+                if self.peek() != ',':
+                    break
+                self.take()
+        return clauses
+
+
+def _get_path(item, path):
+    current = item
+    for part in path:
+        if not isinstance(current, dict) or part not in current:
+            return _MISSING
+        current = current[part]
+    return current
+
+
+def _set_path(item, path, value):
+    current = item
+    for part in path[:-1]:
+        if part not in current or not isinstance(current[part], dict):
+            raise ValueError(f"The document path {'.'.join(path)} is invalid for update")
+        current = current[part]
+    current[path[-1]] = value
+
+
+def _remove_path(item, path):
+    current = item
+    for part in path[:-1]:
+        current = current.get(part, {})
+    current.pop(path[-1], None)
+
+
+def _resolve(node, item):
+    kind = node[0]
+    if kind == 'value':
+        return node[1]
+    if kind == 'path':
+        return _get_path(item, node[1])
+    if kind == 'call':
+        name, args = node[1], node[2]
+        if name == 'if_not_exists':
+            existing = _resolve(args[0], item)
+            return _resolve(args[1], item) if existing is _MISSING else existing
+        if name == 'list_append':
+            left, right = _resolve(args[0], item), _resolve(args[1], item)
+            return list(left if left is not _MISSING else []) + list(right if right is not _MISSING else [])
+        if name == 'size':
+            value = _resolve(args[0], item)
+            return _MISSING if value is _MISSING else len(value)
+    if kind == 'arith':
+        left, right = _resolve(node[2], item), _resolve(node[3], item)
+        if left is _MISSING or right is _MISSING:
+            raise ValueError('An operand in the update expression does not exist')
+        return left + right if node[1] == '+' else left - right
+    raise ValueError(f"Unknown operand {node}")
+
+
+def _check(node, item):
+    kind = node[0]
+    if kind == 'or':
+        return _check(node[1], item) or _check(node[2], item)
+    if kind == 'and':
+        return _check(node[1], item) and _check(node[2], item)
+    if kind == 'not':
+        return not _check(node[1], item)
+    if kind == 'func':
+        name, args = node[1], node[2]
+        value = _resolve(args[0], item)
+        if name == 'attribute_exists':
+            return value is not _MISSING
+        if name == 'attribute_not_exists':
+            return value is _MISSING
+        if value is _MISSING:
+            return False
+        if name == 'contains':
+            return _resolve(args[1], item) in value
+        if name == 'begins_with':
+            return isinstance(value, str) and value.startswith(_resolve(args[1], item))
+    if kind == 'between':
+        value = _resolve(node[1], item)
+        return value is not _MISSING and _resolve(node[2], item) <= value <= _resolve(node[3], item)
+    if kind == 'in':
+        value = _resolve(node[1], item)
+        return any(value == _resolve(option, item) for option in node[2])
+    if kind == 'compare':
+        left, right = _resolve(node[2], item), _resolve(node[3], item)
+        if left is _MISSING or right is _MISSING:
+            return node[1] == '<>'
+        try:
+            return {
+                '=': left == right, '<>': left != right,
+                '<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right
+            }[node[1]]
+        except TypeError:
+            return False
+    raise ValueError(f"Unknown condition {node}")
+
+
+def evaluate_condition(expression, item, names=None, values=None):
+    parser = _Parser(expression, names, values)
+    tree = parser.condition()
+    return _check(tree, item)
+
+
+def apply_update(expression, item, names=None, values=None):
+    # Returns a new item with the update applied; the input item is left untouched
+    updated = {key: (set(value) if isinstance(value, set) else value) for key, value in item.items()}
+    for action, path, operand in _Parser(expression, names, values).update():
+        if action == 'SET':
+            _set_path(updated, path, _resolve(operand, item))
+        elif action == 'REMOVE':
+            _remove_path(updated, path)
+        elif action == 'ADD':
+            value = _resolve(operand, item)
+            existing = _get_path(updated, path)
+            if isinstance(value, set):
+                _set_path(updated, path, (existing if existing is not _MISSING else set()) | value)
+            else:
+                _set_path(updated, path, (existing if existing is not _MISSING else Decimal('0')) + value)
+        elif action == 'DELETE':
+            existing = _get_path(updated, path)
+            if existing is not _MISSING:
+                remaining = existing - _resolve(operand, item)
+                if remaining:
+                    _set_path(updated, path, remaining)
+                else:
+                    _remove_path(updated, path)
+    return updated
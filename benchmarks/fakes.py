@@ -0,0 +1,655 @@
+"""In-process stand-ins for the AWS services used by the Lambda handlers.
+
+These fakes model only the request/response shapes the handlers rely on, plus a
+fixed per-call latency so that round-trip savings (batching, parallelism) show up
+in benchmark numbers the same way they would against the real service.
+"""
+import bisect
+import re
+import threading
+import time
+import types
+import zlib
+from collections import Counter, defaultdict
+
+from botocore.exceptions import ClientError
+
+from fake_expressions import apply_update, evaluate_condition
+
+BATCH_WRITE_LIMIT = 25
+
+
+class CallStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+    def record(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+}
+
+
+def _evaluate(condition, item):
+    # Evaluates a boto3.dynamodb.conditions expression (Key/Attr builders) against a plain dict
+    expression = condition.get_expression()
+    operator, values = expression['operator'], expression['values']
+    if operator == 'AND':
+        return _evaluate(values[0], item) and _evaluate(values[1], item)
+    if operator == 'OR':
+        return _evaluate(values[0], item) or _evaluate(values[1], item)
+    if operator == 'NOT':
+        return not _evaluate(values[0], item)
+    if operator == 'attribute_exists':
+        return values[0].name in item
+    if operator == 'attribute_not_exists':
+        return values[0].name not in item
+    actual = item.get(values[0].name)
+    if operator in _COMPARISONS:
+        return _COMPARISONS[operator](actual, values[1])
+    if operator == 'BETWEEN':
+        return actual is not None and values[1] <= actual <= values[2]
+    if operator == 'begins_with':
+        return isinstance(actual, str) and actual.startswith(values[1])
+    if operator == 'contains':
+        return actual is not None and values[1] in actual
+    if operator == 'IN':
+        return actual in values[1]
+    raise NotImplementedError(f"Unsupported condition operator: {operator}")
+
+
+_NO_VALUE = object()
+
+
+def _equality_value(condition, name):
+    # The value a Key condition requires attribute `name` to equal, or _NO_VALUE
+    expression = condition.get_expression()
+    if expression['operator'] == 'AND':
+        value = _equality_value(expression['values'][0], name)
+        return value if value is not _NO_VALUE else _equality_value(expression['values'][1], name)
+    if expression['operator'] == '=' and expression['values'][0].name == name:
+        return expression['values'][1]
+    return _NO_VALUE
+
+
+def _matches_filter(item, filter_expression):
+    if filter_expression is None:
+        return True
+    if isinstance(filter_expression, str):
+        match = re.fullmatch(r'attribute_exists\((\w+)\)', filter_expression.strip())
+        if not match:
+            raise NotImplementedError(f"Unsupported filter expression: {filter_expression}")
+        return match.group(1) in item
+    return _evaluate(filter_expression, item)
+
+
+def _conditional_check_failed(operation):
+    return ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+        operation
+    )
+
+
+def _validation_error(operation, message):
+    return ClientError({'Error': {'Code': 'ValidationException', 'Message': message}}, operation)
+
+
+def _throttled(operation):
+    return ClientError(
+        {'Error': {'Code': 'ProvisionedThroughputExceededException',
+                   'Message': 'The level of configured provisioned throughput for the table was exceeded.'}},
+        operation
+    )
+
+
+class FakeCapacity:
+    """Provisioned read or write capacity: units refill every second up to one second's worth.
+
+    As in DynamoDB, a request is let through while any capacity is left and is charged what it consumed
+    afterwards, which can leave the table in debt; requests arriving with nothing left are throttled.
+    """
+
+    def __init__(self, units_per_second):
+        self.units_per_second = units_per_second
+        self._available = units_per_second
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._available = min(self.units_per_second, self._available + (now - self._updated) * self.units_per_second)
+        self._updated = now
+
+    def admit(self, operation):
+        with self._lock:
+            self._refill()
+            if self._available <= 0:
+                raise _throttled(operation)
+
+    def charge(self, units):
+        with self._lock:
+            self._refill()
+            self._available -= units
+
+
+def _consumed(table_name, units, kwargs):
+    # The ConsumedCapacity field DynamoDB adds when the request asks for it
+    if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+        return {'ConsumedCapacity': {'TableName': table_name, 'CapacityUnits': units}}
+    return {}
+
+
+def _condition_holds(condition, item, names, values):
+    if condition is None:
+        return True
+    if isinstance(condition, str):
+        return evaluate_condition(condition, item, names, values)
+    return _evaluate(condition, item)
+
+
+def _project(item, projection_expression, attribute_names):
+    if not projection_expression:
+        return dict(item)
+    names = attribute_names or {}
+    projected = {}
+    for name in projection_expression.split(','):
+        name = names.get(name.strip(), name.strip())
+        if name in item:
+            projected[name] = item[name]
+    return projected
+
+
+class FakeBatchWriter:
+    def __init__(self, table, overwrite_by_pkeys=None):
+        self._table = table
+        self._buffer = {}
+        self._overwrite_by_pkeys = overwrite_by_pkeys
+
+    def _buffer_key(self, item):
+        if self._overwrite_by_pkeys:
+            return tuple(item.get(k) for k in self._overwrite_by_pkeys)
+        return len(self._buffer)
+
+    def put_item(self, Item):
+        self._buffer[self._buffer_key(Item)] = Item
+        if len(self._buffer) >= BATCH_WRITE_LIMIT:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        self._table._call('BatchWriteItem')
+        self._table._admit('BatchWriteItem', 'write')
+        self._table._charge('write', len(self._buffer))
+        with self._table._lock:
+            for item in self._buffer.values():
+                self._table._store(item)
+        self._buffer = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._flush()
+
+
+class FakeTable:
+    # Reads are charged half a unit per item read (eventually consistent, items under 4 KB) and writes one
+    # unit per item. With read_capacity/write_capacity the table is provisioned and throttles past them.
+    READ_UNITS_PER_ITEM = 0.5
+
+    def __init__(self, name, key_names, latency=0.0, stats=None, keep_items=True, indexes=None, page_size=1000,
+                 read_capacity=None, write_capacity=None):
+        self.name = name
+        self.key_names = list(key_names)
+        # index name -> key attribute names, e.g. {'employee_id-index': ['employee_id']}
+        self.indexes = indexes or {}
+        # Items returned per Query page, standing in for DynamoDB's 1 MB page limit
+        self.page_size = page_size
+        self.latency = latency
+        self.stats = stats or CallStats()
+        # With keep_items=False writes are only counted, so large runs do not grow the fake itself
+        self.keep_items = keep_items
+        self.write_count = 0
+        self._items = {}
+        self._lock = threading.Lock()
+        self._segment_keys = {}
+        # index name (None for the table) -> (hash key name, {hash key value: set of item keys}), built by
+        # the first Query of each, so that queries do not go through every item of a large table
+        self._partitions = {}
+        # Read like boto3's Table.provisioned_throughput; zero for an on-demand table
+        self.provisioned_throughput = {'ReadCapacityUnits': read_capacity or 0,
+                                       'WriteCapacityUnits': write_capacity or 0}
+        self.global_secondary_indexes = [{'IndexName': index_name, 'ProvisionedThroughput': self.provisioned_throughput}
+                                         for index_name in self.indexes]
+        self._capacity = {'read': FakeCapacity(read_capacity) if read_capacity else None,
+                          'write': FakeCapacity(write_capacity) if write_capacity else None}
+        self.throttled = Counter()
+
+    def _call(self, operation):
+        self.stats.record(operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _admit(self, operation, kind):
+        capacity = self._capacity[kind]
+        if capacity:
+            try:
+                capacity.admit(operation)
+            except ClientError:
+                self.throttled[operation] += 1
+                raise
+
+    def _charge(self, kind, units):
+        if self._capacity[kind]:
+            self._capacity[kind].charge(units)
+        return units
+
+    def _key_of(self, item):
+        return tuple(item[k] for k in self.key_names)
+
+    def _store(self, item):
+        # As in DynamoDB, an index key attribute may be left out (the item is then not in the index) but
+        # cannot be NULL
+        for key_names in self.indexes.values():
+            for name in key_names:
+                if name in item and item[name] is None:
+                    raise _validation_error('PutItem', f"Type mismatch for Index Key {name}")
+        self.write_count += 1
+        if not self.keep_items:
+            return
+        key = self._key_of(item)
+        existing = self._items.get(key)
+        if existing is None:
+            self._segment_keys.clear()
+        for hash_name, partitions in self._partitions.values():
+            if existing is not None and hash_name in existing:
+                partitions[existing[hash_name]].discard(key)
+            if hash_name in item:
+                partitions[item[hash_name]].add(key)
+        self._items[key] = dict(item)
+
+    def _discard(self, key):
+        existing = self._items.pop(key, None)
+        if existing is None:
+            return
+        self._segment_keys.clear()
+        for hash_name, partitions in self._partitions.values():
+            if hash_name in existing:
+                partitions[existing[hash_name]].discard(key)
+
+    def _partition(self, index_name, key_condition):
+        # Items the key condition can match: the partition its hash key equality names
+        key_names = self.indexes[index_name] if index_name else self.key_names
+        hash_value = _equality_value(key_condition, key_names[0])
+        with self._lock:
+            if hash_value is _NO_VALUE:
+                return list(self._items.values())
+            if index_name not in self._partitions:
+                partitions = defaultdict(set)
+                for key, item in self._items.items():
+                    if key_names[0] in item:
+                        partitions[item[key_names[0]]].add(key)
+                self._partitions[index_name] = (key_names[0], partitions)
+            return [self._items[key] for key in self._partitions[index_name][1].get(hash_value, ())]
+
+    def load(self, items):
+        # Bulk-load fixtures without charging any calls
+        for item in items:
+            self._store(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def items(self):
+        return list(self._items.values())
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self._call('PutItem')
+        self._admit('PutItem', 'write')
+        units = self._charge('write', 1)
+        with self._lock:
+            existing = self._items.get(self._key_of(Item), {})
+            if not _condition_holds(ConditionExpression, existing, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise _conditional_check_failed('PutItem')
+            self._store(Item)
+        return _consumed(self.name, units, kwargs)
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        self._call('UpdateItem')
+        self._admit('UpdateItem', 'write')
+        consumed = _consumed(self.name, self._charge('write', 1), kwargs)
+        with self._lock:
+            existing = self._items.get(self._key_of(Key))
+            current = dict(existing) if existing is not None else dict(Key)
+            if not _condition_holds(ConditionExpression, existing or {}, ExpressionAttributeNames,
+                                    ExpressionAttributeValues):
+                raise _conditional_check_failed('UpdateItem')
+            updated = apply_update(UpdateExpression, current, ExpressionAttributeNames, ExpressionAttributeValues)
+            self._store(updated)
+        if ReturnValues == 'ALL_NEW':
+            return dict(consumed, Attributes=dict(updated))
+        if ReturnValues == 'ALL_OLD' and existing is not None:
+            return dict(consumed, Attributes=dict(existing))
+        return consumed
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call('GetItem')
+        self._admit('GetItem', 'read')
+        units = self._charge('read', self.READ_UNITS_PER_ITEM * (2 if kwargs.get('ConsistentRead') else 1))
+        item = self._items.get(self._key_of(Key))
+        response = _consumed(self.name, units, kwargs)
+        if item is not None:
+            response['Item'] = _project(item, ProjectionExpression, ExpressionAttributeNames)
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatchWriter(self, overwrite_by_pkeys=overwrite_by_pkeys)
+
+    def _keys_for_segment(self, segment, total_segments):
+        # Keys are visited in a stable order; a segment owns the keys whose hash falls into it
+        with self._lock:
+            cache_key = (segment, total_segments)
+            if cache_key not in self._segment_keys:
+                self._segment_keys[cache_key] = sorted(
+                    k for k in self._items if zlib.crc32(repr(k[0]).encode()) % total_segments == segment)
+            return self._segment_keys[cache_key]
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, ExclusiveStartKey=None,
+              ProjectionExpression=None, ExpressionAttributeNames=None, FilterExpression=None,
+              ScanIndexForward=True, **kwargs):
+        self._call('Query')
+        self._admit('Query', 'read')
+        key_names = self.indexes[IndexName] if IndexName else self.key_names
+        sort_key = key_names[1] if len(key_names) > 1 else None
+        candidates = self._partition(IndexName, KeyConditionExpression)
+        sort_value = _equality_value(KeyConditionExpression, sort_key) if sort_key else _NO_VALUE
+        if sort_value is not _NO_VALUE:
+            # A point lookup within the partition: skip the full condition for items it cannot match
+            candidates = [item for item in candidates if item.get(sort_key) == sort_value]
+        matched = [item for item in candidates if _evaluate(KeyConditionExpression, item)]
+        # Items are ordered by the sort key, then by the table key so index pages are stable
+        def order(item):
+            return (item.get(sort_key) if sort_key else ''), self._key_of(item)
+        matched.sort(key=order, reverse=not ScanIndexForward)
+        start = 0
+        if ExclusiveStartKey:
+            # Past the start key's position, as in DynamoDB, whether or not its item is still there
+            after = order(ExclusiveStartKey)
+            start = next((i for i, item in enumerate(matched)
+                          if (order(item) > after if ScanIndexForward else order(item) < after)), len(matched))
+        page_size = min(Limit, self.page_size) if Limit else self.page_size
+        page = matched[start:start + page_size]
+        items = [_project(item, ProjectionExpression, ExpressionAttributeNames)
+                 for item in page if _matches_filter(item, FilterExpression)]
+        units = self._charge('read', max(1, len(page)) * self.READ_UNITS_PER_ITEM)
+        response = dict(_consumed(self.name, units, kwargs), Items=items, Count=len(items), ScannedCount=len(page))
+        if start + page_size < len(matched):
+            last = page[-1]
+            response['LastEvaluatedKey'] = {name: last[name] for name in set(self.key_names) | set(key_names)}
+        return response
+
+    def scan(self, Limit=None, ExclusiveStartKey=None, Segment=0, TotalSegments=1, FilterExpression=None,
+             ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self._call('Scan')
+        self._admit('Scan', 'read')
+        keys = self._keys_for_segment(Segment, TotalSegments)
+        start = 0
+        if ExclusiveStartKey:
+            start = bisect.bisect_right(keys, self._key_of(ExclusiveStartKey))
+        page_keys = keys[start:start + Limit] if Limit else keys[start:]
+        items = [_project(self._items[k], ProjectionExpression, ExpressionAttributeNames)
+                 for k in page_keys if _matches_filter(self._items[k], FilterExpression)]
+        units = self._charge('read', max(1, len(page_keys)) * self.READ_UNITS_PER_ITEM)
+        response = dict(_consumed(self.name, units, kwargs), Items=items, Count=len(items),
+                        ScannedCount=len(page_keys))
+        if Limit and start + Limit < len(keys):
+            response['LastEvaluatedKey'] = {name: value for name, value in zip(self.key_names, page_keys[-1])}
+        return response
+
+
+class FakeDynamoDB:
+    """Stand-in for boto3.resource('dynamodb'): table lookup plus the multi-table batch calls."""
+
+    def __init__(self, tables=(), latency=0.0, stats=None, unprocessed_every=0):
+        self.latency = latency
+        self.stats = stats or CallStats()
+        self.tables = {}
+        for table in tables:
+            self.add_table(table)
+        # With unprocessed_every=n, every n-th key or write request is returned as unprocessed once
+        self.unprocessed_every = unprocessed_every
+        self._request_counter = 0
+        self._lock = threading.Lock()
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def add_table(self, table):
+        # Like a boto3 Table, the table reaches the batch calls through meta.client (boto3's BatchWriter)
+        self.tables[table.name] = table
+        table.meta = types.SimpleNamespace(client=self)
+        return table
+
+    def _call(self, operation):
+        self.stats.record(operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _defer(self):
+        if not self.unprocessed_every:
+            return False
+        with self._lock:
+            self._request_counter += 1
+            return self._request_counter % self.unprocessed_every == 0
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self._call('BatchGetItem')
+        responses, unprocessed, consumed = {}, {}, []
+        for table_name in RequestItems:
+            self.tables[table_name]._admit('BatchGetItem', 'read')
+        for table_name, request in RequestItems.items():
+            if len(request['Keys']) > 100:
+                raise ValueError('Too many items requested for the BatchGetItem call')
+            table = self.tables[table_name]
+            units = table._charge('read', len(request['Keys']) * table.READ_UNITS_PER_ITEM)
+            consumed.append({'TableName': table_name, 'CapacityUnits': units})
+            for key in request['Keys']:
+                if self._defer():
+                    unprocessed.setdefault(table_name, dict(request, Keys=[]))['Keys'].append(key)
+                    continue
+                item = table._items.get(table._key_of(key))
+                if item is not None:
+                    responses.setdefault(table_name, []).append(
+                        _project(item, request.get('ProjectionExpression'), request.get('ExpressionAttributeNames')))
+        response = {'Responses': responses, 'UnprocessedKeys': unprocessed}
+        if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+            response['ConsumedCapacity'] = consumed
+        return response
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self._call('BatchWriteItem')
+        unprocessed, consumed = {}, []
+        if sum(len(requests) for requests in RequestItems.values()) > BATCH_WRITE_LIMIT:
+            raise ValueError('Too many items in the BatchWriteItem call')
+        for table_name in RequestItems:
+            self.tables[table_name]._admit('BatchWriteItem', 'write')
+        for table_name, requests in RequestItems.items():
+            table = self.tables[table_name]
+            consumed.append({'TableName': table_name, 'CapacityUnits': table._charge('write', len(requests))})
+            for request in requests:
+                if self._defer():
+                    unprocessed.setdefault(table_name, []).append(request)
+                    continue
+                with table._lock:
+                    if 'PutRequest' in request:
+                        table._store(request['PutRequest']['Item'])
+                    else:
+                        table._discard(table._key_of(request['DeleteRequest']['Key']))
+        response = {'UnprocessedItems': unprocessed}
+        if kwargs.get('ReturnConsumedCapacity') in ('TOTAL', 'INDEXES'):
+            response['ConsumedCapacity'] = consumed
+        return response
+
+
+class FakeS3:
+    def __init__(self, latency=0.0, stats=None, keep_bodies=True):
+        self.latency = latency
+        self.stats = stats or CallStats()
+        self.keep_bodies = keep_bodies
+        self.objects = {}
+        self.object_sizes = {}
+        self.object_metadata = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        self.stats.record(operation)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self._call('PutObject')
+        body = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        self.object_sizes[(Bucket, Key)] = len(body)
+        self.object_metadata[(Bucket, Key)] = dict(Metadata or {})
+        if self.keep_bodies:
+            self.objects[(Bucket, Key)] = body
+        return {'ETag': f'"{zlib.crc32(body):08x}"'}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **kwargs):
+        # boto3's managed transfer; counted as a single PutObject whatever its size
+        with open(Filename, 'rb') as f:
+            return self.put_object(Bucket=Bucket, Key=Key, Body=f.read(), **(ExtraArgs or {}))
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._call('CreateMultipartUpload')
+        with self._lock:
+            upload_id = f'upload-{len(self._uploads) + 1}'
+            self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._call('UploadPart')
+        self._uploads[UploadId][PartNumber] = Body if self.keep_bodies else len(Body)
+        return {'ETag': f'"part-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call('CompleteMultipartUpload')
+        parts = self._uploads.pop(UploadId)
+        ordered = [parts[p['PartNumber']] for p in MultipartUpload['Parts']]
+        if self.keep_bodies:
+            self.objects[(Bucket, Key)] = b''.join(ordered)
+            self.object_sizes[(Bucket, Key)] = len(self.objects[(Bucket, Key)])
+        else:
+            self.object_sizes[(Bucket, Key)] = sum(ordered)
+        return {}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call('AbortMultipartUpload')
+        self._uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600, **kwargs):
+        return f"https://{Params['Bucket']}.s3.local/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+    def _etag(self, Bucket, Key):
+        return f'"{zlib.crc32(self.objects[(Bucket, Key)]):08x}"'
+
+    def _missing(self, operation, code='NoSuchKey'):
+        return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('HeadObject')
+        if (Bucket, Key) not in self.objects:
+            raise self._missing('HeadObject', '404')
+        return {'ContentLength': self.object_sizes[(Bucket, Key)], 'ETag': self._etag(Bucket, Key),
+                'Metadata': dict(self.object_metadata.get((Bucket, Key), {}))}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **kwargs):
+        self._call('GetObject')
+        if (Bucket, Key) not in self.objects:
+            raise self._missing('GetObject')
+        etag = self._etag(Bucket, Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise self._missing('GetObject', 'PreconditionFailed')
+        body = self.objects[(Bucket, Key)]
+        start = 0
+        if Range:
+            start = int(re.fullmatch(r'bytes=(\d+)-', Range).group(1))
+            if start >= len(body):
+                raise self._missing('GetObject', 'InvalidRange')
+        return {'Body': FakeStreamingBody(memoryview(body)[start:]), 'ContentLength': len(body) - start,
+                'ETag': etag, 'Metadata': dict(self.object_metadata.get((Bucket, Key), {}))}
+
+
+class FakeStreamingBody:
+    # The parts of botocore's StreamingBody the handlers use; chunks are copied out one at a time
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def read(self, amt=None):
+        end = len(self._data) if amt is None else min(len(self._data), self._position + amt)
+        chunk = bytes(self._data[self._position:end])
+        self._position = end
+        return chunk
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._data = memoryview(b'')
+
+
+class FakeLambda:
+    # Records asynchronous self-invocations so a benchmark can run them in order
+    def __init__(self, stats=None):
+        self.stats = stats or CallStats()
+        self.invocations = []
+
+    def invoke(self, FunctionName, Payload, InvocationType='RequestResponse', **kwargs):
+        self.stats.record('Invoke')
+        self.invocations.append((FunctionName, InvocationType, Payload))
+        return {'StatusCode': 202 if InvocationType == 'Event' else 200}
+
+
+class FakeSES:
+    def __init__(self, latency=0.0, stats=None):
+        self.latency = latency
+        self.stats = stats or CallStats()
+        self.sent = []
+
+    def send_raw_email(self, **kwargs):
+        self.stats.record('SendRawEmail')
+        time.sleep(self.latency)
+        self.sent.append(kwargs)
+        return {'MessageId': f'fake-{len(self.sent)}'}
+
+    def send_email(self, **kwargs):
+        self.stats.record('SendEmail')
+        time.sleep(self.latency)
+        self.sent.append(kwargs)
+        return {'MessageId': f'fake-{len(self.sent)}'}
@@ -1,106 +1,306 @@
+import base64
+import binascii
+import hashlib
 import json
-import boto3
 import os
-from datetime import datetime
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-dynamodb = boto3.resource('dynamodb')
-allottees_table = dynamodb.Table(os.environ['ALLOTTEES_TABLE_NAME'])
+from boto3.dynamodb.conditions import Attr
 
-def lambda_handler(event, context):
-    http_method = event['httpMethod']
-    path = event['path']
+import common
+import occupancy
 
-    if http_method == 'GET' and path == '/v1/allottees':
-        # Logic for GET /v1/allottees (Billing Software pulling data from CPWD)
-        # In a real scenario, this Lambda would *call CPWD's API* to get the data
-        # For this SAM template, we're assuming CPWD pushes to us or we're mocking this part.
-        # For a full system, you'd likely have a separate internal Lambda that regularly
-        # pulls from CPWD and updates your AllotteesTable.
-
-        # Mock response for demonstration
-        return {
-            'statusCode': 200,
-            'body': json.dumps([
-                {
-                    "allottee_id": "LSQA001",
-                    "employee_id": "PFMS12345",
-                    "name": "Smt. Priya Sharma",
-                    "quarter_id": "LSL-C-123",
-                    "allotment_start_date": "2023-01-15",
-                    "allotment_end_date": None,
-                    "status": "OCCUPIED",
-                    "last_updated": "2025-06-23T10:00:00Z"
-                },
-                {
-                    "allottee_id": "LSQA003",
-                    "employee_id": "PFMS54321",
-                    "name": "Shri. Rahul Kumar",
-                    "quarter_id": "LSL-A-401",
-                    "allotment_start_date": "2024-03-01",
-                    "allotment_end_date": "2025-06-20", # Recently vacated
-                    "status": "VACATED",
-                    "last_updated": "2025-06-20T15:30:00Z"
-                }
-            ])
+dynamodb = common.lazy_dynamodb()
+allottees_table = common.lazy_table(os.environ['ALLOTTEES_TABLE_NAME'])
+
+# A CPWD push is validated as a whole before anything is written, then applied with chunked
+# BatchGetItem/BatchWriteItem calls instead of a GetItem and PutItem per update.
+STATUS_UPDATE_WORKERS = int(os.environ.get('STATUS_UPDATE_WORKERS', '8'))
+MAX_REPORTED_ERRORS = 100
+
+ALLOTMENT_STATUSES = ('OCCUPIED', 'VACATED', 'TRANSFERRED')
+ID_PATTERN = re.compile(r'[A-Z0-9]{6,12}')
+QUARTER_ID_PATTERN = re.compile(r'[A-Z0-9-]{4,20}')
+
+# GET /v1/allottees pages through AllotteesTable for the billing software
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+# With a selective `since` filter most scanned items are dropped; cap the scan calls per request and
+# hand the client a cursor instead of scanning the whole table in one request
+LIST_MAX_SCAN_CALLS = int(os.environ.get('LIST_MAX_SCAN_CALLS', '10'))
+ALLOTTEE_FIELDS = ('quarter_id', 'allottee_id', 'employee_id', 'name', 'status', 'effective_date',
+                   'allotment_start_date', 'allotment_end_date', 'previous_allottee_id', 'previous_employee_id',
+                   'previous_allotment_start_date', 'previous_allotment_end_date', 'last_updated')
+
+
+def validate_status_update(update):
+    # Returns why a CPWD status update cannot be applied, or None when it is valid
+    if not isinstance(update, dict):
+        return 'update must be an object'
+    for field in ('allottee_id', 'quarter_id', 'status', 'effective_date'):
+        if not update.get(field):
+            return f"{field} is required"
+    for field, pattern in (('allottee_id', ID_PATTERN), ('quarter_id', QUARTER_ID_PATTERN),
+                           ('employee_id', ID_PATTERN), ('new_allottee_id', ID_PATTERN),
+                           ('new_employee_id', ID_PATTERN)):
+        value = update.get(field)
+        if value is not None and (not isinstance(value, str) or not pattern.fullmatch(value)):
+            return f"{field} is invalid"
+    if update['status'] not in ALLOTMENT_STATUSES:
+        return f"status must be one of {', '.join(ALLOTMENT_STATUSES)}"
+    try:
+        datetime.strptime(update['effective_date'], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return 'effective_date must be a YYYY-MM-DD date'
+    if (update.get('new_allottee_id') or update.get('new_employee_id')) and update['status'] != 'TRANSFERRED':
+        return 'new_allottee_id and new_employee_id are only allowed with status TRANSFERRED'
+    return None
+
+
+def fetch_allotments(quarter_ids):
+    # Returns {quarter_id: item} for up to 100 quarters
+    table_name = allottees_table.name
+    found = dynamodb.batch_get_all({table_name: {
+        'Keys': [{'quarter_id': quarter_id} for quarter_id in quarter_ids],
+        'ProjectionExpression': 'quarter_id, allottee_id, employee_id, #name, allotment_start_date',
+        'ExpressionAttributeNames': {'#name': 'name'}
+    }})
+    return {item['quarter_id']: item for item in found[table_name]}
+
+
+def apply_status_update(update, existing, last_updated):
+    # Builds the new AllotteesTable item for a quarter from a CPWD update and the quarter's current record
+    allottee_id = update['allottee_id']
+    effective_date = update['effective_date']
+    item = {
+        'quarter_id': update['quarter_id'], # Primary Key
+        'allottee_id': allottee_id,
+        'status': update['status'],
+        'effective_date': effective_date,
+        'last_updated': last_updated
+    }
+    # employee_id keys employee_id-index, which rejects NULL: an update without one leaves it out (or, when
+    # it ends the current allotment, keeps the one already recorded for it)
+    employee_id = update.get('employee_id')
+    if not employee_id and update['status'] != 'OCCUPIED' and existing and existing.get('allottee_id') == allottee_id:
+        employee_id = existing.get('employee_id')
+    if employee_id:
+        item['employee_id'] = employee_id
+
+    if update['status'] == 'OCCUPIED':
+        item['allotment_start_date'] = effective_date
+        item['allotment_end_date'] = None # Currently occupied
+        return item
+
+    # VACATED or TRANSFERRED: the allotment ends on the effective date; keep what is known about it
+    if existing:
+        item['allotment_start_date'] = existing.get('allotment_start_date')
+        if existing.get('allottee_id') == allottee_id and existing.get('name'):
+            item['name'] = existing['name']
+    item['allotment_end_date'] = effective_date
+
+    if update['status'] == 'TRANSFERRED' and (update.get('new_allottee_id') or update.get('new_employee_id')):
+        # The quarter passes to a new allottee from the effective date; the outgoing allotment is kept
+        # on the item as previous_* so its final month can still be billed and audited
+        outgoing = item
+        item = {
+            'quarter_id': update['quarter_id'],
+            'allottee_id': update.get('new_allottee_id') or allottee_id,
+            'status': 'OCCUPIED',
+            'effective_date': effective_date,
+            'allotment_start_date': effective_date,
+            'allotment_end_date': None,
+            'previous_allottee_id': outgoing['allottee_id'],
+            'previous_employee_id': outgoing.get('employee_id'),
+            'previous_allotment_start_date': outgoing.get('allotment_start_date'),
+            'previous_allotment_end_date': effective_date,
+            'last_updated': last_updated
         }
+        employee_id = update.get('new_employee_id') or outgoing.get('employee_id')
+        if employee_id:
+            item['employee_id'] = employee_id
+    return item
+
+
+def write_allotments(items):
+    with allottees_table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
 
-    elif http_method == 'POST' and path == '/v1/allottees/status-updates':
-        # Logic for POST /v1/allottees/status-updates (CPWD pushing updates to us)
-        try:
-            body = json.loads(event['body'])
-            updates = body.get('updates', [])
 
+def process_status_updates(event):
+    try:
+        with common.span('Request.Parse'):
+            body = json.loads(common.request_body(event))
+        updates = body.get('updates') if isinstance(body, dict) else None
+        if not isinstance(updates, list) or not updates:
+            return common.json_response(400, {'message': 'Missing updates in request body.'})
+
+        # Validate everything before writing anything, so a bad update cannot leave the batch half-applied
+        errors = []
+        for index, update in enumerate(updates):
+            reason = validate_status_update(update)
+            if reason:
+                errors.append({'index': index, 'quarter_id': update.get('quarter_id') if isinstance(update, dict)
+                               else None, 'reason': reason})
+        if errors:
+            return common.json_response(400, {'message': f"{len(errors)} invalid status updates; nothing was written.",
+                                              'errors': errors[:MAX_REPORTED_ERRORS]})
+
+        with ThreadPoolExecutor(max_workers=STATUS_UPDATE_WORKERS) as executor:
+            # Only updates that end an allotment need the current record (for its start date)
+            quarter_ids = sorted({update['quarter_id'] for update in updates if update['status'] != 'OCCUPIED'})
+            allotments = {}
+            chunks = [quarter_ids[start:start + common.BATCH_GET_LIMIT]
+                      for start in range(0, len(quarter_ids), common.BATCH_GET_LIMIT)]
+            for fetched in executor.map(fetch_allotments, chunks):
+                allotments.update(fetched)
+
+            # Updates are applied in order in memory, so several updates to one quarter in the same push
+            # behave as they did when each was written before the next was read
+            last_updated = datetime.now().isoformat() + 'Z'
+            changed = {}
+            # Every state a quarter passes through is recorded in its occupancy history, so an allotment
+            # that begins and ends within one push keeps its span; a span seen twice keeps its last version
+            spans = {}
             for update in updates:
-                allottee_id = update.get('allottee_id')
-                quarter_id = update.get('quarter_id')
-                employee_id = update.get('employee_id')
-                status = update.get('status')
-                effective_date = update.get('effective_date') # YYYY-MM-DD
-
-                if not all([allottee_id, quarter_id, status, effective_date]):
-                    return {
-                        'statusCode': 400,
-                        'body': json.dumps({'message': 'Missing required fields in update.'})
-                    }
-
-                item = {
-                    'quarter_id': quarter_id, # Primary Key
-                    'allottee_id': allottee_id,
-                    'employee_id': employee_id,
-                    'status': status,
-                    'effective_date': effective_date,
-                    'last_updated': datetime.now().isoformat() + 'Z'
-                }
-
-                # Logic to handle different statuses (OCCUPIED, VACATED, TRANSFERRED)
-                # This is where you manage the 'allotment_start_date' and 'allotment_end_date'
-                # in your AllotteesTable.
-
-                # Example: If status is VACATED or TRANSFERRED, set allotment_end_date
-                if status in ['VACATED', 'TRANSFERRED']:
-                    # Retrieve existing record to preserve start date if needed
-                    existing_item = allottees_table.get_item(Key={'quarter_id': quarter_id}).get('Item')
-                    if existing_item:
-                        item['allotment_start_date'] = existing_item.get('allotment_start_date')
-                    item['allotment_end_date'] = effective_date
-                elif status == 'OCCUPIED':
-                    item['allotment_start_date'] = effective_date
-                    item['allotment_end_date'] = None # Currently occupied
-
-                allottees_table.put_item(Item=item)
+                quarter_id = update['quarter_id']
+                changed[quarter_id] = apply_status_update(
+                    update, changed.get(quarter_id) or allotments.get(quarter_id), last_updated)
+                for span in occupancy.spans_from_allottee(changed[quarter_id]):
+                    spans[(span['quarter_id'], span['span_key'])] = span
 
+            items = list(changed.values())
+            slice_size = -(-len(items) // STATUS_UPDATE_WORKERS)
+            list(executor.map(write_allotments, [items[start:start + slice_size]
+                                                 for start in range(0, len(items), slice_size)]))
+            spans = list(spans.values())
+            slice_size = -(-len(spans) // STATUS_UPDATE_WORKERS)
+            list(executor.map(occupancy.write_spans, [spans[start:start + slice_size]
+                                                      for start in range(0, len(spans), slice_size)]))
+
+        print(f"Applied {len(updates)} status updates to {len(items)} quarters.")
+        return common.json_response(200, {'message': 'Allottee status updates processed successfully.',
+                                          'updates': len(updates), 'quarters_updated': len(items)})
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
+    except Exception as e:
+        print(f"Error processing status update: {e}")
+        return common.json_response(500, {'message': 'Internal Server Error', 'error': str(e)})
+
+
+def encode_cursor(last_evaluated_key):
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    # Returns the ExclusiveStartKey for a cursor from a previous page, or raises ValueError
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('cursor is invalid')
+    if not isinstance(key, dict) or set(key) != {'quarter_id'} or not isinstance(key['quarter_id'], str):
+        raise ValueError('cursor is invalid')
+    return key
+
+
+def parse_list_parameters(params):
+    # Turns the query string into scan arguments, or raises ValueError with the problem
+    try:
+        limit = int(params.get('limit') or LIST_DEFAULT_LIMIT)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= LIST_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {LIST_MAX_LIMIT}")
+
+    scan_kwargs = {}
+    if params.get('fields'):
+        fields = [field.strip() for field in params['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in ALLOTTEE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        # Several field names (name, status) are DynamoDB reserved words, so all go through placeholders
+        names = {f"#f{index}": field for index, field in enumerate(dict.fromkeys(['quarter_id'] + fields))}
+        scan_kwargs['ProjectionExpression'] = ', '.join(names)
+        scan_kwargs['ExpressionAttributeNames'] = names
+
+    if params.get('since'):
+        # A timestamp with an offset is compared in UTC; one without is taken to be UTC already
+        try:
+            since = datetime.fromisoformat(params['since'].removesuffix('Z'))
+            if since.tzinfo:
+                since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        except (ValueError, OverflowError):
+            raise ValueError('since must be an ISO 8601 timestamp')
+        # last_updated is stored as a UTC ISO string with a Z suffix, so string order is time order
+        scan_kwargs['FilterExpression'] = Attr('last_updated').gte(since.isoformat(timespec='microseconds') + 'Z')
+
+    if params.get('cursor'):
+        scan_kwargs['ExclusiveStartKey'] = decode_cursor(params['cursor'])
+    return limit, scan_kwargs
+
+
+def list_allottees(event):
+    params = event.get('queryStringParameters') or {}
+    try:
+        limit, scan_kwargs = parse_list_parameters(params)
+    except ValueError as e:
+        return common.json_response(400, {'message': str(e)})
+
+    try:
+        items = []
+        last_evaluated_key = scan_kwargs.get('ExclusiveStartKey')
+        for _ in range(LIST_MAX_SCAN_CALLS):
+            # Never evaluate more items than still fit on the page, so the page ends exactly at
+            # LastEvaluatedKey and the next cursor cannot skip anything
+            scan_response = allottees_table.scan(Limit=limit - len(items), **scan_kwargs)
+            items.extend(scan_response.get('Items', []))
+            last_evaluated_key = scan_response.get('LastEvaluatedKey')
+            if not last_evaluated_key or len(items) >= limit:
+                break
+            scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+        with common.span('Response.Serialize', items=len(items)):
+            body = common.dumps({
+                'allottees': items,
+                'count': len(items),
+                'next_cursor': encode_cursor(last_evaluated_key) if last_evaluated_key else None
+            })
+            etag = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+        # Polling clients send back the ETag of the page they already have; unchanged pages are not resent
+        if_none_match = common.request_headers(event).get('if-none-match', '')
+        if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
             return {
-                'statusCode': 200,
-                'body': json.dumps({'message': 'Allottee status updates processed successfully.'})
-            }
-        except Exception as e:
-            print(f"Error processing status update: {e}")
-            return {
-                'statusCode': 500,
-                'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
+                'statusCode': 304,
+                'headers': headers,
+                'body': ''
             }
 
-    return {
-        'statusCode': 404,
-        'body': json.dumps({'message': 'Not Found'})
-    }
\ No newline at end of file
+        return common.json_response(200, body, event, headers=headers)
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
+    except Exception as e:
+        print(f"Error listing allottees: {e}")
+        return common.json_response(500, {'message': 'Internal Server Error', 'error': str(e)})
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    http_method = event['httpMethod']
+    path = event['path']
+
+    if http_method == 'GET' and path == '/v1/allottees':
+        # Logic for GET /v1/allottees (Billing Software pulling the roster from AllotteesTable)
+        return list_allottees(event)
+
+    elif http_method == 'POST' and path == '/v1/allottees/status-updates':
+        # Logic for POST /v1/allottees/status-updates (CPWD pushing updates to us)
+        return process_status_updates(event)
+
+    return common.json_response(404, {'message': 'Not Found'})
\ No newline at end of file
@@ -0,0 +1,74 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import billing_index
+import common
+
+# Settles bills from PaymentStatusesTable's stream (src/billing_index.py). Both ways PFMS results come in,
+# the callback and result files, write them to that table; settling bills here, a batch of stream records
+# at a time, keeps a query and an update per result off the callback, which has to answer PFMS within API
+# Gateway's 29 seconds. The arrears index trails the PFMS results by the stream's delay.
+#
+# WaterBillsTable's stream brings the bills that enter the arrears index (filtered in template.yaml): a
+# bill written after its month's PFMS result, by a resumed deduction run or the backfill, is not found by
+# that result's record, so it is settled here from the stored result.
+#
+# A record that raises is reported back as a batch item failure, and Lambda retries the shard from the
+# earliest one. Settling a result again changes nothing, so records retried with it are harmless.
+
+payment_statuses_table = common.lazy_table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+
+SETTLEMENT_WORKERS = int(os.environ.get('SETTLEMENT_WORKERS', '32'))
+
+
+def pfms_status(employee_id, billing_month):
+    item = payment_statuses_table.get_item(
+        Key={'employee_id': employee_id, 'billing_month': billing_month},
+        ProjectionExpression='#status',
+        ExpressionAttributeNames={'#status': 'status'}
+    ).get('Item')
+    return item.get('status') if item else None
+
+
+def settle_new_bill(image):
+    # A bill record: settles the bill from its month's PFMS result, if there is one yet
+    allottee_id, billing_month, employee_id = (image.get(name, {}).get('S') for name in
+                                               ('allottee_id', 'billing_month', 'employee_id'))
+    if not (allottee_id and billing_month and employee_id):
+        return 0
+    status = pfms_status(employee_id, billing_month)
+    if not status:
+        return 0
+    return int(billing_index.settle_bill({'allottee_id': allottee_id, 'billing_month': billing_month}, status))
+
+
+def settle_record(record):
+    # Returns the bills a stream record of a PFMS result, or of a bill, settled or marked
+    image = record['dynamodb'].get('NewImage') or {}
+    if 'allottee_id' in image:
+        with common.item_span('WaterBills.SettleNew'):
+            return settle_new_bill(image)
+    employee_id, billing_month, status = (image.get(name, {}).get('S') for name in
+                                          ('employee_id', 'billing_month', 'status'))
+    if not (employee_id and billing_month and status):
+        return 0
+    with common.item_span('WaterBills.Settle'):
+        return billing_index.settle_bills(employee_id, billing_month, status)
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    records = event.get('Records', [])
+    failures = []
+    updated = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(SETTLEMENT_WORKERS, len(records)))) as executor:
+        futures = [(record, executor.submit(settle_record, record)) for record in records]
+        for record, future in futures:
+            try:
+                updated += future.result()
+            except Exception as e:
+                sequence_number = record['dynamodb']['SequenceNumber']
+                print(f"Error settling bills for stream record {sequence_number}: {e}")
+                failures.append({'itemIdentifier': sequence_number})
+    print(f"Updated {updated} bills from {len(records)} stream records; {len(failures)} failed.")
+    return {'batchItemFailures': failures}
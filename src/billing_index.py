@@ -0,0 +1,114 @@
+import os
+import zlib
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+import common
+
+# Month and arrears indexes of WaterBillsTable and PaymentStatusesTable, for the questions their keys
+# (allottee or employee first) cannot answer without a scan: a month's bills or PFMS results, and the
+# bills not settled yet.
+#
+#   WaterBillsTable month-index        hash month_shard '<billing_month>#<shard>', range employee_id
+#   WaterBillsTable arrears-index      hash arrears_shard '<shard>', range billing_month. Sparse: only a
+#                                      bill not settled yet carries arrears_shard
+#   PaymentStatusesTable month-index   hash month_shard '<billing_month>#<shard>', range status
+#
+# The shard is one of BILLING_INDEX_SHARDS, from a hash of employee_id, so a month's bills (written in one
+# deduction run) and PFMS results spread over that many index partitions instead of one hot one, and
+# batch jobs read a month back with a query per shard. An employee's bills and PFMS result for a month
+# fall into the same shard. BILLING_INDEX_SHARDS must not change once bills are written.
+#
+# DynamoDB creates one GSI per table update, so an existing stack gets WaterBillsTable's indexes in two
+# deployments: month-index first, then arrears-index with ArrearsIndexEnabled=true once month-index is
+# ACTIVE. Bills carry arrears_shard from the start, so the arrears-index is complete when it is built.
+#
+# As in the dues ledger, a SUCCESS result settles its month: settle_bills(), run for every PFMS result from
+# PaymentStatusesTable's stream (bill_settlement_lambda), marks the employee's bills for the month PAID and
+# takes them out of the arrears index. Until then a bill is UNPAID, and pfms_status holds the month's
+# latest PFMS status (FAILED or PARTIAL) once there is one. A bill that enters the arrears index after its
+# month's result was written (a resumed deduction run, the backfill) is settled by settle_bill() from
+# WaterBillsTable's stream instead.
+
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+
+MONTH_INDEX_NAME = 'month-index' # Of both tables
+ARREARS_INDEX_NAME = 'arrears-index'
+BILLING_INDEX_SHARDS = int(os.environ.get('BILLING_INDEX_SHARDS', '16'))
+
+
+def index_shard(employee_id):
+    # crc32 rather than hash(), which differs between processes
+    return f"{zlib.crc32(employee_id.encode('utf-8')) % BILLING_INDEX_SHARDS:02d}"
+
+
+def month_shard(billing_month, employee_id):
+    return f"{billing_month}#{index_shard(employee_id)}"
+
+
+def bill_index_fields(bill, settled=False):
+    # The index attributes of a bill as written, unsettled unless it is already paid for
+    fields = {
+        'month_shard': month_shard(bill['billing_month'], bill['employee_id']),
+        'settlement_status': 'PAID' if settled else 'UNPAID'
+    }
+    if not settled:
+        fields['arrears_shard'] = index_shard(bill['employee_id'])
+    return fields
+
+
+def payment_index_fields(payment):
+    return {'month_shard': month_shard(payment['billing_month'], payment['employee_id'])}
+
+
+def month_pages(table, billing_month, shard, **query_kwargs):
+    # Yields pages of one shard of a month from a table's month-index
+    query_kwargs = dict(query_kwargs, IndexName=MONTH_INDEX_NAME,
+                        KeyConditionExpression=Key('month_shard').eq(f"{billing_month}#{shard:02d}"))
+    while True:
+        with common.span('BillingIndex.MonthQuery') as timed:
+            response = table.query(**query_kwargs)
+            timed.items = len(response.get('Items', []))
+        yield response.get('Items', [])
+        if not response.get('LastEvaluatedKey'):
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def month_bills(employee_id, billing_month):
+    # The employee's bills for the month, one per allotment held; only the table keys are read
+    response = water_bills_table.query(
+        IndexName=MONTH_INDEX_NAME,
+        KeyConditionExpression=Key('month_shard').eq(month_shard(billing_month, employee_id))
+        & Key('employee_id').eq(employee_id),
+        ProjectionExpression='allottee_id, billing_month'
+    )
+    return response.get('Items', [])
+
+
+def settle_bill(key, status):
+    # Records a PFMS result on a bill; SUCCESS settles it. A bill already PAID is left as it is, so a late or
+    # replayed result cannot put it back into arrears. Returns whether the bill was updated.
+    if status == 'SUCCESS':
+        update_expression = 'SET settlement_status = :paid, pfms_status = :status REMOVE arrears_shard'
+    else:
+        update_expression = 'SET pfms_status = :status'
+    try:
+        water_bills_table.update_item(
+            Key={'allottee_id': key['allottee_id'], 'billing_month': key['billing_month']},
+            UpdateExpression=update_expression,
+            ConditionExpression='attribute_exists(allottee_id) AND '
+                                '(attribute_not_exists(settlement_status) OR settlement_status <> :paid)',
+            ExpressionAttributeValues={':paid': 'PAID', ':status': status}
+        )
+        return True
+    except ClientError as e:
+        if not common.is_conditional_check_failure(e):
+            raise
+        return False
+
+
+def settle_bills(employee_id, billing_month, status):
+    # Records a PFMS result on the employee's bills for the month; returns the bills updated
+    return sum(settle_bill(bill, status) for bill in month_bills(employee_id, billing_month))
@@ -0,0 +1,127 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import billing_index
+import common
+
+dynamodb = common.lazy_dynamodb()
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+payment_statuses_table = common.lazy_table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+
+# Adds the month and arrears index attributes (src/billing_index.py) to the bills and PFMS results written
+# before the indexes existed; a bill is settled when its employee's PFMS result for the month is SUCCESS.
+# Run once when the indexes are introduced, while no PFMS results are coming in; the deduction run and the
+# payment confirmations keep the attributes current from then on. Items that have them already are left
+# alone, so running it again only completes what an interrupted run missed.
+BACKFILL_SEGMENTS = int(os.environ.get('BILLING_INDEX_BACKFILL_SEGMENTS', '16')) # Per table
+
+
+def pfms_statuses(bills):
+    # {(employee_id, billing_month): status} of the PFMS results for the bills, read with BatchGetItem
+    keys = sorted({(bill['employee_id'], bill['billing_month']) for bill in bills})
+    table_name = payment_statuses_table.name
+    found = dynamodb.batch_get_all({table_name: {
+        'Keys': [{'employee_id': employee_id, 'billing_month': billing_month} for employee_id, billing_month in keys],
+        'ProjectionExpression': 'employee_id, billing_month, #status',
+        'ExpressionAttributeNames': {'#status': 'status'}
+    }})
+    return {(item['employee_id'], item['billing_month']): item.get('status') for item in found[table_name]}
+
+
+def add_index_fields(table, key, fields):
+    # Sets the attributes unless the item has been indexed (or deleted) meanwhile; returns whether it did
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression='SET ' + ', '.join(f"{name} = :{name}" for name in fields),
+            ConditionExpression='attribute_exists(billing_month) AND attribute_not_exists(month_shard)',
+            ExpressionAttributeValues={f":{name}": value for name, value in fields.items()}
+        )
+        return True
+    except ClientError as e:
+        if not common.is_conditional_check_failure(e):
+            raise
+        return False
+
+
+def index_bills(page):
+    statuses = pfms_statuses(page)
+    indexed = 0
+    for bill in page:
+        status = statuses.get((bill['employee_id'], bill['billing_month']))
+        fields = billing_index.bill_index_fields(bill, settled=status == 'SUCCESS')
+        if status:
+            fields['pfms_status'] = status
+        indexed += add_index_fields(water_bills_table,
+                                    {'allottee_id': bill['allottee_id'], 'billing_month': bill['billing_month']},
+                                    fields)
+    return indexed
+
+
+def index_payments(page):
+    return sum(add_index_fields(payment_statuses_table,
+                                {'employee_id': payment['employee_id'], 'billing_month': payment['billing_month']},
+                                billing_index.payment_index_fields(payment))
+               for payment in page)
+
+
+SIDES = {
+    # name: (attributes read, page indexer)
+    'bills': ('allottee_id, billing_month, employee_id', index_bills),
+    'payments': ('employee_id, billing_month', index_payments)
+}
+
+
+def side_table(side):
+    return water_bills_table if side == 'bills' else payment_statuses_table
+
+
+def backfill_segment(side, segment, total_segments):
+    # Returns (items read, items indexed) for one scan segment of a table
+    projection, index_page = SIDES[side]
+    scan_kwargs = {'Segment': segment, 'TotalSegments': total_segments, 'ProjectionExpression': projection,
+                   'FilterExpression': Attr('month_shard').not_exists()}
+    read = indexed = 0
+    while True:
+        scan_response = side_table(side).scan(**scan_kwargs)
+        page = [item for item in scan_response.get('Items', []) if item.get('employee_id')]
+        indexed += index_page(page)
+        read += len(page)
+
+        last_evaluated_key = scan_response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return read, indexed
+        scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    # Invoked manually, with an empty event
+    try:
+        segments = max(1, BACKFILL_SEGMENTS)
+        tasks = [(side, segment) for segment in range(segments) for side in SIDES]
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            results = list(executor.map(lambda task: backfill_segment(task[0], task[1], segments), tasks))
+        summary = {}
+        for (side, _), (read, indexed) in zip(tasks, results):
+            summary[side] = summary.get(side, 0) + read
+            summary[f"{side}_indexed"] = summary.get(f"{side}_indexed", 0) + indexed
+        print(f"Billing index backfill finished: {summary['bills_indexed']} of {summary['bills']} bills and "
+              f"{summary['payments_indexed']} of {summary['payments']} PFMS results indexed.")
+        return {
+            'statusCode': 200,
+            'body': json.dumps(summary)
+        }
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
+    except Exception as e:
+        print(f"Error during billing index backfill: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
+        }
@@ -0,0 +1,40 @@
+import os
+
+import common
+import deduction_runs
+from job_state import get_job
+
+# GET /v1/billing-runs/{billing_month}?run_id=...: the progress of the month's deduction run, read from its
+# checkpoint in JobStateTable, so it can be followed while the run is in progress.
+
+# Suggested wait between polls of a run in progress
+BILLING_RUN_POLL_SECONDS = int(os.environ.get('BILLING_RUN_POLL_SECONDS', '30'))
+
+
+def error_response(status_code, message):
+    return common.json_response(status_code, {'message': message})
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    billing_month = (event.get('pathParameters') or {}).get('billing_month') or ''
+    run_id = (event.get('queryStringParameters') or {}).get('run_id')
+    if not common.valid_billing_month(billing_month) or (run_id and not common.RUN_ID_PATTERN.fullmatch(run_id)):
+        return error_response(400, 'billing_month must be in YYYY-MM format and run_id alphanumeric.')
+
+    try:
+        job_key = deduction_runs.job_key(billing_month, run_id)
+        state = get_job(job_key)
+        if not state:
+            return error_response(404, f"No deduction run for {billing_month}.")
+
+        headers = {'Cache-Control': 'no-store'}
+        if state.get('status') == 'IN_PROGRESS':
+            headers['Retry-After'] = str(BILLING_RUN_POLL_SECONDS)
+        return common.json_response(200, deduction_runs.summary(job_key, state), headers=headers)
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
+    except Exception as e:
+        print(f"Error reading deduction run for {billing_month}: {e}")
+        return common.json_response(500, {'message': 'Internal Server Error', 'error': str(e)})
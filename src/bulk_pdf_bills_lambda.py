@@ -0,0 +1,431 @@
+import json
+import os
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import wait
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+import billing_index
+import common
+from generate_pdf_bill_lambda import (CONTENT_HASH_METADATA_KEY, bill_fields, bill_template, content_hash,
+                                      pdf_filename, pdf_object_key, render_bill_pdf)
+from job_state import LostOwnership, claim_job, end_claim, get_job, save_progress
+
+# Renders the PDF bill of every allottee for a billing month, for month-end distribution.
+#
+# Event: {"billing_month": "YYYY-MM", "zip": true, "run_id": "..."}, all optional. The month defaults to
+# the previous one, as in send_deductions_lambda; run_id starts a fresh run for a month that was already
+# completed.
+#
+# The month's bills are listed from WaterBillsTable's month-index, a page at a time and one index shard
+# after another (billing_index.py), rather than by scanning every month's bills. The index only carries
+# some of a bill's attributes, so each page's bills and their allottees are read with BatchGetItem. Only
+# bills whose stored PDF (same key and content-hash metadata as the single-bill endpoint) is missing or
+# out of date are rendered. Rendering is CPU-bound, so it is spread over worker processes, one per core,
+# while uploads run on a thread pool. Each page's bills are listed in a manifest on S3, and with "zip"
+# the manifests are read back at the end to build one archive per DDO: bills/{month}/archives/{ddo}.zip.
+#
+# The shard, the position in it and the running counts are checkpointed in JobStateTable after every page
+# and archive. A completed run's record is kept (no TTL), so the month is not rendered again by mistake.
+# Near the timeout the function re-invokes itself and the continuation resumes from the checkpoint; a
+# run that died is resumed by invoking it again with the same event once its lease has run out.
+
+# Threads for uploads, HEADs and batch reads; common.aws pools enough connections for them
+BULK_PDF_IO_WORKERS = int(os.environ.get('BULK_PDF_IO_WORKERS', '32'))
+
+s3 = common.lazy_client('s3')
+lambda_client = common.lazy_client('lambda')
+dynamodb = common.lazy_dynamodb()
+
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+allottees_table = common.lazy_table(os.environ['ALLOTTEES_TABLE_NAME'])
+pdf_bills_bucket_name = os.environ['PDF_BILLS_BUCKET_NAME']
+
+# 0 renders in one process per available core
+BULK_PDF_RENDER_PROCESSES = int(os.environ.get('BULK_PDF_RENDER_PROCESSES', '0'))
+BULK_PDF_RENDER_BATCH = int(os.environ.get('BULK_PDF_RENDER_BATCH', '20'))
+# Bills read from the month-index between checkpoints
+BULK_PDF_PAGE_BILLS = int(os.environ.get('BULK_PDF_PAGE_BILLS', '500'))
+BULK_PDF_ZIP_DEFAULT = os.environ.get('BULK_PDF_ZIP_DEFAULT', 'false').lower() == 'true'
+# Allottees without a ddo_code are archived under this code
+BULK_PDF_DEFAULT_DDO = os.environ.get('BULK_PDF_DEFAULT_DDO', 'UNASSIGNED')
+# Hand over to a continuation when less than this is left of the invocation
+BULK_PDF_TIME_RESERVE_MS = int(os.environ.get('BULK_PDF_TIME_RESERVE_MS', '60000'))
+BILL_PROJECTION = 'allottee_id, quarter_id, billing_month, amount_inr, #status, billed_date'
+ALLOTTEE_PROJECTION = 'quarter_id, #name, employee_id, ddo_code'
+MAX_REPORTED_FAILURES = 100
+ARCHIVE_DIRECTORY = '/tmp'
+
+
+def render_batch(batch):
+    # Returns (index, PDF bytes, None) or (index, None, error) for every (index, fields) in the batch
+    results = []
+    for index, fields in batch:
+        try:
+            results.append((index, render_bill_pdf(fields), None))
+        except Exception as e:
+            results.append((index, None, str(e)))
+    return results
+
+
+def render_worker(connection):
+    # Runs in a worker process: renders the batches it is sent until it receives None
+    while True:
+        batch = connection.recv()
+        if batch is None:
+            break
+        connection.send(render_batch(batch))
+    connection.close()
+
+
+class RenderPool:
+    # multiprocessing.Pool and ProcessPoolExecutor need shared-memory semaphores (/dev/shm), which Lambda
+    # does not provide, so the workers are plain processes fed over pipes.
+    def __init__(self, processes):
+        self.processes = processes
+        self.workers = []
+
+    def __enter__(self):
+        # Built before forking, so every worker starts with the bill template ready
+        bill_template()
+        if self.processes > 1:
+            for _ in range(self.processes):
+                parent_connection, child_connection = Pipe()
+                process = Process(target=render_worker, args=(child_connection,), daemon=True)
+                process.start()
+                child_connection.close()
+                self.workers.append((process, parent_connection))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for process, connection in self.workers:
+            try:
+                connection.send(None)
+            except OSError:
+                pass # The worker already exited
+            connection.close()
+        for process, _ in self.workers:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+
+    def render(self, jobs):
+        # Yields (index, PDF bytes, error) for every (index, fields) job as soon as its batch is rendered
+        batches = deque(jobs[i:i + BULK_PDF_RENDER_BATCH] for i in range(0, len(jobs), BULK_PDF_RENDER_BATCH))
+        if not self.workers:
+            while batches:
+                yield from render_batch(batches.popleft())
+            return
+
+        idle = [connection for _, connection in self.workers]
+        busy = []
+        while batches or busy:
+            while batches and idle:
+                connection = idle.pop()
+                connection.send(batches.popleft())
+                busy.append(connection)
+            for connection in wait(busy):
+                results = connection.recv() # EOFError if the worker died
+                busy.remove(connection)
+                idle.append(connection)
+                yield from results
+
+
+def render_process_count():
+    if BULK_PDF_RENDER_PROCESSES > 0:
+        return BULK_PDF_RENDER_PROCESSES
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def fetch_allottees(executor, quarter_ids):
+    # Returns {quarter_id: allottee} for the given quarters, 100 keys per BatchGetItem
+    def fetch(chunk):
+        found = dynamodb.batch_get_all({allottees_table.name: {
+            'Keys': [{'quarter_id': quarter_id} for quarter_id in chunk],
+            'ProjectionExpression': ALLOTTEE_PROJECTION,
+            'ExpressionAttributeNames': {'#name': 'name'}
+        }})
+        return {item['quarter_id']: item for item in found[allottees_table.name]}
+
+    quarter_ids = sorted(quarter_ids)
+    allottees = {}
+    chunks = [quarter_ids[i:i + common.BATCH_GET_LIMIT] for i in range(0, len(quarter_ids), common.BATCH_GET_LIMIT)]
+    for found in executor.map(fetch, chunks):
+        allottees.update(found)
+    return allottees
+
+
+def read_page(billing_month, shard, start_key):
+    # Reads up to BULK_PDF_PAGE_BILLS bills of one month-index shard from start_key.
+    # Returns (bills, key to resume the shard from or None at its end).
+    query_kwargs = {
+        'IndexName': billing_index.MONTH_INDEX_NAME,
+        'KeyConditionExpression': Key('month_shard').eq(f"{billing_month}#{shard:02d}"),
+        'ProjectionExpression': 'allottee_id, billing_month',
+        'Limit': BULK_PDF_PAGE_BILLS
+    }
+    if start_key:
+        query_kwargs['ExclusiveStartKey'] = start_key
+    with common.span('BillingIndex.MonthQuery') as timed:
+        response = water_bills_table.query(**query_kwargs)
+        timed.items = len(response.get('Items', []))
+    keys = response.get('Items', [])
+    if not keys:
+        return [], response.get('LastEvaluatedKey')
+
+    table_name = water_bills_table.name
+    found = dynamodb.batch_get_all({table_name: {
+        'Keys': keys,
+        'ProjectionExpression': BILL_PROJECTION,
+        'ExpressionAttributeNames': {'#status': 'status'}
+    }})
+    return found[table_name], response.get('LastEvaluatedKey')
+
+
+def stored_content_hash(s3_key):
+    try:
+        response = s3.head_object(Bucket=pdf_bills_bucket_name, Key=s3_key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return response.get('Metadata', {}).get(CONTENT_HASH_METADATA_KEY)
+
+
+def upload_pdf(s3_key, filename, pdf_output, bill_hash):
+    # Stored exactly as the single-bill endpoint stores it, so either one serves the other's PDFs
+    s3.put_object(Bucket=pdf_bills_bucket_name, Key=s3_key, Body=pdf_output, ContentType='application/pdf',
+                  ContentDisposition=f'attachment; filename="{filename}"',
+                  Metadata={CONTENT_HASH_METADATA_KEY: bill_hash})
+
+
+def process_page(pool, executor, bills, billing_month, progress):
+    # Renders and uploads the page's new or changed bills; returns its manifest entries [ddo, key, filename]
+    allottees = fetch_allottees(executor, {bill['quarter_id'] for bill in bills if bill.get('quarter_id')})
+    entries = []
+    for bill in bills:
+        allottee = allottees.get(bill.get('quarter_id'), {})
+        fields = bill_fields(bill, allottee, billing_month)
+        entries.append({
+            'ddo': str(allottee.get('ddo_code') or BULK_PDF_DEFAULT_DDO),
+            'key': pdf_object_key(bill['allottee_id'], billing_month),
+            'filename': pdf_filename(bill['allottee_id'], billing_month),
+            'fields': fields,
+            'hash': content_hash(fields)
+        })
+
+    stored_hashes = list(executor.map(stored_content_hash, [entry['key'] for entry in entries]))
+    jobs = [(index, entry['fields']) for index, (entry, stored_hash) in enumerate(zip(entries, stored_hashes))
+            if stored_hash != entry['hash']]
+    progress['unchanged'] += len(entries) - len(jobs)
+
+    failed = set()
+    uploads = []
+    # The page's render time across the pool; uploads overlap with it and are timed as S3 calls
+    with common.span('PDF.Render', items=len(jobs)):
+        for index, pdf_output, error in pool.render(jobs):
+            entry = entries[index]
+            if error:
+                failed.add(index)
+                progress['failed'] += 1
+                if len(progress['failures']) < MAX_REPORTED_FAILURES:
+                    progress['failures'].append({'key': entry['key'], 'reason': error})
+                continue
+            uploads.append(executor.submit(upload_pdf, entry['key'], entry['filename'], pdf_output, entry['hash']))
+    for upload in uploads:
+        upload.result()
+    progress['rendered'] += len(uploads)
+
+    return [[entry['ddo'], entry['key'], entry['filename']]
+            for index, entry in enumerate(entries) if index not in failed]
+
+
+def manifest_key(run, page):
+    return f"bills/{run['billing_month']}/manifests/{run['run_id'] or 'monthly'}/{page:05d}.json"
+
+
+def archive_key(billing_month, ddo):
+    return f"bills/{billing_month}/archives/{ddo}.zip"
+
+
+def render_pages(run, progress, context):
+    # Returns False when the invocation stopped early for a continuation
+    with RenderPool(render_process_count()) as pool, \
+            ThreadPoolExecutor(max_workers=BULK_PDF_IO_WORKERS) as executor:
+        while progress['phase'] == 'RENDER':
+            bills, next_key = read_page(run['billing_month'], progress['shard'], progress['shard_key'])
+            if bills:
+                entries = process_page(pool, executor, bills, run['billing_month'], progress)
+                s3.put_object(Bucket=pdf_bills_bucket_name,
+                              Key=manifest_key(run, progress['pages']),
+                              Body=json.dumps(entries), ContentType='application/json')
+                progress['pages'] += 1
+            progress['bills'] += len(bills)
+            progress['shard_key'] = next_key
+            if not next_key:
+                progress['shard'] += 1
+                if progress['shard'] == billing_index.BILLING_INDEX_SHARDS:
+                    progress['phase'] = 'ARCHIVE' if run['zip'] else 'DONE'
+            checkpoint(run, progress)
+            if progress['phase'] == 'RENDER' and context.get_remaining_time_in_millis() < BULK_PDF_TIME_RESERVE_MS:
+                return False
+    return True
+
+
+def archive_ddos(run, progress, context):
+    # Builds one ZIP of the month's PDFs per DDO from the page manifests; returns False when it stopped early
+    by_ddo = {}
+    with ThreadPoolExecutor(max_workers=BULK_PDF_IO_WORKERS) as executor:
+        manifests = executor.map(
+            lambda page: json.loads(s3.get_object(
+                Bucket=pdf_bills_bucket_name, Key=manifest_key(run, page)
+            )['Body'].read()),
+            range(progress['pages']))
+        for entries in manifests:
+            for ddo, s3_key, filename in entries:
+                by_ddo.setdefault(ddo, []).append((s3_key, filename))
+
+        remaining = [ddo for ddo in sorted(by_ddo) if ddo not in progress['archived_ddos']]
+        for ddo in remaining:
+            write_archive(executor, run['billing_month'], ddo, by_ddo[ddo])
+            progress['archived_ddos'].append(ddo)
+            checkpoint(run, progress)
+            if ddo != remaining[-1] and context.get_remaining_time_in_millis() < BULK_PDF_TIME_RESERVE_MS:
+                return False
+
+    progress['phase'] = 'DONE'
+    return True
+
+
+def write_archive(executor, billing_month, ddo, members):
+    # PDFs are already compressed, so they are stored as they are; the archive is spooled to /tmp
+    path = os.path.join(ARCHIVE_DIRECTORY, f"bills-{billing_month}-{ddo}.zip")
+
+    def fetch(s3_key):
+        return s3.get_object(Bucket=pdf_bills_bucket_name, Key=s3_key)['Body'].read()
+
+    try:
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for (_, filename), pdf_output in zip(members, executor.map(fetch, [key for key, _ in members])):
+                archive.writestr(filename, pdf_output)
+        s3.upload_file(path, pdf_bills_bucket_name, archive_key(billing_month, ddo),
+                       ExtraArgs={'ContentType': 'application/zip'})
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"Archived {len(members)} bills for DDO {ddo}.")
+
+
+def checkpoint(run, progress, status='IN_PROGRESS'):
+    progress['elapsed_ms'] = run['elapsed_ms'] + int((time.monotonic() - run['started']) * 1000)
+    save_progress(run['job_key'], run['owner'], progress, status=status, keep=status == 'COMPLETED')
+
+
+def summary(job_key, state):
+    bills = int(state.get('rendered', 0)) + int(state.get('unchanged', 0))
+    elapsed_ms = int(state.get('elapsed_ms', 0))
+    return {
+        'job_id': job_key,
+        'status': state.get('status'),
+        'bills': int(state.get('bills', 0)),
+        'rendered': int(state.get('rendered', 0)),
+        'unchanged': int(state.get('unchanged', 0)),
+        'failed': int(state.get('failed', 0)),
+        'archived_ddos': len(state.get('archived_ddos', [])),
+        'elapsed_seconds': round(elapsed_ms / 1000, 1),
+        'bills_per_second': round(bills * 1000 / elapsed_ms, 1) if elapsed_ms else None,
+        'failures': state.get('failures', [])
+    }
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    print(f"Received event: {json.dumps(event)}")
+    continuation = event.get('continuation') or {}
+    request = continuation or event
+
+    billing_month = request.get('billing_month')
+    if not billing_month:
+        billing_month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    if not common.valid_billing_month(billing_month):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'message': 'billing_month must be in YYYY-MM format.'})
+        }
+    make_archives = bool(request.get('zip', BULK_PDF_ZIP_DEFAULT))
+    run_id = request.get('run_id')
+    job_key = f"bulk-pdf#{billing_month}" + (f"#{run_id}" if run_id else '')
+    owner = context.aws_request_id
+
+    state = claim_job(job_key, 'BULK_PDF_BILLS', owner, continuation.get('owner'), context)
+    if state is None:
+        state = get_job(job_key) or {}
+        print(f"Bulk PDF run {job_key} is {state.get('status')}; nothing to do.")
+        return {
+            'statusCode': 409 if state.get('status') == 'IN_PROGRESS' else 200,
+            'body': json.dumps(summary(job_key, state))
+        }
+
+    progress = {
+        'phase': state.get('phase', 'RENDER'),
+        'shard': int(state.get('shard', 0)),
+        'shard_key': state.get('shard_key'),
+        'pages': int(state.get('pages', 0)),
+        'bills': int(state.get('bills', 0)),
+        'rendered': int(state.get('rendered', 0)),
+        'unchanged': int(state.get('unchanged', 0)),
+        'failed': int(state.get('failed', 0)),
+        'failures': state.get('failures', []),
+        'archived_ddos': state.get('archived_ddos', []),
+        'elapsed_ms': int(state.get('elapsed_ms', 0))
+    }
+    run = {'job_key': job_key, 'run_id': run_id, 'owner': owner, 'billing_month': billing_month,
+           'zip': make_archives, 'started': time.monotonic(), 'elapsed_ms': progress['elapsed_ms']}
+    print(f"Bulk PDF run {job_key}: phase {progress['phase']}, {progress['bills']} bills done so far.")
+
+    try:
+        finished = render_pages(run, progress, context)
+        if finished and progress['phase'] == 'ARCHIVE':
+            finished = archive_ddos(run, progress, context)
+    except LostOwnership:
+        print(f"Another invocation took over {job_key}; stopping.")
+        return {
+            'statusCode': 409,
+            'body': json.dumps({'message': 'Run taken over by another invocation.', 'job_id': job_key})
+        }
+    except Exception:
+        # Release the lease so that invoking the run again resumes it from the last checkpoint
+        end_claim(job_key, owner)
+        raise
+
+    if not finished:
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({'continuation': {'billing_month': billing_month, 'zip': make_archives,
+                                                 'run_id': run_id, 'owner': owner}})
+        )
+        print(f"Handed {job_key} over to a continuation invocation after {progress['bills']} bills.")
+        return {
+            'statusCode': 202,
+            'body': json.dumps(summary(job_key, dict(progress, status='IN_PROGRESS')))
+        }
+
+    checkpoint(run, progress, status='COMPLETED')
+    result = summary(job_key, dict(progress, status='COMPLETED'))
+    print(f"Bulk PDF run {job_key} completed: {result['rendered']} rendered, {result['unchanged']} unchanged, "
+          f"{result['failed']} failed, {result['bills_per_second']} bills/s.")
+    return {
+        'statusCode': 200,
+        'body': json.dumps(result)
+    }
@@ -0,0 +1,6 @@
+from common.aws import client, lazy_client, lazy_dynamodb, lazy_resource, lazy_table, resource, session, table
+from common.dynamo import (BATCH_GET_LIMIT, BATCH_WRITE_LIMIT, Throttled, capacity_report, is_conditional_check_failure,
+                           throttled_response)
+from common.metrics import instrumented, item_span, span
+from common.months import BILLING_MONTH_PATTERN, RUN_ID_PATTERN, month_bounds, valid_billing_month
+from common.responses import binary_response, dumps, json_response, request_body, request_headers
@@ -0,0 +1,135 @@
+import os
+import threading
+
+from common.dynamo import ThrottledDynamoDB, ThrottledTable
+from common.metrics import instrument_client
+
+# AWS clients, resources and tables shared by every module in a container.
+#
+# Nothing is created at import time. lazy_client('s3') or lazy_table(name) returns a stand-in that
+# creates the real object on first attribute access and then forwards to it, so modules keep their
+# module-level names (s3, water_bills_table, ...) while an invocation that never touches a service
+# never pays for creating its client. Whatever has been created is reused by later (warm) invocations
+# and by every other module: one session, one client per service and one DynamoDB resource per container.
+#
+# Connection pooling, keep-alive, timeouts and retries are configured here, once, for every client.
+# DynamoDB tables and batch calls are wrapped by common.dynamo, which does their retries itself; the calls
+# of every other client are timed by common.metrics.
+# boto3 itself is imported on first use too: importing it and botocore.config takes longer than
+# everything else a handler module imports.
+
+BOTO_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('BOTO_CONNECT_TIMEOUT_SECONDS', '2'))
+BOTO_READ_TIMEOUT_SECONDS = float(os.environ.get('BOTO_READ_TIMEOUT_SECONDS', '10'))
+BOTO_MAX_ATTEMPTS = int(os.environ.get('BOTO_MAX_ATTEMPTS', '5'))
+# Connections are opened on demand, so the pool only caps how many are kept; it must cover the largest
+# thread pool any module drives a client from
+BOTO_MAX_POOL_CONNECTIONS = int(os.environ.get('BOTO_MAX_POOL_CONNECTIONS', '64'))
+
+_lock = threading.RLock()
+_session = None
+_config = None
+_dynamodb_config = None
+_clients = {}
+_resources = {}
+_tables = {}
+
+
+def session():
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session()
+        return _session
+
+
+def boto_config():
+    global _config
+    with _lock:
+        if _config is None:
+            from botocore.config import Config
+            _config = Config(
+                connect_timeout=BOTO_CONNECT_TIMEOUT_SECONDS,
+                read_timeout=BOTO_READ_TIMEOUT_SECONDS,
+                # Adaptive mode also rate-limits the client itself once the service starts throttling
+                retries={'mode': 'adaptive', 'max_attempts': BOTO_MAX_ATTEMPTS},
+                max_pool_connections=BOTO_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True
+            )
+        return _config
+
+
+def dynamodb_config():
+    # common.dynamo retries DynamoDB calls according to the caller's priority; botocore must not add its own
+    global _dynamodb_config
+    with _lock:
+        if _dynamodb_config is None:
+            from botocore.config import Config
+            _dynamodb_config = boto_config().merge(Config(retries={'mode': 'standard', 'total_max_attempts': 1}))
+        return _dynamodb_config
+
+
+def client(service_name):
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = instrument_client(session().client(service_name, config=boto_config()))
+        return _clients[service_name]
+
+
+def resource(service_name):
+    with _lock:
+        if service_name not in _resources:
+            config = dynamodb_config() if service_name == 'dynamodb' else boto_config()
+            _resources[service_name] = session().resource(service_name, config=config)
+        return _resources[service_name]
+
+
+def table(table_name):
+    with _lock:
+        if table_name not in _tables:
+            _tables[table_name] = ThrottledTable(resource('dynamodb').Table(table_name))
+        return _tables[table_name]
+
+
+class Lazy:
+    # Creates its target with factory() on first attribute access and forwards every attribute to it
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            with _lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+class LazyTable(Lazy):
+    # The table name is known without creating the table, e.g. for the keys of batch_get_item
+
+    def __init__(self, table_name):
+        super().__init__(lambda: table(table_name))
+        self.name = table_name
+        self.table_name = table_name
+
+
+def lazy_client(service_name):
+    return Lazy(lambda: client(service_name))
+
+
+def lazy_resource(service_name):
+    return Lazy(lambda: resource(service_name))
+
+
+def lazy_dynamodb():
+    # The DynamoDB resource for multi-table batch calls, through common.dynamo
+    return Lazy(lambda: ThrottledDynamoDB(resource('dynamodb')))
+
+
+def lazy_table(table_name):
+    return LazyTable(table_name)
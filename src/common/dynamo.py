@@ -0,0 +1,389 @@
+import json
+import os
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+# Throttle-aware access to DynamoDB. Every table and batch call made through common goes through here:
+#
+# - Each call asks for ReturnConsumedCapacity and the units are added up per table, index and operation
+#   (capacity_report()), together with the time calls took, the items they read or wrote, throttles,
+#   retries and time spent waiting. common.metrics logs every invocation's share.
+# - Calls are either interactive (API requests with a caller waiting) or bulk (scheduled and batch jobs),
+#   by DYNAMODB_PRIORITY on the function, or per table with ThrottledTable(table, priority=...).
+# - Bulk calls first take their expected units from a token bucket refilled at
+#   DYNAMODB_BULK_CAPACITY_SHARE of the table's (or index's) provisioned capacity, so a month-end scan
+#   leaves the rest to the interactive lookups. On-demand tables have no provisioned capacity and are not
+#   rate-limited. The bucket is per container: a job is assumed to run in one invocation at a time.
+# - Throttled and transient failures are retried with full-jitter exponential backoff. Interactive calls
+#   retry a few times with short delays and then raise Throttled, which handlers answer with a 503 and
+#   Retry-After instead of a 500; bulk calls keep backing off for longer.
+# - Batch calls can succeed with part of the request left over (UnprocessedKeys, UnprocessedItems).
+#   ThrottledDynamoDB.batch_get_all() and batch_write_all() split a request into calls of at most
+#   BATCH_GET_LIMIT keys or BATCH_WRITE_LIMIT writes, send what is left over again with the same backoff
+#   and raise Throttled when some is still left after the retries.
+#
+# botocore's own retries are turned off for DynamoDB (see common.aws), so these are the only ones.
+
+DYNAMODB_PRIORITY = os.environ.get('DYNAMODB_PRIORITY', 'interactive')
+DYNAMODB_BULK_CAPACITY_SHARE = float(os.environ.get('DYNAMODB_BULK_CAPACITY_SHARE', '0.5'))
+DYNAMODB_INTERACTIVE_RETRIES = int(os.environ.get('DYNAMODB_INTERACTIVE_RETRIES', '3'))
+DYNAMODB_BULK_RETRIES = int(os.environ.get('DYNAMODB_BULK_RETRIES', '10'))
+
+# Full-jitter backoff per priority: the n-th retry waits a random time up to min(cap, base * 2**n) seconds
+BACKOFF_SECONDS = {'interactive': (0.025, 0.4), 'bulk': (0.1, 10.0)}
+THROTTLED_RETRY_AFTER_SECONDS = 1
+BATCH_GET_LIMIT = 100 # BatchGetItem accepts at most 100 keys per request
+BATCH_WRITE_LIMIT = 25 # BatchWriteItem accepts at most 25 requests
+
+THROTTLE_ERROR_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded'}
+TRANSIENT_ERROR_CODES = {'InternalServerError', 'ServiceUnavailable'}
+
+READ_OPERATIONS = {'GetItem', 'Query', 'Scan', 'BatchGetItem'}
+
+
+def is_conditional_check_failure(error):
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+class Throttled(ClientError):
+    # DynamoDB still throttled the call after every retry its priority allows
+
+    def __init__(self, error, operation_name):
+        super().__init__(error.response, operation_name)
+        self.retry_after = THROTTLED_RETRY_AFTER_SECONDS
+
+
+def throttled_response(error):
+    return {
+        'statusCode': 503,
+        'headers': {'Content-Type': 'application/json', 'Retry-After': str(error.retry_after)},
+        'body': json.dumps({'message': 'The service is busy; retry the request shortly.'})
+    }
+
+
+class TokenBucket:
+    # Capacity units refilled at `rate` per second, holding at most `burst`. take() reserves units up
+    # front and sleeps off any shortfall, so concurrent callers queue fairly; adjust() settles the
+    # difference once the call reports what it actually consumed, which can leave the bucket in debt.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, units):
+        with self._lock:
+            self._refill()
+            self._tokens -= units
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def adjust(self, units):
+        with self._lock:
+            self._refill()
+            self._tokens -= units
+
+
+class CapacityMeter:
+    # Consumed units, time, items and throttling per (table, index, operation), since the container started
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        if key not in self._stats:
+            self._stats[key] = {'calls': 0, 'units': 0.0, 'seconds': 0.0, 'items': 0, 'throttles': 0, 'retries': 0,
+                                'wait_seconds': 0.0}
+        return self._stats[key]
+
+    def estimate(self, key):
+        # Units the next call is expected to consume: the average so far, or one unit for a first call
+        with self._lock:
+            entry = self._stats.get(key)
+            return entry['units'] / entry['calls'] if entry and entry['calls'] and entry['units'] else 1.0
+
+    def add(self, key, **counts):
+        with self._lock:
+            entry = self._entry(key)
+            for field, value in counts.items():
+                entry[field] += value
+
+    def report(self):
+        with self._lock:
+            return [dict(table=table, index=index, operation=operation, units=round(entry['units'], 1),
+                         seconds=round(entry['seconds'], 6), wait_seconds=round(entry['wait_seconds'], 3),
+                         **{field: entry[field] for field in ('calls', 'items', 'throttles', 'retries')})
+                    for (table, index, operation), entry in sorted(self._stats.items(), key=str)]
+
+    def snapshot(self):
+        # The raw counters by (table, index, operation), cheap enough to take on every invocation
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+meter = CapacityMeter()
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def capacity_report():
+    return meter.report()
+
+
+def provisioned_units(table, index_name, kind):
+    # The table's (or the index's) provisioned read or write capacity; None for on-demand tables or
+    # when the table cannot be described
+    field = 'ReadCapacityUnits' if kind == 'read' else 'WriteCapacityUnits'
+    try:
+        throughput = table.provisioned_throughput
+        if index_name:
+            throughput = next(index['ProvisionedThroughput'] for index in table.global_secondary_indexes or []
+                              if index['IndexName'] == index_name)
+    except Exception as e:
+        print(f"Not rate-limiting {getattr(table, 'name', table)}: cannot read its provisioned capacity ({e})")
+        return None
+    return (throughput or {}).get(field) or None
+
+
+def bucket_for(table_name, index_name, kind, describe):
+    # describe() returns the Table, which is only needed (and described) the first time
+    key = (table_name, index_name, kind)
+    with _buckets_lock:
+        if key not in _buckets:
+            units = provisioned_units(describe(), index_name, kind)
+            rate = units * DYNAMODB_BULK_CAPACITY_SHARE if units and DYNAMODB_BULK_CAPACITY_SHARE else None
+            # One second's worth of burst: DynamoDB's own burst credits are left to interactive calls
+            _buckets[key] = TokenBucket(rate, rate) if rate else None
+        return _buckets[key]
+
+
+def reset_buckets():
+    with _buckets_lock:
+        _buckets.clear()
+
+
+def consumed_units(response):
+    consumed = response.get('ConsumedCapacity') if isinstance(response, dict) else None
+    if not consumed:
+        return {}
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return {entry['TableName']: entry.get('CapacityUnits', 0.0) for entry in consumed}
+
+
+def item_count(operation, kwargs, response, table_name):
+    # Items the call read or wrote on table_name
+    if operation in ('Query', 'Scan'):
+        return response.get('Count', 0)
+    if operation == 'GetItem':
+        return int('Item' in response)
+    if operation == 'BatchGetItem':
+        return len(response.get('Responses', {}).get(table_name, []))
+    if operation == 'BatchWriteItem':
+        return len(kwargs['RequestItems'].get(table_name, [])) - \
+            len(response.get('UnprocessedItems', {}).get(table_name, []))
+    return 1
+
+
+def call(operation, method, kwargs, targets, priority=None):
+    # Runs method(**kwargs) for DynamoDB `operation` with the accounting, rate limiting and retries described
+    # above. targets lists what the call consumes capacity from: (table name, index name, describe)
+    priority = priority or DYNAMODB_PRIORITY
+    bulk = priority == 'bulk'
+    kind = 'read' if operation in READ_OPERATIONS else 'write'
+    kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+    retries = DYNAMODB_BULK_RETRIES if bulk else DYNAMODB_INTERACTIVE_RETRIES
+    base, cap = BACKOFF_SECONDS['bulk' if bulk else 'interactive']
+    keys = [(table_name, index_name, operation) for table_name, index_name, _ in targets]
+    started = time.perf_counter()
+
+    for attempt in range(retries + 1):
+        reserved = []
+        if bulk:
+            for (table_name, index_name, describe), key in zip(targets, keys):
+                bucket = bucket_for(table_name, index_name, kind, describe)
+                if bucket:
+                    estimate = meter.estimate(key)
+                    meter.add(key, wait_seconds=bucket.take(estimate))
+                    reserved.append((bucket, key, estimate))
+        try:
+            response = method(**kwargs)
+        except (ClientError, BotoConnectionError, HTTPClientError) as e:
+            code = e.response.get('Error', {}).get('Code') if isinstance(e, ClientError) else 'ConnectionError'
+            if code not in THROTTLE_ERROR_CODES and code not in TRANSIENT_ERROR_CODES and code != 'ConnectionError':
+                raise
+            # A failed call consumed nothing
+            for bucket, _, estimate in reserved:
+                bucket.adjust(-estimate)
+            for key in keys:
+                meter.add(key, throttles=int(code in THROTTLE_ERROR_CODES))
+            if attempt == retries:
+                for key in keys:
+                    meter.add(key, seconds=time.perf_counter() - started)
+                if code in THROTTLE_ERROR_CODES:
+                    raise Throttled(e, operation) from e
+                raise
+            for key in keys:
+                meter.add(key, retries=1)
+            time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+            continue
+
+        consumed = consumed_units(response)
+        seconds = time.perf_counter() - started
+        for key in keys:
+            meter.add(key, calls=1, units=consumed.get(key[0], 0.0), seconds=seconds,
+                      items=item_count(operation, kwargs, response, key[0]))
+        for bucket, key, estimate in reserved:
+            bucket.adjust(consumed.get(key[0], estimate) - estimate)
+        return response
+
+
+class ThrottledTable:
+    # A DynamoDB Table whose data-plane calls go through call(); everything else is the table's own
+
+    def __init__(self, table, priority=None):
+        self._table = table
+        self._priority = priority
+
+    def __getattr__(self, name):
+        return getattr(self._table, name)
+
+    def _call(self, operation, method, kwargs):
+        return call(operation, method, kwargs, [(self._table.name, kwargs.get('IndexName'), lambda: self._table)],
+                    self._priority)
+
+    def get_item(self, **kwargs):
+        return self._call('GetItem', self._table.get_item, kwargs)
+
+    def put_item(self, **kwargs):
+        return self._call('PutItem', self._table.put_item, kwargs)
+
+    def update_item(self, **kwargs):
+        return self._call('UpdateItem', self._table.update_item, kwargs)
+
+    def delete_item(self, **kwargs):
+        return self._call('DeleteItem', self._table.delete_item, kwargs)
+
+    def query(self, **kwargs):
+        return self._call('Query', self._table.query, kwargs)
+
+    def scan(self, **kwargs):
+        return self._call('Scan', self._table.scan, kwargs)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        # boto3's BatchWriter, sending its BatchWriteItem calls through call() as well
+        from boto3.dynamodb.table import BatchWriter
+        return BatchWriter(self._table.name, _BatchWriteClient(self._table, self._priority),
+                           overwrite_by_pkeys=overwrite_by_pkeys)
+
+
+class _BatchWriteClient:
+    def __init__(self, table, priority):
+        self._table = table
+        self._priority = priority
+
+    def batch_write_item(self, **kwargs):
+        return call('BatchWriteItem', self._table.meta.client.batch_write_item, kwargs,
+                    [(self._table.name, None, lambda: self._table)], self._priority)
+
+
+def unprocessed_count(request_items):
+    # Keys (BatchGetItem) or write requests (BatchWriteItem) in a request or what is left of one
+    return sum(len(request['Keys']) if isinstance(request, dict) else len(request)
+               for request in request_items.values())
+
+
+def batch_chunks(request_items, limit):
+    # Splits a multi-table batch request into requests of at most limit keys or write requests each
+    chunk, size = {}, 0
+    for table_name, request in request_items.items():
+        entries = request['Keys'] if isinstance(request, dict) else request
+        position = 0
+        while position < len(entries):
+            part = entries[position:position + limit - size]
+            chunk[table_name] = dict(request, Keys=part) if isinstance(request, dict) else part
+            position += len(part)
+            size += len(part)
+            if size == limit:
+                yield chunk
+                chunk, size = {}, 0
+    if chunk:
+        yield chunk
+
+
+class ThrottledDynamoDB:
+    # The DynamoDB service resource, with its multi-table batch calls going through call()
+
+    def __init__(self, resource, priority=None):
+        self._resource = resource
+        self._priority = priority
+
+    def __getattr__(self, name):
+        return getattr(self._resource, name)
+
+    def _targets(self, request_items):
+        return [(table_name, None, lambda table_name=table_name: self._resource.Table(table_name))
+                for table_name in request_items]
+
+    def batch_get_item(self, **kwargs):
+        return call('BatchGetItem', self._resource.batch_get_item, kwargs, self._targets(kwargs['RequestItems']),
+                    self._priority)
+
+    def batch_write_item(self, **kwargs):
+        return call('BatchWriteItem', self._resource.batch_write_item, kwargs,
+                    self._targets(kwargs['RequestItems']), self._priority)
+
+    def _until_processed(self, operation, send, request_items, unprocessed_field, collect=None):
+        # Sends the request, then what DynamoDB left unprocessed, with the priority's retries and backoff
+        bulk = (self._priority or DYNAMODB_PRIORITY) == 'bulk'
+        retries = DYNAMODB_BULK_RETRIES if bulk else DYNAMODB_INTERACTIVE_RETRIES
+        base, cap = BACKOFF_SECONDS['bulk' if bulk else 'interactive']
+        for attempt in range(retries + 1):
+            response = send(RequestItems=request_items)
+            if collect:
+                collect(response)
+            request_items = response.get(unprocessed_field)
+            if not request_items:
+                return
+            for table_name in request_items:
+                meter.add((table_name, None, operation), throttles=1, retries=int(attempt < retries))
+            if attempt < retries:
+                time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+        error = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException',
+                                       'Message': f"{unprocessed_count(request_items)} requests left unprocessed"}},
+                            operation)
+        raise Throttled(error, operation)
+
+    def batch_get_all(self, request_items):
+        # BatchGetItem for every key of the request; returns {table name: [item, ...]}
+        found = {table_name: [] for table_name in request_items}
+
+        def collect(response):
+            for table_name, items in response.get('Responses', {}).items():
+                found.setdefault(table_name, []).extend(items)
+
+        for chunk in batch_chunks(request_items, BATCH_GET_LIMIT):
+            self._until_processed('BatchGetItem', self.batch_get_item, chunk, 'UnprocessedKeys', collect)
+        return found
+
+    def batch_write_all(self, request_items):
+        # BatchWriteItem for every write request
+        for chunk in batch_chunks(request_items, BATCH_WRITE_LIMIT):
+            self._until_processed('BatchWriteItem', self.batch_write_item, chunk, 'UnprocessedItems')
@@ -0,0 +1,243 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+from common import dynamo
+
+# Per-invocation timings and counts, logged as CloudWatch embedded metric format (EMF).
+#
+# A span is a named, timed step. Per span name an invocation adds up calls, milliseconds, items (when the
+# step reports them) and failures:
+#
+# - DynamoDB calls are timed by common.dynamo's meter, per table, index and operation, together with the
+#   capacity they consumed: DynamoDB.<operation>.<table>[.<index>]
+# - S3, SES, Lambda and SQS calls are timed by hooks on the clients common.aws creates, retries included:
+#   <service>.<operation>, e.g. S3.PutObject
+# - Handlers time their own expensive steps with span(): PDF.Render, CSV.Build, Response.Serialize, ...
+#
+# @instrumented handlers end every invocation by logging one JSON line (more past EMF_MAX_METRICS
+# metrics). CloudWatch turns its fields into metrics in METRICS_NAMESPACE with the function name as the
+# dimension; the request ID and status code are plain fields, for Logs Insights.
+#
+# A span costs two perf_counter() calls and a dictionary update under a lock, a few microseconds, so the
+# metrics stay on in production (METRICS_ENABLED=false turns them off). A METRICS_DETAIL_SAMPLE_RATE share
+# of invocations is detailed: item_span() then times each item of a batch too, and every span name also
+# logs up to EMF_MAX_VALUES individual durations (<name>.Latency), from which CloudWatch computes
+# percentiles. item_span() costs nothing in the other invocations.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'LokSabhaWaterBilling')
+METRICS_DETAIL_SAMPLE_RATE = float(os.environ.get('METRICS_DETAIL_SAMPLE_RATE', '0.01'))
+
+# CloudWatch limits: metrics per EMF document and values per metric
+EMF_MAX_METRICS = 100
+EMF_MAX_VALUES = 100
+
+
+class Recorder:
+    # Calls, time, items and failures per span name since the container started, like common.dynamo's
+    # meter; instrumented() logs the difference an invocation made. The durations sampled in a detailed
+    # invocation are kept for that invocation only.
+
+    def __init__(self):
+        self.detailed = False
+        self._spans = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def start(self, detailed):
+        with self._lock:
+            self.detailed = detailed
+            self._samples = {}
+
+    def add(self, name, seconds, items=None, failed=False):
+        with self._lock:
+            entry = self._spans.get(name)
+            if entry is None:
+                entry = self._spans[name] = {'calls': 0, 'seconds': 0.0, 'items': 0, 'errors': 0}
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['items'] += items or 0
+            entry['errors'] += int(failed)
+            if self.detailed:
+                samples = self._samples.setdefault(name, [])
+                if len(samples) < EMF_MAX_VALUES:
+                    samples.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self._spans.items()}
+
+    def samples(self):
+        with self._lock:
+            return {name: list(samples) for name, samples in self._samples.items()}
+
+
+recorder = Recorder()
+_cold_start = True
+
+
+class Span:
+    # with span('CSV.Build') as timed: ...; timed.items = len(rows)
+
+    __slots__ = ('name', 'items', '_started')
+
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if METRICS_ENABLED:
+            recorder.add(self.name, time.perf_counter() - self._started, self.items, exc_type is not None)
+        return False
+
+
+class NullSpan:
+    # Stands in for an item span outside detailed invocations
+
+    items = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_null_span = NullSpan()
+
+
+def span(name, items=None):
+    return Span(name, items)
+
+
+def item_span(name, items=None):
+    # A span around one item of a batch, timed in detailed invocations only
+    return Span(name, items) if recorder.detailed else _null_span
+
+
+def _client_call_started(model, context, **kwargs):
+    context['metrics_span'] = (f"{model.service_model.service_id}.{model.name}", time.perf_counter())
+
+
+def _client_call_finished(context, http_response=None, **kwargs):
+    name, started = context.pop('metrics_span', (None, None))
+    if name:
+        failed = http_response is None or http_response.status_code >= 300
+        recorder.add(name, time.perf_counter() - started, failed=failed)
+
+
+def instrument_client(client):
+    # Times every API call the client makes as a '<service>.<operation>' span. after-call-error is emitted
+    # when a call fails without a response (connection errors, timeouts).
+    if METRICS_ENABLED:
+        client.meta.events.register('before-call', _client_call_started)
+        client.meta.events.register('after-call', _client_call_finished)
+        client.meta.events.register('after-call-error', _client_call_finished)
+    return client
+
+
+def changes(before, after):
+    # The counters of a recorder or meter snapshot that moved since an earlier snapshot, by how much
+    moved = {}
+    for key, entry in after.items():
+        earlier = before.get(key)
+        if earlier is None:
+            moved[key] = entry
+        elif entry != earlier:
+            moved[key] = {field: value - earlier[field] for field, value in entry.items()}
+    return moved
+
+
+def capacity_metric_name(key):
+    # DynamoDB.<operation>.<table>[.<index>] for the meter's (table, index, operation)
+    table, index, operation = key
+    return f"DynamoDB.{operation}.{table}.{index}" if index else f"DynamoDB.{operation}.{table}"
+
+
+def invocation_metrics(seconds, spans, capacity, samples, failed):
+    # {metric name: (value, unit)} for the invocation's spans and DynamoDB consumption
+    values = {'Invocation.Time': (round(seconds * 1000, 3), 'Milliseconds')}
+    if failed:
+        values['Invocation.Errors'] = (1, 'Count')
+    for name, entry in spans.items():
+        values[f"{name}.Calls"] = (entry['calls'], 'Count')
+        values[f"{name}.Time"] = (round(entry['seconds'] * 1000, 3), 'Milliseconds')
+        if entry['items']:
+            values[f"{name}.Items"] = (entry['items'], 'Count')
+        if entry['errors']:
+            values[f"{name}.Errors"] = (entry['errors'], 'Count')
+    for name, durations in samples.items():
+        values[f"{name}.Latency"] = ([round(duration * 1000, 3) for duration in durations], 'Milliseconds')
+    for key, entry in capacity.items():
+        name = capacity_metric_name(key)
+        values[f"{name}.Calls"] = (entry['calls'], 'Count')
+        values[f"{name}.Time"] = (round(entry['seconds'] * 1000, 3), 'Milliseconds')
+        values[f"{name}.CapacityUnits"] = (round(entry['units'], 1), 'Count')
+        for field, suffix in (('items', 'Items'), ('throttles', 'Throttles'), ('retries', 'Retries')):
+            if entry[field]:
+                values[f"{name}.{suffix}"] = (entry[field], 'Count')
+    return values
+
+
+def emf_documents(function_name, values, properties):
+    names = sorted(values)
+    timestamp = int(time.time() * 1000)
+    for start in range(0, len(names), EMF_MAX_METRICS):
+        chunk = names[start:start + EMF_MAX_METRICS]
+        document = {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [['FunctionName']],
+                    'Metrics': [{'Name': name, 'Unit': values[name][1]} for name in chunk]
+                }]
+            },
+            'FunctionName': function_name
+        }
+        document.update(properties)
+        document.update((name, values[name][0]) for name in chunk)
+        yield document
+
+
+def instrumented(handler):
+    # Decorates a handler so that every invocation ends by logging its metrics
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold_start
+        if not METRICS_ENABLED:
+            return handler(event, context)
+
+        recorder.start(random.random() < METRICS_DETAIL_SAMPLE_RATE)
+        spans_before, capacity_before = recorder.snapshot(), dynamo.meter.snapshot()
+        started = time.perf_counter()
+        response, raised = None, True
+        try:
+            response = handler(event, context)
+            raised = False
+            return response
+        finally:
+            seconds = time.perf_counter() - started
+            status = response.get('statusCode') if isinstance(response, dict) else None
+            values = invocation_metrics(seconds, changes(spans_before, recorder.snapshot()),
+                                        changes(capacity_before, dynamo.meter.snapshot()),
+                                        recorder.samples(), raised or (status or 0) >= 500)
+            properties = {
+                'RequestId': getattr(context, 'aws_request_id', None),
+                'StatusCode': status,
+                'ColdStart': _cold_start,
+                'Detailed': recorder.detailed
+            }
+            _cold_start = False
+            function_name = getattr(context, 'function_name', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+            for document in emf_documents(function_name or 'local', values, properties):
+                print(json.dumps(document, separators=(',', ':')))
+    return wrapper
@@ -0,0 +1,20 @@
+import calendar
+import re
+from datetime import date
+
+# Billing months ('YYYY-MM'). Kept apart from tariff, which needs NumPy, so that handlers that only work
+# with months (occupancy, and through it allottee sync) do not load it.
+
+BILLING_MONTH_PATTERN = re.compile(r'\d{4}-(?:0[1-9]|1[0-2])')
+# Tells apart a fresh run of a month already done (see deduction_runs.job_key)
+RUN_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def valid_billing_month(value):
+    return isinstance(value, str) and BILLING_MONTH_PATTERN.fullmatch(value) is not None
+
+
+def month_bounds(billing_month):
+    # (first day, number of days) of a YYYY-MM month
+    year, month = map(int, billing_month.split('-'))
+    return date(year, month, 1), calendar.monthrange(year, month)[1]
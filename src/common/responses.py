@@ -0,0 +1,135 @@
+import base64
+import gzip
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+from common.metrics import span
+
+# API Gateway proxy responses, shared by the API handlers.
+#
+# dumps() serialises in one pass of json's C encoder: DynamoDB's Decimals (as JSON numbers, integers when
+# integral), dates and datetimes (ISO 8601) and sets (sorted lists) are converted by the encoder's default
+# hook as it meets them, instead of walking every item beforehand or falling back to default=str, which
+# turned amounts into strings and sets into their repr.
+#
+# json_response() compresses bodies of RESPONSE_COMPRESSION_MIN_BYTES or more when the request's
+# Accept-Encoding allows: br when the optional brotli package is installed and the client prefers it (or
+# accepts it as much as gzip), gzip otherwise. Compressed and binary bodies go out base64-encoded with
+# isBase64Encoded set; API Gateway decodes them because BinaryMediaTypes is */* (template.yaml), which in
+# turn makes it base64-encode request bodies: handlers read them through request_body().
+
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESSION_MIN_BYTES', '1024'))
+RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', '5'))
+RESPONSE_BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', '4'))
+
+_brotli = None
+
+
+def _default(value):
+    # Called by the encoder only for values json cannot serialise itself
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_encoder = json.JSONEncoder(default=_default)
+
+
+def dumps(value):
+    return _encoder.encode(value)
+
+
+def brotli_module():
+    # Imported on first use; None when the package is not installed
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+
+def request_headers(event):
+    return {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+
+
+def request_body(event):
+    # The request body as text, decoded if API Gateway passed it base64-encoded
+    body = event.get('body')
+    if body and event.get('isBase64Encoded'):
+        return base64.b64decode(body).decode('utf-8')
+    return body
+
+
+def accepted_encodings(event):
+    # {coding: q} from Accept-Encoding, leaving out codings the client refuses (q=0)
+    accepted = {}
+    for part in request_headers(event).get('accept-encoding', '').split(','):
+        coding, _, params = part.strip().lower().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if coding and quality > 0:
+            accepted[coding] = quality
+    return accepted
+
+
+def choose_encoding(event):
+    accepted = accepted_encodings(event)
+    wildcard = accepted.get('*', 0)
+    gzip_quality = accepted.get('gzip', wildcard)
+    brotli_quality = accepted.get('br', wildcard) if brotli_module() else 0
+    if brotli_quality and brotli_quality >= gzip_quality:
+        return 'br'
+    return 'gzip' if gzip_quality else None
+
+
+def compress(data, encoding):
+    with span('Response.Compress', items=len(data)):
+        if encoding == 'br':
+            return brotli_module().compress(data, quality=RESPONSE_BROTLI_QUALITY)
+        return gzip.compress(data, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def json_response(status_code, body, event=None, headers=None):
+    # body is serialised with dumps() unless it already is a string; without the request event the body
+    # is never compressed
+    if not isinstance(body, str):
+        body = dumps(body)
+    headers = dict({'Content-Type': 'application/json'}, **(headers or {}))
+    if event is None or len(body) < RESPONSE_COMPRESSION_MIN_BYTES:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+
+    headers['Vary'] = 'Accept-Encoding'
+    encoding = choose_encoding(event)
+    if not encoding:
+        return {'statusCode': status_code, 'headers': headers, 'body': body, 'isBase64Encoded': False}
+    headers['Content-Encoding'] = encoding
+    # A strong ETag stands for the exact bytes sent, which compression changes
+    if headers.get('ETag', '').startswith('"'):
+        headers['ETag'] = 'W/' + headers['ETag']
+    return binary_response(status_code, compress(body.encode('utf-8'), encoding), headers=headers)
+
+
+def binary_response(status_code, data, content_type=None, headers=None):
+    headers = dict(headers or {})
+    if content_type:
+        headers['Content-Type'] = content_type
+    return {
+        'statusCode': status_code,
+        'headers': headers,
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
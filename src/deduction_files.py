@@ -0,0 +1,78 @@
+import csv
+import os
+import zlib
+from io import StringIO
+
+import common
+
+# CSV files written to S3: the monthly deduction file (send_deductions_lambda) and the reconciliation
+# report (reconciliation_lambda). Both can run to hundreds of thousands of rows, so they are streamed into
+# a multipart upload instead of being built in memory.
+
+s3 = common.lazy_client('s3')
+
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MULTIPART_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get('DEDUCTION_FILE_PART_SIZE', str(8 * 1024 * 1024))))
+
+
+def csv_bytes(rows):
+    with common.span('CSV.Build', items=len(rows)):
+        text = StringIO()
+        csv.writer(text).writerows(rows)
+        return text.getvalue().encode('utf-8')
+
+
+class DeductionFileWriter:
+    # Streams CSV text into an S3 multipart upload, optionally gzip-compressed.
+    # Only the current part (at most MULTIPART_PART_SIZE plus one write) is held in memory.
+
+    def __init__(self, bucket, key, compress=False):
+        self.bucket = bucket
+        self.key = key
+        self._parts = []
+        self._buffer = bytearray()
+        self._compressor = zlib.compressobj(wbits=31) if compress else None # wbits=31 writes a gzip container
+
+        create_kwargs = {'Bucket': bucket, 'Key': key, 'ContentType': 'text/csv'}
+        if compress:
+            create_kwargs['ContentEncoding'] = 'gzip'
+        self._upload_id = s3.create_multipart_upload(**create_kwargs)['UploadId']
+
+    def _append(self, data):
+        self._buffer.extend(data)
+        if len(self._buffer) >= MULTIPART_PART_SIZE:
+            self._upload_part()
+
+    def _upload_part(self):
+        part_number = len(self._parts) + 1
+        response = s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=bytes(self._buffer)
+        )
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self._buffer = bytearray()
+
+    def write(self, data):
+        # Compression is timed as CSV.Build; part uploads are timed as S3 calls
+        if self._compressor:
+            with common.span('CSV.Build'):
+                data = self._compressor.compress(data)
+        self._append(data)
+
+    def close(self):
+        if self._compressor:
+            self._buffer.extend(self._compressor.flush())
+        if self._buffer or not self._parts:
+            self._upload_part()
+        s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={'Parts': self._parts}
+        )
+
+    def abort(self):
+        s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
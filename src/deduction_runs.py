@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+# Monthly deduction runs as JobStateTable jobs (see job_state.py), shared by send_deductions_lambda, which
+# runs them, and billing_run_status_lambda, which reports on them.
+#
+# Run item, besides job_state's fields:
+#   billing_month, run_id      the month billed; run_id is set for a fresh run of a month already done
+#   phase                      BILL, ASSEMBLE, NOTIFY, then DONE
+#   shards, shards_total       per occupancy index shard ("007"): cursor (the last share billed, as
+#                              [quarter_id, span_key]), pages written, done
+#   bills                      bills in the deduction file so far, one per occupant-month
+#   new_bills, existing_bills  of those, bills this run wrote, and bills an earlier attempt had written
+#   conflicting_bills          occupant-months left out, the allottee's bill for the month being for
+#                              another quarter
+#   amount_inr, pages          total of the bills, CSV pages written
+#   elapsed_ms                 time spent working, summed over invocations
+#   deduction_file, notified_at  the assembled file's S3 location, and when the DDO was sent it
+
+JOB_TYPE = 'MONTHLY_DEDUCTIONS'
+
+
+def job_key(billing_month, run_id=None):
+    return f"deductions#{billing_month}" + (f"#{run_id}" if run_id else '')
+
+
+def summary(job_key, state):
+    bills = int(state.get('bills', 0))
+    elapsed_ms = int(state.get('elapsed_ms', 0))
+    shards = state.get('shards', {})
+    return {
+        'job_id': job_key,
+        'billing_month': state.get('billing_month'),
+        'run_id': state.get('run_id'),
+        'status': state.get('status'),
+        'phase': state.get('phase'),
+        'shards_done': sum(1 for shard in shards.values() if shard.get('done')),
+        'shards_total': int(state.get('shards_total', 0)),
+        'bills': bills,
+        'new_bills': int(state.get('new_bills', 0)),
+        'existing_bills': int(state.get('existing_bills', 0)),
+        'conflicting_bills': int(state.get('conflicting_bills', 0)),
+        'amount_inr': str(state.get('amount_inr', Decimal('0'))),
+        'pages': int(state.get('pages', 0)),
+        'invocations': int(state.get('invocations', 0)),
+        'elapsed_seconds': round(elapsed_ms / 1000, 1),
+        'bills_per_second': round(bills * 1000 / elapsed_ms, 1) if elapsed_ms else None,
+        'updated_at': state.get('updated_at'),
+        'deduction_file': state.get('deduction_file'),
+        'notified_at': state.get('notified_at'),
+        'error': state.get('error')
+    }
@@ -0,0 +1,249 @@
+import os
+from datetime import datetime
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+import common
+
+# Materialized per-allottee dues ledger, keyed on employee_id so the NOC dues check is a single GetItem.
+#
+# Ledger item:
+#   employee_id, allottee_id, quarter_id
+#   total_billed, total_paid       running totals (SUCCESS payments only, as in the dues engine)
+#   billed_bills                   bills already applied, as '<allottee_id>#<billing_month>' (the bill's key)
+#   billed_months, paid_months     months already billed / paid; paid_months makes payments idempotent
+#   pending_months                 billed months without a SUCCESS payment yet
+#   last_paid_month                latest month with a SUCCESS payment
+#   version                        incremented on every change
+#
+# PFMS reports short deductions as PARTIAL, so a SUCCESS result settles its month. An employee can have
+# more than one bill in a month (two allotments, a corrected occupancy span), so bills are applied per
+# bill and every one of them adds to total_billed. Ledgers written before billed_bills existed only take
+# bills for months not billed yet until the rebuild (dues_ledger_rebuild_lambda) adds it.
+#
+# fetch_bills and fetch_payments read the raw tables a ledger is built from, for the rebuild and for the
+# dues lookup of employees without a ledger.
+
+dynamodb = common.lazy_dynamodb()
+dues_ledger_table = common.lazy_table(os.environ['DUES_LEDGER_TABLE_NAME'])
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+payment_statuses_table = common.lazy_table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+
+LEDGER_PROJECTION = 'employee_id, allottee_id, quarter_id, total_billed, total_paid, ' \
+                    'pending_months, last_paid_month, version'
+
+
+def bill_key(bill):
+    return f"{bill['allottee_id']}#{bill['billing_month']}"
+
+
+def record_bill(bill):
+    # Adds a bill to its employee's ledger once; re-running the billing for the same month is a no-op.
+    try:
+        dues_ledger_table.update_item(
+            Key={'employee_id': bill['employee_id']},
+            UpdateExpression='SET allottee_id = :allottee_id, quarter_id = :quarter_id, updated_at = :now '
+                             'ADD total_billed :amount, billed_bills :bills, billed_months :months, '
+                             'pending_months :months, version :one',
+            ConditionExpression='(attribute_exists(billed_bills) AND NOT contains(billed_bills, :bill)) OR '
+                                '(attribute_not_exists(billed_bills) AND '
+                                '(attribute_not_exists(billed_months) OR NOT contains(billed_months, :month)))',
+            ExpressionAttributeValues={
+                ':allottee_id': bill['allottee_id'],
+                ':quarter_id': bill['quarter_id'],
+                ':now': datetime.now().isoformat() + 'Z',
+                ':amount': Decimal(str(bill['amount_inr'])),
+                ':bills': {bill_key(bill)},
+                ':bill': bill_key(bill),
+                ':months': {bill['billing_month']},
+                ':month': bill['billing_month'],
+                ':one': 1
+            }
+        )
+        return True
+    except ClientError as e:
+        if common.is_conditional_check_failure(e):
+            return False
+        raise
+
+
+def record_payment(employee_id, billing_month, amount_deducted_inr, status):
+    # Applies a SUCCESS payment to the ledger once; other statuses do not change the dues. Only an existing
+    # ledger is updated: one made by a payment alone would have no allottee. The rebuild picks up payments
+    # of employees who have no ledger yet.
+    if status != 'SUCCESS':
+        return False
+
+    values = {
+        ':now': datetime.now().isoformat() + 'Z',
+        ':amount': Decimal(str(amount_deducted_inr)),
+        ':months': {billing_month},
+        ':month': billing_month,
+        ':one': 1
+    }
+    apply_payment = 'ADD total_paid :amount, paid_months :months, version :one DELETE pending_months :months'
+    not_applied = 'attribute_exists(allottee_id) AND ' \
+                  '(attribute_not_exists(paid_months) OR NOT contains(paid_months, :month))'
+
+    # Payments normally arrive in month order, so first try to move last_paid_month forward in the same write
+    try:
+        dues_ledger_table.update_item(
+            Key={'employee_id': employee_id},
+            UpdateExpression=f'SET updated_at = :now, last_paid_month = :month {apply_payment}',
+            ConditionExpression=f'{not_applied} AND (attribute_not_exists(last_paid_month) OR last_paid_month < :month)',
+            ExpressionAttributeValues=values
+        )
+        return True
+    except ClientError as e:
+        if not common.is_conditional_check_failure(e):
+            raise
+
+    # An older month confirmed late (or a replay): apply it without touching last_paid_month
+    try:
+        dues_ledger_table.update_item(
+            Key={'employee_id': employee_id},
+            UpdateExpression=f'SET updated_at = :now {apply_payment}',
+            ConditionExpression=not_applied,
+            ExpressionAttributeValues=values
+        )
+        return True
+    except ClientError as e:
+        if common.is_conditional_check_failure(e):
+            return False
+        raise
+
+
+def get_ledger(employee_id, full=False):
+    # The dues lookup does not need the applied-month sets, so they are projected out unless asked for
+    get_kwargs = {'Key': {'employee_id': employee_id}}
+    if not full:
+        get_kwargs['ProjectionExpression'] = LEDGER_PROJECTION
+    return dues_ledger_table.get_item(**get_kwargs).get('Item')
+
+
+def get_ledgers(employee_ids):
+    # Reads many ledgers with chunked BatchGetItem calls.
+    # Returns {employee_id: ledger} for the employees whose ledger could be read.
+    ledgers = {}
+    table_name = dues_ledger_table.name
+    employee_ids = list(employee_ids)
+
+    for start in range(0, len(employee_ids), common.BATCH_GET_LIMIT):
+        chunk = employee_ids[start:start + common.BATCH_GET_LIMIT]
+        try:
+            found = dynamodb.batch_get_all({table_name: {
+                'Keys': [{'employee_id': employee_id} for employee_id in chunk],
+                'ProjectionExpression': LEDGER_PROJECTION
+            }})
+        except common.Throttled as e:
+            # Leave the chunk out; callers read missing ledgers individually
+            print(f"Dues ledgers of {len(chunk)} employees not read: {e}")
+            continue
+        for ledger in found[table_name]:
+            ledgers[ledger['employee_id']] = ledger
+
+    return ledgers
+
+
+def replace_ledger(item, expected_version):
+    # Overwrites a ledger unless an incremental update changed it since it was read
+    item = dict(item, version=(expected_version or 0) + 1)
+    put_kwargs = {'Item': item}
+    if expected_version is None:
+        put_kwargs['ConditionExpression'] = 'attribute_not_exists(employee_id)'
+    else:
+        put_kwargs['ConditionExpression'] = 'version = :version'
+        put_kwargs['ExpressionAttributeValues'] = {':version': expected_version}
+    try:
+        dues_ledger_table.put_item(**put_kwargs)
+        return True
+    except ClientError as e:
+        if common.is_conditional_check_failure(e):
+            return False
+        raise
+
+
+def query_all(table, **query_kwargs):
+    # Follows LastEvaluatedKey so results larger than one 1 MB page are read completely
+    while True:
+        response = table.query(**query_kwargs)
+        yield from response.get('Items', [])
+
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            break
+        query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+def fetch_bills(allottee_id):
+    # With the key attributes, so that build_ledger can key each bill
+    return query_all(
+        water_bills_table,
+        KeyConditionExpression=Key('allottee_id').eq(allottee_id),
+        ProjectionExpression='allottee_id, billing_month, employee_id, amount_inr'
+    )
+
+
+def fetch_payments(employee_id):
+    return query_all(
+        payment_statuses_table,
+        KeyConditionExpression=Key('employee_id').eq(employee_id),
+        ProjectionExpression='billing_month, amount_deducted_inr, #status',
+        ExpressionAttributeNames={'#status': 'status'}
+    )
+
+
+def build_ledger(employee_id, allottee_id, quarter_id, bills, payments):
+    # Recomputes a ledger item from raw bills and payments using the same rules as the incremental updates
+    billed_bills = set()
+    billed_months = set()
+    paid_months = set()
+    total_billed = Decimal('0')
+    total_paid = Decimal('0')
+
+    for bill in bills:
+        if bill_key(bill) in billed_bills:
+            continue
+        billed_bills.add(bill_key(bill))
+        billed_months.add(bill['billing_month'])
+        total_billed += Decimal(str(bill.get('amount_inr', 0)))
+
+    for payment in payments:
+        if payment.get('status') != 'SUCCESS' or payment['billing_month'] in paid_months:
+            continue
+        paid_months.add(payment['billing_month'])
+        total_paid += Decimal(str(payment.get('amount_deducted_inr', 0)))
+
+    item = {
+        'employee_id': employee_id,
+        'allottee_id': allottee_id,
+        'quarter_id': quarter_id,
+        'total_billed': total_billed,
+        'total_paid': total_paid,
+        'updated_at': datetime.now().isoformat() + 'Z'
+    }
+    # DynamoDB does not allow empty sets, so empty ones are left out
+    pending_months = billed_months - paid_months
+    if billed_bills:
+        item['billed_bills'] = billed_bills
+        item['billed_months'] = billed_months
+    if paid_months:
+        item['paid_months'] = paid_months
+        item['last_paid_month'] = max(paid_months)
+    if pending_months:
+        item['pending_months'] = pending_months
+    return item
+
+
+def ledger_differences(expected, stored):
+    # Returns the ledger fields whose stored value differs from the recomputed one
+    if stored is None:
+        return ['missing']
+    differences = []
+    for field in ('allottee_id', 'total_billed', 'total_paid', 'billed_bills', 'billed_months', 'paid_months',
+                  'pending_months', 'last_paid_month'):
+        if expected.get(field) != stored.get(field):
+            differences.append(field)
+    return differences
@@ -0,0 +1,108 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+import dues_ledger
+import occupancy
+
+REBUILD_WORKERS = int(os.environ.get('LEDGER_REBUILD_WORKERS', '8'))
+MAX_REPORTED_MISMATCHES = 100
+
+
+def collect_employees(employee_ids=None):
+    # Groups the occupancy history by employee. AllotteesTable keeps only a quarter's current (or last)
+    # allotment, so an employee whose quarter was re-occupied or transferred away has bills under
+    # allottee_ids only the history still holds. The ledger points at the allotment that began last.
+    employees = {}
+
+    def add(span):
+        employee = employees.setdefault(span['employee_id'], {'allottee_ids': set(), 'span_key': ''})
+        employee['allottee_ids'].add(span['allottee_id'])
+        if span['span_key'] > employee['span_key']:
+            employee.update(span_key=span['span_key'], allottee_id=span['allottee_id'], quarter_id=span['quarter_id'])
+
+    if employee_ids:
+        with ThreadPoolExecutor(max_workers=REBUILD_WORKERS) as executor:
+            for spans in executor.map(occupancy.employee_spans, sorted(employee_ids)):
+                for span in spans:
+                    add(span)
+    else:
+        for page in occupancy.employee_span_pages():
+            for span in page:
+                add(span)
+    return employees
+
+
+def check_employee(employee_id, employee, rebuild):
+    with common.item_span('DuesLedger.Check'):
+        # An allottee_id kept across a transfer without a new one has the incoming employee's bills too
+        bills = [bill for allottee_id in sorted(employee['allottee_ids'])
+                 for bill in dues_ledger.fetch_bills(allottee_id)
+                 if bill.get('employee_id', employee_id) == employee_id]
+        expected = dues_ledger.build_ledger(
+            employee_id, employee['allottee_id'], employee['quarter_id'], bills, dues_ledger.fetch_payments(employee_id)
+        )
+        stored = dues_ledger.get_ledger(employee_id, full=True)
+        differences = dues_ledger.ledger_differences(expected, stored)
+
+        rebuilt = False
+        if differences and rebuild:
+            rebuilt = dues_ledger.replace_ledger(expected, stored.get('version') if stored else None)
+    return employee_id, differences, rebuilt
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    # Recomputes every dues ledger from WaterBillsTable and PaymentStatusesTable and compares it with
+    # the stored one. {"mode": "verify"} only reports drift; {"mode": "rebuild"} also overwrites
+    # drifted or missing ledgers. "employee_ids" limits the run to the given employees; those without any
+    # allotment in the occupancy history are reported as not_found.
+    print(f"Received event: {json.dumps(event)}")
+
+    mode = event.get('mode', 'verify')
+    if mode not in ('verify', 'rebuild'):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'message': "mode must be 'verify' or 'rebuild'."})
+        }
+
+    try:
+        employee_ids = set(event['employee_ids']) if event.get('employee_ids') else None
+        employees = collect_employees(employee_ids)
+
+        not_found = sorted(employee_ids - set(employees)) if employee_ids else []
+
+        summary = {'mode': mode, 'checked': 0, 'mismatched': 0, 'rebuilt': 0, 'conflicts': 0, 'mismatches': [],
+                   'not_found': not_found[:MAX_REPORTED_MISMATCHES]}
+        with ThreadPoolExecutor(max_workers=REBUILD_WORKERS) as executor:
+            results = executor.map(
+                lambda entry: check_employee(entry[0], entry[1], mode == 'rebuild'),
+                employees.items()
+            )
+            for employee_id, differences, rebuilt in results:
+                summary['checked'] += 1
+                if not differences:
+                    continue
+                summary['mismatched'] += 1
+                if rebuilt:
+                    summary['rebuilt'] += 1
+                elif mode == 'rebuild':
+                    # The ledger changed while it was being recomputed; the next run will pick it up
+                    summary['conflicts'] += 1
+                if len(summary['mismatches']) < MAX_REPORTED_MISMATCHES:
+                    summary['mismatches'].append({'employee_id': employee_id, 'fields': differences})
+
+        print(f"Ledger {mode} finished: {summary['checked']} checked, {summary['mismatched']} mismatched, "
+              f"{summary['rebuilt']} rebuilt, {summary['conflicts']} conflicts, {len(not_found)} not found.")
+        return {
+            'statusCode': 200,
+            'body': json.dumps(summary)
+        }
+
+    except Exception as e:
+        print(f"Error during ledger {mode}: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
+        }
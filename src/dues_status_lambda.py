@@ -1,97 +1,497 @@
+import base64
+import binascii
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 
-import boto3
 from boto3.dynamodb.conditions import Key
 
-dynamodb = boto3.resource('dynamodb')
-allottees_table = dynamodb.Table(os.environ['ALLOTTEES_TABLE_NAME'])
-water_bills_table = dynamodb.Table(os.environ['WATER_BILLS_TABLE_NAME'])
-payment_statuses_table = dynamodb.Table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+import billing_index
+import common
+import dues_ledger
+import occupancy
 
+allottees_table = common.lazy_table(os.environ['ALLOTTEES_TABLE_NAME'])
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+payment_statuses_table = common.lazy_table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+
+# A pending month becomes OVERDUE once it is more than this many months behind the current month.
+# Bills for month M are only deducted from salary in month M+1, so the default allows one extra cycle.
+DUES_OVERDUE_AFTER_MONTHS = int(os.environ.get('DUES_OVERDUE_AFTER_MONTHS', '2'))
+
+# Bulk NOC checks: maximum employee IDs per request and concurrent lookups for employees without a ledger
+DUES_BATCH_MAX_EMPLOYEES = int(os.environ.get('DUES_BATCH_MAX_EMPLOYEES', '500'))
+DUES_BATCH_WORKERS = int(os.environ.get('DUES_BATCH_WORKERS', '16'))
+
+DUES_CACHE_MAX_ENTRIES = int(os.environ.get('DUES_CACHE_MAX_ENTRIES', '1024'))
+DUES_CACHE_TTL_SECONDS = float(os.environ.get('DUES_CACHE_TTL_SECONDS', '300'))
+
+# Arrears and aging (GET /v1/arrears) are read from WaterBillsTable's sparse arrears-index, which holds only
+# the bills no SUCCESS result has settled (src/billing_index.py): "unpaid bills for 2025-04" is
+# billing_month=2025-04 and "dues older than 90 days" older_than_days=90. A bill falls due on the first of
+# the month after its billing month, when it is deducted from salary, and its age counts from then. The
+# index shards are read one after another, each for no more than still fits on the page, and the cursor
+# names the shard and key to go on from: a page costs a query per shard it passes plus one per 1 MB read,
+# however large the table.
+ARREARS_DEFAULT_LIMIT = int(os.environ.get('ARREARS_DEFAULT_LIMIT', '100'))
+ARREARS_MAX_LIMIT = int(os.environ.get('ARREARS_MAX_LIMIT', '1000'))
+# False until the stack's second deployment adds WaterBillsTable's arrears-index (template.yaml)
+ARREARS_INDEX_ENABLED = os.environ.get('ARREARS_INDEX_ENABLED', 'true').lower() == 'true'
+ARREARS_PROJECTION = 'allottee_id, billing_month, employee_id, quarter_id, amount_inr, pfms_status'
+AGING_BUCKETS = (('0-30', 30), ('31-90', 90), ('90+', None)) # (name, up to days past due)
+
+
+class DuesCache:
+    # Bounded LRU with a TTL, kept in module scope so it survives warm invocations. It holds only dues
+    # computed from the raw tables (employees without a ledger): a ledger is one GetItem, the same as
+    # checking a cached entry would cost. Entries carry the version stamp they were computed at; callers
+    # compare it with the current stamp before serving an entry.
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry['stored_at'] > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = {'version': version, 'value': value, 'stored_at': time.monotonic()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def record(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds
+        }
+
+
+dues_cache = DuesCache(DUES_CACHE_MAX_ENTRIES, DUES_CACHE_TTL_SECONDS)
+
+
+def get_allottee_by_employee_id(employee_id):
+    response_allottee = allottees_table.query(
+        IndexName='employee_id-index',
+        KeyConditionExpression=Key('employee_id').eq(employee_id),
+        ProjectionExpression='allottee_id, quarter_id'
+    )
+    if response_allottee['Items']:
+        return response_allottee['Items'][0]
+    # A transfer moves the outgoing employee to previous_* on the quarter's item, out of employee_id-index,
+    # while their dues are still asked for (NOC clearance). Their allotments stay in the occupancy history.
+    return occupancy.latest_employee_span(employee_id)
+
+
+def to_decimal(value):
+    # DynamoDB already returns Decimal; anything else (e.g. synthetic data) goes through str to stay exact
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def months_between(earlier_month, later_month):
+    earlier_year, earlier_mon = (int(part) for part in earlier_month.split('-'))
+    later_year, later_mon = (int(part) for part in later_month.split('-'))
+    return (later_year - earlier_year) * 12 + (later_mon - earlier_mon)
+
+
+def compute_dues(bills, payments, as_of_month):
+    # Single pass over each input: payments are aggregated per billing_month first, then every
+    # bill is compared with its month's total, so the cost is O(bills + payments).
+    paid_by_month = {}
+    total_paid = Decimal('0')
+    last_paid_month = None
+
+    for payment in payments:
+        if payment.get('status') != 'SUCCESS':
+            continue
+        month = payment.get('billing_month')
+        amount = to_decimal(payment.get('amount_deducted_inr', 0))
+        paid_by_month[month] = paid_by_month.get(month, Decimal('0')) + amount
+        total_paid += amount
+        if last_paid_month is None or month > last_paid_month:
+            last_paid_month = month
+
+    total_billed = Decimal('0')
+    pending_months = []
+
+    for bill in bills:
+        bill_month = bill['billing_month']
+        bill_amount = to_decimal(bill.get('amount_inr', 0))
+        total_billed += bill_amount
+        if paid_by_month.get(bill_month, Decimal('0')) < bill_amount:
+            pending_months.append(bill_month)
+
+    return classify_dues(total_billed, total_paid, pending_months, last_paid_month, as_of_month)
+
+
+def classify_dues(total_billed, total_paid, pending_months, last_paid_month, as_of_month):
+    pending_amount = round(total_billed - total_paid, 2)
+
+    if pending_amount <= 0:
+        dues_status = "CLEARED"
+        pending_months = []
+    elif any(months_between(month, as_of_month) > DUES_OVERDUE_AFTER_MONTHS for month in pending_months):
+        dues_status = "OVERDUE"
+    else:
+        dues_status = "PENDING"
+
+    return {
+        'dues_status': dues_status,
+        'total_billed': total_billed,
+        'total_paid': total_paid,
+        'pending_amount': pending_amount,
+        'pending_months': sorted(pending_months),
+        'last_paid_month': last_paid_month
+    }
+
+
+def is_complete_ledger(ledger):
+    # A ledger item without its allotment (left by a payment recorded before any bill) is not a ledger;
+    # the employee is answered from the raw tables instead
+    return bool(ledger) and 'allottee_id' in ledger and 'quarter_id' in ledger
+
+
+def dues_from_ledger(ledger, as_of_month):
+    return classify_dues(
+        to_decimal(ledger.get('total_billed', 0)),
+        to_decimal(ledger.get('total_paid', 0)),
+        ledger.get('pending_months', set()),
+        ledger.get('last_paid_month'),
+        as_of_month
+    )
+
+
+def latest_item(table, key_name, key_value, projection):
+    response = table.query(
+        KeyConditionExpression=Key(key_name).eq(key_value),
+        ScanIndexForward=False,
+        Limit=1,
+        ProjectionExpression=projection
+    )
+    return response['Items'][0] if response['Items'] else {}
+
+
+def raw_version_stamp(allottee_id, employee_id):
+    # Version of an employee without a ledger: the newest bill and the newest payment record.
+    # Corrections to older months are not visible here, which the cache TTL bounds.
+    bill = latest_item(water_bills_table, 'allottee_id', allottee_id, 'billing_month, billed_date')
+    payment = latest_item(payment_statuses_table, 'employee_id', employee_id, 'billing_month, confirmed_at')
+    return '|'.join(str(part) for part in (
+        bill.get('billing_month'), bill.get('billed_date'), payment.get('billing_month'), payment.get('confirmed_at')
+    ))
+
+
+def get_dues(employee_id, as_of_month):
+    # Returns (allottee_id, quarter_id, dues) or None when the employee has no allotment.
+    # The materialized ledger answers with a single GetItem. Employees without a ledger yet (e.g.
+    # before the backfill has run) fall back to reading the raw tables; those results are cached and
+    # served again after a version check of two one-item queries.
+    ledger = dues_ledger.get_ledger(employee_id)
+    if is_complete_ledger(ledger):
+        return ledger['allottee_id'], ledger['quarter_id'], dues_from_ledger(ledger, as_of_month)
+
+    cache_key = (employee_id, as_of_month) # OVERDUE depends on the current month
+    cached = dues_cache.get(cache_key)
+    if cached is not None:
+        if raw_version_stamp(cached['value'][0], employee_id) == cached['version']:
+            dues_cache.record('hits')
+            return cached['value']
+        dues_cache.record('stale')
+    else:
+        dues_cache.record('misses')
+
+    # Get allottee info using GSI on employee_id
+    allottee_info = get_allottee_by_employee_id(employee_id)
+    if not allottee_info:
+        return None
+
+    allottee_id = allottee_info['allottee_id']
+    # Stamp before reading so a write landing during the calculation invalidates the entry
+    version = raw_version_stamp(allottee_id, employee_id)
+    dues = compute_dues(dues_ledger.fetch_bills(allottee_id), dues_ledger.fetch_payments(employee_id), as_of_month)
+    result = (allottee_id, allottee_info['quarter_id'], dues)
+    dues_cache.put(cache_key, version, result)
+    return result
+
+
+def dues_response(employee_id, allottee_id, quarter_id, dues):
+    return {
+        'employee_id': employee_id,
+        'quarter_id': quarter_id,
+        'allottee_id': allottee_id,
+        'dues_status': dues['dues_status'],
+        'total_billed': dues['total_billed'],
+        'total_paid': dues['total_paid'],
+        'pending_amount': dues['pending_amount'],
+        'pending_months': dues['pending_months'],
+        'last_paid_month': dues['last_paid_month']
+    }
+
+
+def timed_get_dues(employee_id, as_of_month):
+    with common.item_span('Dues.Employee'):
+        return get_dues(employee_id, as_of_month)
+
+
+def get_dues_batch(employee_ids, as_of_month):
+    # Ledgers for the whole batch come from chunked BatchGetItem calls; employees without one are
+    # resolved concurrently (GSI query, bills and payments) on a bounded pool. A failure for one
+    # employee is reported in its own result instead of failing the batch.
+    results = {}
+    try:
+        ledgers = dues_ledger.get_ledgers(employee_ids)
+    except Exception as e:
+        # Fall back to per-employee lookups, which isolate any failure to the affected employees
+        print(f"Error reading dues ledgers in bulk: {e}")
+        ledgers = {}
+
+    ledgers = {employee_id: ledger for employee_id, ledger in ledgers.items() if is_complete_ledger(ledger)}
+    for employee_id, ledger in ledgers.items():
+        try:
+            result = (ledger['allottee_id'], ledger['quarter_id'], dues_from_ledger(ledger, as_of_month))
+        except Exception as e:
+            print(f"Error checking dues status for {employee_id}: {e}")
+            results[employee_id] = {'status': 'ERROR', 'error': str(e)}
+            continue
+        results[employee_id] = {'status': 'OK', 'dues': dues_response(employee_id, *result)}
+
+    remaining = [employee_id for employee_id in employee_ids if employee_id not in ledgers]
+    if remaining:
+        with ThreadPoolExecutor(max_workers=min(DUES_BATCH_WORKERS, len(remaining))) as executor:
+            futures = {employee_id: executor.submit(timed_get_dues, employee_id, as_of_month)
+                       for employee_id in remaining}
+            for employee_id, future in futures.items():
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error checking dues status for {employee_id}: {e}")
+                    results[employee_id] = {'status': 'ERROR', 'error': str(e)}
+                    continue
+                if result is None:
+                    results[employee_id] = {'status': 'NOT_FOUND'}
+                else:
+                    results[employee_id] = {'status': 'OK', 'dues': dues_response(employee_id, *result)}
+
+    return [dict({'employee_id': employee_id}, **results[employee_id]) for employee_id in employee_ids]
+
+
+def batch_handler(event):
+    try:
+        body = json.loads(common.request_body(event) or '{}')
+    except ValueError:
+        return common.json_response(400, {'message': 'Request body must be valid JSON.'})
+
+    employee_ids = body.get('employee_ids')
+    if not isinstance(employee_ids, list) or not employee_ids or \
+            not all(isinstance(employee_id, str) and employee_id for employee_id in employee_ids):
+        return common.json_response(400, {'message': 'employee_ids must be a non-empty list of employee IDs.'})
+
+    employee_ids = list(dict.fromkeys(employee_ids)) # De-duplicate, keeping request order
+    if len(employee_ids) > DUES_BATCH_MAX_EMPLOYEES:
+        return common.json_response(400, {'message': f'At most {DUES_BATCH_MAX_EMPLOYEES} employee IDs per request.'})
+
+    results = get_dues_batch(employee_ids, datetime.now().strftime('%Y-%m'))
+    print(json.dumps({'dues_cache': dues_cache.stats()}))
+
+    summary = {'requested': len(employee_ids), 'found': 0, 'not_found': 0, 'failed': 0}
+    for result in results:
+        summary[{'OK': 'found', 'NOT_FOUND': 'not_found', 'ERROR': 'failed'}[result['status']]] += 1
+
+    with common.span('Response.Serialize', items=len(results)):
+        body = common.dumps({'summary': summary, 'results': results})
+    return common.json_response(200, body, event)
+
+
+def due_date(billing_month):
+    year, month = (int(part) for part in billing_month.split('-'))
+    return date(year + month // 12, month % 12 + 1, 1)
+
+
+def latest_month_due_by(day):
+    # The latest billing month due on or before the day: the month before the day's
+    return (day.replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+
+
+def aging_bucket(age_days):
+    for name, up_to in AGING_BUCKETS:
+        if up_to is None or age_days <= up_to:
+            return name
+
+
+def encode_arrears_cursor(shard, key):
+    position = json.dumps({'shard': shard, 'key': key}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_arrears_cursor(cursor):
+    # Returns (shard, ExclusiveStartKey or None) for a cursor from a previous page, or raises ValueError
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('cursor is invalid')
+    if not isinstance(position, dict) or set(position) != {'shard', 'key'}:
+        raise ValueError('cursor is invalid')
+    shard, key = position['shard'], position['key']
+    if not isinstance(shard, int) or not 0 <= shard < billing_index.BILLING_INDEX_SHARDS:
+        raise ValueError('cursor is invalid')
+    if key is not None and (not isinstance(key, dict) or not all(isinstance(value, str) for value in key.values())):
+        raise ValueError('cursor is invalid')
+    return shard, key
+
+
+def parse_arrears_parameters(params):
+    # Turns the query string into the arrears query, or raises ValueError with the problem
+    billing_month = params.get('billing_month')
+    if billing_month and params.get('older_than_days'):
+        raise ValueError('billing_month and older_than_days cannot be combined')
+    if billing_month and not common.valid_billing_month(billing_month):
+        raise ValueError('billing_month must be in YYYY-MM format')
+    try:
+        older_than_days = int(params.get('older_than_days') or 0)
+        limit = int(params.get('limit') or ARREARS_DEFAULT_LIMIT)
+    except ValueError:
+        raise ValueError('older_than_days and limit must be integers')
+    if older_than_days < 0:
+        raise ValueError('older_than_days must not be negative')
+    if not 1 <= limit <= ARREARS_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {ARREARS_MAX_LIMIT}")
+    shard, key = decode_arrears_cursor(params['cursor']) if params.get('cursor') else (0, None)
+    return {'billing_month': billing_month, 'older_than_days': older_than_days, 'limit': limit,
+            'shard': shard, 'key': key}
+
+
+def arrears_condition(shard, query, today):
+    condition = Key('arrears_shard').eq(f"{shard:02d}")
+    if query['billing_month']:
+        return condition & Key('billing_month').eq(query['billing_month'])
+    return condition & Key('billing_month').lte(latest_month_due_by(today - timedelta(days=query['older_than_days'])))
+
+
+def query_arrears(query, today):
+    # Returns (the page's unsettled bills, the next page's cursor or None)
+    bills = []
+    shard, start_key = query['shard'], query['key']
+    while shard < billing_index.BILLING_INDEX_SHARDS and len(bills) < query['limit']:
+        query_kwargs = {
+            'IndexName': billing_index.ARREARS_INDEX_NAME,
+            'KeyConditionExpression': arrears_condition(shard, query, today),
+            'ProjectionExpression': ARREARS_PROJECTION,
+            'Limit': query['limit'] - len(bills) # Never read more than still fits on the page
+        }
+        if start_key:
+            query_kwargs['ExclusiveStartKey'] = start_key
+        with common.span('Arrears.Query') as timed:
+            response = water_bills_table.query(**query_kwargs)
+            timed.items = len(response.get('Items', []))
+        bills.extend(response.get('Items', []))
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            shard += 1
+    if shard >= billing_index.BILLING_INDEX_SHARDS:
+        return bills, None
+    return bills, encode_arrears_cursor(shard, start_key)
+
+
+def arrears_entry(bill, today, as_of_month):
+    due = due_date(bill['billing_month'])
+    age_days = max(0, (today - due).days)
+    overdue = months_between(bill['billing_month'], as_of_month) > DUES_OVERDUE_AFTER_MONTHS
+    return {
+        'employee_id': bill.get('employee_id'),
+        'allottee_id': bill['allottee_id'],
+        'quarter_id': bill.get('quarter_id'),
+        'billing_month': bill['billing_month'],
+        'amount_inr': to_decimal(bill.get('amount_inr', 0)),
+        'pfms_status': bill.get('pfms_status'), # None until PFMS reports on the month
+        'due_date': due.isoformat(),
+        'age_days': age_days,
+        'aging_bucket': aging_bucket(age_days),
+        'dues_status': 'OVERDUE' if overdue else 'PENDING'
+    }
+
+
+def arrears_handler(event):
+    if not ARREARS_INDEX_ENABLED:
+        return common.json_response(503, {'message': 'Arrears are not available until the arrears index is built.'})
+    try:
+        query = parse_arrears_parameters(event.get('queryStringParameters') or {})
+    except ValueError as e:
+        return common.json_response(400, {'message': str(e)})
+
+    today = datetime.now().date()
+    bills, next_cursor = query_arrears(query, today)
+    arrears = [arrears_entry(bill, today, today.strftime('%Y-%m')) for bill in bills]
+
+    # Totals of this page by aging bucket
+    aging = {name: {'bills': 0, 'amount_inr': Decimal('0')} for name, _ in AGING_BUCKETS}
+    for entry in arrears:
+        aging[entry['aging_bucket']]['bills'] += 1
+        aging[entry['aging_bucket']]['amount_inr'] += entry['amount_inr']
+
+    with common.span('Response.Serialize', items=len(arrears)):
+        body = common.dumps({'as_of': today.isoformat(), 'count': len(arrears), 'aging': aging,
+                             'arrears': arrears, 'next_cursor': next_cursor})
+    return common.json_response(200, body, event)
+
+
+@common.instrumented
 def lambda_handler(event, context):
     try:
+        if event.get('httpMethod') == 'POST' and event.get('path', '').endswith('/water-dues-status/batch'):
+            return batch_handler(event)
+        if event.get('httpMethod') == 'GET' and event.get('path', '').endswith('/arrears'):
+            return arrears_handler(event)
+
         employee_id = event['pathParameters'].get('employee_id')
 
         if not employee_id:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'message': 'Employee ID is required.'})
-            }
-
-        # 1. Get allottee info using GSI on employee_id
-        response_allottee = allottees_table.query(
-            IndexName='employee_id-index',
-            KeyConditionExpression=Key('employee_id').eq(employee_id)
-        )
-        allottee_info = response_allottee['Items'][0] if response_allottee['Items'] else None
-
-        if not allottee_info:
-            return {
-                'statusCode': 404,
-                'body': json.dumps({'message': 'Allottee not found.'})
-            }
-
-        allottee_id = allottee_info['allottee_id']
-        quarter_id = allottee_info['quarter_id']
-
-        # 2. Query WaterBillsTable for all bills for this allottee
-        bills_response = water_bills_table.query(
-            KeyConditionExpression=Key('allottee_id').eq(allottee_id)
-        )
-        bills = bills_response.get('Items', [])
-
-        # 3. Query PaymentStatusesTable for all confirmed payments for this allottee
-        payments_response = payment_statuses_table.query(
-            KeyConditionExpression=Key('employee_id').eq(employee_id)
-        )
-        payments = payments_response.get('Items', [])
-
-        # 4. Calculate actual dues
-        total_billed = sum(b.get('amount_inr', 0) for b in bills)
-        total_paid = sum(p.get('amount_deducted_inr', 0) for p in payments if p.get('status') == 'SUCCESS')
-
-        pending_amount = round(total_billed - total_paid, 2)
-
-        dues_status = "CLEARED" if pending_amount <= 0 else "PENDING"
-        pending_months = []
-        last_paid_month = None
-
-        if payments:
-            successful_payments = [p for p in payments if p.get('status') == 'SUCCESS']
-            if successful_payments:
-                last_paid_month = max(p.get('billing_month') for p in successful_payments)
-
-        if pending_amount > 0:
-            # Find pending months by comparing bills and payments
-            for bill in bills:
-                bill_month = bill['billing_month']
-                bill_amount = bill['amount_inr']
-                paid_for_month = sum(p.get('amount_deducted_inr', 0) for p in payments
-                                   if p.get('billing_month') == bill_month and p.get('status') == 'SUCCESS')
-                if paid_for_month < bill_amount:
-                    pending_months.append(bill_month)
-
-        response = {
-            'employee_id': employee_id,
-            'quarter_id': quarter_id,
-            'allottee_id': allottee_id,
-            'dues_status': dues_status,
-            'total_billed': total_billed,
-            'total_paid': total_paid,
-            'pending_amount': pending_amount,
-            'pending_months': sorted(pending_months) if pending_months else [],
-            'last_paid_month': last_paid_month
-        }
+            return common.json_response(400, {'message': 'Employee ID is required.'})
 
-        return {
-            'statusCode': 200,
-            'body': json.dumps(response)
-        }
+        result = get_dues(employee_id, datetime.now().strftime('%Y-%m'))
+        print(json.dumps({'dues_cache': dues_cache.stats()}))
 
+        if not result:
+            return common.json_response(404, {'message': 'Allottee not found.'})
+
+        with common.span('Response.Serialize'):
+            body = common.dumps(dues_response(employee_id, *result))
+        return common.json_response(200, body, event)
+
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
     except Exception as e:
         print(f"Error checking dues status: {e}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
-        }
\ No newline at end of file
+        return common.json_response(500, {'message': 'Internal Server Error', 'error': str(e)})
\ No newline at end of file
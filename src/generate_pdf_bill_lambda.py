@@ -1,16 +1,45 @@
 import os
+import hashlib
 import json
-import boto3
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 from fpdf import FPDF # fpdf2 library
+from fpdf.util import escape_parens
+import common
+from pdf_jobs import JOB_KEY_PREFIX, can_replace, job_backend, new_job
 
-# Initialize DynamoDB and S3 clients
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
+# DynamoDB and S3 clients, created on first use
+s3 = common.lazy_client('s3')
 
-water_bills_table = dynamodb.Table(os.environ['WATER_BILLS_TABLE_NAME'])
-allottees_table = dynamodb.Table(os.environ['ALLOTTEES_TABLE_NAME'])
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+allottees_table = common.lazy_table(os.environ['ALLOTTEES_TABLE_NAME'])
 pdf_bills_bucket_name = os.environ['PDF_BILLS_BUCKET_NAME']
 
+# A rendered bill is stored with a hash of everything printed on it in its S3 metadata. When the stored
+# hash still matches, the PDF is served from S3 without rendering or uploading again.
+# Bump PDF_LAYOUT_VERSION whenever the layout below changes, so cached PDFs are re-rendered.
+PDF_LAYOUT_VERSION = '2'
+CONTENT_HASH_METADATA_KEY = 'content-hash'
+# ?delivery=inline returns the PDF bytes, url a presigned S3 URL as JSON, redirect a 302 to that URL
+PDF_DELIVERY_MODES = ('inline', 'url', 'redirect')
+PDF_DEFAULT_DELIVERY = os.environ.get('PDF_DEFAULT_DELIVERY', 'inline')
+PDF_URL_EXPIRY_SECONDS = int(os.environ.get('PDF_URL_EXPIRY_SECONDS', '300'))
+# Seconds a client is asked to wait between polls of a queued or running PDF job
+PDF_JOB_POLL_SECONDS = int(os.environ.get('PDF_JOB_POLL_SECONDS', '2'))
+# ?months=N returns a statement of the N months ending with billing_month instead of a single bill
+STATEMENT_MAX_MONTHS = int(os.environ.get('STATEMENT_MAX_MONTHS', '36'))
+# PDFs are dated by the bill rather than the clock, so the same fields always give the same bytes
+PDF_FALLBACK_CREATION_DATE = datetime(2000, 1, 1, tzinfo=timezone.utc)
+BILL_TEMPLATE_FIELDS = ('billing_month', 'name', 'employee_id', 'quarter_id', 'bill_month', 'amount_inr', 'status',
+                        'billed_date')
+TEMPLATE_PLACEHOLDER_PATTERN = re.compile(rb'@@(\w+)@@')
+
 class PDF(FPDF):
     def header(self):
         self.set_font('Arial', 'B', 15)
@@ -32,95 +61,524 @@ class PDF(FPDF):
         self.multi_cell(0, 5, body)
         self.ln()
 
-def lambda_handler(event, context):
+def bill_fields(bill_item, allottee_details, billing_month):
+    # Everything the PDF shows, as strings; the content hash is taken over exactly these values
+    return {
+        'layout_version': PDF_LAYOUT_VERSION,
+        'billing_month': billing_month,
+        'name': str(allottee_details.get('name', 'N/A')),
+        'employee_id': str(allottee_details.get('employee_id', 'N/A')),
+        'quarter_id': str(bill_item.get('quarter_id', 'N/A')),
+        'bill_month': str(bill_item.get('billing_month', 'N/A')),
+        'amount_inr': str(bill_item.get('amount_inr', '0.00')),
+        'status': str(bill_item.get('status', 'N/A')),
+        'billed_date': str(bill_item.get('billed_date', 'N/A')).split('T')[0] # Extract date part
+    }
+
+
+def pdf_object_key(allottee_id, billing_month):
+    return f"bills/{allottee_id}/{billing_month}.pdf"
+
+
+def pdf_filename(allottee_id, billing_month):
+    return f"{allottee_id}_{billing_month}_bill.pdf"
+
+
+def content_hash(fields):
+    canonical = json.dumps(fields, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def document_date(date_text):
     try:
-        allottee_id = event['pathParameters'].get('allottee_id')
-        billing_month = event['pathParameters'].get('billing_month') # Expected format YYYY-MM
+        return datetime.strptime(date_text, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return PDF_FALLBACK_CREATION_DATE
 
-        if not allottee_id or not billing_month:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'message': 'Allottee ID and Billing Month are required.'})
-            }
 
-        # 1. Fetch bill data from DynamoDB
+def draw_bill(pdf, fields):
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    pdf.chapter_title(f"Bill for {fields['billing_month']}")
+
+    # Allottee Details
+    pdf.set_font('Arial', 'B', 10)
+    pdf.cell(0, 7, 'Allottee Details:', 0, 1)
+    pdf.set_font('Arial', '', 10)
+    pdf.cell(0, 7, f"Name: {fields['name']}", 0, 1)
+    pdf.cell(0, 7, f"Employee ID: {fields['employee_id']}", 0, 1)
+    pdf.cell(0, 7, f"Quarter ID: {fields['quarter_id']}", 0, 1)
+    pdf.ln(5)
+
+    # Bill Details
+    pdf.set_font('Arial', 'B', 10)
+    pdf.cell(0, 7, 'Bill Summary:', 0, 1)
+    pdf.set_font('Arial', '', 10)
+    pdf.cell(0, 7, f"Billing Month: {fields['bill_month']}", 0, 1)
+    pdf.cell(0, 7, f"Billed Amount: INR {fields['amount_inr']}", 0, 1)
+    pdf.cell(0, 7, f"Bill Status: {fields['status']}", 0, 1)
+    pdf.cell(0, 7, f"Billed Date: {fields['billed_date']}", 0, 1)
+    pdf.ln(10)
+
+    pdf.set_font('Arial', 'I', 9)
+    pdf.multi_cell(0, 5, "Note: This is an auto-generated water bill. For any discrepancies, please contact the DDO office.")
+
+
+def render_bill_pdf_direct(fields, compress=True, creation_date=None):
+    # Lays the bill out from scratch with fpdf2
+    pdf = PDF()
+    pdf.set_compression(compress)
+    pdf.set_creation_date(creation_date or document_date(fields['billed_date']))
+    draw_bill(pdf, fields)
+    return bytes(pdf.output(dest='S'))
+
+
+class TemplateTextError(ValueError):
+    pass
+
+
+class TemplateLayoutError(RuntimeError):
+    # fpdf2 wrote the placeholder bill in a layout the template does not know how to cut
+    pass
+
+
+class BillTemplate:
+    # The single-bill layout rendered once with a placeholder in every field and cut into byte segments.
+    # Filling in a bill escapes its fields into the page's content stream, compresses it and writes the
+    # cross-reference table the way fpdf2 would, so the result is byte-for-byte what render_bill_pdf_direct
+    # returns, without laying out the header, footer, fonts and static text again.
+    def __init__(self):
+        placeholders = {name: f"@@{name}@@" for name in BILL_TEMPLATE_FIELDS}
+        raw = render_bill_pdf_direct(placeholders, compress=False, creation_date=PDF_FALLBACK_CREATION_DATE)
+        template_date = PDF_FALLBACK_CREATION_DATE.strftime('D:%Y%m%d%H%M%SZ').encode('ascii')
+
+        body_start = find(raw, b'\n1 0 obj\n') + 1
+        xref_start = find(raw, b'\nxref\n') + 1
+        self.header = raw[:body_start]
+        # Objects in order; the page content stream and the info dictionary are rebuilt for every bill
+        self.objects = []
+        self.content_segments = self.info_parts = None
+        position = body_start
+        for match in re.finditer(rb'(\d+) 0 obj\n(.*?)\nendobj\n', raw[body_start:xref_start], re.S):
+            if match.start() + body_start != position or int(match.group(1)) != len(self.objects) + 1:
+                raise TemplateLayoutError(f"object {match.group(1).decode('ascii')} is out of sequence")
+            position = match.end() + body_start
+            number, body = match.group(1), match.group(2)
+            if b'\nstream\n' in body:
+                stream = body[body.index(b'\nstream\n') + 8:body.rindex(b'\nendstream')]
+                self.content_prefix = b'%s 0 obj\n<<\n/Filter /FlateDecode\n/Length ' % number
+                self.content_segments = TEMPLATE_PLACEHOLDER_PATTERN.split(stream)
+                self.objects.append(None)
+            elif template_date in body:
+                self.info_parts = match.group(0).split(template_date)
+                self.objects.append(b'')
+            else:
+                self.objects.append(match.group(0))
+        if position != xref_start:
+            raise TemplateLayoutError('the objects do not run up to the cross-reference table')
+        if self.content_segments is None or self.info_parts is None or len(self.info_parts) != 2:
+            raise TemplateLayoutError('no page content stream or creation date found')
+        trailer = raw[find(raw, b'\ntrailer\n') + 1:find(raw, b'\nstartxref\n') + 1]
+        self.trailer_parts = re.split(rb'<[0-9A-F]{32}><[0-9A-F]{32}>', trailer)
+        if len(self.trailer_parts) != 2:
+            raise TemplateLayoutError('no file identifier found in the trailer')
+
+    def fill(self, fields, creation_date=None):
+        content = bytearray()
+        for index, segment in enumerate(self.content_segments):
+            if index % 2:
+                try:
+                    value = fields[segment.decode('ascii')].encode('latin-1')
+                except UnicodeEncodeError as e:
+                    raise TemplateTextError(str(e))
+                if any(byte < 0x20 for byte in value):
+                    raise TemplateTextError('control characters are laid out by fpdf2')
+                content += escape_parens(value)
+            else:
+                content += segment
+        stream = zlib.compress(bytes(content), level=-1)
+        date = creation_date or document_date(fields['billed_date'])
+
+        output = bytearray(self.header)
+        offsets = []
+        for obj in self.objects:
+            offsets.append(len(output))
+            if obj is None:
+                output += self.content_prefix + b'%d\n>>\nstream\n' % len(stream) + stream + b'\nendstream\nendobj\n'
+            elif not obj:
+                date_text = date.astimezone(timezone.utc).strftime('D:%Y%m%d%H%M%SZ').encode('ascii')
+                output += date_text.join(self.info_parts)
+            else:
+                output += obj
+
+        file_id = hashlib.md5(output + date.astimezone(timezone.utc).strftime('%Y%m%d%H%M%S').encode('utf8'))
+        file_id = file_id.hexdigest().upper()
+        startxref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(offsets) + 1)
+        for offset in offsets:
+            output += b'%010d 00000 n \n' % offset
+        output += f"<{file_id}><{file_id}>".encode('ascii').join(self.trailer_parts)
+        output += b'startxref\n%d\n%%%%EOF\n' % startxref
+        return bytes(output)
+
+
+def find(raw, marker):
+    position = raw.find(marker)
+    if position < 0:
+        raise TemplateLayoutError(f"{marker.strip().decode('ascii')} not found")
+    return position
+
+
+_bill_template = None
+_bill_template_lock = threading.Lock()
+
+
+def bill_template():
+    # Built on first use and kept for the life of the container. None when fpdf2's output cannot be cut
+    # into a template (e.g. after an fpdf2 upgrade); bills are then laid out by fpdf2 directly.
+    global _bill_template
+    with _bill_template_lock:
+        if _bill_template is None:
+            try:
+                _bill_template = BillTemplate()
+            except TemplateLayoutError as e:
+                print(f"Bill template unavailable, rendering bills directly: {e}")
+                _bill_template = False
+        return _bill_template or None
+
+
+def render_bill_pdf(fields):
+    template = bill_template()
+    if template is None:
+        return render_bill_pdf_direct(fields)
+    try:
+        return template.fill(fields)
+    except TemplateTextError:
+        # Text the template cannot carry verbatim goes through fpdf2, which renders or rejects it as before
+        return render_bill_pdf_direct(fields)
+
+
+def month_offset(billing_month, months):
+    year, month = map(int, billing_month.split('-'))
+    index = year * 12 + month - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def statement_object_key(allottee_id, first_month, last_month):
+    return f"bills/{allottee_id}/statements/{first_month}_{last_month}.pdf"
+
+
+def statement_filename(allottee_id, first_month, last_month):
+    return f"{allottee_id}_{first_month}_{last_month}_statement.pdf"
+
+
+def fetch_statement_bills(allottee_id, first_month, last_month):
+    # All of the allottee's bills in the range, oldest first, from one paginated Query
+    bills = []
+    query_kwargs = {
+        'KeyConditionExpression': Key('allottee_id').eq(allottee_id) & Key('billing_month').between(first_month,
+                                                                                                   last_month)
+    }
+    while True:
+        response = water_bills_table.query(**query_kwargs)
+        bills.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return bills
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def statement_fields(bills, allottee_details, first_month, last_month):
+    # Everything the statement shows, as strings, like bill_fields for a single bill
+    total = Decimal('0')
+    rows = []
+    for bill in bills:
+        amount = bill.get('amount_inr', '0.00')
+        try:
+            total += Decimal(str(amount))
+        except InvalidOperation:
+            pass
+        rows.append([str(bill.get('billing_month', 'N/A')), str(amount), str(bill.get('status', 'N/A')),
+                     str(bill.get('billed_date', 'N/A')).split('T')[0]])
+    return {
+        'layout_version': PDF_LAYOUT_VERSION,
+        'document': 'statement',
+        'from_month': first_month,
+        'to_month': last_month,
+        'name': str(allottee_details.get('name', 'N/A')),
+        'employee_id': str(allottee_details.get('employee_id', 'N/A')),
+        'quarter_id': str(bills[-1].get('quarter_id', 'N/A')),
+        'bills': rows,
+        'total_inr': str(total)
+    }
+
+
+STATEMENT_COLUMNS = (('Billing Month', 40), ('Billed Amount (INR)', 50), ('Bill Status', 40), ('Billed Date', 50))
+
+
+def statement_table_header(pdf):
+    pdf.set_font('Arial', 'B', 10)
+    for title, width in STATEMENT_COLUMNS:
+        pdf.cell(width, 7, title, 1, 0, 'C')
+    pdf.ln()
+    pdf.set_font('Arial', '', 10)
+
+
+def render_statement_pdf(fields):
+    # One row per month; the table continues over as many pages as it needs, with its header repeated
+    pdf = PDF()
+    pdf.set_creation_date(document_date(max((row[3] for row in fields['bills']), default='N/A')))
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    pdf.chapter_title(f"Statement for {fields['from_month']} to {fields['to_month']}")
+
+    pdf.set_font('Arial', 'B', 10)
+    pdf.cell(0, 7, 'Allottee Details:', 0, 1)
+    pdf.set_font('Arial', '', 10)
+    pdf.cell(0, 7, f"Name: {fields['name']}", 0, 1)
+    pdf.cell(0, 7, f"Employee ID: {fields['employee_id']}", 0, 1)
+    pdf.cell(0, 7, f"Quarter ID: {fields['quarter_id']}", 0, 1)
+    pdf.ln(5)
+
+    statement_table_header(pdf)
+    for row in fields['bills']:
+        if pdf.will_page_break(7):
+            pdf.add_page()
+            statement_table_header(pdf)
+        for value, (_, width) in zip(row, STATEMENT_COLUMNS):
+            pdf.cell(width, 7, value, 1, 0, 'C')
+        pdf.ln()
+
+    pdf.set_font('Arial', 'B', 10)
+    pdf.cell(STATEMENT_COLUMNS[0][1], 7, 'Total', 1, 0, 'C')
+    pdf.cell(STATEMENT_COLUMNS[1][1], 7, fields['total_inr'], 1, 1, 'C')
+    pdf.ln(10)
+
+    pdf.set_font('Arial', 'I', 9)
+    pdf.multi_cell(0, 5, "Note: This is an auto-generated water bill statement. For any discrepancies, "
+                         "please contact the DDO office.")
+
+    return bytes(pdf.output(dest='S'))
+
+
+def find_cached_pdf(s3_key, bill_hash, with_body):
+    # Returns (hit, PDF bytes) for the PDF stored under s3_key. A HEAD is enough when only a link is
+    # handed out; when the bytes are needed a single GET both checks the hash and fetches them.
+    try:
+        if with_body:
+            response = s3.get_object(Bucket=pdf_bills_bucket_name, Key=s3_key)
+        else:
+            response = s3.head_object(Bucket=pdf_bills_bucket_name, Key=s3_key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False, None
+        raise
+
+    hit = response.get('Metadata', {}).get(CONTENT_HASH_METADATA_KEY) == bill_hash
+    pdf_output = None
+    if with_body:
+        pdf_output = response['Body'].read() if hit else None
+        response['Body'].close()
+    return hit, pdf_output
+
+
+def parse_pdf_request(event):
+    # Returns ((allottee_id, billing_month, months), None) or (None, error response)
+    allottee_id = (event.get('pathParameters') or {}).get('allottee_id')
+    billing_month = (event.get('pathParameters') or {}).get('billing_month') # Expected format YYYY-MM
+    query_params = event.get('queryStringParameters') or {}
+
+    if not allottee_id or not billing_month:
+        return None, common.json_response(400, {'message': 'Allottee ID and Billing Month are required.'})
+    try:
+        months = int(query_params.get('months') or 1)
+    except ValueError:
+        months = 0
+    if not 1 <= months <= STATEMENT_MAX_MONTHS or \
+            (months > 1 and not common.valid_billing_month(billing_month)):
+        return None, common.json_response(400, {'message': f"months must be between 1 and {STATEMENT_MAX_MONTHS}, "
+                                                           f"with billing_month in YYYY-MM format."})
+    return (allottee_id, billing_month, months), None
+
+
+def load_document(allottee_id, billing_month, months):
+    # Reads what a bill (months == 1) or statement shows; returns None when there is no bill to show
+    # 1. Fetch bill data from DynamoDB
+    if months == 1:
         bill_response = water_bills_table.get_item(
             Key={
                 'allottee_id': allottee_id,
                 'billing_month': billing_month
             }
         )
-        bill_item = bill_response.get('Item')
+        bills = [bill_response['Item']] if 'Item' in bill_response else []
+    else:
+        first_month = month_offset(billing_month, 1 - months)
+        bills = fetch_statement_bills(allottee_id, first_month, billing_month)
+    if not bills:
+        return None
+
+    # 2. Fetch allottee details (optional, for richer PDF)
+    allottee_response = allottees_table.get_item(
+        Key={
+            'quarter_id': bills[-1]['quarter_id'] # Assuming quarter_id is primary key
+        }
+    )
+    allottee_details = allottee_response.get('Item', {})
+
+    if months == 1:
+        fields = bill_fields(bills[0], allottee_details, billing_month)
+        document = {'s3_key': pdf_object_key(allottee_id, billing_month),
+                    'filename': pdf_filename(allottee_id, billing_month), 'render': render_bill_pdf}
+    else:
+        fields = statement_fields(bills, allottee_details, first_month, billing_month)
+        document = {'s3_key': statement_object_key(allottee_id, first_month, billing_month),
+                    'filename': statement_filename(allottee_id, first_month, billing_month),
+                    'render': render_statement_pdf}
+    document.update(fields=fields, content_hash=content_hash(fields))
+    return document
+
+
+def store_document(document, with_body):
+    # Renders and stores the PDF only when nothing printed on it changed since it was last stored.
+    # Returns the PDF bytes when with_body is set (or when it had to be rendered), else None.
+    hit, pdf_output = find_cached_pdf(document['s3_key'], document['content_hash'], with_body=with_body)
+    if not hit:
+        with common.span('PDF.Render'):
+            pdf_output = document['render'](document['fields'])
+        s3.put_object(Bucket=pdf_bills_bucket_name, Key=document['s3_key'], Body=pdf_output,
+                      ContentType='application/pdf',
+                      ContentDisposition=f'attachment; filename="{document["filename"]}"',
+                      Metadata={CONTENT_HASH_METADATA_KEY: document['content_hash']})
+        print(f"Rendered {document['s3_key']} ({len(pdf_output)} bytes).")
+    return pdf_output
+
 
-        if not bill_item:
+def presigned_url(s3_key):
+    return s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': pdf_bills_bucket_name, 'Key': s3_key},
+        ExpiresIn=PDF_URL_EXPIRY_SECONDS
+    )
+
+
+def get_pdf(event):
+    request, error = parse_pdf_request(event)
+    if error:
+        return error
+    delivery = (event.get('queryStringParameters') or {}).get('delivery') or PDF_DEFAULT_DELIVERY
+    if delivery not in PDF_DELIVERY_MODES:
+        return common.json_response(400, {'message': f"delivery must be one of {', '.join(PDF_DELIVERY_MODES)}."})
+
+    document = load_document(*request)
+    if document is None:
+        return common.json_response(404, {'message': 'Water bill not found for the specified allottee and month.'})
+
+    # 3. Render and store the PDF only when nothing printed on it changed since it was last stored
+    pdf_output = store_document(document, with_body=delivery == 'inline')
+
+    # 4. Hand out a short-lived link to the stored PDF instead of passing the bytes through Lambda
+    if delivery in ('url', 'redirect'):
+        url = presigned_url(document['s3_key'])
+        if delivery == 'redirect':
             return {
-                'statusCode': 404,
-                'headers': {'Content-Type': 'application/json'},
-                'body': json.dumps({'message': 'Water bill not found for the specified allottee and month.'})
+                'statusCode': 302,
+                'headers': {'Location': url, 'Cache-Control': 'no-store'},
+                'body': ''
             }
+        return common.json_response(200, {'url': url, 'expires_in': PDF_URL_EXPIRY_SECONDS,
+                                          'content_hash': document['content_hash']},
+                                    headers={'Cache-Control': 'no-store'})
 
-        # 2. Fetch allottee details (optional, for richer PDF)
-        allottee_response = allottees_table.get_item(
-            Key={
-                'quarter_id': bill_item['quarter_id'] # Assuming quarter_id is primary key
-            }
-        )
-        allottee_details = allottee_response.get('Item', {})
-
-        # 3. Generate PDF
-        pdf = PDF()
-        pdf.add_page()
-        pdf.set_auto_page_break(auto=True, margin=15)
-
-        pdf.chapter_title(f"Bill for {billing_month}")
-
-        # Allottee Details
-        pdf.set_font('Arial', 'B', 10)
-        pdf.cell(0, 7, 'Allottee Details:', 0, 1)
-        pdf.set_font('Arial', '', 10)
-        pdf.cell(0, 7, f"Name: {allottee_details.get('name', 'N/A')}", 0, 1)
-        pdf.cell(0, 7, f"Employee ID: {allottee_details.get('employee_id', 'N/A')}", 0, 1)
-        pdf.cell(0, 7, f"Quarter ID: {bill_item.get('quarter_id', 'N/A')}", 0, 1)
-        pdf.ln(5)
-
-        # Bill Details
-        pdf.set_font('Arial', 'B', 10)
-        pdf.cell(0, 7, 'Bill Summary:', 0, 1)
-        pdf.set_font('Arial', '', 10)
-        pdf.cell(0, 7, f"Billing Month: {bill_item.get('billing_month', 'N/A')}", 0, 1)
-        pdf.cell(0, 7, f"Billed Amount: INR {bill_item.get('amount_inr', '0.00')}", 0, 1)
-        pdf.cell(0, 7, f"Bill Status: {bill_item.get('status', 'N/A')}", 0, 1)
-        pdf.cell(0, 7, f"Billed Date: {bill_item.get('billed_date', 'N/A').split('T')[0]}", 0, 1) # Extract date part
-        pdf.ln(10)
-
-        pdf.set_font('Arial', 'I', 9)
-        pdf.multi_cell(0, 5, "Note: This is an auto-generated water bill. For any discrepancies, please contact the DDO office.")
-
-        # Save PDF to BytesIO object
-        pdf_output = bytes(pdf.output(dest='S'))  # Convert to bytes directly
-
-        # 4. Store PDF in S3
-        s3_key = f"bills/{allottee_id}/{billing_month}.pdf"
-        s3.put_object(Bucket=pdf_bills_bucket_name, Key=s3_key, Body=pdf_output, ContentType='application/pdf')
-
-        # 5. Return PDF content directly (API Gateway binary support)
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/pdf',
-                'Content-Disposition': f'attachment; filename="{allottee_id}_{billing_month}_bill.pdf"'
-            },
-            'body': pdf_output.decode('latin-1'), # Decode back to string for API Gateway, it handles binary
-            'isBase64Encoded': False # fpdf2 output is bytes, but API Gateway expects string for direct binary pass-through
-            # if binaryMediaTypes is configured correctly, it will handle the byte stream.
-            # For Python, often decoding to latin-1 or base64 encoding is needed if direct byte stream fails.
-            # Let's use base64 encoding for robustness.
-        }
+    # 5. Return PDF content directly, base64-encoded for API Gateway to decode (BinaryMediaTypes)
+    with common.span('Response.Serialize'):
+        return common.binary_response(200, pdf_output, 'application/pdf', headers={
+            'Content-Disposition': f'attachment; filename="{document["filename"]}"',
+            'ETag': f'"{document["content_hash"]}"'
+        })
+
+
+def job_view(job):
+    job_id = job['job_id'][len(JOB_KEY_PREFIX):]
+    view = {
+        'job_id': job_id,
+        'status': job['status'],
+        'allottee_id': job['allottee_id'],
+        'billing_month': job['billing_month'],
+        'months': int(job['months']),
+        'content_hash': job['content_hash'],
+        'status_url': f"/v1/pdf-jobs/{job_id}"
+    }
+    if job['status'] == 'COMPLETED':
+        view.update(url=presigned_url(job['s3_key']), expires_in=PDF_URL_EXPIRY_SECONDS)
+    elif job['status'] == 'FAILED':
+        view['error'] = job.get('error')
+    return view
+
+
+def job_response(job, posted=False):
+    # POST answers a job still to render with 202 and its Location to poll; a finished job, or a GET, is 200
+    headers = {'Cache-Control': 'no-store'}
+    status_code = 200
+    if job['status'] in ('QUEUED', 'RUNNING'):
+        headers['Retry-After'] = str(PDF_JOB_POLL_SECONDS)
+        if posted:
+            status_code = 202
+            headers['Location'] = f"/v1/pdf-jobs/{job['job_id'][len(JOB_KEY_PREFIX):]}"
+    return common.json_response(status_code, job_view(job), headers=headers)
+
+
+def create_pdf_job(event):
+    # Queues a render of the bill or statement, or joins the job already rendering the same document
+    request, error = parse_pdf_request(event)
+    if error:
+        return error
+    allottee_id, billing_month, months = request
+
+    document = load_document(allottee_id, billing_month, months)
+    if document is None:
+        return common.json_response(404, {'message': 'Water bill not found for the specified allottee and month.'})
+
+    job_id = hashlib.sha256(f"{allottee_id}#{billing_month}#{months}#{document['content_hash']}".encode('utf-8'))
+    job_id = job_id.hexdigest()[:32]
+    store, queue = job_backend()
+    existing = store.get(JOB_KEY_PREFIX + job_id)
+    if existing and not can_replace(existing, int(time.time())):
+        return job_response(existing, posted=True)
+
+    # A PDF already stored for this content needs no render at all
+    hit, _ = find_cached_pdf(document['s3_key'], document['content_hash'], with_body=False)
+    job, created = store.create(new_job(job_id, allottee_id, billing_month, months, document['content_hash'],
+                                        status='COMPLETED' if hit else 'QUEUED',
+                                        s3_key=document['s3_key'] if hit else None))
+    if created and job['status'] == 'QUEUED':
+        queue.send(job['job_id'])
+        print(f"Queued PDF job {job_id} for {document['s3_key']}.")
+    return job_response(job, posted=True)
+
+
+def get_pdf_job(event):
+    job_id = (event.get('pathParameters') or {}).get('job_id') or ''
+    store, _ = job_backend()
+    job = store.get(JOB_KEY_PREFIX + job_id) if re.fullmatch(r'[0-9a-f]{32}', job_id) else None
+    if not job:
+        return common.json_response(404, {'message': 'PDF job not found.'})
+    return job_response(job)
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    # GET .../pdf renders synchronously; POST .../pdf-jobs and GET /v1/pdf-jobs/{job_id} are the async mode
+    try:
+        if event.get('httpMethod') == 'POST':
+            return create_pdf_job(event)
+        if (event.get('pathParameters') or {}).get('job_id') is not None:
+            return get_pdf_job(event)
+        return get_pdf(event)
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
     except Exception as e:
         print(f"Error generating PDF bill: {e}")
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json'},
-            'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
-        }
\ No newline at end of file
+        return common.json_response(500, {'message': 'Internal Server Error', 'error': str(e)})
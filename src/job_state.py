@@ -0,0 +1,111 @@
+import os
+import time
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+import common
+
+# Claims and checkpoints for long-running jobs in JobStateTable, shared by the functions that hand work
+# over to continuation invocations.
+#
+# Job item:
+#   job_id                  caller-chosen key, e.g. "pfms-ingest#<bucket>/<key>#<etag>"
+#   job_type, status        IN_PROGRESS until the job is closed (COMPLETED, FAILED, ...)
+#   owner, lease_expires_at request id of the invocation working on the job and when its claim lapses
+#   invocations             how many invocations have claimed the job
+#   expires_at              TTL; finished jobs are kept for JOB_STATE_TTL_DAYS, unless closed with keep=True
+#   ...                     the job's own checkpoint fields, written by save_progress
+
+job_state_table = common.lazy_table(os.environ['JOB_STATE_TABLE_NAME'])
+
+JOB_STATE_TTL_DAYS = 30
+
+
+class LostOwnership(Exception):
+    pass
+
+
+def claim_job(job_key, job_type, owner, previous_owner, context):
+    # Takes the job for this invocation. A new request can only claim a job nobody is working on (or whose
+    # owner died and let its lease run out); a continuation takes over from the invocation that started it.
+    # Returns the job state, or None when the job is finished or held by another invocation.
+    now = int(time.time())
+    try:
+        response = job_state_table.update_item(
+            Key={'job_id': job_key},
+            UpdateExpression='SET #owner = :owner, lease_expires_at = :lease, updated_at = :updated_at, '
+                             'job_type = :job_type, expires_at = :expires_at, '
+                             '#status = if_not_exists(#status, :in_progress) ADD invocations :one',
+            ConditionExpression='attribute_not_exists(job_id) OR (#status = :in_progress AND '
+                                '(lease_expires_at < :now OR #owner = :previous_owner))',
+            ExpressionAttributeNames={'#owner': 'owner', '#status': 'status'},
+            ExpressionAttributeValues={
+                ':owner': owner,
+                ':previous_owner': previous_owner or '-',
+                ':lease': now + context.get_remaining_time_in_millis() // 1000 + 60,
+                ':now': now,
+                ':updated_at': datetime.now().isoformat() + 'Z',
+                ':job_type': job_type,
+                ':expires_at': now + JOB_STATE_TTL_DAYS * 86400,
+                ':in_progress': 'IN_PROGRESS',
+                ':one': 1
+            },
+            ReturnValues='ALL_NEW'
+        )
+        return response['Attributes']
+    except ClientError as e:
+        if common.is_conditional_check_failure(e):
+            return None
+        raise
+
+
+def get_job(job_key):
+    return job_state_table.get_item(Key={'job_id': job_key}).get('Item')
+
+
+def save_progress(job_key, owner, progress, status='IN_PROGRESS', keep=False):
+    # Writes the job's checkpoint fields as they are in progress; raises LostOwnership when another
+    # invocation has claimed the job in the meantime. keep=True removes the TTL, for jobs whose record must
+    # outlive JOB_STATE_TTL_DAYS because claim_job would otherwise let the job run again from the start.
+    names = {'#owner': 'owner', '#status': 'status'}
+    values = {':owner': owner, ':status': status, ':updated_at': datetime.now().isoformat() + 'Z'}
+    assignments = ['#status = :status', 'updated_at = :updated_at']
+    for index, (field, value) in enumerate(progress.items()):
+        names[f'#p{index}'] = field
+        values[f':p{index}'] = value
+        assignments.append(f'#p{index} = :p{index}')
+    try:
+        job_state_table.update_item(
+            Key={'job_id': job_key},
+            UpdateExpression='SET ' + ', '.join(assignments) + (' REMOVE expires_at' if keep else ''),
+            ConditionExpression='#owner = :owner',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    except ClientError as e:
+        if common.is_conditional_check_failure(e):
+            raise LostOwnership(job_key)
+        raise
+
+
+def end_claim(job_key, owner, status=None, error=None):
+    # Gives up the lease without touching the checkpoint, optionally closing the job
+    update_expression = 'SET lease_expires_at = :zero, updated_at = :updated_at'
+    names = {'#owner': 'owner'}
+    values = {':owner': owner, ':zero': 0, ':updated_at': datetime.now().isoformat() + 'Z'}
+    if status:
+        update_expression += ', #status = :status, #error = :error'
+        names.update({'#status': 'status', '#error': 'error'})
+        values.update({':status': status, ':error': error})
+    try:
+        job_state_table.update_item(
+            Key={'job_id': job_key},
+            UpdateExpression=update_expression,
+            ConditionExpression='#owner = :owner',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    except ClientError as e:
+        if not common.is_conditional_check_failure(e):
+            raise
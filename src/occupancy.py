@@ -0,0 +1,241 @@
+import bisect
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from boto3.dynamodb.conditions import Attr, Key
+
+import common
+
+# Occupancy history: an OccupancyHistoryTable item (a span) per allotment of a quarter, keyed by the quarter
+# and span_key '<start date>#<allottee_id>', so a quarter's spans sort by the date they began. A span is
+# written when the allotment begins and again, with its end date, when it ends (VACATED, or TRANSFERRED
+# to a new allottee whose span begins that day). Spans are never deleted: earlier occupants stay on
+# record after AllotteesTable's item for the quarter has moved on. As for billing, an allotment holds the
+# quarter from its start date up to, not including, its end date.
+#
+# "Who occupied the quarters in month M" is answered from the end_month-index GSI, without a scan. Its
+# hash key index_shard is one of OCCUPANCY_INDEX_SHARDS, from a hash of the quarter, and its range key
+# end_month is the month the span ended (OPEN_END_MONTH while it lasts). The spans overlapping M are
+# those ending in M or later that began before M was over: per shard, a range query on end_month and a
+# filter on start_date. The shards spread what would otherwise be one hot partition of open spans, and
+# batch jobs read them in parallel. OCCUPANCY_INDEX_SHARDS must not change once spans are written.
+#
+# The employee_id-index GSI (hash key employee_id, range key span_key) gives an employee's allotments in
+# start order, including those AllotteesTable no longer lists (the quarter was re-occupied or transferred
+# away): the dues lookup and the ledger rebuild read it.
+#
+# OccupancyIndex holds spans in memory, by quarter and in start order, for batch jobs: it says who held a
+# quarter on a day and how a month divides between its occupants.
+
+occupancy_table = common.lazy_table(os.environ['OCCUPANCY_HISTORY_TABLE_NAME'])
+
+OCCUPANCY_INDEX_NAME = 'end_month-index'
+EMPLOYEE_INDEX_NAME = 'employee_id-index'
+OCCUPANCY_INDEX_SHARDS = int(os.environ.get('OCCUPANCY_INDEX_SHARDS', '32'))
+OCCUPANCY_QUERY_WORKERS = int(os.environ.get('OCCUPANCY_QUERY_WORKERS', '8'))
+OPEN_END_MONTH = '9999-12'
+# What batch jobs need of a span
+SPAN_PROJECTION = 'quarter_id, span_key, allottee_id, employee_id, start_date, end_date'
+
+
+def index_shard(quarter_id):
+    # crc32 rather than hash(), which differs between processes
+    return f"{zlib.crc32(quarter_id.encode('utf-8')) % OCCUPANCY_INDEX_SHARDS:03d}"
+
+
+def span_item(quarter_id, allottee_id, employee_id, start_date, end_date=None, end_reason=None, last_updated=None):
+    item = {
+        'quarter_id': quarter_id,
+        'span_key': f"{start_date}#{allottee_id}",
+        'allottee_id': allottee_id,
+        'start_date': start_date,
+        'end_month': end_date[:7] if end_date else OPEN_END_MONTH,
+        'index_shard': index_shard(quarter_id)
+    }
+    # Left out rather than stored as NULL, which attribute_exists() would match
+    if employee_id:
+        item['employee_id'] = employee_id
+    if last_updated:
+        item['last_updated'] = last_updated
+    if end_date:
+        item['end_date'] = end_date
+        item['end_reason'] = end_reason
+    return item
+
+
+def spans_from_allottee(item):
+    # The spans an AllotteesTable item records: its current (or last) allotment and, after a transfer,
+    # the outgoing one kept as previous_*. Allotments without a start date cannot be keyed and are left out.
+    spans = []
+    if item.get('previous_allottee_id') and item.get('previous_allotment_start_date'):
+        spans.append(span_item(item['quarter_id'], item['previous_allottee_id'], item.get('previous_employee_id'),
+                               item['previous_allotment_start_date'], item.get('previous_allotment_end_date'),
+                               'TRANSFERRED', item.get('last_updated')))
+    if item.get('allottee_id') and item.get('allotment_start_date'):
+        ended = item.get('status') in ('VACATED', 'TRANSFERRED') and item.get('allotment_end_date')
+        spans.append(span_item(item['quarter_id'], item['allottee_id'], item.get('employee_id'),
+                               item['allotment_start_date'], item['allotment_end_date'] if ended else None,
+                               item['status'] if ended else None, item.get('last_updated')))
+    return spans
+
+
+def write_spans(spans):
+    # A span written twice in one batch (opened, then closed) is sent once, as its last version
+    with occupancy_table.batch_writer(overwrite_by_pkeys=['quarter_id', 'span_key']) as batch:
+        for span in spans:
+            batch.put_item(Item=span)
+
+
+def month_after(billing_month):
+    first_day, days = common.month_bounds(billing_month)
+    return (first_day + timedelta(days=days)).isoformat()
+
+
+def quarter_spans(quarter_id, billing_month=None):
+    # A quarter's spans in start order; with a month, only those that began before it was over
+    key_condition = Key('quarter_id').eq(quarter_id)
+    if billing_month:
+        key_condition &= Key('span_key').lt(month_after(billing_month))
+    query_kwargs = {'KeyConditionExpression': key_condition}
+    spans = []
+    while True:
+        response = occupancy_table.query(**query_kwargs)
+        spans.extend(response.get('Items', []))
+        if not response.get('LastEvaluatedKey'):
+            return spans
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def employee_spans(employee_id):
+    # The employee's spans in start order (keys and allottee_id, which the index projects)
+    query_kwargs = {'IndexName': EMPLOYEE_INDEX_NAME, 'KeyConditionExpression': Key('employee_id').eq(employee_id)}
+    spans = []
+    while True:
+        response = occupancy_table.query(**query_kwargs)
+        spans.extend(response.get('Items', []))
+        if not response.get('LastEvaluatedKey'):
+            return spans
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def latest_employee_span(employee_id):
+    # The allotment the employee began last, current or ended, or None when they never held a quarter
+    response = occupancy_table.query(
+        IndexName=EMPLOYEE_INDEX_NAME,
+        KeyConditionExpression=Key('employee_id').eq(employee_id),
+        ScanIndexForward=False,
+        Limit=1,
+        ProjectionExpression='allottee_id, quarter_id'
+    )
+    return response['Items'][0] if response['Items'] else None
+
+
+def employee_span_pages():
+    # Yields pages of every span that has an employee, from a scan of the table
+    scan_kwargs = {'FilterExpression': Attr('employee_id').exists(),
+                   'ProjectionExpression': 'quarter_id, span_key, allottee_id, employee_id'}
+    while True:
+        response = occupancy_table.scan(**scan_kwargs)
+        yield response.get('Items', [])
+        if not response.get('LastEvaluatedKey'):
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def month_span_pages(billing_month, shard):
+    # Yields pages of the spans in one index shard that overlap the month and have an employee to bill
+    query_kwargs = {
+        'IndexName': OCCUPANCY_INDEX_NAME,
+        'KeyConditionExpression': Key('index_shard').eq(f"{shard:03d}") & Key('end_month').gte(billing_month),
+        'FilterExpression': Attr('start_date').lt(month_after(billing_month)) & Attr('employee_id').exists(),
+        'ProjectionExpression': SPAN_PROJECTION
+    }
+    while True:
+        response = occupancy_table.query(**query_kwargs)
+        yield response.get('Items', [])
+        if not response.get('LastEvaluatedKey'):
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def shard_spans(billing_month, shard):
+    return [span for page in month_span_pages(billing_month, shard) for span in page]
+
+
+def month_spans(billing_month, shards=None):
+    # Every span overlapping the month, from the given index shards (all by default) read in parallel
+    shards = list(range(OCCUPANCY_INDEX_SHARDS) if shards is None else shards)
+    with ThreadPoolExecutor(max_workers=max(1, min(OCCUPANCY_QUERY_WORKERS, len(shards)))) as executor:
+        return [span for spans in executor.map(lambda shard: shard_spans(billing_month, shard), shards)
+                for span in spans]
+
+
+class OccupancyIndex:
+    # Spans by quarter in start order, for lookups by date. Dates are compared as YYYY-MM-DD strings.
+    # Spans of one quarter are not expected to overlap; where they do (CPWD reported a new allotment
+    # without ending the last one), each span is taken to end when the next one begins.
+
+    def __init__(self, billing_month, spans):
+        self.billing_month = billing_month
+        first_day, self.month_days = common.month_bounds(billing_month)
+        self._first_day = first_day.isoformat()
+        self._after_month = month_after(billing_month)
+        self._spans = {}
+        for span in spans:
+            self._spans.setdefault(span['quarter_id'], []).append(span)
+        self._starts = {}
+        for quarter_id, spans in self._spans.items():
+            spans.sort(key=lambda span: span['span_key'])
+            self._starts[quarter_id] = [span['start_date'] for span in spans]
+
+    @classmethod
+    def load(cls, billing_month, shards=None):
+        # Reads the month's spans (from the given index shards) once
+        return cls(billing_month, month_spans(billing_month, shards))
+
+    def __len__(self):
+        return len(self._spans)
+
+    def quarters(self):
+        return self._spans.keys()
+
+    def spans(self, quarter_id):
+        return self._spans.get(quarter_id, [])
+
+    def _end(self, spans, position):
+        # Where a span stops holding the quarter: its end date, or the next span's start if earlier
+        ends = [spans[position].get('end_date')]
+        if position + 1 < len(spans):
+            ends.append(spans[position + 1]['start_date'])
+        ends = [end for end in ends if end]
+        return min(ends) if ends else None
+
+    def occupant(self, quarter_id, day):
+        # The span holding the quarter on a YYYY-MM-DD day, or None
+        spans = self._spans.get(quarter_id)
+        if not spans:
+            return None
+        position = bisect.bisect_right(self._starts[quarter_id], day) - 1
+        if position < 0:
+            return None
+        end = self._end(spans, position)
+        return spans[position] if end is None or day < end else None
+
+    def shares(self, quarter_id):
+        # [(span, start, end, days)]: the part [start, end) of the month each occupant held the quarter,
+        # in order, leaving out spans that held it for none of the month
+        spans = self._spans.get(quarter_id, [])
+        shares = []
+        for position, span in enumerate(spans):
+            start = max(span['start_date'], self._first_day)
+            end = min(self._end(spans, position) or self._after_month, self._after_month)
+            if start < end:
+                shares.append((span, start, end, (date.fromisoformat(end) - date.fromisoformat(start)).days))
+        return shares
+
+    def month_shares(self):
+        # Every quarter's shares of the month, quarter by quarter
+        for quarter_id in self._spans:
+            yield from self.shares(quarter_id)
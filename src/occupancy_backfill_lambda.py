@@ -0,0 +1,55 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import common
+import occupancy
+
+allottees_table = common.lazy_table(os.environ['ALLOTTEES_TABLE_NAME'])
+
+# Writes the occupancy history AllotteesTable still knows about: each quarter's current (or last)
+# allotment and, after a transfer, the outgoing one. Run once when the history table is introduced;
+# allottee_sync keeps it current from then on. Running it again rewrites the same spans.
+BACKFILL_SEGMENTS = int(os.environ.get('OCCUPANCY_BACKFILL_SEGMENTS', '4'))
+
+
+def backfill_segment(segment, total_segments):
+    # Returns (allottees read, spans written) for one scan segment
+    scan_kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+    allottees = spans = 0
+    while True:
+        scan_response = allottees_table.scan(**scan_kwargs)
+        page = scan_response.get('Items', [])
+        page_spans = [span for item in page for span in occupancy.spans_from_allottee(item)]
+        occupancy.write_spans(page_spans)
+        allottees += len(page)
+        spans += len(page_spans)
+
+        last_evaluated_key = scan_response.get('LastEvaluatedKey')
+        if not last_evaluated_key:
+            return allottees, spans
+        scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    # Invoked manually, with an empty event
+    try:
+        segments = max(1, BACKFILL_SEGMENTS)
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            results = list(executor.map(backfill_segment, range(segments), [segments] * segments))
+        summary = {'allottees': sum(allottees for allottees, _ in results), 'spans': sum(spans for _, spans in results)}
+        print(f"Occupancy backfill finished: {summary['spans']} spans from {summary['allottees']} allottee records.")
+        return {
+            'statusCode': 200,
+            'body': json.dumps(summary)
+        }
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
+    except Exception as e:
+        print(f"Error during occupancy backfill: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
+        }
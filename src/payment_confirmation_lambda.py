@@ -1,56 +1,170 @@
 import json
-import boto3
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from decimal import Decimal
 
-dynamodb = boto3.resource('dynamodb')
-payment_statuses_table = dynamodb.Table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+import billing_index
+import common
+import dues_ledger
 
+# A full-month PFMS callback carries tens of thousands of results and PFMS retries the whole payload on
+# any failure, so results are processed in chunks: existing rows are prefetched with BatchGetItem to skip
+# replays, and new rows are written with BatchWriteItem. A result is a replay when PaymentStatusesTable
+# already holds the same job_id for its employee_id and billing_month. The month's bills are settled from
+# the table's stream (bill_settlement_lambda), not here.
+CONFIRMATION_WORKERS = int(os.environ.get('CONFIRMATION_WORKERS', '64'))
+CONFIRMATION_CHUNK_SIZE = int(os.environ.get('CONFIRMATION_CHUNK_SIZE', '2000'))
+# Stop taking new chunks when less than this is left, so the response still reaches PFMS
+CONFIRMATION_TIME_RESERVE_MS = int(os.environ.get('CONFIRMATION_TIME_RESERVE_MS', '4000'))
+MAX_REPORTED_REJECTIONS = 100
+
+PAYMENT_STATUSES = ('SUCCESS', 'FAILED', 'PARTIAL')
+EMPLOYEE_ID_PATTERN = re.compile(r'[A-Z0-9]{6,12}')
+FAILURE_REASON_MAX_LENGTH = 200
+
+dynamodb = common.lazy_dynamodb()
+payment_statuses_table = common.lazy_table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+
+
+def validate_result(result):
+    # Returns why a PFMS result row cannot be stored, or None when it is valid
+    if not isinstance(result, dict):
+        return 'result must be an object'
+    employee_id = result.get('employee_id')
+    if not isinstance(employee_id, str) or not EMPLOYEE_ID_PATTERN.fullmatch(employee_id):
+        return 'employee_id is missing or invalid'
+    amount_deducted_inr = result.get('amount_deducted_inr')
+    if isinstance(amount_deducted_inr, bool) or not isinstance(amount_deducted_inr, (int, Decimal)) \
+            or amount_deducted_inr < 0:
+        return 'amount_deducted_inr must be a non-negative number'
+    if result.get('status') not in PAYMENT_STATUSES:
+        return f"status must be one of {', '.join(PAYMENT_STATUSES)}"
+    failure_reason = result.get('failure_reason')
+    if failure_reason is not None and (not isinstance(failure_reason, str)
+                                       or len(failure_reason) > FAILURE_REASON_MAX_LENGTH):
+        return f"failure_reason must be a string of at most {FAILURE_REASON_MAX_LENGTH} characters"
+    return None
+
+
+def fetch_existing_job_ids(employee_ids, billing_month):
+    # Returns {employee_id: job_id} for the employees that already have a row for the month
+    table_name = payment_statuses_table.name
+    found = dynamodb.batch_get_all({table_name: {
+        'Keys': [{'employee_id': employee_id, 'billing_month': billing_month} for employee_id in employee_ids],
+        'ProjectionExpression': 'employee_id, job_id'
+    }})
+    return {item['employee_id']: item.get('job_id') for item in found[table_name]}
+
+
+def write_payment_rows(items):
+    # Writes up to 25 rows
+    dynamodb.batch_write_all({payment_statuses_table.name: [{'PutRequest': {'Item': item}} for item in items]})
+
+
+def process_chunk(executor, rows, billing_month, job_id):
+    # Stores the rows of one chunk that this job has not stored yet; returns (accepted, duplicate)
+    employee_ids = [row['employee_id'] for row in rows]
+    existing = {}
+    chunks = [employee_ids[start:start + common.BATCH_GET_LIMIT]
+              for start in range(0, len(employee_ids), common.BATCH_GET_LIMIT)]
+    for job_ids in executor.map(lambda chunk: fetch_existing_job_ids(chunk, billing_month), chunks):
+        existing.update(job_ids)
+
+    # A row from an earlier job (e.g. a re-run deduction after a FAILED one) is superseded, not a replay
+    new_rows = [row for row in rows if existing.get(row['employee_id']) != job_id]
+
+    # The ledger is updated before the status row is written: the ledger update is idempotent on its own,
+    # so a run cut off between the two is completed by the retry instead of being skipped as a replay.
+    def record_payment(row):
+        with common.item_span('DuesLedger.RecordPayment'):
+            dues_ledger.record_payment(row['employee_id'], billing_month, row['amount_deducted_inr'], row['status'])
+
+    list(executor.map(record_payment, [row for row in new_rows if row['status'] == 'SUCCESS']))
+
+    confirmed_at = datetime.now().isoformat() + 'Z'
+    items = [{
+        'employee_id': row['employee_id'],
+        'billing_month': billing_month,
+        'job_id': job_id,
+        'amount_deducted_inr': row['amount_deducted_inr'],
+        'status': row['status'],
+        'failure_reason': row.get('failure_reason'),
+        'confirmed_at': confirmed_at,
+        'month_shard': billing_index.month_shard(billing_month, row['employee_id'])
+    } for row in new_rows]
+    list(executor.map(write_payment_rows,
+                      [items[start:start + common.BATCH_WRITE_LIMIT]
+                       for start in range(0, len(items), common.BATCH_WRITE_LIMIT)]))
+
+    return len(new_rows), len(rows) - len(new_rows)
+
+
+@common.instrumented
 def lambda_handler(event, context):
     try:
-        body = json.loads(event['body'])
+        # Amounts are parsed as Decimal: DynamoDB does not accept floats
+        with common.span('Request.Parse'):
+            body = json.loads(common.request_body(event), parse_float=Decimal)
         billing_month = body.get('billing_month')
         job_id = body.get('job_id')
         results = body.get('results', [])
 
-        if not billing_month or not results:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'message': 'Missing billing_month or results in request body.'})
-            }
+        if not billing_month or not job_id or not results:
+            return common.json_response(400, {'message': 'Missing billing_month, job_id or results in request body.'})
+        # The month is part of every row's key and bill lookup, so it is checked before anything is written
+        if not common.valid_billing_month(billing_month):
+            return common.json_response(400, {'message': 'billing_month must be in YYYY-MM format.'})
 
-        for result in results:
-            employee_id = result.get('employee_id')
-            amount_deducted_inr = result.get('amount_deducted_inr')
-            status = result.get('status')
-            failure_reason = result.get('failure_reason')
-
-            if not all([employee_id, amount_deducted_inr is not None, status]):
-                print(f"Skipping malformed result: {result}")
+        counts = {'accepted': 0, 'duplicate': 0, 'rejected': 0}
+        rejections = []
+        rows = []
+        seen = set()
+        for index, result in enumerate(results):
+            reason = validate_result(result)
+            if reason:
+                counts['rejected'] += 1
+                if len(rejections) < MAX_REPORTED_REJECTIONS:
+                    employee_id = result.get('employee_id') if isinstance(result, dict) else None
+                    if not isinstance(employee_id, str):
+                        employee_id = None
+                    rejections.append({'index': index, 'employee_id': employee_id, 'reason': reason})
+                continue
+            if result['employee_id'] in seen:
+                # The same employee twice in one payload: only the first result is stored
+                counts['duplicate'] += 1
                 continue
+            seen.add(result['employee_id'])
+            rows.append(result)
+
+        processed = 0
+        with ThreadPoolExecutor(max_workers=CONFIRMATION_WORKERS) as executor:
+            for start in range(0, len(rows), CONFIRMATION_CHUNK_SIZE):
+                if context.get_remaining_time_in_millis() < CONFIRMATION_TIME_RESERVE_MS:
+                    break
+                accepted, duplicate = process_chunk(executor, rows[start:start + CONFIRMATION_CHUNK_SIZE],
+                                                    billing_month, job_id)
+                counts['accepted'] += accepted
+                counts['duplicate'] += duplicate
+                processed = min(start + CONFIRMATION_CHUNK_SIZE, len(rows))
+
+        print(f"Payment confirmations for job {job_id} ({billing_month}): {counts['accepted']} accepted, "
+              f"{counts['duplicate']} duplicate, {counts['rejected']} rejected, "
+              f"{len(rows) - processed} left unprocessed.")
+
+        response_body = dict(counts, job_id=job_id, billing_month=billing_month, rejections=rejections)
+        if processed < len(rows):
+            # Everything stored so far is skipped as a duplicate when PFMS retries the same payload
+            response_body.update(message='Ran out of time; retry the request to process the remaining results.',
+                                 unprocessed=len(rows) - processed)
+            return common.json_response(503, response_body)
 
-            # Update PaymentStatusesTable
-            payment_statuses_table.put_item(
-                Item={
-                    'employee_id': employee_id,
-                    'billing_month': billing_month,
-                    'job_id': job_id,
-                    'amount_deducted_inr': amount_deducted_inr,
-                    'status': status,
-                    'failure_reason': failure_reason,
-                    'confirmed_at': datetime.now().isoformat() + 'Z'
-                }
-            )
-
-            print(f"Confirmed payment for {employee_id} ({billing_month}): {status}")
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps({'message': 'Payment confirmations processed successfully.'})
-        }
+        response_body['message'] = 'Payment confirmations processed successfully.'
+        return common.json_response(200, response_body)
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
     except Exception as e:
         print(f"Error processing payment confirmation: {e}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
-        }
\ No newline at end of file
+        return common.json_response(500, {'message': 'Internal Server Error', 'error': str(e)})
\ No newline at end of file
@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+import common
+import job_state
+
+# Asynchronous PDF render jobs. POST /v1/bills/{allottee_id}/{billing_month}/pdf-jobs records a job and
+# queues it, pdf_render_worker_lambda renders it, and GET /v1/pdf-jobs/{job_id} reports its status.
+#
+# The job id is derived from the allottee, the months covered and the content hash of the document, so
+# every request for the same document while it is unchanged lands on the same job: only the request that
+# creates the job queues it. Jobs live in JobStateTable next to the other long-running jobs.
+#
+# Job item:
+#   job_id                  "pdf-render#<id>"
+#   job_type, status        PDF_RENDER; QUEUED, RUNNING, COMPLETED or FAILED
+#   allottee_id, billing_month, months, content_hash
+#   s3_key                  where the PDF is stored, once COMPLETED
+#   queued_at               epoch seconds; a job queued longer ago than PDF_JOB_REQUEUE_SECONDS is queued again
+#   owner, lease_expires_at worker rendering the job and when its claim lapses
+#   error                   reason, once FAILED
+#
+# PDF_JOB_BACKEND=memory swaps the SQS queue and the DynamoDB store for in-process stand-ins with the same
+# semantics, so the whole flow runs offline; the queue is then drained by calling drain() on it.
+
+PDF_JOB_BACKEND = os.environ.get('PDF_JOB_BACKEND', 'aws')
+PDF_JOB_REQUEUE_SECONDS = int(os.environ.get('PDF_JOB_REQUEUE_SECONDS', '900'))
+PDF_JOB_TTL_DAYS = 7
+JOB_KEY_PREFIX = 'pdf-render#'
+
+
+def new_job(job_id, allottee_id, billing_month, months, content_hash, status='QUEUED', s3_key=None):
+    now = int(time.time())
+    job = {
+        'job_id': JOB_KEY_PREFIX + job_id,
+        'job_type': 'PDF_RENDER',
+        'status': status,
+        'allottee_id': allottee_id,
+        'billing_month': billing_month,
+        'months': months,
+        'content_hash': content_hash,
+        'queued_at': now,
+        'updated_at': datetime.now().isoformat() + 'Z',
+        'expires_at': now + PDF_JOB_TTL_DAYS * 86400
+    }
+    if s3_key:
+        job['s3_key'] = s3_key
+    return job
+
+
+def can_replace(existing, now):
+    # A failed job, or one that has sat queued or running for too long (its message was lost or its worker
+    # died), is taken over by the next request for the same document
+    if existing['status'] == 'FAILED':
+        return True
+    return existing['status'] != 'COMPLETED' and int(existing['queued_at']) < now - PDF_JOB_REQUEUE_SECONDS
+
+
+class DynamoJobStore:
+    def __init__(self, table):
+        self.table = table
+
+    def create(self, job):
+        # Returns (job, created): the stored job, and whether this call created it
+        try:
+            self.table.put_item(
+                Item=job,
+                ConditionExpression='attribute_not_exists(job_id) OR #status = :failed OR '
+                                    '(#status <> :completed AND queued_at < :stale_before)',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':failed': 'FAILED', ':completed': 'COMPLETED',
+                                           ':stale_before': job['queued_at'] - PDF_JOB_REQUEUE_SECONDS}
+            )
+            return job, True
+        except ClientError as e:
+            if not common.is_conditional_check_failure(e):
+                raise
+        existing = self.get(job['job_id'])
+        return existing or job, False
+
+    def get(self, job_key):
+        return self.table.get_item(Key={'job_id': job_key}, ConsistentRead=True).get('Item')
+
+    def start(self, job_key, owner, lease_seconds):
+        # Moves a queued job (or one whose worker's lease ran out) to RUNNING; returns it, or None when the
+        # job is finished or another worker has it
+        now = int(time.time())
+        try:
+            response = self.table.update_item(
+                Key={'job_id': job_key},
+                UpdateExpression='SET #status = :running, #owner = :owner, lease_expires_at = :lease, '
+                                 'updated_at = :updated_at',
+                ConditionExpression='#status = :queued OR (#status = :running AND lease_expires_at < :now)',
+                ExpressionAttributeNames={'#status': 'status', '#owner': 'owner'},
+                ExpressionAttributeValues={':running': 'RUNNING', ':queued': 'QUEUED', ':owner': owner,
+                                           ':lease': now + lease_seconds, ':now': now,
+                                           ':updated_at': datetime.now().isoformat() + 'Z'},
+                ReturnValues='ALL_NEW'
+            )
+            return response['Attributes']
+        except ClientError as e:
+            if common.is_conditional_check_failure(e):
+                return None
+            raise
+
+    def finish(self, job_key, owner, status, **fields):
+        names = {'#status': 'status', '#owner': 'owner'}
+        values = {':status': status, ':owner': owner, ':updated_at': datetime.now().isoformat() + 'Z'}
+        assignments = ['#status = :status', 'updated_at = :updated_at']
+        for index, (field, value) in enumerate(fields.items()):
+            names[f'#f{index}'] = field
+            values[f':f{index}'] = value
+            assignments.append(f'#f{index} = :f{index}')
+        try:
+            self.table.update_item(
+                Key={'job_id': job_key},
+                UpdateExpression='SET ' + ', '.join(assignments),
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            if not common.is_conditional_check_failure(e):
+                raise
+
+
+class InMemoryJobStore:
+    def __init__(self):
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            existing = self.jobs.get(job['job_id'])
+            if existing is None or can_replace(existing, job['queued_at']):
+                self.jobs[job['job_id']] = dict(job)
+                return dict(job), True
+            return dict(existing), False
+
+    def get(self, job_key):
+        with self._lock:
+            job = self.jobs.get(job_key)
+            return dict(job) if job else None
+
+    def start(self, job_key, owner, lease_seconds):
+        now = int(time.time())
+        with self._lock:
+            job = self.jobs.get(job_key)
+            if not job or not (job['status'] == 'QUEUED' or
+                               (job['status'] == 'RUNNING' and job['lease_expires_at'] < now)):
+                return None
+            job.update(status='RUNNING', owner=owner, lease_expires_at=now + lease_seconds,
+                       updated_at=datetime.now().isoformat() + 'Z')
+            return dict(job)
+
+    def finish(self, job_key, owner, status, **fields):
+        with self._lock:
+            job = self.jobs.get(job_key)
+            if job and job.get('owner') == owner:
+                job.update(fields, status=status, updated_at=datetime.now().isoformat() + 'Z')
+
+
+class SqsJobQueue:
+    def __init__(self, client, queue_url):
+        self.client = client
+        self.queue_url = queue_url
+
+    def send(self, job_key):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps({'job_id': job_key}))
+
+
+class InMemoryJobQueue:
+    def __init__(self):
+        self.messages = deque()
+        self._lock = threading.Lock()
+
+    def send(self, job_key):
+        with self._lock:
+            self.messages.append(json.dumps({'job_id': job_key}))
+
+    def drain(self, handle):
+        # Delivers queued messages to handle(body) until the queue is empty; returns how many were delivered
+        delivered = 0
+        while True:
+            with self._lock:
+                if not self.messages:
+                    return delivered
+                body = self.messages.popleft()
+            handle(body)
+            delivered += 1
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def job_backend():
+    # (store, queue), created on first use and shared by the API handler and the worker in this container
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if PDF_JOB_BACKEND == 'memory':
+                _backend = (InMemoryJobStore(), InMemoryJobQueue())
+            else:
+                _backend = (DynamoJobStore(job_state.job_state_table),
+                            SqsJobQueue(common.client('sqs'), os.environ['PDF_RENDER_QUEUE_URL']))
+        return _backend
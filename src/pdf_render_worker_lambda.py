@@ -0,0 +1,75 @@
+import json
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+import common
+from common.dynamo import THROTTLE_ERROR_CODES, TRANSIENT_ERROR_CODES
+from generate_pdf_bill_lambda import load_document, store_document
+from pdf_jobs import job_backend
+
+# Renders the PDF jobs queued by POST /v1/bills/{allottee_id}/{billing_month}/pdf-jobs. Triggered by SQS;
+# a message that raises is reported back as a batch item failure so that only it is redelivered.
+#
+# SQS delivers at least once, so a job is claimed (QUEUED -> RUNNING) before it is rendered and a
+# duplicate delivery of a claimed or finished job is dropped. A render that fails marks the job FAILED;
+# the next POST for the same document queues it again. A throttled or transient AWS error is not the
+# document's fault: the job goes back to QUEUED and the message fails, so SQS redelivers it.
+
+LEASE_MARGIN_SECONDS = 30
+# DynamoDB's and S3's codes for errors that a later attempt can get past
+RETRYABLE_ERROR_CODES = THROTTLE_ERROR_CODES | TRANSIENT_ERROR_CODES | {'SlowDown', 'InternalError', 'RequestTimeout'}
+
+
+def is_retryable(error):
+    if isinstance(error, (BotoConnectionError, HTTPClientError)):
+        return True
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES
+
+
+def process_message(body, context):
+    job_key = json.loads(body)['job_id']
+    store, _ = job_backend()
+    owner = context.aws_request_id
+    job = store.start(job_key, owner, context.get_remaining_time_in_millis() // 1000 + LEASE_MARGIN_SECONDS)
+    if job is None:
+        print(f"Skipping {job_key}: already rendered or being rendered by another worker.")
+        return
+
+    try:
+        document = load_document(job['allottee_id'], job['billing_month'], int(job['months']))
+        if document is None:
+            store.finish(job_key, owner, 'FAILED', error='Water bill not found for the specified allottee and month.')
+            return
+        store_document(document, with_body=False)
+    except Exception as e:
+        if is_retryable(e):
+            print(f"Retrying {job_key} later: {e}")
+            try:
+                store.finish(job_key, owner, 'QUEUED')
+            except Exception as release_error:
+                # The claim lapses with its lease instead
+                print(f"Could not release {job_key}: {release_error}")
+            raise
+        print(f"Error rendering {job_key}: {e}")
+        store.finish(job_key, owner, 'FAILED', error=str(e))
+        return
+    # The bill may have changed since the job was queued; the job records what was actually stored
+    store.finish(job_key, owner, 'COMPLETED', s3_key=document['s3_key'], content_hash=document['content_hash'])
+
+
+def drain(context):
+    # With PDF_JOB_BACKEND=memory: renders every job queued in this process, as the SQS trigger would
+    _, queue = job_backend()
+    return queue.drain(lambda body: process_message(body, context))
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    failures = []
+    for record in event.get('Records', []):
+        try:
+            process_message(record['body'], context)
+        except Exception as e:
+            print(f"Error processing message {record.get('messageId')}: {e}")
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
@@ -0,0 +1,238 @@
+import csv
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from urllib.parse import unquote_plus
+
+from botocore.exceptions import ClientError
+
+import common
+from job_state import LostOwnership, claim_job, end_claim, save_progress
+from payment_confirmation_lambda import MAX_REPORTED_REJECTIONS, process_chunk, validate_result
+
+# Streams a PFMS result file dropped into S3 (too large for the 10 MB API Gateway body limit) into
+# PaymentStatusesTable, using the same validation, replay detection and batch writes as the JSON callback.
+#
+# Object keys: pfms-results/{billing_month}/{job_id}.csv or .jsonl
+#   CSV files start with a header row naming employee_id, amount_deducted_inr, status and optionally
+#   failure_reason; JSONL files carry one result object per line. Quoted CSV fields must not span lines.
+#
+# Progress is checkpointed in JobStateTable (byte offset into the file plus running counts) after every
+# chunk. When the invocation nears its timeout it re-invokes itself asynchronously, and the continuation
+# resumes from the checkpoint with a ranged GET. Rows between the checkpoint and a crash are written again
+# on resume and are then skipped as replays of the same job.
+
+s3 = common.lazy_client('s3')
+lambda_client = common.lazy_client('lambda')
+
+RESULT_KEY_PATTERN = re.compile(r'(?:.*/)?(\d{4}-(?:0[1-9]|1[0-2]))/([^/]+)\.(csv|jsonl)')
+REQUIRED_COLUMNS = ('employee_id', 'amount_deducted_inr', 'status')
+INGEST_CHUNK_LINES = int(os.environ.get('INGEST_CHUNK_LINES', '2000'))
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', '64'))
+INGEST_READ_CHUNK_BYTES = 1024 * 1024
+# Hand over to a continuation when less than this is left of the invocation
+INGEST_TIME_RESERVE_MS = int(os.environ.get('INGEST_TIME_RESERVE_MS', '30000'))
+
+
+class InvalidResultFile(Exception):
+    pass
+
+
+def state_key(bucket, key, etag):
+    return f"pfms-ingest#{bucket}/{key}#{etag}"
+
+
+def iter_lines(body, offset):
+    # Yields (line, offset just past the line) without holding more than one read chunk in memory
+    pending = b''
+    for chunk in body.iter_chunks(INGEST_READ_CHUNK_BYTES):
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            offset += len(line) + 1
+            yield line, offset
+    if pending:
+        yield pending, offset + len(pending)
+
+
+def parse_csv_line(text, columns):
+    values = next(csv.reader([text]))
+    result = dict(zip(columns, (value.strip() for value in values)))
+    try:
+        amount_deducted_inr = Decimal(result.get('amount_deducted_inr', ''))
+        if amount_deducted_inr.is_finite():
+            result['amount_deducted_inr'] = amount_deducted_inr
+    except InvalidOperation:
+        pass # Left as text, so validate_result rejects it
+    if not result.get('failure_reason'):
+        result['failure_reason'] = None
+    return result
+
+
+def parse_line(line, file_format, columns):
+    # Returns (result, None) or (None, reason)
+    try:
+        text = line.decode('utf-8').strip()
+    except UnicodeDecodeError:
+        return None, 'line is not valid UTF-8'
+    if file_format == 'jsonl':
+        try:
+            return json.loads(text, parse_float=Decimal), None
+        except ValueError:
+            return None, 'line is not valid JSON'
+    return parse_csv_line(text, columns), None
+
+
+def ingest_file(bucket, key, etag, owner, previous_owner, context):
+    # Returns 'COMPLETED', 'SUSPENDED' (handed to a continuation), 'FAILED' or 'SKIPPED'
+    match = RESULT_KEY_PATTERN.fullmatch(key)
+    if not match:
+        print(f"Ignoring s3://{bucket}/{key}: expected pfms-results/<billing_month>/<job_id>.csv|.jsonl")
+        return 'SKIPPED'
+    billing_month, job_id, file_format = match.groups()
+
+    job_key = state_key(bucket, key, etag)
+    state = claim_job(job_key, 'PFMS_RESULT_INGEST', owner, previous_owner, context)
+    if state is None:
+        print(f"Skipping s3://{bucket}/{key}: already ingested or being ingested by another invocation.")
+        return 'SKIPPED'
+
+    progress = {
+        'byte_offset': int(state.get('byte_offset', 0)),
+        'lines_read': int(state.get('lines_read', 0)),
+        'accepted': int(state.get('accepted', 0)),
+        'duplicate': int(state.get('duplicate', 0)),
+        'rejected': int(state.get('rejected', 0)),
+        'rejections': state.get('rejections', []),
+        'columns': state.get('columns', [])
+    }
+    print(f"Ingesting s3://{bucket}/{key} (job {job_id}, {billing_month}) from byte {progress['byte_offset']}.")
+
+    try:
+        # IfMatch pins every read to the object version the job was started for
+        size = s3.head_object(Bucket=bucket, Key=key, IfMatch=f'"{etag}"')['ContentLength']
+        if progress['byte_offset'] < size:
+            body = s3.get_object(Bucket=bucket, Key=key, IfMatch=f'"{etag}"',
+                                 Range=f"bytes={progress['byte_offset']}-")['Body']
+            with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+                if not ingest_lines(executor, body, progress, file_format, billing_month, job_id, job_key, owner,
+                                    context):
+                    return 'SUSPENDED'
+    except LostOwnership:
+        print(f"Another invocation took over s3://{bucket}/{key}; stopping.")
+        return 'SKIPPED'
+    except InvalidResultFile as e:
+        end_claim(job_key, owner, status='FAILED', error=str(e))
+        print(f"Cannot ingest s3://{bucket}/{key}: {e}")
+        return 'FAILED'
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('PreconditionFailed', '412'):
+            end_claim(job_key, owner)
+            raise
+        # The file was overwritten; the new object has its own S3 event and job
+        end_claim(job_key, owner, status='SUPERSEDED')
+        print(f"s3://{bucket}/{key} changed since the event was sent; leaving it to the newer event.")
+        return 'SKIPPED'
+    except Exception:
+        # Release the lease so the S3 retry can pick the file up again from the last checkpoint
+        end_claim(job_key, owner)
+        raise
+
+    save_progress(job_key, owner, progress, status='COMPLETED')
+    print(f"Ingested s3://{bucket}/{key}: {progress['lines_read']} lines, {progress['accepted']} accepted, "
+          f"{progress['duplicate']} duplicate, {progress['rejected']} rejected.")
+    return 'COMPLETED'
+
+
+def ingest_lines(executor, body, progress, file_format, billing_month, job_id, job_key, owner, context):
+    # Processes the file from the checkpoint; returns False when it stopped early for a continuation
+    rows, seen = [], set()
+    chunk_lines = 0
+    end_offset = progress['byte_offset']
+    for line, end_offset in iter_lines(body, progress['byte_offset']):
+        progress['lines_read'] += 1
+        chunk_lines += 1
+        if line.strip():
+            if file_format == 'csv' and not progress['columns']:
+                progress['columns'] = [column.strip() for column in next(csv.reader([line.decode('utf-8-sig')]))]
+                missing = [column for column in REQUIRED_COLUMNS if column not in progress['columns']]
+                if missing:
+                    raise InvalidResultFile(f"CSV header is missing columns: {', '.join(missing)}")
+            else:
+                with common.item_span('PFMS.ParseLine'):
+                    result, reason = parse_line(line, file_format, progress['columns'])
+                    reason = reason or validate_result(result)
+                if reason:
+                    progress['rejected'] += 1
+                    if len(progress['rejections']) < MAX_REPORTED_REJECTIONS:
+                        progress['rejections'].append({'line': progress['lines_read'], 'reason': reason})
+                elif result['employee_id'] in seen:
+                    progress['duplicate'] += 1
+                else:
+                    seen.add(result['employee_id'])
+                    rows.append(result)
+
+        if chunk_lines >= INGEST_CHUNK_LINES:
+            store_chunk(executor, rows, progress, end_offset, billing_month, job_id, job_key, owner)
+            rows, seen = [], set()
+            chunk_lines = 0
+            if context.get_remaining_time_in_millis() < INGEST_TIME_RESERVE_MS:
+                return False
+
+    if chunk_lines:
+        store_chunk(executor, rows, progress, end_offset, billing_month, job_id, job_key, owner)
+    return True
+
+
+def store_chunk(executor, rows, progress, end_offset, billing_month, job_id, job_key, owner):
+    # Writes one chunk and moves the checkpoint past it
+    if rows:
+        accepted, duplicate = process_chunk(executor, rows, billing_month, job_id)
+        progress['accepted'] += accepted
+        progress['duplicate'] += duplicate
+    progress['byte_offset'] = end_offset
+    save_progress(job_key, owner, progress)
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    # Invoked by S3 for new result files, and by itself with {"continuation": {...}, "pending": [...]} to
+    # resume a file it could not finish. Errors are raised so that S3's asynchronous retries apply.
+    print(f"Received event: {json.dumps(event)}")
+
+    work = []
+    if event.get('continuation'):
+        work.append(event['continuation'])
+    work.extend(event.get('pending', []))
+    for record in event.get('Records', []):
+        work.append({
+            'bucket': record['s3']['bucket']['name'],
+            'key': unquote_plus(record['s3']['object']['key']),
+            'etag': record['s3']['object'].get('eTag')
+        })
+
+    outcomes = {}
+    for index, item in enumerate(work):
+        bucket, key = item['bucket'], item['key']
+        etag = (item.get('etag') or s3.head_object(Bucket=bucket, Key=key)['ETag']).strip('"')
+        outcome = ingest_file(bucket, key, etag, context.aws_request_id, item.get('owner'), context)
+        outcomes[f"s3://{bucket}/{key}"] = outcome
+
+        if outcome == 'SUSPENDED':
+            lambda_client.invoke(
+                FunctionName=context.invoked_function_arn,
+                InvocationType='Event',
+                Payload=json.dumps({
+                    'continuation': {'bucket': bucket, 'key': key, 'etag': etag, 'owner': context.aws_request_id},
+                    'pending': work[index + 1:]
+                })
+            )
+            print(f"Handed s3://{bucket}/{key} over to a continuation invocation.")
+            break
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(outcomes)
+    }
@@ -0,0 +1,272 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import billing_index
+import common
+import deduction_files
+
+# Month-end reconciliation of WaterBillsTable against PaymentStatusesTable.
+#
+# Event: {"billing_month": "YYYY-MM"}, optional; defaults to the previous month, whose PFMS results have
+# come in by the time ReconciliationSchedule runs it.
+#
+# Both tables are read from their month-index, a query per index shard, all in parallel (billing_index.py),
+# so only the month's rows are read however many months the tables hold. The rows are joined on
+# employee_id: an employee's bills for the month (one per allotment held) are added up and compared with
+# the month's PFMS result.
+# Each employee is classified as
+#   PAID           SUCCESS (or PARTIAL) deducting exactly what was billed
+#   SHORT_PAID     PARTIAL, or SUCCESS deducting less than was billed
+#   FAILED         FAILED
+#   MISSING        billed, with no PFMS result
+#   OVER_DEDUCTED  more deducted than billed, a result without a bill included
+#
+# The join is a grace hash join, so that a month of a million rows fits any Lambda memory size: while the
+# queries run, rows of both tables are written to RECONCILE_PARTITIONS spill files each under /tmp by a hash
+# of employee_id, and each partition pair is then joined in memory on its own. Only one partition (and
+# each query worker's buffer) is held at a time. Every employee not PAID goes into the mismatch report,
+# streamed to S3 as it is produced; the counts and amounts are returned, logged and stored beside it.
+
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+payment_statuses_table = common.lazy_table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+s3 = common.lazy_client('s3')
+reports_bucket_name = os.environ['DEDUCTION_FILES_BUCKET_NAME']
+
+RECONCILE_PARTITIONS = int(os.environ.get('RECONCILE_PARTITIONS', '64'))
+# Rows a query worker buffers before appending them to the spill files
+RECONCILE_SPILL_BUFFER_ROWS = int(os.environ.get('RECONCILE_SPILL_BUFFER_ROWS', '5000'))
+RECONCILE_SPILL_DIR = os.environ.get('RECONCILE_SPILL_DIR', tempfile.gettempdir())
+RECONCILIATION_REPORT_GZIP = os.environ.get('RECONCILIATION_REPORT_GZIP', 'false').lower() == 'true'
+
+CLASSIFICATIONS = ('PAID', 'SHORT_PAID', 'FAILED', 'MISSING', 'OVER_DEDUCTED')
+REPORT_HEADER = ["EMPLOYEE_ID", "ALLOTTEE_IDS", "QUARTER_IDS", "BILLING_MONTH", "BILLED_INR", "DEDUCTED_INR",
+                 "DIFFERENCE_INR", "PFMS_STATUS", "CLASSIFICATION", "FAILURE_REASON", "PFMS_JOB_ID"]
+ZERO = Decimal('0')
+
+
+def partition_of(employee_id):
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(employee_id.encode('utf-8')) % RECONCILE_PARTITIONS
+
+
+class Spill:
+    # One side of the join: tab-separated rows in a file per partition. Query workers append whole buffers
+    # under the partition's lock, so rows from different workers never interleave.
+
+    def __init__(self, directory, name):
+        self._paths = [os.path.join(directory, f"{name}-{partition:03d}")
+                       for partition in range(RECONCILE_PARTITIONS)]
+        self._files = [open(path, 'wb') for path in self._paths]
+        self._locks = [threading.Lock() for _ in self._paths]
+        self._counter_lock = threading.Lock()
+        self.rows = 0
+        self.bytes = 0
+
+    def write(self, buffered):
+        # buffered: {partition: [encoded row, ...]}
+        written = 0
+        for partition, lines in buffered.items():
+            data = b''.join(lines)
+            with self._locks[partition]:
+                self._files[partition].write(data)
+            written += len(data)
+        with self._counter_lock:
+            self.rows += sum(len(lines) for lines in buffered.values())
+            self.bytes += written
+
+    def close(self):
+        for spill_file in self._files:
+            spill_file.close()
+
+    def rows_of(self, partition):
+        with open(self._paths[partition], 'rb') as spill_file:
+            for line in spill_file:
+                yield line.decode('utf-8').rstrip('\n').split('\t')
+
+
+def spill_field(value):
+    # Spill rows are tab-separated lines
+    return '' if value is None else str(value).replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+
+
+def bill_row(bill):
+    return bill['employee_id'], [bill['employee_id'], bill['allottee_id'], bill.get('quarter_id'),
+                                 bill.get('amount_inr', ZERO)]
+
+
+def payment_row(payment):
+    return payment['employee_id'], [payment['employee_id'], payment.get('amount_deducted_inr', ZERO),
+                                    payment.get('status'), payment.get('failure_reason'), payment.get('job_id')]
+
+
+SIDES = {
+    # name: (query arguments, row maker)
+    'bills': ({'ProjectionExpression': 'employee_id, allottee_id, quarter_id, amount_inr'}, bill_row),
+    'payments': ({'ProjectionExpression': 'employee_id, amount_deducted_inr, #status, failure_reason, job_id',
+                  'ExpressionAttributeNames': {'#status': 'status'}}, payment_row)
+}
+
+
+def side_table(side):
+    return water_bills_table if side == 'bills' else payment_statuses_table
+
+
+def query_shard(side, spill, billing_month, shard):
+    # Spills one index shard of a table's rows for the month; returns the rows read
+    query_arguments, row_of = SIDES[side]
+    buffered, pending, rows = {}, 0, 0
+    for items in billing_index.month_pages(side_table(side), billing_month, shard, **query_arguments):
+        with common.span(f"Reconcile.Spill.{side}", items=len(items)):
+            for item in items:
+                if not item.get('employee_id'):
+                    continue
+                employee_id, fields = row_of(item)
+                buffered.setdefault(partition_of(employee_id), []).append(
+                    ('\t'.join(spill_field(field) for field in fields) + '\n').encode('utf-8'))
+            pending += len(items)
+            rows += len(items)
+            if pending >= RECONCILE_SPILL_BUFFER_ROWS:
+                spill.write(buffered)
+                buffered, pending = {}, 0
+    spill.write(buffered)
+    return rows
+
+
+def classify(billed, payment):
+    # billed: the month's bills added up, or None; payment: (amount deducted, status, ...), or None
+    if payment is None:
+        return 'MISSING'
+    deducted, status = payment[0], payment[1]
+    billed = billed or ZERO
+    if deducted > billed:
+        return 'OVER_DEDUCTED'
+    if status == 'FAILED':
+        return 'FAILED'
+    if deducted < billed or status not in ('SUCCESS', 'PARTIAL'):
+        return 'SHORT_PAID'
+    return 'PAID'
+
+
+def join_partition(bills, payments, partition):
+    # Yields (employee_id, classification, bill entry or None, payment or None) for a partition, by employee
+    payment_of = {}
+    for employee_id, amount, status, failure_reason, job_id in payments.rows_of(partition):
+        payment_of[employee_id] = (Decimal(amount), status, failure_reason, job_id)
+    billed = {}
+    for employee_id, allottee_id, quarter_id, amount in bills.rows_of(partition):
+        entry = billed.get(employee_id)
+        if entry is None:
+            entry = billed[employee_id] = [ZERO, [], []]
+        entry[0] += Decimal(amount)
+        entry[1].append(allottee_id)
+        entry[2].append(quarter_id)
+    for employee_id in sorted(billed.keys() | payment_of.keys()):
+        entry, payment = billed.get(employee_id), payment_of.get(employee_id)
+        yield employee_id, classify(entry[0] if entry else None, payment), entry, payment
+
+
+def report_row(billing_month, employee_id, classification, entry, payment):
+    billed = entry[0] if entry else ZERO
+    deducted, status, failure_reason, job_id = payment or (ZERO, '', '', '')
+    return [employee_id, ';'.join(entry[1]) if entry else '', ';'.join(entry[2]) if entry else '', billing_month,
+            str(billed), str(deducted), str(billed - deducted), status, classification, failure_reason, job_id]
+
+
+def reconcile(billing_month, spill_directory):
+    started = time.monotonic()
+    spills = {side: Spill(spill_directory, side) for side in SIDES}
+    try:
+        tasks = [(side, shard) for shard in range(billing_index.BILLING_INDEX_SHARDS) for side in SIDES]
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            list(executor.map(lambda task: query_shard(task[0], spills[task[0]], billing_month, task[1]), tasks))
+    finally:
+        for spill in spills.values():
+            spill.close()
+
+    counts = Counter({classification: 0 for classification in CLASSIFICATIONS})
+    amounts = {'billed_inr': ZERO, 'deducted_inr': ZERO, 'shortfall_inr': ZERO, 'excess_inr': ZERO}
+    report_key = f"reconciliation/{billing_month}/LokSabhaWaterReconciliation_{billing_month}.csv" + \
+        ('.gz' if RECONCILIATION_REPORT_GZIP else '')
+    writer = deduction_files.DeductionFileWriter(reports_bucket_name, report_key, compress=RECONCILIATION_REPORT_GZIP)
+    try:
+        writer.write(deduction_files.csv_bytes([REPORT_HEADER]))
+        for partition in range(RECONCILE_PARTITIONS):
+            with common.span('Reconcile.Join') as timed:
+                mismatches = []
+                for employee_id, classification, entry, payment in join_partition(
+                        spills['bills'], spills['payments'], partition):
+                    counts[classification] += 1
+                    billed, deducted = entry[0] if entry else ZERO, payment[0] if payment else ZERO
+                    amounts['billed_inr'] += billed
+                    amounts['deducted_inr'] += deducted
+                    amounts['shortfall_inr'] += max(billed - deducted, ZERO)
+                    amounts['excess_inr'] += max(deducted - billed, ZERO)
+                    if classification != 'PAID':
+                        mismatches.append(report_row(billing_month, employee_id, classification, entry, payment))
+                timed.items = len(mismatches)
+            if mismatches:
+                writer.write(deduction_files.csv_bytes(mismatches))
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    summary = {
+        'billing_month': billing_month,
+        'bills': spills['bills'].rows,
+        'payments': spills['payments'].rows,
+        'employees': sum(counts.values()),
+        'classifications': dict(counts),
+        'mismatches': sum(counts.values()) - counts['PAID'],
+        **{name: str(amount) for name, amount in amounts.items()},
+        'spilled_bytes': sum(spill.bytes for spill in spills.values()),
+        'elapsed_seconds': round(time.monotonic() - started, 1),
+        'report': report_key
+    }
+    s3.put_object(Bucket=reports_bucket_name, Key=f"reconciliation/{billing_month}/summary.json",
+                  Body=json.dumps(summary).encode('utf-8'), ContentType='application/json')
+    return summary
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    print(f"Received event: {json.dumps(event)}")
+
+    billing_month = event.get('billing_month')
+    if not billing_month:
+        billing_month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    if not common.valid_billing_month(billing_month):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'message': 'billing_month must be in YYYY-MM format.'})
+        }
+
+    spill_directory = tempfile.mkdtemp(prefix='reconcile-', dir=RECONCILE_SPILL_DIR)
+    try:
+        summary = reconcile(billing_month, spill_directory)
+        print(json.dumps({'reconciliation': summary}))
+        return {
+            'statusCode': 200,
+            'body': json.dumps(summary)
+        }
+    except common.Throttled as e:
+        print(f"DynamoDB is throttling requests: {e}")
+        return common.throttled_response(e)
+    except Exception as e:
+        print(f"Error reconciling {billing_month}: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
+        }
+    finally:
+        # A warm container keeps /tmp, so nothing is left behind for the next invocation
+        shutil.rmtree(spill_directory, ignore_errors=True)
@@ -1,13 +1,41 @@
 import json
 import os
-import boto3
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 
-dynamodb = boto3.resource('dynamodb')
+import billing_index
+import common
+import dues_ledger
+import occupancy
+import seed_population
 
-allottees_table = dynamodb.Table(os.environ['ALLOTTEES_TABLE_NAME'])
-water_bills_table = dynamodb.Table(os.environ['WATER_BILLS_TABLE_NAME'])
-payment_statuses_table = dynamodb.Table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+allottees_table = common.lazy_table(os.environ['ALLOTTEES_TABLE_NAME'])
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+payment_statuses_table = common.lazy_table(os.environ['PAYMENT_STATUSES_TABLE_NAME'])
+meter_readings_table = common.lazy_table(os.environ['METER_READINGS_TABLE_NAME'])
+lambda_client = common.lazy_client('lambda')
+
+# Two seeding modes, chosen by the custom resource's properties or the event of a direct invocation:
+#   demo       the 10 allottees and 30 bills below (the default)
+#   synthetic  seed_population's deterministic population of `allottees` quarters and their occupancy
+#              history, with `months` months of meter readings, bills and payments ending with `end_month`
+#              (default: last month), e.g.
+#              {"mode": "synthetic", "allottees": 100000, "months": 3, "seed": 1}
+# A synthetic seed is written in chunks of quarters by parallel workers, each through a batch writer per
+# table (BatchWriteItem, 25 items per call). Items are overwritten with identical ones when the same seed
+# is run again. When the invocation nears its timeout it stops taking chunks and re-invokes itself
+# asynchronously to continue; the last invocation reports, and answers CloudFormation.
+SEED_MODES = ('demo', 'synthetic')
+SEED_DEFAULT_MONTHS = int(os.environ.get('SEED_DEFAULT_MONTHS', '3'))
+SEED_MAX_ALLOTTEES = int(os.environ.get('SEED_MAX_ALLOTTEES', '2000000'))
+SEED_MAX_MONTHS = 120
+SEED_WORKERS = int(os.environ.get('SEED_WORKERS', '32'))
+SEED_CHUNK_QUARTERS = int(os.environ.get('SEED_CHUNK_QUARTERS', '250'))
+# Stop taking chunks when less than this is left of the invocation
+SEED_TIME_RESERVE_MS = int(os.environ.get('SEED_TIME_RESERVE_MS', '30000'))
 
 def seed_allottees():
     allottees_data = [
@@ -23,20 +51,22 @@ def seed_allottees():
         {"allottee_id": "LSQA010", "employee_id": "PFMS10010", "name": "Ravi Kumar", "quarter_id": "LSL-C-110", "allotment_start_date": "2023-10-15", "status": "OCCUPIED"}
     ]
 
+    spans = []
     for data in allottees_data:
         # Using update_item to be idempotent and only create if not exists
-        allottees_table.put_item(
-            Item={
-                'quarter_id': data['quarter_id'],
-                'allottee_id': data['allottee_id'],
-                'employee_id': data['employee_id'],
-                'name': data['name'],
-                'allotment_start_date': data['allotment_start_date'],
-                'allotment_end_date': data.get('allotment_end_date'),
-                'status': data['status'],
-                'last_updated': datetime.now().isoformat() + 'Z'
-            }
-        )
+        item = {
+            'quarter_id': data['quarter_id'],
+            'allottee_id': data['allottee_id'],
+            'employee_id': data['employee_id'],
+            'name': data['name'],
+            'allotment_start_date': data['allotment_start_date'],
+            'allotment_end_date': data.get('allotment_end_date'),
+            'status': data['status'],
+            'last_updated': datetime.now().isoformat() + 'Z'
+        }
+        allottees_table.put_item(Item=item)
+        spans.extend(occupancy.spans_from_allottee(item))
+    occupancy.write_spans(spans)
     print(f"Seeded {len(allottees_data)} allottee records.")
 
 def seed_bills_and_payments():
@@ -54,17 +84,20 @@ def seed_bills_and_payments():
             amount = 500 + (i * 10) + (j * 5) # Varying amounts
 
             # Seed Water Bill
-            water_bills_table.put_item(
-                Item={
-                    'allottee_id': allottee_id,
-                    'billing_month': billing_month,
-                    'quarter_id': quarter_id,
-                    'employee_id': employee_id,
-                    'amount_inr': amount,
-                    'billed_date': bill_date.isoformat() + 'Z',
-                    'status': 'PENDING_DDO_UPLOAD'
-                }
-            )
+            bill = {
+                'allottee_id': allottee_id,
+                'billing_month': billing_month,
+                'quarter_id': quarter_id,
+                'employee_id': employee_id,
+                'amount_inr': amount,
+                'billed_date': bill_date.isoformat() + 'Z',
+                'status': 'PENDING_DDO_UPLOAD'
+            }
+            bill.update(billing_index.bill_index_fields(bill, settled=j > 0))
+            if j > 0:
+                bill['pfms_status'] = 'SUCCESS'
+            water_bills_table.put_item(Item=bill)
+            dues_ledger.record_bill(bill)
 
             # Seed Payment Status (assume all paid except for current month's bill)
             if j > 0: # Assume previous months are paid
@@ -74,34 +107,171 @@ def seed_bills_and_payments():
                         'billing_month': billing_month,
                         'amount_deducted_inr': amount,
                         'status': 'SUCCESS',
-                        'confirmed_at': (bill_date + timedelta(days=5)).isoformat() + 'Z'
+                        'confirmed_at': (bill_date + timedelta(days=5)).isoformat() + 'Z',
+                        'month_shard': billing_index.month_shard(billing_month, employee_id)
                     }
                 )
+                dues_ledger.record_payment(employee_id, billing_month, amount, 'SUCCESS')
     print("Seeded dummy bill and payment records.")
 
+def seed_options(source):
+    # Seeding options from custom resource properties (Mode, Allottees, Months, Seed, EndMonth; CloudFormation
+    # passes them as strings) or a direct invocation's event (mode, allottees, months, seed, end_month).
+    # Raises ValueError when they are invalid.
+    given = {key.replace('_', '').lower(): value for key, value in (source or {}).items()}
+    options = {'mode': str(given.get('mode') or 'demo').lower()}
+    if options['mode'] not in SEED_MODES:
+        raise ValueError(f"mode must be one of {', '.join(SEED_MODES)}")
+    if options['mode'] == 'demo':
+        return options
+
+    try:
+        options['allottees'] = int(given.get('allottees') or 0)
+        options['months'] = int(given.get('months') or SEED_DEFAULT_MONTHS)
+        options['seed'] = int(given.get('seed') or 1)
+    except (TypeError, ValueError):
+        raise ValueError('allottees, months and seed must be integers')
+    if not 1 <= options['allottees'] <= SEED_MAX_ALLOTTEES:
+        raise ValueError(f"allottees must be between 1 and {SEED_MAX_ALLOTTEES}")
+    if not 1 <= options['months'] <= SEED_MAX_MONTHS:
+        raise ValueError(f"months must be between 1 and {SEED_MAX_MONTHS}")
+    # The last complete month by default, which is what the monthly deduction run bills
+    last_month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    options['end_month'] = str(given.get('endmonth') or last_month)
+    if not common.valid_billing_month(options['end_month']):
+        raise ValueError('end_month must be in YYYY-MM format')
+    return options
+
+
+def write_quarters(first, last, window, seed):
+    # Writes the records of quarters first..last; returns the number of items written per table
+    written = Counter()
+    with common.span('Seed.Chunk', items=last - first + 1), \
+            allottees_table.batch_writer() as allottees, occupancy.occupancy_table.batch_writer() as spans, \
+            meter_readings_table.batch_writer() as readings, water_bills_table.batch_writer() as bills, \
+            payment_statuses_table.batch_writer() as payments, dues_ledger.dues_ledger_table.batch_writer() as ledgers:
+        for allottee, quarter_spans, quarter_readings, quarter_bills, quarter_payments, quarter_ledgers in \
+                seed_population.population(first, last, window, seed):
+            allottees.put_item(Item=allottee)
+            for span in quarter_spans:
+                spans.put_item(Item=span)
+            for reading in quarter_readings:
+                readings.put_item(Item=reading)
+            for bill in quarter_bills:
+                bills.put_item(Item=bill)
+            for payment in quarter_payments:
+                payments.put_item(Item=payment)
+            for ledger in quarter_ledgers:
+                ledgers.put_item(Item=ledger)
+            written['allottees'] += 1
+            written['occupancy_history'] += len(quarter_spans)
+            written['meter_readings'] += len(quarter_readings)
+            written['water_bills'] += len(quarter_bills)
+            written['payment_statuses'] += len(quarter_payments)
+            written['dues_ledger'] += len(quarter_ledgers)
+    return written
+
+
+def seed_synthetic(options, context, continuation=None):
+    # Writes the population from the first quarter not written yet; returns (summary, next quarter), the
+    # next quarter being None once every quarter has been written
+    window = seed_population.billing_window(options['end_month'], options['months'])
+    next_quarter = continuation['next_quarter'] if continuation else 1
+    written = Counter(continuation['written'] if continuation else {})
+    start = time.monotonic()
+    print(f"Seeding quarters {next_quarter}-{options['allottees']} with bills for {window[0]} to {window[-1]}...")
+
+    with ThreadPoolExecutor(max_workers=SEED_WORKERS) as executor:
+        running = set()
+        while True:
+            # A chunk per worker, until the time reserve is reached; the chunks still running then must finish
+            # within the reserve
+            while next_quarter <= options['allottees'] and len(running) < SEED_WORKERS and \
+                    context.get_remaining_time_in_millis() > SEED_TIME_RESERVE_MS:
+                last = min(options['allottees'], next_quarter + SEED_CHUNK_QUARTERS - 1)
+                running.add(executor.submit(write_quarters, next_quarter, last, window, options['seed']))
+                next_quarter = last + 1
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                written.update(future.result())
+
+    seconds = (continuation['seconds'] if continuation else 0.0) + time.monotonic() - start
+    records = sum(written.values())
+    summary = {
+        'mode': 'synthetic',
+        'allottees': options['allottees'],
+        'billing_months': [window[0], window[-1]],
+        'seed': options['seed'],
+        'quarters_written': next_quarter - 1,
+        'written': dict(written),
+        'records': records,
+        'seconds': round(seconds, 1),
+        'records_per_second': round(records / seconds) if seconds else 0
+    }
+    return summary, next_quarter if next_quarter <= options['allottees'] else None
+
+
+def continue_seeding(event, context, options, summary, next_quarter):
+    # Hands the rest of the seed to a new invocation, passing on the custom resource request (if any)
+    lambda_client.invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType='Event',
+        Payload=json.dumps(dict(event, continuation={
+            'options': options, 'next_quarter': next_quarter, 'written': summary['written'],
+            'seconds': summary['seconds']
+        }))
+    )
+    print(f"Handed quarters {next_quarter}-{options['allottees']} over to a continuation invocation.")
+
+
+@common.instrumented
 def lambda_handler(event, context):
-    # This Lambda is typically triggered by a Custom Resource in CloudFormation
-    # It should respond to CloudFormation to indicate success/failure
+    # This Lambda is typically triggered by a Custom Resource in CloudFormation, with the seeding options
+    # in its properties; it then responds to CloudFormation to indicate success/failure. It can also be
+    # invoked directly with the options in the event, and then returns the outcome.
+    print(f"Received event: {json.dumps(event)}")
+    custom_resource = 'RequestType' in event
+    continuation = event.get('continuation')
 
     response_data = {}
     try:
-        request_type = event['RequestType']
+        request_type = event.get('RequestType', 'Create')
         if request_type == 'Create' or request_type == 'Update':
-            print("Seeding database...")
-            seed_allottees()
-            seed_bills_and_payments()
-            response_data['Message'] = "Database seeded successfully."
+            options = continuation['options'] if continuation else \
+                seed_options(event.get('ResourceProperties') if custom_resource else event)
+            print(f"Seeding database: {json.dumps(options)}")
+            if options['mode'] == 'demo':
+                seed_allottees()
+                seed_bills_and_payments()
+                response_data['Message'] = "Database seeded successfully."
+            else:
+                summary, next_quarter = seed_synthetic(options, context, continuation)
+                print(json.dumps({'seed': summary}))
+                if next_quarter:
+                    continue_seeding(event, context, options, summary, next_quarter)
+                    return {'statusCode': 202, 'body': json.dumps(dict(summary, next_quarter=next_quarter))}
+                response_data['Message'] = f"Seeded {summary['records']} records for {options['allottees']} " \
+                                           f"allottees in {summary['seconds']} s " \
+                                           f"({summary['records_per_second']} records/s)."
+                response_data['Records'] = summary['records']
+                response_data['RecordsPerSecond'] = summary['records_per_second']
         elif request_type == 'Delete':
             print("Delete event received (no specific cleanup for seed data needed).")
             response_data['Message'] = "Delete event processed."
 
         # Send success signal to CloudFormation
-        send_response(event, context, 'SUCCESS', response_data)
+        if custom_resource:
+            send_response(event, context, 'SUCCESS', response_data)
+        return {'statusCode': 200, 'body': json.dumps(response_data)}
 
     except Exception as e:
         print(f"Error seeding database: {e}")
         response_data['Message'] = f"Failed to seed database: {str(e)}"
-        send_response(event, context, 'FAILED', response_data)
+        if custom_resource:
+            send_response(event, context, 'FAILED', response_data)
+        return {'statusCode': 400 if isinstance(e, ValueError) else 500, 'body': json.dumps(response_data)}
 
 # Helper function to send response to CloudFormation (required for Custom Resources)
 def send_response(event, context, response_status, response_data):
@@ -123,13 +293,11 @@ def send_response(event, context, response_status, response_data):
         'content-length': str(len(response_body))
     }
 
+    # urllib rather than requests: requests is not in the Lambda runtime and costs a cold-start import
+    request = urllib.request.Request(event['ResponseURL'], data=response_body.encode('utf-8'), headers=headers,
+                                     method='PUT')
     try:
-        response = requests.put(event['ResponseURL'], headers=headers, data=response_body)
-        print(f"Status code: {response.status_code}")
+        with urllib.request.urlopen(request, timeout=10) as response:
+            print(f"Status code: {response.status}")
     except Exception as e:
         print(f"send_response failed: {e}")
-
-# This import is needed for the send_response helper function, but 'requests'
-# is not typically included in Lambda's default environment.
-# Make sure 'requests' is in your requirements.txt
-import requests
\ No newline at end of file
@@ -0,0 +1,230 @@
+import random
+from decimal import Decimal
+
+import billing_index
+import dues_ledger
+import occupancy
+import tariff
+
+# A deterministic synthetic population for staging test environments: quarters, their allottees and
+# occupancy history, and months of meter readings, bills, payment results and dues ledgers, in the shapes
+# the handlers write them.
+#
+# Quarter i (LSL-C-0000001 onwards) starts with allottee LSQA{i:07d} / employee PFMS{i:07d}. During the
+# window some allotments begin, some end (VACATED) and some quarters pass to a new allottee LSQT{i:07d} /
+# PFMT{i:07d} (TRANSFERRED, with the outgoing allotment kept as previous_* as allottee_sync stores it).
+# Every quarter's meter is read every month, a few readings are missing or FAULTY, and every occupant is
+# billed by the tariff for each month they held the quarter, so the deduction run charges the same
+# amounts. Bills before the last month have a PFMS result: mostly SUCCESS, some PARTIAL or FAILED, a
+# few none yet; the last month is not deducted yet. Consumption is skewed: each quarter's is log-normal,
+# so most occupied quarters use about MEDIAN_CONSUMPTION_KL a month and a few several times it.
+#
+# Each quarter draws from its own Random(seed, i) and every timestamp is derived from the billing
+# months, so a quarter's records do not depend on which worker generates them or when: the same
+# arguments always produce the same items, and writing them again is a no-op.
+
+MEDIAN_CONSUMPTION_KL = 16
+VACANT_CONSUMPTION_KL = 0.5 # At most, in a month nobody held the quarter
+MISSING_READING_SHARE = 0.01
+FAULTY_READING_SHARE = 0.02
+NEW_ALLOTMENT_SHARE = 0.05 # Allotments that begin during the window
+VACATED_SHARE = 0.04
+TRANSFERRED_SHARE = 0.04
+PAYMENT_OUTCOMES = (('SUCCESS', 0.86), ('PARTIAL', 0.05), ('FAILED', 0.05), (None, 0.04))
+FAILURE_REASONS = ('Insufficient pay', 'Employee on leave without pay', 'Salary not processed')
+
+FIRST_NAMES = ('Priya', 'Rahul', 'Anjali', 'Vikram', 'Sneha', 'Deepak', 'Pooja', 'Sanjay', 'Kavita', 'Ravi',
+               'Meena', 'Arjun', 'Lakshmi', 'Imran', 'Neha', 'Suresh')
+LAST_NAMES = ('Sharma', 'Kumar', 'Singh', 'Yadav', 'Gupta', 'Verma', 'Devi', 'Mishra', 'Nair', 'Reddy', 'Das',
+              'Khan')
+
+
+def quarter_id(i):
+    return f"LSL-C-{i:07d}"
+
+
+def allottee_id(i, incoming=False):
+    return f"LSQ{'T' if incoming else 'A'}{i:07d}"
+
+
+def employee_id(i, incoming=False):
+    return f"PFM{'T' if incoming else 'S'}{i:07d}"
+
+
+def month_offset(billing_month, months):
+    year, month = map(int, billing_month.split('-'))
+    index = year * 12 + month - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def billing_window(end_month, months):
+    # The `months` billing months ending with end_month, oldest first
+    return [month_offset(end_month, offset) for offset in range(1 - months, 1)]
+
+
+def quarter_rng(seed, i):
+    return random.Random(seed * 1000003 + i)
+
+
+def allotments(rng, i, window):
+    # [(allottee_id, employee_id, start_date, end_date or None)] for quarter i, oldest first, and its status
+    if len(window) > 1 and rng.random() < NEW_ALLOTMENT_SHARE:
+        start_index = rng.randrange(1, len(window))
+        start_date = f"{window[start_index]}-{rng.randint(1, 27):02d}"
+    else:
+        start_index = 0
+        start_date = f"{month_offset(window[0], -rng.randint(1, 72))}-{rng.randint(1, 27):02d}"
+
+    outcome = rng.random()
+    if outcome >= VACATED_SHARE + TRANSFERRED_SHARE:
+        return [(allottee_id(i), employee_id(i), start_date, None)], 'OCCUPIED'
+
+    end_index = rng.randrange(start_index, len(window))
+    first_day = int(start_date[-2:]) + 1 if end_index == start_index and start_date[:7] == window[end_index] else 1
+    end_date = f"{window[end_index]}-{rng.randint(first_day, 28):02d}"
+    if outcome < VACATED_SHARE:
+        return [(allottee_id(i), employee_id(i), start_date, end_date)], 'VACATED'
+    return [(allottee_id(i), employee_id(i), start_date, end_date),
+            (allottee_id(i, True), employee_id(i, True), end_date, None)], 'TRANSFERRED'
+
+
+def allottee_item(rng, i, held, status, last_updated):
+    # The AllotteesTable item as allottee_sync leaves it after the quarter's history
+    current_allottee, current_employee, start_date, end_date = held[-1]
+    item = {
+        'quarter_id': quarter_id(i),
+        'allottee_id': current_allottee,
+        'employee_id': current_employee,
+        'name': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        'status': 'VACATED' if status == 'VACATED' else 'OCCUPIED',
+        'effective_date': end_date if status == 'VACATED' else start_date,
+        'allotment_start_date': start_date,
+        'allotment_end_date': end_date,
+        'last_updated': last_updated
+    }
+    if status == 'TRANSFERRED':
+        previous_allottee, previous_employee, previous_start, previous_end = held[0]
+        item.update({
+            'previous_allottee_id': previous_allottee,
+            'previous_employee_id': previous_employee,
+            'previous_allotment_start_date': previous_start,
+            'previous_allotment_end_date': previous_end
+        })
+    return item
+
+
+def payment_item(rng, bill):
+    # The PFMS result for a bill, or None when none has arrived
+    draw = rng.random()
+    for status, share in PAYMENT_OUTCOMES:
+        draw -= share
+        if draw < 0:
+            break
+    if status is None:
+        return None
+    amount = bill['amount_inr']
+    if status == 'PARTIAL':
+        amount = (amount * Decimal(rng.randint(30, 90)) / 100).quantize(Decimal('0.01'))
+    elif status == 'FAILED':
+        amount = Decimal('0.00')
+    next_month = month_offset(bill['billing_month'], 1)
+    return {
+        'employee_id': bill['employee_id'],
+        'billing_month': bill['billing_month'],
+        'job_id': f"SEED-{next_month}",
+        'amount_deducted_inr': amount,
+        'status': status,
+        'failure_reason': rng.choice(FAILURE_REASONS) if status != 'SUCCESS' else None,
+        'confirmed_at': f"{next_month}-{rng.randint(5, 20):02d}T10:00:00Z"
+    }
+
+
+def meter_readings(rng, i, held, window):
+    # {billing_month: MeterReadingsTable item or None (not read)} for quarter i. The meter starts anywhere
+    # on its dial, so a few quarters roll over during the window.
+    # Log-normal consumption with a median of 1, capped so one quarter cannot dominate the totals
+    consumption = min(rng.lognormvariate(0, 0.45), 8.0)
+    rollover_litres = int(tariff.METER_ROLLOVER_KL * 1000)
+    litres = rng.randrange(rollover_litres)
+    readings = {}
+    for billing_month in window:
+        if any(start_date[:7] <= billing_month and not (end_date and end_date[:7] < billing_month)
+               for _, _, start_date, end_date in held):
+            used = int(MEDIAN_CONSUMPTION_KL * 1000 * consumption * rng.uniform(0.85, 1.15))
+        else:
+            used = int(VACANT_CONSUMPTION_KL * 1000 * rng.random())
+        opening, litres = litres, (litres + used) % rollover_litres
+        draw = rng.random()
+        if draw < MISSING_READING_SHARE:
+            readings[billing_month] = None
+            continue
+        readings[billing_month] = {
+            'quarter_id': quarter_id(i),
+            'billing_month': billing_month,
+            'opening_reading_kl': Decimal(opening).scaleb(-3),
+            'closing_reading_kl': Decimal(litres).scaleb(-3),
+            'reading_status': 'FAULTY' if draw < MISSING_READING_SHARE + FAULTY_READING_SHARE else tariff.READING_OK,
+            'read_date': f"{month_offset(billing_month, 1)}-01"
+        }
+    return readings
+
+
+def quarter_records(i, window, seed):
+    # Returns (allottee item, occupancy spans, meter readings, bills, payments, ledgers) for quarter i
+    rng = quarter_rng(seed, i)
+    held, status = allotments(rng, i, window)
+    item = allottee_item(rng, i, held, status, f"{month_offset(window[-1], 1)}-01T00:00:00Z")
+    readings = meter_readings(rng, i, held, window)
+
+    bills, payments, ledgers = [], [], []
+    for held_allottee, held_employee, start_date, end_date in held:
+        own_bills = []
+        for billing_month in window:
+            # Billed for every month the allotment covers, the partial first and last ones included
+            if start_date[:7] > billing_month or (end_date and end_date[:7] < billing_month):
+                continue
+            reading = readings[billing_month]
+            metered = tariff.is_metered(reading)
+            amount, kilolitres, days = tariff.charge(
+                billing_month, reading['opening_reading_kl'] if metered else 0,
+                reading['closing_reading_kl'] if metered else 0, metered, start_date, end_date)
+            if not days: # Handed over on the first of the month
+                continue
+            own_bills.append({
+                'allottee_id': held_allottee,
+                'billing_month': billing_month,
+                'quarter_id': item['quarter_id'],
+                'employee_id': held_employee,
+                'amount_inr': amount,
+                'consumption_kl': kilolitres,
+                'charge_basis': 'METERED' if metered else 'ASSESSED',
+                'occupied_days': days,
+                'billed_date': f"{month_offset(billing_month, 1)}-01T06:00:00Z",
+                'status': 'PENDING_DDO_UPLOAD'
+            })
+        own_payments = [payment for payment in (payment_item(rng, bill) for bill in own_bills
+                                                if bill['billing_month'] != window[-1]) if payment]
+        # Index attributes as the deduction run and the PFMS results leave them (src/billing_index.py)
+        pfms_status = {payment['billing_month']: payment['status'] for payment in own_payments}
+        for bill in own_bills:
+            status = pfms_status.get(bill['billing_month'])
+            bill.update(billing_index.bill_index_fields(bill, settled=status == 'SUCCESS'))
+            if status:
+                bill['pfms_status'] = status
+        for payment in own_payments:
+            payment.update(billing_index.payment_index_fields(payment))
+        ledger = dues_ledger.build_ledger(held_employee, held_allottee, item['quarter_id'], own_bills, own_payments)
+        # The ledger's time and version follow from the data, as if each bill and payment had been recorded
+        ledger['updated_at'] = item['last_updated']
+        ledger['version'] = len(own_bills) + sum(payment['status'] == 'SUCCESS' for payment in own_payments)
+        bills.extend(own_bills)
+        payments.extend(own_payments)
+        ledgers.append(ledger)
+    return item, occupancy.spans_from_allottee(item), [reading for reading in readings.values() if reading], \
+        bills, payments, ledgers
+
+
+def population(first, last, window, seed):
+    # Yields the records of quarters first..last (inclusive)
+    for i in range(first, last + 1):
+        yield quarter_records(i, window, seed)
@@ -1,169 +1,469 @@
 import json
-import boto3
 import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import csv
-from io import StringIO
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+import billing_index
+import common
+import deduction_files
+import deduction_runs
+import dues_ledger
+import occupancy
+import tariff
+from job_state import LostOwnership, claim_job, end_claim, get_job, save_progress
+
+# The monthly billing run, as a resumable job.
+#
+# Event: {"billing_month": "YYYY-MM", "run_id": "..."}, both optional. The month defaults to the previous
+# one; run_id starts a fresh run for a month that was already completed.
+#
+# The month's occupants are billed shard by shard of the occupancy index, by parallel workers, a page of
+# BILLING_PAGE_SIZE at a time. Each bill is written only if the month's bill for the allottee does not
+# exist yet; one that does (written by an earlier attempt) is kept as it is and used in its place, so a
+# re-run never duplicates or changes a bill, and the dues ledger counts each month once. Each page's CSV
+# rows are stored on S3, and the shard's cursor and the run's counters are checkpointed in JobStateTable
+# (see deduction_runs.py) after every page. Near the timeout the function re-invokes itself and the
+# continuation resumes from the checkpoint; a run that died is resumed by invoking it again once its
+# lease has run out, which the hourly ResumeSchedule in template.yaml does on the 1st.
+#
+# Once every shard is billed, the pages are joined into the deduction file and the DDO is notified. The
+# run is marked COMPLETED right after the email is sent, and a completed run is not run again.
 
 # Initialize DynamoDB clients
-dynamodb = boto3.resource('dynamodb')
-allottees_table = dynamodb.Table(os.environ['ALLOTTEES_TABLE_NAME'])
-water_bills_table = dynamodb.Table(os.environ['WATER_BILLS_TABLE_NAME'])
+water_bills_table = common.lazy_table(os.environ['WATER_BILLS_TABLE_NAME'])
+meter_readings_table = common.lazy_table(os.environ['METER_READINGS_TABLE_NAME'])
+dynamodb = common.lazy_dynamodb()
 
-# Initialize SES client
-ses_client = boto3.client('ses')
+# Initialize SES, S3 and Lambda clients
+ses_client = common.lazy_client('ses')
+s3 = common.lazy_client('s3')
+lambda_client = common.lazy_client('lambda')
+deduction_files_bucket_name = os.environ['DEDUCTION_FILES_BUCKET_NAME']
 
-def lambda_handler(event):
-    print(f"Received event: {json.dumps(event)}")
+# Occupants are billed by parallel workers, each taking the next index shard still to do
+BILLING_WORKERS = int(os.environ.get('BILLING_WORKERS', '4'))
+# Occupants charged per pass of the tariff engine (and per round of meter reading reads)
+BILLING_PAGE_SIZE = int(os.environ.get('BILLING_PAGE_SIZE', '500'))
 
-    ddo_email_recipient = os.environ.get('DDO_EMAIL_RECIPIENT')
-    ses_email_sender = os.environ.get('SES_EMAIL_SENDER')
+DEDUCTION_FILE_GZIP = os.environ.get('DEDUCTION_FILE_GZIP', 'false').lower() == 'true'
+DEDUCTION_FILE_URL_EXPIRY_SECONDS = int(os.environ.get('DEDUCTION_FILE_URL_EXPIRY_SECONDS', '604800'))
 
-    if not ddo_email_recipient or not ses_email_sender:
-        print("DDO Email Recipient or SES Sender Email not configured.")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'message': 'Email configuration missing.'})
+# Each page's CSV rows, kept until the deduction file is assembled (a lifecycle rule expires them)
+DEDUCTION_PAGES_PREFIX = 'deduction-pages'
+# Pages read ahead while the deduction file is assembled
+DEDUCTION_FILE_READ_WORKERS = int(os.environ.get('DEDUCTION_FILE_READ_WORKERS', '8'))
+# Hand over to a continuation when less than this is left of the invocation
+DEDUCTION_TIME_RESERVE_MS = int(os.environ.get('DEDUCTION_TIME_RESERVE_MS', '60000'))
+
+# Bill writes and dues ledger updates are single-item conditional writes, so they are fanned out over a
+# shared pool
+BILL_WRITE_WORKERS = int(os.environ.get('BILL_WRITE_WORKERS', '16'))
+
+CSV_HEADER = ["EMPLOYEE_ID", "ALLOTTEE_ID", "QUARTER_ID", "BILLING_MONTH", "AMOUNT_INR", "REASON"]
+
+
+def get_readings(quarter_ids, billing_month):
+    # Returns {quarter_id: MeterReadingsTable item} for the month, by BatchGetItem calls. A quarter
+    # without a reading is charged the assessed consumption, so a reading that cannot be read fails the run
+    # (batch_get_all raises) rather than being left out.
+    table_name = meter_readings_table.name
+    quarter_ids = list(dict.fromkeys(quarter_ids)) # BatchGetItem rejects duplicate keys
+    found = dynamodb.batch_get_all({table_name: {
+        'Keys': [{'quarter_id': quarter_id, 'billing_month': billing_month} for quarter_id in quarter_ids],
+        'ProjectionExpression': 'quarter_id, opening_reading_kl, closing_reading_kl, reading_status'
+    }})
+    return {reading['quarter_id']: reading for reading in found[table_name]}
+
+
+def bill_page(shares, billing_month, billed_date):
+    # Charges a page of occupancy shares (span, start, end, days) in one pass of the tariff engine, from
+    # the month's meter readings and the part of the month each occupant held the quarter. When a quarter
+    # changed hands during the month, the outgoing and incoming allottees each pay for their days.
+    readings = get_readings([span['quarter_id'] for span, _, _, _ in shares], billing_month)
+    with common.span('Tariff.Charge', items=len(shares)):
+        page_readings = [readings.get(span['quarter_id']) for span, _, _, _ in shares]
+        metered = [tariff.is_metered(reading) for reading in page_readings]
+        paise, litres, days = tariff.month_charges(
+            billing_month,
+            [reading['opening_reading_kl'] if usable else 0 for reading, usable in zip(page_readings, metered)],
+            [reading['closing_reading_kl'] if usable else 0 for reading, usable in zip(page_readings, metered)],
+            metered,
+            [start for _, start, _, _ in shares],
+            [end for _, _, end, _ in shares]
+        )
+        amounts, consumption = tariff.paise_to_inr(paise), tariff.litres_to_kl(litres)
+
+    # An allottee holding the quarter twice in the month (a corrected occupancy date, or leaving and coming
+    # back) gets one bill for all their days: bills are keyed by allottee and month
+    bills = {}
+    for (span, _, _, _), amount, kilolitres, held_days, usable in zip(shares, amounts, consumption, days.tolist(),
+                                                                      metered):
+        bill = bills.get((span['allottee_id'], span['quarter_id']))
+        if bill is not None:
+            bill['amount_inr'] += amount
+            bill['consumption_kl'] += kilolitres
+            bill['occupied_days'] += held_days
+            continue
+        bill = {
+            'allottee_id': span['allottee_id'],
+            'billing_month': billing_month,
+            'quarter_id': span['quarter_id'],
+            'employee_id': span['employee_id'],
+            'amount_inr': amount,
+            'consumption_kl': kilolitres,
+            'charge_basis': 'METERED' if usable else 'ASSESSED',
+            'occupied_days': held_days,
+            'billed_date': billed_date,
+            'status': 'PENDING_DDO_UPLOAD' # New status indicating it's sent to DDO
         }
+        bill.update(billing_index.bill_index_fields(bill))
+        bills[(span['allottee_id'], span['quarter_id'])] = bill
+    return list(bills.values())
 
-    try:
-        # Determine the billing month (e.g., previous month)
-        current_date = datetime.now()
-        billing_month_dt = current_date.replace(day=1) - timedelta(days=1) # Last day of previous month
-        billing_month = billing_month_dt.strftime('%Y-%m')
 
-        deduction_data = [] # Data to be written to CSV
+def deduction_row(bill):
+    return [
+        bill['employee_id'],
+        bill['allottee_id'],
+        bill['quarter_id'],
+        bill['billing_month'],
+        str(bill['amount_inr']), # Convert to string for CSV
+        f"Water Charges - {bill['billing_month']}"
+    ]
 
-        # CSV Header
-        csv_header = ["EMPLOYEE_ID", "ALLOTTEE_ID", "QUARTER_ID", "BILLING_MONTH", "AMOUNT_INR", "REASON"]
-        deduction_data.append(csv_header)
 
-        # 1. Fetch all relevant allottees for the billing month
-        # Using pagination to handle large datasets efficiently
-        allottees = []
-        last_evaluated_key = None
-        
-        while True:
-            scan_kwargs = {
-                'FilterExpression': 'attribute_exists(employee_id)',
-                'Limit': 100  # Process in batches
-            }
-            if last_evaluated_key:
-                scan_kwargs['ExclusiveStartKey'] = last_evaluated_key
-            
-            scan_response = allottees_table.scan(**scan_kwargs)
-            allottees.extend(scan_response.get('Items', []))
-            
-            last_evaluated_key = scan_response.get('LastEvaluatedKey')
-            if not last_evaluated_key:
-                break
-
-        for allottee in allottees:
-            quarter_id = allottee['quarter_id']
-            employee_id = allottee.get('employee_id')
-            allottee_id = allottee.get('allottee_id')
-            status = allottee.get('status')
-            allotment_start_date_str = allottee.get('allotment_start_date')
-            allotment_end_date_str = allottee.get('allotment_end_date')
-
-            if not employee_id: # Skip if no employee associated
-                continue
-
-            # Check if allottee was occupying the quarter during the billing month
-            # This is simplified. Actual logic should use meter readings and occupancy dates.
-            is_occupied_during_month = False
-            if status == "OCCUPIED" and (not allotment_start_date_str or datetime.strptime(allotment_start_date_str, '%Y-%m-%d').strftime('%Y-%m') <= billing_month):
-                is_occupied_during_month = True
-            elif status in ["VACATED", "TRANSFERRED"] and allotment_end_date_str:
-                if datetime.strptime(allotment_start_date_str, '%Y-%m-%d').strftime('%Y-%m') <= billing_month and \
-                        datetime.strptime(allotment_end_date_str, '%Y-%m-%d').strftime('%Y-%m') >= billing_month_dt.strftime('%Y-%m'):
-                    is_occupied_during_month = True # For pro-rata billing in vacation/transfer month
-
-            if not is_occupied_during_month:
-                print(f"Quarter {quarter_id} not occupied by {allottee_id} during {billing_month}. Skipping.")
-                continue
-
-            # --- Mock Water Charge Calculation ---
-            # In a real system:
-            # 1. Retrieve meter readings for quarter_id for billing_month from MDMS.
-            # 2. Calculate consumption based on start/end readings for the occupancy period.
-            # 3. Apply DoE rates to get amount.
-            water_charge_amount = 500.00 + (len(quarter_id) % 5) * 10.0 # Just a dummy calculation for demonstration
-
-            # Store the generated bill in WaterBillsTable
+def store_bill(bill):
+    # Writes the bill unless the allottee's bill for the month exists, and adds the bill kept to the dues
+    # ledger (once per month, so an attempt that died between the two writes is completed here).
+    # Returns (the bill as stored, NEW or EXISTING), or (the bill, CONFLICT) when the allottee's bill for
+    # the month is for another quarter: bills are keyed by allottee and month, so only one can be kept.
+    try:
+        with common.item_span('WaterBills.Put'):
             water_bills_table.put_item(
-                Item={
-                    'allottee_id': allottee_id,
-                    'billing_month': billing_month,
-                    'quarter_id': quarter_id,
-                    'employee_id': employee_id,
-                    'amount_inr': water_charge_amount,
-                    'billed_date': datetime.now().isoformat() + 'Z',
-                    'status': 'PENDING_DDO_UPLOAD' # New status indicating it's sent to DDO
-                }
+                Item=bill,
+                ConditionExpression='attribute_not_exists(allottee_id)'
             )
+        stored, outcome = bill, 'NEW'
+    except ClientError as e:
+        if not common.is_conditional_check_failure(e):
+            raise
+        stored = water_bills_table.get_item(
+            Key={'allottee_id': bill['allottee_id'], 'billing_month': bill['billing_month']},
+            ConsistentRead=True
+        )['Item']
+        if stored.get('quarter_id') != bill['quarter_id']:
+            print(f"Allottee {bill['allottee_id']} is already billed for {bill['billing_month']} for quarter "
+                  f"{stored.get('quarter_id')}; not billing quarter {bill['quarter_id']}.")
+            return bill, 'CONFLICT'
+        outcome = 'EXISTING'
+    with common.item_span('DuesLedger.RecordBill'):
+        dues_ledger.record_bill(stored)
+    return stored, outcome
 
-            deduction_data.append([
-                employee_id,
-                allottee_id,
-                quarter_id,
-                billing_month,
-                str(water_charge_amount), # Convert to string for CSV
-                f"Water Charges - {billing_month}"
-            ])
 
-        if not deduction_data[1:]: # Check if there are actual data rows besides header
-            print(f"No deduction data generated for {billing_month}. Email will not be sent.")
-            return {
-                'statusCode': 200,
-                'body': json.dumps({'message': f'No deduction data generated for {billing_month}.'})
-            }
+def shard_shares(billing_month, shard):
+    # The shard's occupancy shares of the month in (quarter_id, span_key) order, which the cursor follows
+    index = occupancy.OccupancyIndex(billing_month, occupancy.shard_spans(billing_month, shard))
+    return sorted(index.month_shares(), key=share_key)
+
+
+def share_key(share):
+    return [share[0]['quarter_id'], share[0]['span_key']]
+
+
+def share_pages(shares):
+    # Pages of BILLING_PAGE_SIZE shares or a few more: a page never splits a quarter, so an allottee's
+    # shares of a quarter are billed together
+    page = []
+    for share in shares:
+        if len(page) >= BILLING_PAGE_SIZE and share[0]['quarter_id'] != page[-1][0]['quarter_id']:
+            yield page
+            page = []
+        page.append(share)
+    if page:
+        yield page
+
+
+def page_key(run, shard, page):
+    return f"{DEDUCTION_PAGES_PREFIX}/{run['billing_month']}/{run['run_id'] or 'monthly'}/{shard:03d}-{page:05d}.csv"
+
+
+def deduction_file_key(run):
+    filename = f"LokSabhaWaterCharges_{run['billing_month']}.csv" + ('.gz' if DEDUCTION_FILE_GZIP else '')
+    return f"deductions/{run['billing_month']}/" + (f"{run['run_id']}/" if run['run_id'] else '') + filename
+
+
+def stopping(run):
+    return run['stop'].is_set() or run['context'].get_remaining_time_in_millis() < DEDUCTION_TIME_RESERVE_MS
+
+
+def bill_shard(run, progress, shard, executor):
+    # Bills the shard from its cursor a page at a time, storing each page's rows and checkpointing after
+    # it. Returns False when it stopped early for a continuation.
+    name = f"{shard:03d}"
+    state = progress['shards'].get(name) or {'cursor': None, 'pages': 0, 'done': False}
+    shares = shard_shares(run['billing_month'], shard)
+    if state['cursor']:
+        shares = [share for share in shares if share_key(share) > state['cursor']]
+
+    for page in share_pages(shares):
+        if stopping(run):
+            return False
+        results = list(executor.map(store_bill, bill_page(page, run['billing_month'], run['billed_date'])))
+        outcomes = Counter(outcome for _, outcome in results)
+        bills = [bill for bill, outcome in results if outcome != 'CONFLICT']
+        s3.put_object(Bucket=deduction_files_bucket_name, Key=page_key(run, shard, state['pages']),
+                      Body=deduction_files.csv_bytes([deduction_row(bill) for bill in bills]), ContentType='text/csv')
+        state = {'cursor': share_key(page[-1]), 'pages': state['pages'] + 1, 'done': False}
+        with run['lock']:
+            progress['shards'][name] = state
+            progress['bills'] += len(bills)
+            progress['new_bills'] += outcomes['NEW']
+            progress['existing_bills'] += outcomes['EXISTING']
+            progress['conflicting_bills'] += outcomes['CONFLICT']
+            progress['amount_inr'] += sum(Decimal(str(bill['amount_inr'])) for bill in bills)
+            progress['pages'] += 1
+            checkpoint(run, progress)
+
+    with run['lock']:
+        progress['shards'][name] = dict(state, done=True)
+        checkpoint(run, progress)
+    return True
+
+
+def bill_shards(run, progress):
+    # Runs the billing workers over the shards still to do; returns False when they stopped early
+    pending = [shard for shard in range(occupancy.OCCUPANCY_INDEX_SHARDS)
+               if not progress['shards'].get(f"{shard:03d}", {}).get('done')]
+
+    def run_worker():
+        while True:
+            with run['lock']:
+                if not pending or run['stop'].is_set():
+                    return
+                shard = pending.pop(0)
+            try:
+                if not bill_shard(run, progress, shard, executor):
+                    run['stop'].set()
+                    return
+            except Exception:
+                run['stop'].set()
+                raise
+
+    workers = max(1, min(BILLING_WORKERS, len(pending)))
+    with ThreadPoolExecutor(max_workers=BILL_WRITE_WORKERS) as executor, \
+            ThreadPoolExecutor(max_workers=workers) as worker_executor:
+        futures = [worker_executor.submit(run_worker) for _ in range(workers)]
+        for future in futures:
+            future.result()
+    return not pending and not run['stop'].is_set()
 
-        # 2. Generate CSV file in memory
-        csv_buffer = StringIO()
-        csv_writer = csv.writer(csv_buffer)
-        csv_writer.writerows(deduction_data)
-        csv_content = csv_buffer.getvalue()
 
-        # 3. Send email with CSV attachment via SES
-        msg = MIMEMultipart()
-        msg['Subject'] = f"Lok Sabha Quarters - Water Charges for {billing_month}"
-        msg['From'] = ses_email_sender
-        msg['To'] = ddo_email_recipient
+def assemble_file(run, progress):
+    # Joins the pages, shard by shard, into the deduction file, with a few pages read ahead at a time
+    keys = [page_key(run, shard, page) for shard in range(occupancy.OCCUPANCY_INDEX_SHARDS)
+            for page in range(progress['shards'].get(f"{shard:03d}", {}).get('pages', 0))]
+    s3_key = deduction_file_key(run)
+    writer = deduction_files.DeductionFileWriter(deduction_files_bucket_name, s3_key, compress=DEDUCTION_FILE_GZIP)
+    try:
+        writer.write(deduction_files.csv_bytes([CSV_HEADER]))
+        with ThreadPoolExecutor(max_workers=DEDUCTION_FILE_READ_WORKERS) as executor:
+            for start in range(0, len(keys), DEDUCTION_FILE_READ_WORKERS):
+                pages = executor.map(
+                    lambda key: s3.get_object(Bucket=deduction_files_bucket_name, Key=key)['Body'].read(),
+                    keys[start:start + DEDUCTION_FILE_READ_WORKERS])
+                for data in pages:
+                    writer.write(data)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    progress['deduction_file'] = s3_key
+
+
+def notify_ddo(run, progress, ddo_email_recipient, ses_email_sender):
+    # Send the DDO a summary and a download link instead of attaching the file.
+    # Presigned URLs signed with the function's role credentials stop working when
+    # those credentials expire, so the S3 location is included as well.
+    billing_month = run['billing_month']
+    s3_key = progress['deduction_file']
+    download_url = s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': deduction_files_bucket_name, 'Key': s3_key},
+        ExpiresIn=DEDUCTION_FILE_URL_EXPIRY_SECONDS
+    )
 
-        # Email body
-        body_text = f"""Dear DDO,
+    body_text = f"""Dear DDO,
 
-Please find attached the monthly water charge deduction data for Lok Sabha Quarters for the month of {billing_month}.
+The monthly water charge deduction data for Lok Sabha Quarters for the month of {billing_month} is ready.
 
 This data is to be uploaded to PFMS EIS module using COMPDDO for direct salary deductions.
 
-Total entries: {len(deduction_data) - 1}
+Total entries: {progress['bills']}
+Total amount (INR): {progress['amount_inr']}
+File: s3://{deduction_files_bucket_name}/{s3_key}
+
+Download link:
+{download_url}
 
 Regards,
 Lok Sabha Water Billing System
 """
-        msg.attach(MIMEText(body_text, 'plain'))
-
-        # Attach CSV file
-        filename = f"LokSabhaWaterCharges_{billing_month}.csv"
-        part = MIMEApplication(csv_content.encode('utf-8'))
-        part.add_header('Content-Disposition', 'attachment', filename=filename)
-        msg.attach(part)
-
-        ses_client.send_raw_email(
-            Source=ses_email_sender,
-            Destinations=[ddo_email_recipient],
-            RawMessage={'Data': msg.as_string()}
-        )
 
-        print(f"Successfully sent water charge data email to DDO for {billing_month}.")
+    ses_client.send_email(
+        Source=ses_email_sender,
+        Destination={'ToAddresses': [ddo_email_recipient]},
+        Message={
+            'Subject': {'Data': f"Lok Sabha Quarters - Water Charges for {billing_month}"},
+            'Body': {'Text': {'Data': body_text}}
+        }
+    )
+
+
+def checkpoint(run, progress, status='IN_PROGRESS'):
+    progress['elapsed_ms'] = run['elapsed_ms'] + int((time.monotonic() - run['started']) * 1000)
+    # A completed run is kept past the job TTL: once its item expired, invoking the month again would
+    # claim it as a new run and email the DDO a second time
+    save_progress(run['job_key'], run['owner'], progress, status=status, keep=status == 'COMPLETED')
+
+
+def run_phases(run, progress, ddo_email_recipient, ses_email_sender):
+    # Advances the run as far as this invocation allows; returns False when it stopped for a continuation
+    if progress['phase'] == 'BILL':
+        if not bill_shards(run, progress):
+            return False
+        progress['phase'] = 'ASSEMBLE' if progress['bills'] else 'DONE'
+        checkpoint(run, progress)
+
+    if progress['phase'] == 'ASSEMBLE':
+        if stopping(run):
+            return False
+        assemble_file(run, progress)
+        progress['phase'] = 'NOTIFY'
+        checkpoint(run, progress)
+
+    if progress['phase'] == 'NOTIFY':
+        # Marked done straight after sending: only an invocation that dies in between sends it twice
+        notify_ddo(run, progress, ddo_email_recipient, ses_email_sender)
+        progress['notified_at'] = datetime.now().isoformat() + 'Z'
+        progress['phase'] = 'DONE'
+    return True
+
+
+def run_progress(state, billing_month, run_id):
+    # Numbers come back from DynamoDB as Decimal
+    shards = {name: {'cursor': shard.get('cursor'), 'pages': int(shard.get('pages', 0)),
+                     'done': bool(shard.get('done'))}
+              for name, shard in (state.get('shards') or {}).items()}
+    return {
+        'billing_month': billing_month,
+        'run_id': run_id,
+        'phase': state.get('phase', 'BILL'),
+        'shards': shards,
+        'shards_total': occupancy.OCCUPANCY_INDEX_SHARDS,
+        'bills': int(state.get('bills', 0)),
+        'new_bills': int(state.get('new_bills', 0)),
+        'existing_bills': int(state.get('existing_bills', 0)),
+        'conflicting_bills': int(state.get('conflicting_bills', 0)),
+        'amount_inr': Decimal(str(state.get('amount_inr', 0))),
+        'pages': int(state.get('pages', 0)),
+        'billed_date': state.get('billed_date') or datetime.now().isoformat() + 'Z',
+        'deduction_file': state.get('deduction_file'),
+        'notified_at': state.get('notified_at'),
+        'elapsed_ms': int(state.get('elapsed_ms', 0))
+    }
+
+
+@common.instrumented
+def lambda_handler(event, context):
+    print(f"Received event: {json.dumps(event)}")
+
+    ddo_email_recipient = os.environ.get('DDO_EMAIL_RECIPIENT')
+    ses_email_sender = os.environ.get('SES_EMAIL_SENDER')
+
+    if not ddo_email_recipient or not ses_email_sender:
+        print("DDO Email Recipient or SES Sender Email not configured.")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'message': 'Email configuration missing.'})
+        }
+
+    continuation = event.get('continuation') or {}
+    request = continuation or event
+    # Determine the billing month (e.g., previous month)
+    billing_month = request.get('billing_month')
+    if not billing_month:
+        billing_month_dt = datetime.now().replace(day=1) - timedelta(days=1) # Last day of previous month
+        billing_month = billing_month_dt.strftime('%Y-%m')
+    run_id = request.get('run_id')
+    if not common.valid_billing_month(billing_month) or (run_id and not common.RUN_ID_PATTERN.fullmatch(run_id)):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'message': 'billing_month must be in YYYY-MM format and run_id alphanumeric.'})
+        }
+    job_key = deduction_runs.job_key(billing_month, run_id)
+    owner = context.aws_request_id
+
+    try:
+        state = claim_job(job_key, deduction_runs.JOB_TYPE, owner, continuation.get('owner'), context)
+        if state is None:
+            state = get_job(job_key) or {}
+            print(f"Deduction run {job_key} is {state.get('status')}; nothing to do.")
+            return {
+                'statusCode': 409 if state.get('status') == 'IN_PROGRESS' else 200,
+                'body': json.dumps(deduction_runs.summary(job_key, state))
+            }
+
+        progress = run_progress(state, billing_month, run_id)
+        run = {'job_key': job_key, 'run_id': run_id, 'owner': owner, 'billing_month': billing_month,
+               'billed_date': progress['billed_date'], 'context': context, 'lock': threading.Lock(),
+               'stop': threading.Event(), 'started': time.monotonic(), 'elapsed_ms': progress['elapsed_ms']}
+        print(f"Deduction run {job_key}: phase {progress['phase']}, {progress['bills']} bills done so far.")
+
+        try:
+            finished = run_phases(run, progress, ddo_email_recipient, ses_email_sender)
+        except LostOwnership:
+            print(f"Another invocation took over {job_key}; stopping.")
+            return {
+                'statusCode': 409,
+                'body': json.dumps({'message': 'Run taken over by another invocation.', 'job_id': job_key})
+            }
+        except Exception:
+            # Release the lease so that invoking the run again resumes it from the last checkpoint
+            end_claim(job_key, owner)
+            raise
+
+        if not finished:
+            lambda_client.invoke(
+                FunctionName=context.invoked_function_arn,
+                InvocationType='Event',
+                Payload=json.dumps({'continuation': {'billing_month': billing_month, 'run_id': run_id,
+                                                     'owner': owner}})
+            )
+            print(f"Handed {job_key} over to a continuation invocation after {progress['bills']} bills.")
+            return {
+                'statusCode': 202,
+                'body': json.dumps(deduction_runs.summary(job_key, dict(progress, status='IN_PROGRESS',
+                                                                        invocations=state.get('invocations'))))
+            }
+
+        checkpoint(run, progress, status='COMPLETED')
+        result = deduction_runs.summary(job_key, dict(progress, status='COMPLETED',
+                                                      invocations=state.get('invocations')))
+        if progress['bills']:
+            print(f"Deduction run {job_key} completed and sent to the DDO: {result['bills']} bills "
+                  f"({result['existing_bills']} already written), INR {result['amount_inr']}.")
+        else:
+            print(f"No deduction data generated for {billing_month}. Email will not be sent.")
         return {
             'statusCode': 200,
-            'body': json.dumps({'message': f'Water charge data sent to DDO email for {billing_month}.'})
+            'body': json.dumps(result)
         }
 
     except Exception as e:
@@ -171,4 +471,4 @@ Lok Sabha Water Billing System
         return {
             'statusCode': 500,
             'body': json.dumps({'message': 'Internal Server Error', 'error': str(e)})
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,141 @@
+import os
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+from common.months import month_bounds
+
+# Water charges from meter readings.
+#
+# A quarter's charge for a month is a fixed charge plus the month's consumption priced by slab, scaled by
+# the share of the month the occupant held the quarter. Consumption is the closing minus the opening
+# reading; a meter that passed METER_ROLLOVER_KL starts again from zero. A month without a usable reading
+# (none, or a reading_status other than OK) is charged WATER_ASSESSED_KL instead. An allotment counts
+# from its start date up to, not including, its end date, so on a transfer the day of handover is the
+# incoming allottee's.
+#
+# month_charges() prices a whole page (or month) of quarters at once on NumPy arrays, in whole numbers:
+# consumption in litres, slab rates in paise per kL (so litres x rate is in thousandths of a paisa) and
+# the pro-rata share as occupied days over days in the month, rounded half up to the paisa once, at the
+# end. Amounts are therefore exactly those of charge(), the per-row Decimal reference, which the seeder
+# uses and benchmarks/bench_tariff_engine.py checks the engine against. Readings are stored to the litre
+# (three decimals).
+
+WATER_FIXED_CHARGE_INR = Decimal(os.environ.get('WATER_FIXED_CHARGE_INR', '150.00'))
+# "<up to kL>:<INR per kL>" per slab, in order; the last slab has no upper bound
+WATER_TARIFF_SLABS = os.environ.get('WATER_TARIFF_SLABS', '10:7.00,20:11.00,30:20.00,:30.00')
+WATER_ASSESSED_KL = Decimal(os.environ.get('WATER_ASSESSED_KL', '20'))
+METER_ROLLOVER_KL = Decimal(os.environ.get('METER_ROLLOVER_KL', '100000'))
+
+READING_OK = 'OK'
+PAISE = Decimal('0.01')
+
+
+def parse_slabs(spec):
+    # [(upper bound in kL or None, INR per kL)]; raises ValueError unless the bounds increase, only the
+    # last slab is open and the rates are in whole paise
+    slabs = []
+    for part in spec.split(','):
+        upper, rate = part.split(':')
+        slabs.append((Decimal(upper) if upper.strip() else None, Decimal(rate)))
+    bounds = [Decimal(0)] + [upper for upper, _ in slabs[:-1]]
+    if slabs[-1][0] is not None or None in bounds or any(a >= b for a, b in zip(bounds, bounds[1:])) or \
+            any(rate < 0 or rate != rate.quantize(PAISE) for _, rate in slabs):
+        raise ValueError(f"Invalid WATER_TARIFF_SLABS: {spec}")
+    return slabs
+
+
+SLABS = parse_slabs(WATER_TARIFF_SLABS)
+
+# The same tariff in whole numbers for the engine
+_FIXED_MILLIPAISE = int(WATER_FIXED_CHARGE_INR * 100000)
+_SLAB_LITRES = [(int(upper * 1000) if upper is not None else None, int(rate * 100)) for upper, rate in SLABS]
+_ASSESSED_LITRES = int(WATER_ASSESSED_KL * 1000)
+_ROLLOVER_LITRES = int(METER_ROLLOVER_KL * 1000)
+
+
+def is_metered(reading):
+    # Whether a MeterReadingsTable item (or None) can be billed on its readings
+    return bool(reading) and reading.get('reading_status', READING_OK) == READING_OK and \
+        reading.get('opening_reading_kl') is not None and reading.get('closing_reading_kl') is not None
+
+
+# --- Per-row reference ---
+
+def consumption_litres(opening_kl, closing_kl, metered):
+    if not metered:
+        return _ASSESSED_LITRES
+    litres = int((Decimal(closing_kl) * 1000).to_integral_value()) - \
+        int((Decimal(opening_kl) * 1000).to_integral_value())
+    return litres + _ROLLOVER_LITRES if litres < 0 else litres
+
+
+def occupied_days(billing_month, start_date, end_date):
+    # Days of the month in [start_date, end_date); either may be None (held since before / still held)
+    first_day, month_days = month_bounds(billing_month)
+    after_month = date.fromordinal(first_day.toordinal() + month_days)
+    start = max(date.fromisoformat(start_date), first_day) if start_date else first_day
+    end = min(date.fromisoformat(end_date), after_month) if end_date else after_month
+    return max(0, (end - start).days)
+
+
+def charge(billing_month, opening_kl, closing_kl, metered, start_date, end_date):
+    # Returns (amount in INR, consumption in kL, occupied days) for one quarter, in Decimal arithmetic
+    kilolitres = Decimal(consumption_litres(opening_kl, closing_kl, metered)).scaleb(-3)
+    total, lower = WATER_FIXED_CHARGE_INR, Decimal(0)
+    for upper, rate in SLABS:
+        in_slab = (min(kilolitres, upper) if upper is not None else kilolitres) - lower
+        if in_slab <= 0:
+            break
+        total += in_slab * rate
+        lower = upper
+    days = occupied_days(billing_month, start_date, end_date)
+    amount = (total * days / month_bounds(billing_month)[1]).quantize(PAISE, rounding=ROUND_HALF_UP)
+    return amount, kilolitres, days
+
+
+# --- Vectorised engine ---
+
+def month_charges(billing_month, opening_kl, closing_kl, metered, start_dates, end_dates):
+    # Columns of equal length, one row per quarter: opening and closing readings in kL (numbers, or
+    # anything float() accepts; 0 where there is no usable reading), whether each reading is usable, and
+    # allotment start and end dates (YYYY-MM-DD or None). Returns arrays of the amounts in paise,
+    # consumption in litres and occupied days, all int64.
+    first_day, month_days = month_bounds(billing_month)
+    metered = np.asarray(metered, dtype=bool)
+
+    opening = np.rint(np.asarray(opening_kl, dtype=np.float64) * 1000).astype(np.int64)
+    closing = np.rint(np.asarray(closing_kl, dtype=np.float64) * 1000).astype(np.int64)
+    litres = closing - opening
+    litres += np.where(litres < 0, _ROLLOVER_LITRES, 0)
+    litres = np.where(metered, litres, _ASSESSED_LITRES)
+
+    millipaise = np.full(litres.shape, _FIXED_MILLIPAISE, dtype=np.int64)
+    lower = 0
+    for upper, rate in _SLAB_LITRES:
+        in_slab = litres - lower if upper is None else np.minimum(litres, upper) - lower
+        millipaise += np.maximum(in_slab, 0) * rate
+        lower = upper
+
+    # [start, end) clipped to the month; allotments still held end with it
+    month_start = np.datetime64(first_day, 'D')
+    after_month = month_start + month_days
+    first, after = str(month_start), str(after_month)
+    starts = np.maximum(np.array([day or first for day in start_dates], dtype='datetime64[D]'), month_start)
+    ends = np.minimum(np.array([day or after for day in end_dates], dtype='datetime64[D]'), after_month)
+    days = np.maximum((ends - starts).astype(np.int64), 0)
+
+    # millipaise x days / (1000 x month_days), rounded half up
+    denominator = 1000 * month_days
+    paise = (2 * millipaise * days + denominator) // (2 * denominator)
+    return paise, litres, days
+
+
+def paise_to_inr(paise):
+    # Exact Decimal amounts (two places) for an array of paise
+    return [Decimal(value).scaleb(-2) for value in paise.tolist()]
+
+
+def litres_to_kl(litres):
+    return [Decimal(value).scaleb(-3) for value in litres.tolist()]
@@ -0,0 +1,77 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# Handlers run against the in-memory stand-ins in benchmarks/fakes.py; no AWS account is needed.
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'src'), os.path.join(ROOT, 'benchmarks')]
+os.environ.setdefault('AWS_DEFAULT_REGION', 'ap-south-1')
+os.environ.setdefault('ALLOTTEES_TABLE_NAME', 'test-allottees')
+os.environ.setdefault('OCCUPANCY_HISTORY_TABLE_NAME', 'test-occupancy-history')
+os.environ.setdefault('WATER_BILLS_TABLE_NAME', 'test-water-bills')
+os.environ.setdefault('METER_READINGS_TABLE_NAME', 'test-meter-readings')
+os.environ.setdefault('PAYMENT_STATUSES_TABLE_NAME', 'test-payment-statuses')
+os.environ.setdefault('DUES_LEDGER_TABLE_NAME', 'test-dues-ledger')
+os.environ.setdefault('JOB_STATE_TABLE_NAME', 'test-job-state')
+os.environ.setdefault('PDF_BILLS_BUCKET_NAME', 'test-pdf-bills')
+os.environ.setdefault('DEDUCTION_FILES_BUCKET_NAME', 'test-deduction-files')
+os.environ.setdefault('DDO_EMAIL_RECIPIENT', 'ddo@example.com')
+os.environ.setdefault('SES_EMAIL_SENDER', 'billing@example.com')
+os.environ['PDF_JOB_BACKEND'] = 'memory'
+
+from common import dynamo  # noqa: E402
+from fakes import FakeDynamoDB, FakeTable  # noqa: E402
+
+
+class Context:
+    function_name = 'test'
+    invoked_function_arn = 'arn:aws:lambda:ap-south-1:000000000000:function:test'
+
+    def __init__(self, remaining_ms=300000):
+        self.aws_request_id = str(uuid.uuid4())
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.fixture
+def context():
+    return Context()
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    # Fresh fake tables, installed in every module that holds one
+    import allottee_sync_lambda
+    import billing_index
+    import dues_ledger
+    import dues_status_lambda
+    import occupancy
+
+    tables = {
+        'allottees': FakeTable(os.environ['ALLOTTEES_TABLE_NAME'], ['quarter_id'],
+                               indexes={'employee_id-index': ['employee_id']}),
+        'occupancy_history': FakeTable(os.environ['OCCUPANCY_HISTORY_TABLE_NAME'], ['quarter_id', 'span_key'],
+                                       indexes={occupancy.OCCUPANCY_INDEX_NAME: ['index_shard', 'end_month'],
+                                                occupancy.EMPLOYEE_INDEX_NAME: ['employee_id', 'span_key']}),
+        'water_bills': FakeTable(os.environ['WATER_BILLS_TABLE_NAME'], ['allottee_id', 'billing_month'],
+                                 indexes={billing_index.MONTH_INDEX_NAME: ['month_shard', 'employee_id'],
+                                          billing_index.ARREARS_INDEX_NAME: ['arrears_shard', 'billing_month']}),
+        'payment_statuses': FakeTable(os.environ['PAYMENT_STATUSES_TABLE_NAME'], ['employee_id', 'billing_month']),
+        'dues_ledger': FakeTable(os.environ['DUES_LEDGER_TABLE_NAME'], ['employee_id']),
+    }
+    dynamodb = dynamo.ThrottledDynamoDB(FakeDynamoDB(tables.values()))
+    for module, attributes in (
+            (allottee_sync_lambda, {'allottees_table': 'allottees', 'dynamodb': None}),
+            (occupancy, {'occupancy_table': 'occupancy_history'}),
+            (dues_ledger, {'dues_ledger_table': 'dues_ledger', 'water_bills_table': 'water_bills',
+                           'payment_statuses_table': 'payment_statuses', 'dynamodb': None}),
+            (dues_status_lambda, {'allottees_table': 'allottees', 'water_bills_table': 'water_bills',
+                                  'payment_statuses_table': 'payment_statuses'})):
+        for attribute, name in attributes.items():
+            monkeypatch.setattr(module, attribute, tables[name] if name else dynamodb)
+    monkeypatch.setattr(dues_status_lambda, 'dues_cache', dues_status_lambda.DuesCache(0, 0))
+    return tables
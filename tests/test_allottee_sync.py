@@ -0,0 +1,85 @@
+import json
+
+import pytest
+from boto3.dynamodb.conditions import Key
+
+import allottee_sync_lambda
+
+
+def push(updates, context):
+    return allottee_sync_lambda.lambda_handler(
+        {'httpMethod': 'POST', 'path': '/v1/allottees/status-updates', 'body': json.dumps({'updates': updates})},
+        context)
+
+
+def list_allottees(params):
+    response = allottee_sync_lambda.lambda_handler(
+        {'httpMethod': 'GET', 'path': '/v1/allottees', 'queryStringParameters': params}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+VALID_UPDATE = {'quarter_id': 'QTR-A', 'allottee_id': 'ALLOTA1', 'employee_id': 'EMP001', 'status': 'OCCUPIED',
+                'effective_date': '2024-01-01'}
+
+
+@pytest.mark.parametrize('changes, reason', [
+    ({'allottee_id': ''}, 'allottee_id is required'),
+    ({'quarter_id': 'qtr a'}, 'quarter_id is invalid'),
+    ({'employee_id': 12345678}, 'employee_id is invalid'),
+    ({'status': 'EVICTED'}, 'status must be one of OCCUPIED, VACATED, TRANSFERRED'),
+    ({'effective_date': '2024-02-30'}, 'effective_date must be a YYYY-MM-DD date'),
+    ({'new_allottee_id': 'ALLOTA2'}, 'new_allottee_id and new_employee_id are only allowed with status TRANSFERRED'),
+])
+def test_invalid_status_updates_are_reported(changes, reason):
+    assert allottee_sync_lambda.validate_status_update(dict(VALID_UPDATE, **changes)) == reason
+
+
+def test_status_updates_are_validated_as_a_whole_before_any_is_written(tables, context):
+    assert allottee_sync_lambda.validate_status_update(VALID_UPDATE) is None
+    response = push([VALID_UPDATE, dict(VALID_UPDATE, quarter_id='QTR-B', status='EVICTED'), 'not an update'],
+                    context)
+    assert response['statusCode'] == 400
+    assert [(error['index'], error['quarter_id']) for error in json.loads(response['body'])['errors']] \
+        == [(1, 'QTR-B'), (2, None)]
+    assert not tables['allottees'].items() and not tables['occupancy_history'].items()
+
+
+def test_list_cursor_round_trips_and_rejects_anything_else(tables):
+    key = {'quarter_id': 'QTR-A'}
+    assert allottee_sync_lambda.decode_cursor(allottee_sync_lambda.encode_cursor(key)) == key
+    for cursor in ('%%%', allottee_sync_lambda.encode_cursor(['QTR-A']),
+                   allottee_sync_lambda.encode_cursor({'quarter_id': 'QTR-A', 'billing_month': '2024-01'})):
+        with pytest.raises(ValueError):
+            allottee_sync_lambda.decode_cursor(cursor)
+    assert list_allottees({'cursor': '%%%'}) == (400, {'message': 'cursor is invalid'})
+
+
+def test_list_pages_through_every_allottee_once(tables):
+    tables['allottees'].load([dict(VALID_UPDATE, quarter_id=f"QTR-{index:03d}") for index in range(25)])
+    seen, params = [], {'limit': '10'}
+    while True:
+        status, body = list_allottees(params)
+        assert status == 200 and body['count'] <= 10
+        seen.extend(item['quarter_id'] for item in body['allottees'])
+        if not body['next_cursor']:
+            break
+        params = {'limit': '10', 'cursor': body['next_cursor']}
+    assert sorted(seen) == [f"QTR-{index:03d}" for index in range(25)]
+
+
+def test_updates_without_employee_id_leave_the_index_key_out(tables, context):
+    # employee_id keys employee_id-index, which rejects NULL; CPWD does not always send it
+    response = push([{'quarter_id': 'QTR-D', 'allottee_id': 'ALLOTD1', 'status': 'OCCUPIED',
+                      'effective_date': '2024-01-01'}], context)
+    assert response['statusCode'] == 200, response['body']
+    assert 'employee_id' not in tables['allottees'].items()[0]
+
+    push([{'quarter_id': 'QTR-E', 'allottee_id': 'ALLOTE1', 'employee_id': 'EMP005', 'status': 'OCCUPIED',
+           'effective_date': '2024-01-01'}], context)
+    response = push([{'quarter_id': 'QTR-E', 'allottee_id': 'ALLOTE1', 'status': 'VACATED',
+                      'effective_date': '2024-03-01'}], context)
+    assert response['statusCode'] == 200, response['body']
+    # The allotment that ended keeps the employee it was recorded with
+    vacated = tables['allottees'].query(IndexName='employee_id-index',
+                                        KeyConditionExpression=Key('employee_id').eq('EMP005'))['Items']
+    assert [(item['quarter_id'], item['status']) for item in vacated] == [('QTR-E', 'VACATED')]
@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+import dues_ledger
+
+
+def bill(billing_month, amount_inr, allottee_id='ALLOTA1'):
+    return {'employee_id': 'EMP001', 'allottee_id': allottee_id, 'quarter_id': 'QTR-A',
+            'billing_month': billing_month, 'amount_inr': Decimal(amount_inr)}
+
+
+def test_a_bill_is_added_to_the_ledger_once(tables):
+    assert dues_ledger.record_bill(bill('2024-01', '300.00'))
+    # Re-running the month's billing
+    assert not dues_ledger.record_bill(bill('2024-01', '300.00'))
+    # A second allotment billed in the same month is a bill of its own
+    assert dues_ledger.record_bill(bill('2024-01', '120.00', allottee_id='ALLOTB1'))
+
+    ledger = dues_ledger.get_ledger('EMP001', full=True)
+    assert ledger['total_billed'] == Decimal('420.00')
+    assert ledger['billed_bills'] == {'ALLOTA1#2024-01', 'ALLOTB1#2024-01'}
+    assert ledger['pending_months'] == {'2024-01'}
+    assert ledger['version'] == 2
+
+
+def test_a_payment_is_applied_once_and_a_late_one_keeps_last_paid_month(tables):
+    for month in ('2024-01', '2024-02', '2024-03'):
+        dues_ledger.record_bill(bill(month, '300.00'))
+    # A payment without a ledger is left for the rebuild
+    assert not dues_ledger.record_payment('EMP404', '2024-01', Decimal('300.00'), 'SUCCESS')
+    assert not dues_ledger.record_payment('EMP001', '2024-01', Decimal('300.00'), 'FAILED')
+
+    assert dues_ledger.record_payment('EMP001', '2024-02', Decimal('300.00'), 'SUCCESS')
+    assert not dues_ledger.record_payment('EMP001', '2024-02', Decimal('300.00'), 'SUCCESS')
+    # Confirmed after February's
+    assert dues_ledger.record_payment('EMP001', '2024-01', Decimal('250.00'), 'SUCCESS')
+    assert not dues_ledger.record_payment('EMP001', '2024-01', Decimal('250.00'), 'SUCCESS')
+
+    ledger = dues_ledger.get_ledger('EMP001', full=True)
+    assert ledger['total_paid'] == Decimal('550.00')
+    assert ledger['last_paid_month'] == '2024-02'
+    assert ledger['pending_months'] == {'2024-03'}
+    assert 'EMP404' not in {item['employee_id'] for item in tables['dues_ledger'].items()}
@@ -0,0 +1,94 @@
+import json
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Key
+
+import allottee_sync_lambda
+import dues_ledger
+import dues_ledger_rebuild_lambda
+
+
+def push(updates, context):
+    response = allottee_sync_lambda.lambda_handler(
+        {'httpMethod': 'POST', 'path': '/v1/allottees/status-updates', 'body': json.dumps({'updates': updates})},
+        context)
+    assert response['statusCode'] == 200, response['body']
+
+
+def bill(allottee_id, employee_id, quarter_id, billing_month, amount_inr):
+    return {'allottee_id': allottee_id, 'employee_id': employee_id, 'quarter_id': quarter_id,
+            'billing_month': billing_month, 'amount_inr': Decimal(amount_inr)}
+
+
+def rebuild(event, context):
+    response = dues_ledger_rebuild_lambda.lambda_handler(event, context)
+    assert response['statusCode'] == 200, response['body']
+    return json.loads(response['body'])
+
+
+def test_rebuild_counts_allotments_allottees_table_no_longer_lists(tables, context):
+    # EMP001 held QTR-A (vacated, then re-occupied by EMP009) and QTR-B, which was then transferred to EMP002.
+    # AllotteesTable is left with neither of EMP001's allotments.
+    push([{'quarter_id': 'QTR-A', 'allottee_id': 'ALLOTA1', 'employee_id': 'EMP001', 'status': 'OCCUPIED',
+           'effective_date': '2023-10-01'}], context)
+    push([{'quarter_id': 'QTR-A', 'allottee_id': 'ALLOTA1', 'employee_id': 'EMP001', 'status': 'VACATED',
+           'effective_date': '2024-01-01'},
+          {'quarter_id': 'QTR-B', 'allottee_id': 'ALLOTB1', 'employee_id': 'EMP001', 'status': 'OCCUPIED',
+           'effective_date': '2024-01-01'}], context)
+    push([{'quarter_id': 'QTR-A', 'allottee_id': 'ALLOTA9', 'employee_id': 'EMP009', 'status': 'OCCUPIED',
+           'effective_date': '2024-02-01'},
+          {'quarter_id': 'QTR-B', 'allottee_id': 'ALLOTB1', 'employee_id': 'EMP001', 'status': 'TRANSFERRED',
+           'effective_date': '2024-03-01', 'new_allottee_id': 'ALLOTB2', 'new_employee_id': 'EMP002'}], context)
+    assert not tables['allottees'].query(
+        IndexName='employee_id-index', KeyConditionExpression=Key('employee_id').eq('EMP001'))['Items']
+
+    tables['water_bills'].load([
+        bill('ALLOTA1', 'EMP001', 'QTR-A', '2023-12', '300.00'),
+        bill('ALLOTB1', 'EMP001', 'QTR-B', '2024-01', '200.00'),
+        bill('ALLOTB1', 'EMP001', 'QTR-B', '2024-02', '200.00'),
+        bill('ALLOTB2', 'EMP002', 'QTR-B', '2024-03', '250.00'),
+    ])
+    tables['payment_statuses'].load([
+        {'employee_id': 'EMP001', 'billing_month': '2024-01', 'amount_deducted_inr': Decimal('200.00'),
+         'status': 'SUCCESS'},
+    ])
+    # A ledger that missed the first quarter's bill
+    tables['dues_ledger'].load([
+        dict(dues_ledger.build_ledger('EMP001', 'ALLOTB1', 'QTR-B', [
+            bill('ALLOTB1', 'EMP001', 'QTR-B', '2024-01', '200.00'),
+            bill('ALLOTB1', 'EMP001', 'QTR-B', '2024-02', '200.00'),
+        ], []), version=2),
+    ])
+
+    verified = rebuild({'mode': 'verify'}, context)
+    assert verified['checked'] == 3 # EMP001, EMP002 and EMP009
+    assert [mismatch['employee_id'] for mismatch in verified['mismatches'] if mismatch['fields'] != ['missing']] \
+        == ['EMP001']
+
+    rebuilt = rebuild({'mode': 'rebuild', 'employee_ids': ['EMP001', 'EMP404']}, context)
+    assert rebuilt['rebuilt'] == 1 and rebuilt['not_found'] == ['EMP404']
+
+    ledger = dues_ledger.get_ledger('EMP001', full=True)
+    assert ledger['allottee_id'] == 'ALLOTB1' and ledger['quarter_id'] == 'QTR-B'
+    assert ledger['total_billed'] == Decimal('700.00') and ledger['total_paid'] == Decimal('200.00')
+    assert ledger['pending_months'] == {'2023-12', '2024-02'}
+    # EMP002's bill under the next allotment of QTR-B is not EMP001's
+    assert 'ALLOTB2#2024-03' not in ledger['billed_bills']
+
+    assert rebuild({'mode': 'verify', 'employee_ids': ['EMP001']}, context)['mismatched'] == 0
+
+
+def test_rebuild_keeps_bills_of_an_allottee_id_apart_by_employee(tables, context):
+    # A transfer without a new allottee_id leaves both employees' bills under the same one
+    push([{'quarter_id': 'QTR-C', 'allottee_id': 'ALLOTC1', 'employee_id': 'EMP003', 'status': 'OCCUPIED',
+           'effective_date': '2024-01-01'}], context)
+    push([{'quarter_id': 'QTR-C', 'allottee_id': 'ALLOTC1', 'employee_id': 'EMP003', 'status': 'TRANSFERRED',
+           'effective_date': '2024-02-01', 'new_employee_id': 'EMP004'}], context)
+    tables['water_bills'].load([
+        bill('ALLOTC1', 'EMP003', 'QTR-C', '2024-01', '100.00'),
+        bill('ALLOTC1', 'EMP004', 'QTR-C', '2024-02', '120.00'),
+    ])
+
+    assert rebuild({'mode': 'rebuild'}, context)['rebuilt'] == 2
+    assert dues_ledger.get_ledger('EMP003', full=True)['total_billed'] == Decimal('100.00')
+    assert dues_ledger.get_ledger('EMP004', full=True)['total_billed'] == Decimal('120.00')
@@ -0,0 +1,48 @@
+import json
+from decimal import Decimal
+
+import pytest
+
+import billing_index
+import dues_status_lambda
+
+
+def arrears(params):
+    response = dues_status_lambda.lambda_handler(
+        {'httpMethod': 'GET', 'path': '/v1/arrears', 'queryStringParameters': params}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def unpaid_bill(index, billing_month):
+    bill = {'allottee_id': f"ALLOT{index:03d}", 'employee_id': f"EMP{index:03d}", 'quarter_id': f"QTR-{index:03d}",
+            'billing_month': billing_month, 'amount_inr': Decimal('300.00'), 'status': 'PENDING',
+            'billed_date': f"{billing_month}-28T00:00:00Z"}
+    return dict(bill, **billing_index.bill_index_fields(bill))
+
+
+def test_arrears_cursor_round_trips_and_rejects_anything_else():
+    for shard, key in ((0, None), (3, {'arrears_shard': '03', 'billing_month': '2024-01', 'allottee_id': 'A1'})):
+        cursor = dues_status_lambda.encode_arrears_cursor(shard, key)
+        assert dues_status_lambda.decode_arrears_cursor(cursor) == (shard, key)
+    for cursor in ('%%%', dues_status_lambda.encode_arrears_cursor(billing_index.BILLING_INDEX_SHARDS, None),
+                   dues_status_lambda.encode_arrears_cursor('1', None),
+                   dues_status_lambda.encode_arrears_cursor(0, {'billing_month': 202401})):
+        with pytest.raises(ValueError):
+            dues_status_lambda.decode_arrears_cursor(cursor)
+    assert arrears({'cursor': '%%%'}) == (400, {'message': 'cursor is invalid'})
+
+
+def test_arrears_pages_through_every_shard_once(tables):
+    tables['water_bills'].load([unpaid_bill(index, '2024-01') for index in range(40)])
+    paid = dict(unpaid_bill(99, '2024-01'), status='PAID')
+    tables['water_bills'].load([{name: value for name, value in paid.items() if name != 'arrears_shard'}])
+
+    seen, params = [], {'limit': '7', 'billing_month': '2024-01'}
+    while True:
+        status, body = arrears(params)
+        assert status == 200 and body['count'] <= 7
+        seen.extend(entry['allottee_id'] for entry in body['arrears'])
+        if not body['next_cursor']:
+            break
+        params = dict(params, cursor=body['next_cursor'])
+    assert sorted(seen) == [f"ALLOT{index:03d}" for index in range(40)]
@@ -0,0 +1,125 @@
+import json
+from decimal import Decimal
+
+import pytest
+from botocore.exceptions import ClientError
+
+import generate_pdf_bill_lambda
+import pdf_jobs
+import pdf_render_worker_lambda
+from fakes import FakeS3, FakeTable
+
+BUCKET = generate_pdf_bill_lambda.pdf_bills_bucket_name
+PDF_KEY = generate_pdf_bill_lambda.pdf_object_key('ALLOTA1', '2024-01')
+
+
+@pytest.fixture
+def pdf(monkeypatch):
+    # One bill in fake tables, a fake S3 bucket and the in-memory job store and queue
+    allottees = FakeTable('allottees', ['quarter_id'])
+    allottees.load([{'quarter_id': 'QTR-A', 'allottee_id': 'ALLOTA1', 'employee_id': 'EMP001', 'name': 'A. Allottee'}])
+    bills = FakeTable('water_bills', ['allottee_id', 'billing_month'])
+    bills.load([{'allottee_id': 'ALLOTA1', 'billing_month': '2024-01', 'quarter_id': 'QTR-A',
+                 'amount_inr': Decimal('300.00'), 'status': 'PENDING', 'billed_date': '2024-02-01T00:00:00Z'}])
+    s3 = FakeS3()
+    monkeypatch.setattr(generate_pdf_bill_lambda, 'allottees_table', allottees)
+    monkeypatch.setattr(generate_pdf_bill_lambda, 'water_bills_table', bills)
+    monkeypatch.setattr(generate_pdf_bill_lambda, 's3', s3)
+    monkeypatch.setattr(pdf_jobs, '_backend', (pdf_jobs.InMemoryJobStore(), pdf_jobs.InMemoryJobQueue()))
+    return {'bills': bills, 's3': s3, 'queue': pdf_jobs._backend[1]}
+
+
+def call(method, delivery=None, job_id=None):
+    if job_id:
+        event = {'httpMethod': method, 'pathParameters': {'job_id': job_id}}
+    else:
+        event = {'httpMethod': method, 'pathParameters': {'allottee_id': 'ALLOTA1', 'billing_month': '2024-01'},
+                 'queryStringParameters': {'delivery': delivery} if delivery else None}
+    return generate_pdf_bill_lambda.lambda_handler(event, None)
+
+
+def body(response):
+    return json.loads(response['body'])
+
+
+def test_url_delivery_stores_the_pdf_once_and_hands_out_a_presigned_link(pdf):
+    response = call('GET', 'url')
+    assert response['statusCode'] == 200
+    assert body(response)['url'] == f"https://{BUCKET}.s3.local/{PDF_KEY}?X-Amz-Expires=" \
+                                    f"{generate_pdf_bill_lambda.PDF_URL_EXPIRY_SECONDS}"
+    assert pdf['s3'].objects[(BUCKET, PDF_KEY)].startswith(b'%PDF')
+    stored_hash = pdf['s3'].object_metadata[(BUCKET, PDF_KEY)][generate_pdf_bill_lambda.CONTENT_HASH_METADATA_KEY]
+    assert stored_hash == body(response)['content_hash']
+
+    redirect = call('GET', 'redirect')
+    assert redirect['statusCode'] == 302 and redirect['headers']['Location'] == body(response)['url']
+    assert pdf['s3'].stats.calls['PutObject'] == 1
+
+    # A change to what the bill shows renders it again
+    pdf['bills']._items[('ALLOTA1', '2024-01')]['status'] = 'PAID'
+    assert body(call('GET', 'url'))['content_hash'] != stored_hash
+    assert pdf['s3'].stats.calls['PutObject'] == 2
+
+    assert call('GET', 'fax')['statusCode'] == 400
+
+
+def test_pdf_jobs_are_shared_until_rendered_and_then_answered_at_once(pdf, context):
+    first, second = call('POST'), call('POST')
+    assert first['statusCode'] == second['statusCode'] == 202
+    job_id = body(first)['job_id']
+    assert body(second)['job_id'] == job_id and body(first)['status'] == 'QUEUED'
+    assert first['headers']['Location'] == f"/v1/pdf-jobs/{job_id}"
+    assert len(pdf['queue'].messages) == 1
+
+    polled = call('GET', job_id=job_id)
+    assert polled['statusCode'] == 200 and body(polled)['status'] == 'QUEUED' and 'Retry-After' in polled['headers']
+
+    assert pdf_render_worker_lambda.drain(context) == 1
+    polled = call('GET', job_id=job_id)
+    assert body(polled)['status'] == 'COMPLETED' and body(polled)['url'].endswith(
+        f"{PDF_KEY}?X-Amz-Expires={generate_pdf_bill_lambda.PDF_URL_EXPIRY_SECONDS}")
+
+    # Finished: 200 with the link, and nothing queued
+    again = call('POST')
+    assert again['statusCode'] == 200 and body(again)['job_id'] == job_id and body(again)['url']
+    assert 'Location' not in again['headers'] and not pdf['queue'].messages
+    # A duplicate delivery of the message is dropped
+    pdf_render_worker_lambda.process_message(json.dumps({'job_id': pdf_jobs.JOB_KEY_PREFIX + job_id}), context)
+    assert pdf['s3'].stats.calls['PutObject'] == 1
+
+    assert call('GET', job_id='0' * 32)['statusCode'] == 404
+
+
+def test_a_failed_render_is_queued_again_by_the_next_request(pdf, context):
+    job_id = body(call('POST'))['job_id']
+    del pdf['bills']._items[('ALLOTA1', '2024-01')]
+    pdf_render_worker_lambda.drain(context)
+    failed = body(call('GET', job_id=job_id))
+    assert failed['status'] == 'FAILED' and failed['error']
+
+    pdf['bills'].load([{'allottee_id': 'ALLOTA1', 'billing_month': '2024-01', 'quarter_id': 'QTR-A',
+                        'amount_inr': Decimal('300.00'), 'status': 'PENDING', 'billed_date': '2024-02-01T00:00:00Z'}])
+    retried = call('POST')
+    assert retried['statusCode'] == 202 and body(retried)['job_id'] == job_id and body(retried)['status'] == 'QUEUED'
+    pdf_render_worker_lambda.drain(context)
+    assert body(call('GET', job_id=job_id))['status'] == 'COMPLETED'
+
+
+def test_a_throttled_render_goes_back_to_the_queue(pdf, context, monkeypatch):
+    job_id = body(call('POST'))['job_id']
+    message = pdf['queue'].messages.popleft()
+    put_object = pdf['s3'].put_object
+
+    def slow_down_once(**kwargs):
+        # S3 throttles the first upload only
+        monkeypatch.setattr(pdf['s3'], 'put_object', put_object)
+        raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Please reduce your request rate.'}}, 'PutObject')
+
+    monkeypatch.setattr(pdf['s3'], 'put_object', slow_down_once)
+    event = {'Records': [{'messageId': 'm1', 'body': message}]}
+    assert pdf_render_worker_lambda.lambda_handler(event, context) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    assert body(call('GET', job_id=job_id))['status'] == 'QUEUED'
+
+    # SQS redelivers the message
+    assert pdf_render_worker_lambda.lambda_handler(event, context) == {'batchItemFailures': []}
+    assert body(call('GET', job_id=job_id))['status'] == 'COMPLETED'